@@ -11,13 +11,18 @@ from ..models import (
     ArticuloClasificacionFinal
 )
 from ..tasks import cargar_proceso_clasificacion_task
+from automatizaciones.service.exportaciones import accion_exportar_en_segundo_plano
 from ..utils import procesar_clasificacion
 
 
 @admin.register(ProcesoClasificacion)
 class ProcesoClasificacionAdmin(admin.ModelAdmin):
     list_display = ('proceso_display', 'estado', 'fecha_inicio', 'lanzar_wizard')
-    actions = ['ejecutar_carga']
+    actions = [
+        'ejecutar_carga',
+        accion_exportar_en_segundo_plano("clasificacion_temporal", "Exportar artículos temporales en segundo plano"),
+        accion_exportar_en_segundo_plano("clasificacion_final", "Exportar clasificación final en segundo plano"),
+    ]
 
     from django.contrib.auth.models import Group
 
@@ -3,7 +3,7 @@ from django.urls import path, reverse
 from django.utils.html import format_html
 from django.contrib import messages
 from django.shortcuts import get_object_or_404, redirect
-from django.http import HttpResponse
+from django.http import FileResponse
 from django.db.models import Sum, Count, Case, When, F, Q, DecimalField, Exists, OuterRef
 from django.db.models.functions import Coalesce
 from django.db import transaction
@@ -36,16 +36,21 @@ from ..services.notifications import (
     notificar_proveedor_lote_enviado,
     notificar_compras_respuesta_proveedor
 )
-from ..services.exports import export_lines_to_xlsx
+from ..services.exports import export_lines_to_xlsx_file
 from ..services.kpi_proveedores import calcular_cumplimiento_presupuesto
-from django.http import HttpResponse, HttpResponseBadRequest
+from django.http import HttpResponseBadRequest
 from ..services.icg_integration import  enviar_orden_a_icg
 
-from ..services.icg_pedidos import crear_pedido_compra_desde_lote
+from ..services.icg_pedidos import (
+    crear_pedido_compra_desde_lote,
+    ESTADO_PEDIDO_OK,
+    ESTADO_PEDIDO_ERROR,
+)
 from ..services.kpi_utils import obtener_kpis_por_lote
 from ..services.icg_import import actualizar_kpis_lote
 from datetime import timedelta
 from ..forms import SugeridoLoteAdminForm
+from automatizaciones.service.exportaciones import accion_exportar_en_segundo_plano
 
 # ─────────────────────────────
 # Inlines / Admins
@@ -87,24 +92,70 @@ class SugeridoLineaInline(admin.TabularInline):
 class SugeridoLoteAdmin(admin.ModelAdmin):
     form = SugeridoLoteAdminForm
     change_form_template = "admin/compras/sugeridolote/change_form.html"
-    list_display = ("id", "nombre", "fecha_extraccion", "estado",
+    list_display = ("id", "nombre", "fecha_extraccion", "estado", "importacion",
                     "total_lineas", "total_costo", "creado_por", "ver_lineas")
-    list_filter = ("estado", "creado_por",)
+    list_filter = ("estado", "importacion_estado", "creado_por",)
     search_fields = ("nombre", "id", "creado_por__username")
     date_hierarchy = "fecha_extraccion"
     readonly_fields = ("total_lineas","total_costo", "fecha_extraccion", "estado", 
-                       "clasificacion_filtro","numserie","numpedido","subserie","pedidos_icg","creado_por",)
+                       "clasificacion_filtro","numserie","numpedido","subserie","pedidos_icg","creado_por",
+                       "importacion", "importacion_error")
     fields = ("nombre", "proveedor", "marcas", "observaciones")  # Orden específico: proveedor primero, luego marcas
     actions = [
         "accion_enviar_a_proveedor",
         "accion_marcar_confirmado",
         "accion_marcar_completado",
         "accion_exportar_xlsx",
+        accion_exportar_en_segundo_plano("sugerido_lotes", "Exportar XLSX en segundo plano"),
         "accion_recalcular_totales",
         "accion_anular_lote",
         "accion_reabrir_proveedor",
+        "accion_reanudar_importacion",
     ]
 
+    _COLORES_IMPORTACION = {
+        SugeridoLote.EstadoImportacion.EN_COLA: "#6c757d",
+        SugeridoLote.EstadoImportacion.EN_CURSO: "#007bff",
+        SugeridoLote.EstadoImportacion.COMPLETADA: "#28a745",
+        SugeridoLote.EstadoImportacion.FALLIDA: "#dc3545",
+    }
+
+    @admin.display(description="Importación ICG", ordering="importacion_estado")
+    def importacion(self, obj: SugeridoLote):
+        if obj.importacion_estado == SugeridoLote.EstadoImportacion.SIN_IMPORTAR:
+            return "-"
+        texto = obj.get_importacion_estado_display()
+        if obj.importacion_estado != SugeridoLote.EstadoImportacion.COMPLETADA:
+            texto += f" · {obj.importacion_etapa or '-'} {obj.importacion_progreso}%"
+        return format_html(
+            '<span style="color: {}; font-weight: bold;" title="{}">{}</span>',
+            self._COLORES_IMPORTACION.get(obj.importacion_estado, "#333"),
+            obj.importacion_error or "",
+            texto,
+        )
+
+    def get_fields(self, request, obj=None):
+        fields = super().get_fields(request, obj)
+        if obj is not None and obj.importacion_estado != SugeridoLote.EstadoImportacion.SIN_IMPORTAR:
+            fields = tuple(fields) + ("importacion",)
+            if obj.importacion_error:
+                fields += ("importacion_error",)
+        return fields
+
+    @admin.action(description="Reanudar importación ICG")
+    def accion_reanudar_importacion(self, request, qs):
+        from ..services.importacion_lote import iniciar_importacion_lote
+
+        encolados = 0
+        for lote in qs.select_related("proveedor"):
+            if iniciar_importacion_lote(lote):
+                encolados += 1
+        if encolados:
+            self.message_user(request, f"{encolados} lote(s) en cola para continuar la importación.", messages.SUCCESS)
+        omitidos = qs.count() - encolados
+        if omitidos:
+            self.message_user(request, f"{omitidos} lote(s) omitidos: importación completa o en curso.", messages.INFO)
+
     @admin.display(description="Ver líneas")
     def ver_lineas(self, obj: SugeridoLote):
         url = reverse("admin:sugeridolinea_por_lote", args=[obj.id])
@@ -173,15 +224,16 @@ class SugeridoLoteAdmin(admin.ModelAdmin):
             lineas = SugeridoLinea.objects.filter(lote_id__in=ids).select_related("proveedor", "marca", "vendedor")
             filename = "sugerido_lotes_" + "_".join(map(str, ids)) + ".xlsx"
 
-        # ✅ No intentes mutar FKs a str aquí; el exportador hace la conversión segura
-        xlsx_bytes, filename = export_lines_to_xlsx(lineas, filename=filename)
+        # Workbook write-only a archivo temporal y respuesta en streaming:
+        # la memoria no crece con el número de lotes seleccionados
+        xlsx_file, filename = export_lines_to_xlsx_file(lineas, filename=filename)
 
-        resp = HttpResponse(
-            xlsx_bytes,
+        return FileResponse(
+            xlsx_file,
+            as_attachment=True,
+            filename=filename,
             content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
         )
-        resp["Content-Disposition"] = f'attachment; filename="{filename}"'
-        return resp
 
     @admin.action(description="Recalcular totales")
     def accion_recalcular_totales(self, request, qs):
@@ -197,6 +249,17 @@ class SugeridoLoteAdmin(admin.ModelAdmin):
             obj.creado_por = request.user
         super().save_model(request, obj, form, change)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # La señal m2m_changed encola la importación: se informa en lugar de esperarla
+        estado = SugeridoLote.objects.filter(pk=form.instance.pk).values_list("importacion_estado", flat=True).first()
+        if not change and estado == SugeridoLote.EstadoImportacion.EN_COLA:
+            self.message_user(
+                request,
+                "La importación desde ICG quedó en cola; el avance se ve en la columna 'Importación ICG'.",
+                messages.INFO,
+            )
+
     # NUEVO: detección robusta de perfiles
     def _get_perfil_proveedor_obj(self, request):
         perfil = getattr(request.user, "perfil_proveedor", None)
@@ -688,12 +751,25 @@ class SugeridoLineaAdmin(admin.ModelAdmin):
                 kwargs["numserie"] = lote.numserie
             if getattr(lote, "subserie", None):
                 kwargs["subserie_n"] = lote.subserie
+            # ?almacen=2 reintenta solo ese almacén (p.ej. uno que falló)
+            almacenes = request.GET.getlist('almacen')
+            if almacenes:
+                kwargs["almacenes"] = almacenes
 
             pedidos = crear_pedido_compra_desde_lote(lote_id=lote.id, **kwargs)
-            if pedidos:
-                resumen = ", ".join([f"{p.get('numserie')}-{p.get('numpedido')}({p.get('cod_almacen')})" for p in pedidos])
-                self.message_user(request, f"{len(pedidos)} pedido(s) en ICG generados: {resumen}.", level=messages.SUCCESS)
-            else:
+            ok = [p for p in pedidos if p.get('estado') == ESTADO_PEDIDO_OK]
+            fallidos = [p for p in pedidos if p.get('estado') == ESTADO_PEDIDO_ERROR]
+            if ok:
+                resumen = ", ".join([f"{p.get('numserie')}-{p.get('numpedido')}({p.get('cod_almacen')})" for p in ok])
+                self.message_user(request, f"{len(ok)} pedido(s) en ICG generados: {resumen}.", level=messages.SUCCESS)
+            for p in fallidos:
+                self.message_user(
+                    request,
+                    f"Almacén {p.get('cod_almacen')}: error al generar pedido en ICG ({p.get('error')}). "
+                    f"Puede reintentarse solo ese almacén.",
+                    level=messages.ERROR,
+                )
+            if not pedidos:
                 self.message_user(request, "No se generaron pedidos (sin líneas válidas).", level=messages.INFO)
         except Exception as e:
             self.message_user(request, f'Error al generar pedido en ICG: {e}', level=messages.ERROR)
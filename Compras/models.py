@@ -46,7 +46,8 @@ class ProcesoClasificacion(models.Model):
             ('procesado', 'Procesado'),
             ('edicion', 'Edición'),
             ('confirmado', 'Confirmado'),
-            ('actualizado', 'Actualizado en ICG')
+            ('actualizado', 'Actualizado en ICG'),
+            ('error', 'Error en la carga'),
         ],
         default='extraccion'
     )
@@ -83,14 +84,14 @@ class ArticuloClasificacionTemporal(models.Model):
     clasificacion3 = models.CharField(max_length=100, blank=True, null=True)
     clasificacion5 = models.CharField(max_length=100, blank=True, null=True)
     unidades_compras = models.FloatField(blank=True, null=True)
-    importe_compras = models.CharField(max_length=200, blank=True, null=True)
+    importe_compras = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
     unidades = models.FloatField(blank=True, null=True)
-    coste = models.CharField(max_length=200, blank=True, null=True)
-    beneficio = models.CharField(max_length=200, blank=True, null=True)
-    importe = models.CharField(max_length=200, blank=True, null=True)
+    coste = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
+    beneficio = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
+    importe = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
     porcentaje_sv = models.CharField(max_length=100, blank=True, null=True)
     stock_actual = models.FloatField(blank=True, null=True)
-    valoracion_stock_actual = models.CharField(max_length=200, blank=True, null=True)
+    valoracion_stock_actual = models.DecimalField(max_digits=20, decimal_places=2, blank=True, null=True)
     almacen = models.CharField(max_length=100, blank=True, null=True)
     estado_nuevo = models.CharField(max_length=100, blank=True, null=True)
 
@@ -100,6 +101,10 @@ class ArticuloClasificacionTemporal(models.Model):
     class Meta:
         verbose_name = "Artículo Clasificación Temporal"
         verbose_name_plural = "Artículos Clasificación Temporal"
+        indexes = [
+            # Clasificación por sesión (sección+almacén) de un proceso
+            models.Index(fields=['proceso', 'almacen', 'seccion'], name='clasiftemp_proc_alm_sec_idx'),
+        ]
 auditlog.register(ArticuloClasificacionTemporal)
 # 2. Tabla de artículos en proceso, editables 
 class ArticuloClasificacionProcesado(models.Model):
@@ -263,6 +268,13 @@ class SugeridoLote(models.Model):
         COMPLETADO = "COMPLETADO", "Completado/Orden generada"
         ANULADO = "ANULADO", "Anulado"
 
+    class EstadoImportacion(models.TextChoices):
+        SIN_IMPORTAR = "SIN_IMPORTAR", "Sin importar"
+        EN_COLA = "EN_COLA", "En cola"
+        EN_CURSO = "EN_CURSO", "En curso"
+        COMPLETADA = "COMPLETADA", "Completada"
+        FALLIDA = "FALLIDA", "Fallida"
+
     nombre = models.CharField(max_length=255, help_text="Identificador legible del lote (e.g. Sugerido 2025-08 corte semanal)")
     marcas = models.ManyToManyField(Marca, related_name="lotes", blank=True, help_text="Marcas asociadas al sugerido")
     proveedor = models.ForeignKey(Proveedor, on_delete=models.PROTECT, related_name="lotes", null=True, blank=True , help_text="Proveedores disponibles para esa marca")
@@ -284,6 +296,14 @@ class SugeridoLote(models.Model):
     
     fecha_actualizacion_kpis = models.DateTimeField(null=True, blank=True, help_text="Fecha de la última actualización de KPIs desde ICG")
 
+    # Importación desde ICG en segundo plano (Compras.services.importacion_lote)
+    importacion_estado = models.CharField(max_length=20, choices=EstadoImportacion.choices, default=EstadoImportacion.SIN_IMPORTAR, db_index=True)
+    importacion_etapa = models.CharField(max_length=20, blank=True, default="", help_text="Etapa en curso o en la que falló la importación")
+    importacion_progreso = models.PositiveSmallIntegerField(default=0, help_text="Porcentaje de avance de la importación (0-100)")
+    importacion_detalle = models.JSONField(default=dict, blank=True, help_text="Etapas completadas y conteos de la importación")
+    importacion_error = models.TextField(blank=True, null=True)
+    importacion_actualizada = models.DateTimeField(null=True, blank=True)
+
     class Meta:
         ordering = ["-fecha_extraccion"]
         verbose_name = "Lote de Sugerido"
@@ -303,6 +323,13 @@ class SugeridoLote(models.Model):
         # NO llamar a save() aquí para evitar recursión infinita
         # El save se hará desde donde se llame este método
 
+    def actualizar_importacion(self, **campos):
+        """Actualiza el estado de la importación sin disparar save()/señales (se llama desde las tareas)."""
+        campos.setdefault("importacion_actualizada", timezone.now())
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        SugeridoLote.objects.filter(pk=self.pk).update(**campos)
+
     def save(self, *args, **kwargs):
         is_new = self.pk is None
         if is_new:
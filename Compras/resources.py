@@ -1,7 +1,19 @@
 from import_export import resources
+from import_export.widgets import DecimalWidget
 from .models import ArticuloClasificacionTemporal
 
+
+class ImporteWidget(DecimalWidget):
+    """Decimal que ignora las comas de miles de los archivos de ICG ('1,234.50')."""
+    def clean(self, value, row=None, **kwargs):
+        if isinstance(value, str):
+            value = value.replace(',', '')
+        return super().clean(value, row=row, **kwargs)
+
+
 class ArticuloClasificacionTemporalResource(resources.ModelResource):
+    WIDGETS_MAP = {**resources.ModelResource.WIDGETS_MAP, 'DecimalField': ImporteWidget}
+
     class Meta:
         model = ArticuloClasificacionTemporal
         import_id_fields = ('codigo',)
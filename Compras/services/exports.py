@@ -2,11 +2,14 @@
 from decimal import Decimal
 import datetime
 from io import BytesIO
+from itertools import chain, islice
+import tempfile
 from typing import Iterable
 import datetime
 from django.utils import timezone
 from django.db.models import Model, QuerySet
 from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
 
 def _excel_datetime(dt: datetime.datetime) -> datetime.datetime:
     """Convierte un datetime aware a naive (en la zona local del servidor o UTC)."""
@@ -110,31 +113,116 @@ def _row_from_linea(ln) -> list:
     ]
 
 
-def export_lines_to_xlsx(lineas: Iterable, filename="sugerido.xlsx"):
+# ─── Exportación en streaming (write-only) ───
+# Campos leídos con values_list(): evita instanciar modelos y los ~40 getattr por fila.
+# El orden sigue HEADERS; proveedor/marca/vendedor se resuelven como su __str__.
+VALUES_FIELDS = (
+    "proveedor__nombre", "marca__nombre", "cod_almacen", "nombre_almacen",
+    "codigo_articulo", "referencia", "descripcion",
+    "departamento", "seccion", "familia", "subfamilia", "tipo",
+    "clasificacion",
+    "stock_actual", "stock_minimo", "stock_maximo", "lead_time_dias", "stock_seguridad",
+    "uds_compra_base", "uds_compra_mult", "embalaje",
+    "ultimo_costo",
+    "sugerido_base", "factor_almacen", "sugerido_calculado", "cajas_calculadas",
+    "costo_linea",
+    "sugerido_interno", "comentario_interno",
+    "continuidad_activo", "nuevo_sugerido_prov", "descuento_prov_pct", "descuento_prov_pct_2", "descuento_prov_pct_3",
+    "nuevo_nombre_prov", "observaciones_prov",
+    "estado_linea",
+    "creado", "actualizado",
+    "vendedor__alias", "vendedor__user__username",
+)
+
+# Filas usadas para estimar el ancho de columnas (write-only exige fijarlo antes de escribir)
+WIDTH_SAMPLE_ROWS = 200
+STREAM_CHUNK_SIZE = 2000
+
+
+def _row_from_values(v: tuple) -> list:
+    """Fila plana a partir de una tupla de VALUES_FIELDS (mismo resultado que _row_from_linea)."""
+    (proveedor, marca, cod_almacen, nombre_almacen, *medio,
+     creado, actualizado, vendedor_alias, vendedor_username) = v
+    vendedor = (vendedor_alias or vendedor_username) if vendedor_username is not None else None
+    return [
+        _cellify(proveedor),
+        _cellify(marca),
+        _cellify(f"{cod_almacen}-{nombre_almacen}"),
+        *[_cellify(x) for x in medio],
+        _cellify(creado.date() if creado else None),
+        _cellify(actualizado.date() if actualizado else None),
+        _cellify(vendedor),
+    ]
+
+
+def iter_line_rows(lineas: Iterable, chunk_size: int = STREAM_CHUNK_SIZE):
     """
-    Acepta un QuerySet de SugeridoLinea (o lista iterable de instancias) y
-    devuelve (bytes_xlsx, filename).
+    Genera filas para el Excel sin cargar el lote completo en memoria.
+    Con QuerySet usa values_list().iterator(); con listas de instancias cae a _row_from_linea.
+    """
+    if isinstance(lineas, QuerySet):
+        for v in lineas.values_list(*VALUES_FIELDS).iterator(chunk_size=chunk_size):
+            yield _row_from_values(v)
+    else:
+        for ln in lineas:
+            yield _row_from_linea(ln)
+
+
+def _estimar_anchos(filas: list[list]) -> list[float]:
+    """Ancho por columna a partir de cabeceras + muestra de filas."""
+    anchos = []
+    for idx, header in enumerate(HEADERS):
+        max_len = max([len(str(header))] + [len(str(f[idx])) for f in filas if f[idx] is not None])
+        anchos.append(min(max(10, max_len + 2), 60))
+    return anchos
+
+
+def write_lines_xlsx(lineas: Iterable, destino, sample_rows: int = WIDTH_SAMPLE_ROWS, progreso=None) -> int:
     """
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Líneas Sugerido"
+    Escribe las líneas en `destino` (ruta o file-like) con un workbook write-only.
+    Memoria acotada: solo se retiene la muestra usada para los anchos.
+    `progreso(filas)` se invoca cada STREAM_CHUNK_SIZE filas si se indica.
+    Devuelve el número de filas escritas.
+    """
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title="Líneas Sugerido")
+
+    filas = iter_line_rows(lineas)
+    muestra = list(islice(filas, sample_rows))
+    for idx, ancho in enumerate(_estimar_anchos(muestra), start=1):
+        ws.column_dimensions[get_column_letter(idx)].width = ancho
 
     # Cabeceras
     ws.append(HEADERS)
 
-    # Si es QuerySet, optimiza FKs
-    if isinstance(lineas, QuerySet):
-        lineas = lineas.select_related("proveedor", "marca", "vendedor")
+    total = 0
+    for fila in chain(muestra, filas):
+        ws.append(fila)
+        total += 1
+        if progreso and total % STREAM_CHUNK_SIZE == 0:
+            progreso(total)
+
+    wb.save(destino)
+    return total
+
 
-    for ln in lineas:
-        ws.append(_row_from_linea(ln))
+def export_lines_to_xlsx_file(lineas: Iterable, filename="sugerido.xlsx"):
+    """
+    Genera el XLSX en un archivo temporal y devuelve (file_obj, filename) listo
+    para servirse con FileResponse (streaming). El archivo se borra al cerrarse.
+    """
+    tmp = tempfile.TemporaryFile(suffix=".xlsx")
+    write_lines_xlsx(lineas, tmp)
+    tmp.seek(0)
+    return tmp, filename
 
-    # Auto ancho simple
-    for col in ws.columns:
-        max_len = max((len(str(c.value)) if c.value is not None else 0) for c in col)
-        ws.column_dimensions[col[0].column_letter].width = min(max(10, max_len + 2), 60)
 
+def export_lines_to_xlsx(lineas: Iterable, filename="sugerido.xlsx"):
+    """
+    Acepta un QuerySet de SugeridoLinea (o lista iterable de instancias) y
+    devuelve (bytes_xlsx, filename).
+    """
     bio = BytesIO()
-    wb.save(bio)
+    write_lines_xlsx(lineas, bio)
     bio.seek(0)
     return bio.getvalue(), filename
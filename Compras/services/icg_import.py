@@ -1,192 +1,169 @@
 from django.utils import timezone
 from ..models import SugeridoLote, SugeridoLinea
 from django.contrib.auth import get_user_model
-from appMercaSur.conect import conectar_sql_server, ejecutar_consulta
+from appMercaSur.conect import PoolConexionesICG, conectar_sql_server, ejecutar_consulta
 from django.db import transaction
-from django.utils import timezone
-from django.contrib.auth import get_user_model
 from django.conf import settings
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
 
-def import_data_sugerido_inventario(user_id: int | None = None, marcas: list[str] | str | None = None, lote_id: int | None = None, provedor:str | None =None) -> str:
-    """
-    Importa datos desde ICG y genera líneas de sugerido.
-    Si se pasa lote_id, usa ese SugeridoLote existente (no crea uno nuevo).
-    Caso contrario crea un lote nuevo basado en timestamp.
-    
-    Args:
-        marcas: Lista de nombres de marcas o una sola marca (string). Si es None, importa todas las marcas asignadas.
-    """
-    # Normalizar marcas a lista
-    if marcas is None:
-        marcas_list = []
-    elif isinstance(marcas, str):
-        marcas_list = [marcas] if marcas else []
-    else:
-        marcas_list = list(marcas)
-    
-    print(f"Importando datos ICG para marcas={marcas_list}, proveedor={provedor}, lote_id={lote_id}, user_id={user_id}")
-    # ------------------------ Helpers internos ------------------------
-    def _safe_int(val, default=0):
-        try:
-            if val is None:
-                return default
-            if isinstance(val, bool):
-                return int(val)
-            # Convertir a string primero para detectar 'nan'
-            str_val = str(val).lower().strip()
-            if str_val in ['nan', 'null', 'none', '', 'inf', '-inf']:
-                return default
-            return int(float(val))
-        except (ValueError, TypeError, OverflowError):
+
+class ErrorImportacionICG(Exception):
+    """Fallo de conexión o de consulta en ICG: la importación se puede reintentar."""
+
+
+# ------------------------ Helpers de conversión ------------------------
+def _safe_int(val, default=0):
+    try:
+        if val is None:
             return default
+        if isinstance(val, bool):
+            return int(val)
+        # Convertir a string primero para detectar 'nan'
+        str_val = str(val).lower().strip()
+        if str_val in ['nan', 'null', 'none', '', 'inf', '-inf']:
+            return default
+        return int(float(val))
+    except (ValueError, TypeError, OverflowError):
+        return default
 
-    def _safe_float(val, default=0.0):
-        try:
-            if val is None:
-                return default
-            # Convertir a string primero para detectar 'nan'
-            str_val = str(val).lower().strip()
-            if str_val in ['nan', 'null', 'none', '', 'inf', '-inf']:
-                return default
-            converted = float(val)
-            # Verificar si es NaN usando math.isnan o comparación consigo mismo
-            if converted != converted:  # NaN != NaN es True
-                return default
-            return converted
-        except (ValueError, TypeError, OverflowError):
+
+def _safe_float(val, default=0.0):
+    try:
+        if val is None:
+            return default
+        # Convertir a string primero para detectar 'nan'
+        str_val = str(val).lower().strip()
+        if str_val in ['nan', 'null', 'none', '', 'inf', '-inf']:
             return default
+        converted = float(val)
+        # Verificar si es NaN usando math.isnan o comparación consigo mismo
+        if converted != converted:  # NaN != NaN es True
+            return default
+        return converted
+    except (ValueError, TypeError, OverflowError):
+        return default
 
-    # NUEVO: asegurar cast a string con strip sin fallar en int/None
-    def _safe_str(val, default=""):
-        try:
-            if val is None:
-                return default
-            str_val = str(val).strip()
-            if str_val.lower() in ['nan', 'null', 'none', '']:
-                return default
-            return str_val
-        except Exception:
+
+# NUEVO: asegurar cast a string con strip sin fallar en int/None
+def _safe_str(val, default=""):
+    try:
+        if val is None:
+            return default
+        str_val = str(val).strip()
+        if str_val.lower() in ['nan', 'null', 'none', '']:
             return default
+        return str_val
+    except Exception:
+        return default
 
-    def _resolve_usuario(uid: int | None):
-        User = get_user_model()
-        if uid is not None:
-            try:
-                return User.objects.get(pk=uid)
-            except User.DoesNotExist:
-                raise ValueError(f"El usuario con id={uid} no existe.")
-
-        system_id = getattr(settings, "SYSTEM_USER_ID", None)
-        if system_id is not None:
-            try:
-                return User.objects.get(pk=system_id)
-            except User.DoesNotExist:
-                pass
 
+def _resolve_usuario(uid: int | None):
+    User = get_user_model()
+    if uid is not None:
         try:
-            return User.objects.get(username="system")
+            return User.objects.get(pk=uid)
+        except User.DoesNotExist:
+            raise ValueError(f"El usuario con id={uid} no existe.")
+
+    system_id = getattr(settings, "SYSTEM_USER_ID", None)
+    if system_id is not None:
+        try:
+            return User.objects.get(pk=system_id)
         except User.DoesNotExist:
             pass
 
-        su = User.objects.filter(is_superuser=True).order_by("id").first()
-        if su:
-            return su
+    try:
+        return User.objects.get(username="system")
+    except User.DoesNotExist:
+        pass
 
-        raise ValueError(
-            "No se pudo resolver un usuario para 'creado_por'. "
-            "Pasa user_id o define settings.SYSTEM_USER_ID, "
-            "o crea un usuario 'system' o un superuser."
-        )
+    su = User.objects.filter(is_superuser=True).order_by("id").first()
+    if su:
+        return su
 
-    def _ensure_catalogo_by_nombre(ModelClass, nombres: set[str], defaults: dict | None = None) -> dict[str, int]:
-        """
-        Garantiza que existan registros para todos los 'nombres' (campo 'nombre').
-        Retorna: {nombre: id}
-        """
-        if not nombres:
-            return {}
+    raise ValueError(
+        "No se pudo resolver un usuario para 'creado_por'. "
+        "Pasa user_id o define settings.SYSTEM_USER_ID, "
+        "o crea un usuario 'system' o un superuser."
+    )
+
+
+def _ensure_catalogo_by_nombre(ModelClass, nombres: set[str], defaults: dict | None = None) -> dict[str, int]:
+    """
+    Garantiza que existan registros para todos los 'nombres' (campo 'nombre').
+    Retorna: {nombre: id}
+    """
+    if not nombres:
+        return {}
 
-        clean = {str(n).strip() for n in nombres if str(n).strip()}
-        if not clean:
-            return {}
+    clean = {str(n).strip() for n in nombres if str(n).strip()}
+    if not clean:
+        return {}
+
+    existing = dict(
+        ModelClass.objects.filter(nombre__in=list(clean)).values_list("nombre", "id")
+    )
+
+    missing = [n for n in clean if n not in existing]
+    if missing:
+        field_names = {f.name for f in ModelClass._meta.get_fields() if hasattr(f, "attname")}
+        new_objs = []
+        for n in missing:
+            kwargs = {"nombre": n}
+            if defaults:
+                for k, v in defaults.items():
+                    if k in field_names:
+                        kwargs.setdefault(k, v)
+            new_objs.append(ModelClass(**kwargs))
+        if new_objs:
+            # Evita choque por unique en concurrencia
+            ModelClass.objects.bulk_create(new_objs, ignore_conflicts=True)
 
         existing = dict(
             ModelClass.objects.filter(nombre__in=list(clean)).values_list("nombre", "id")
         )
 
-        missing = [n for n in clean if n not in existing]
-        if missing:
-            field_names = {f.name for f in ModelClass._meta.get_fields() if hasattr(f, "attname")}
-            new_objs = []
-            for n in missing:
-                kwargs = {"nombre": n}
-                if defaults:
-                    for k, v in defaults.items():
-                        if k in field_names:
-                            kwargs.setdefault(k, v)
-                new_objs.append(ModelClass(**kwargs))
-            if new_objs:
-                # Evita choque por unique en concurrencia
-                ModelClass.objects.bulk_create(new_objs, ignore_conflicts=True)
-
-            existing = dict(
-                ModelClass.objects.filter(nombre__in=list(clean)).values_list("nombre", "id")
-            )
-
-        return existing
+    return existing
 
-    # ------------------------ Inicio del proceso ------------------------
-    usuario = _resolve_usuario(user_id)
-    now = timezone.localtime(timezone.now())
 
-    if lote_id:
-        try:
-            proceso = SugeridoLote.objects.get(pk=lote_id)
-            creado = False
-        except SugeridoLote.DoesNotExist:
-            return f"Lote con id={lote_id} no existe."
-    else:
-        nombre_lote = f"Lote {now.strftime('%Y-%m-%d %H:%M:%S')}"
-        proceso, creado = SugeridoLote.objects.get_or_create(
-            nombre=nombre_lote,
-            defaults={
-                "fecha_extraccion": now,
-                "creado_por": usuario,
-            },
-        )
+def _normalizar_marcas(marcas: list[str] | str | None) -> list[str]:
+    if marcas is None:
+        return []
+    if isinstance(marcas, str):
+        return [marcas] if marcas else []
+    return list(marcas)
 
-    # Si no se creó uno nuevo, se puede optar por actualizar el usuario/fecha del lote existente
-    if not creado:
-        # Reasigna usuario/fecha si quieres, o déjalo así para idempotencia
-        pass
 
-    # Intenta marcar estado inicial (si existe el campo)
-    try:
-        if getattr(proceso, "estado", None) is not None and not getattr(proceso, "estado"):
-            proceso.estado = "PENDIENTE"
-            proceso.save(update_fields=["estado"])
-    except Exception:
-        pass
+# ------------------------ Etapas de la importación ------------------------
+# Las usa tanto import_data_sugerido_inventario (síncrona) como el pipeline de Celery
+# de Compras.services.importacion_lote, que ejecuta cada etapa en una tarea aparte.
+
+# Almacenes que cubre el sugerido
+ALMACENES_SUGERIDO = ["1", "2", "3", "50"]
+# La extracción se parte en (grupo de marcas × almacén) y las particiones corren en paralelo
+MARCAS_POR_PARTICION = 5
+MAX_CONEXIONES_EXTRACCION = 4
 
-    # ------------------------ Conexión y consulta ------------------------
-    conexion = conectar_sql_server()
-    if conexion is None or isinstance(conexion, str):
-        # No cambies estado del SugeridoLote aquí; solo retorna mensaje de error
-        try:
-            setattr(proceso, "estado", "FALLIDO")
-            proceso.save(update_fields=["estado"])
-        except Exception:
-            pass
-        extra = f" Detalle: {conexion}" if isinstance(conexion, str) else ""
-        return f"Fallo de conexión a ICG en Proceso #{proceso.pk}.{extra}"
 
-    consulta = """
+def _marcadores(valores) -> str:
+    return ", ".join("?" for _ in valores)
+
+
+def consulta_sugerido_inventario(marcas_list: list[str], provedor: str | None = None,
+                                 almacenes: list[str] | None = None) -> tuple[str, list]:
+    """
+    SQL de extracción del sugerido (artículo × almacén) filtrado por almacenes, marcas y proveedor.
+    :return: (consulta con marcadores '?', parámetros en el mismo orden)
+    """
+    almacenes = list(almacenes or ALMACENES_SUGERIDO)
+    params = list(almacenes)
+    consulta = f"""
 WITH AlmacenesSel AS (
     SELECT CODALMACEN, NOMBREALMACEN
     FROM ALMACEN
-    WHERE CODALMACEN IN ('1','2','3','50')
+    WHERE CODALMACEN IN ({_marcadores(almacenes)})
 ),
 Base AS (
     SELECT
@@ -262,12 +239,11 @@ Base AS (
     WHERE AR.DESCATALOGADO = 'F'
       """
     if marcas_list:
-        # Escapar comillas simples en cada marca
-        marcas_escaped = [m.replace("'", "''") for m in marcas_list]
-        marcas_str = "', '".join(marcas_escaped)
-        consulta += f"      AND MC.DESCRIPCION IN ('{marcas_str}')\n"
+        consulta += f"      AND MC.DESCRIPCION IN ({_marcadores(marcas_list)})\n"
+        params.extend(marcas_list)
     if provedor:
-        consulta += f"      AND p.NOMPROVEEDOR = '{provedor.replace("'", "''")}'\n"
+        consulta += "      AND p.NOMPROVEEDOR = ?\n"
+        params.append(provedor)
     consulta += """
 ),
 Calculos AS (
@@ -361,21 +337,62 @@ SELECT
 FROM Final
 ORDER BY nombre_almacen, codigo;
 """
+    return consulta, params
+
+
+def particiones_sugerido(marcas_list: list[str], almacenes: list[str] | None = None,
+                         marcas_por_particion: int = MARCAS_POR_PARTICION) -> list[tuple[list[str], str]]:
+    """Particiones (marcas, almacén) de la extracción; sin marcas, una por almacén con todas las marcas."""
+    almacenes = list(almacenes or ALMACENES_SUGERIDO)
+    grupos = [marcas_list[i:i + marcas_por_particion] for i in range(0, len(marcas_list), marcas_por_particion)] or [[]]
+    return [(grupo, almacen) for grupo in grupos for almacen in almacenes]
 
-    try:
-        # Tu ejecutar_consulta acepta ambos órdenes; uso (sql, conexion).
-        df = ejecutar_consulta( conexion ,consulta)
-    finally:
-        try:
-            if hasattr(conexion, "close"):
-                conexion.close()
-        except Exception:
-            pass
 
+def _extraer_particion(pool: PoolConexionesICG, marcas_list: list[str], almacen: str, provedor: str | None) -> pd.DataFrame:
+    consulta, params = consulta_sugerido_inventario(marcas_list, provedor, [almacen])
+    try:
+        with pool.conexion() as conexion:
+            df = ejecutar_consulta(conexion, consulta, params)
+    except ConnectionError as e:
+        raise ErrorImportacionICG(f"Fallo de conexión a ICG. Detalle: {e}") from e
     if df is None:
-        # No cambies estado del SugeridoLote aquí
-        return f"Error ejecutando consulta en Proceso #{proceso.pk}"
+        raise ErrorImportacionICG(f"Error ejecutando la consulta de sugerido en ICG (almacén {almacen}, marcas {marcas_list}).")
+    return df
+
 
+def extraer_sugerido_icg(marcas: list[str] | str | None = None, provedor: str | None = None,
+                         almacenes: list[str] | None = None, max_conexiones: int = MAX_CONEXIONES_EXTRACCION) -> pd.DataFrame:
+    """
+    Etapa de extracción: consulta el sugerido en ICG partido por (grupo de marcas × almacén).
+    Las particiones corren en paralelo sobre un pool de conexiones y se unen en un solo DataFrame,
+    en el mismo orden que la consulta completa (almacén, código).
+    Lanza ErrorImportacionICG si no hay conexión o alguna partición falla.
+    """
+    particiones = particiones_sugerido(_normalizar_marcas(marcas), almacenes)
+    # Solo se usa pyodbc dentro de los hilos; el ORM se toca antes y después
+    with PoolConexionesICG(maximo=min(max_conexiones, len(particiones))) as pool, \
+            ThreadPoolExecutor(max_workers=pool.maximo) as executor:
+        futuros = [
+            executor.submit(_extraer_particion, pool, grupo, almacen, provedor)
+            for grupo, almacen in particiones
+        ]
+        dfs = [f.result() for f in futuros]
+
+    dfs = [df for df in dfs if not df.empty]
+    if not dfs:
+        return pd.DataFrame()
+    df = pd.concat(dfs, ignore_index=True)
+    print(f"Extracción de sugerido: {len(particiones)} partición(es), {len(df)} filas")
+    return df.sort_values(["Almacen", "Código"], kind="stable", ignore_index=True)
+
+
+def transformar_sugerido(df: pd.DataFrame) -> tuple[list[dict], dict]:
+    """
+    Etapa de transformación: asegura proveedores/marcas en el catálogo y convierte cada fila
+    de ICG en los campos de una SugeridoLinea (sin lote). Los KPIs quedan en cero; los llena
+    actualizar_kpis_lote después de la carga.
+    :return: (lineas, conteos) con conteos = {'omitidas': duplicadas en la extracción, 'errores': n}
+    """
     # ------------------------ Resolver modelos de FK ------------------------
     proveedor_field = SugeridoLinea._meta.get_field("proveedor")
     marca_field = SugeridoLinea._meta.get_field("marca")
@@ -383,11 +400,13 @@ ORDER BY nombre_almacen, codigo;
     MarcaModel = marca_field.remote_field.model
 
     # ------------------------ Construir mapas y crear faltantes ------------------------
+    # Registros como dicts: recorrerlos es mucho más rápido que df.iterrows()
+    filas = df.to_dict("records")
     proveedores = set()
     marcas = set()
     # NUEVO: mapa de nombre proveedor -> CodProveedor (ICG)
     prov_cod_map = {}
-    for _, row in df.iterrows():
+    for row in filas:
         p = _safe_str(row.get("Proveedor"))
         m = _safe_str(row.get("Marca"))
         if p:
@@ -432,42 +451,13 @@ ORDER BY nombre_almacen, codigo;
             if to_update:
                 ProveedorModel.objects.bulk_update(to_update, ["cod_icg"])
 
-    # ------------------------ Obtener KPIs de inventario ------------------------
-    # Extraer marca_ids y almacenes únicos del DataFrame principal
-    marca_names = set(df['Marca'].dropna().unique())
-    almacenes_df = set(df['CODALMACEN'].dropna().astype(str).unique())
-    
-    # Mapear nombres de marca a IDs de ICG (necesitas ajustar este mapeo según tu BD)
-    # Por ahora, usamos los valores por defecto
-    df_kpis = obtener_kpis_inventario_icg(
-        marca_ids=[4, 7, 12],  # Ajusta según las marcas que estés importando
-        almacenes=list(almacenes_df) if almacenes_df else ['1','2','3','50']
-    )
-    
-    # Crear diccionario de búsqueda de KPIs por (almacen, articulo)
-    kpis_dict = {}
-    if df_kpis is not None and not df_kpis.empty:
-        for _, kpi_row in df_kpis.iterrows():
-            key = (str(kpi_row['CodAlmacen']), str(kpi_row['CodigoArticulo']))
-            kpis_dict[key] = {
-                'valor_inventario': _safe_float(kpi_row.get('ValorInventario'), 0.0),
-                'unidades_vendidas_90d': _safe_float(kpi_row.get('UnidadesVendidas_90d'), 0.0),
-                'venta_diaria_promedio': _safe_float(kpi_row.get('VentaDiariaPromedio'), 0.0),
-                'dias_inventario': _safe_float(kpi_row.get('DiasInventario'), None) if kpi_row.get('DiasInventario') is not None else None,
-            }
-    
-    # ------------------------ Evitar duplicados por lote ------------------------
-    existentes = set(
-        SugeridoLinea.objects.filter(lote=proceso)
-        .values_list("cod_almacen", "codigo_articulo")
-    )
-
-    registros = []
-    insertados = 0
+    # ------------------------ Construir líneas ------------------------
+    vistos = set()
+    lineas = []
     omitidos = 0
     errores = 0
 
-    for _, row in df.iterrows():
+    for row in filas:
         cod_alm = _safe_str(row.get("CODALMACEN"))
         cod_art = _safe_str(row.get("Código"))
 
@@ -476,10 +466,10 @@ ORDER BY nombre_almacen, codigo;
             errores += 1
             continue
 
-        if (cod_alm, cod_art) in existentes:
+        if (cod_alm, cod_art) in vistos:
             omitidos += 1
             continue
-        existentes.add((cod_alm, cod_art))
+        vistos.add((cod_alm, cod_art))
 
         prov_name = _safe_str(row.get("Proveedor"))
         marca_name = _safe_str(row.get("Marca"))
@@ -490,11 +480,11 @@ ORDER BY nombre_almacen, codigo;
         # Validar campos numéricos críticos
         ultimo_costo = _safe_float(row.get("UltimoCosto"))
         factor_almacen = _safe_float(row.get("Factor"), 1.0)
-        
+
         # NUEVA VALIDACIÓN: Obtener clasificación y forzar sugeridos a 0 SOLO si es I
         clasificacion_raw = _safe_str(row.get("Clasificacion"))
         clasificacion_upper = clasificacion_raw.upper() if clasificacion_raw else ""
-        
+
         # CAMBIO: Solo forzar a 0 si clasificación es I (NO C)
         if clasificacion_upper == 'I':
             sugerido_base_val = 0
@@ -513,7 +503,7 @@ ORDER BY nombre_almacen, codigo;
             costo_linea_val = _safe_float(row.get("CostoLinea"))
             # Marcar como informativa si sugerido_base es 0 pero diff > 0
             es_informativa_val = bool(_safe_int(row.get("EsInformativa"), 0))
-            
+
             # NUEVO: Para clasificación C, nuevo_sugerido_prov debe ser igual a sugerido_interno
             if clasificacion_upper == 'C':
                 nuevo_sugerido_prov_val = sugerido_interno_val
@@ -521,18 +511,8 @@ ORDER BY nombre_almacen, codigo;
         try:
             # Garantizar que descripcion nunca sea None o vacía
             descripcion = _safe_str(row.get("Descripción")) or "SIN DESCRIPCIÓN"
-            
-            # Obtener KPIs del diccionario
-            kpi_key = (cod_alm, cod_art)
-            kpis = kpis_dict.get(kpi_key, {
-                'valor_inventario': 0.0,
-                'unidades_vendidas_90d': 0.0,
-                'venta_diaria_promedio': 0.0,
-                'dias_inventario': None,
-            })
-            
-            registro = SugeridoLinea(
-                lote=proceso,
+
+            lineas.append(dict(
                 cod_almacen=cod_alm,
                 nombre_almacen=_safe_str(row.get("Almacen")) or None,
                 codigo_articulo=cod_art,
@@ -565,31 +545,87 @@ ORDER BY nombre_almacen, codigo;
                 IVA=_safe_float(row.get("IVA"), 0.0),
                 es_informativa=es_informativa_val,
                 Proveedor_principal=_safe_str(row.get("proveedorPrincipal")),
-                # Nuevos campos de KPIs
-                valor_inventario=Decimal(str(kpis['valor_inventario'])),
-                unidades_vendidas_90d=Decimal(str(kpis['unidades_vendidas_90d'])),
-                venta_diaria_promedio=Decimal(str(kpis['venta_diaria_promedio'])),
-                dias_inventario=Decimal(str(kpis['dias_inventario'])) if kpis['dias_inventario'] is not None else None,
                 clasificacion_original=clasificacion_raw or None,
-            )
-            registros.append(registro)
-            insertados += 1
+            ))
         except Exception as e:
             print(f"Error creando registro para {cod_alm}-{cod_art}: {e}")
             errores += 1
             continue
 
-    with transaction.atomic():
-        if registros:
-            SugeridoLinea.objects.bulk_create(registros, batch_size=1000)
+    return lineas, {"omitidas": omitidos, "errores": errores}
+
+
+def cargar_lineas_sugerido(lote: SugeridoLote, lineas: list[dict], progreso=None, batch_size: int = 1000) -> tuple[int, int]:
+    """
+    Etapa de carga: inserta en bloque las líneas que el lote aún no tiene (cod_almacen, codigo_articulo).
+    Cada bloque se confirma por separado; si la carga se interrumpe, al repetirla se omiten las líneas
+    ya insertadas, así que no se duplican.
+    :param progreso: callback opcional progreso(insertadas, total), llamado tras cada bloque
+    :return: (insertadas, omitidas por existir ya en el lote)
+    """
+    existentes = set(
+        SugeridoLinea.objects.filter(lote=lote).values_list("cod_almacen", "codigo_articulo")
+    )
+    nuevas = [
+        SugeridoLinea(lote=lote, **campos) for campos in lineas
+        if (campos["cod_almacen"], campos["codigo_articulo"]) not in existentes
+    ]
+    for i in range(0, len(nuevas), batch_size):
+        bloque = nuevas[i:i + batch_size]
+        with transaction.atomic():
+            SugeridoLinea.objects.bulk_create(bloque, batch_size=batch_size)
+        if progreso:
+            progreso(i + len(bloque), len(nuevas))
+    return len(nuevas), len(lineas) - len(nuevas)
+
+
+def import_data_sugerido_inventario(user_id: int | None = None, marcas: list[str] | str | None = None, lote_id: int | None = None, provedor:str | None =None) -> str:
+    """
+    Importa datos desde ICG y genera líneas de sugerido (versión síncrona: todas las etapas seguidas).
+    Si se pasa lote_id, usa ese SugeridoLote existente (no crea uno nuevo).
+    Caso contrario crea un lote nuevo basado en timestamp.
+    Los lotes creados desde el admin se importan en segundo plano (Compras.services.importacion_lote).
+
+    Args:
+        marcas: Lista de nombres de marcas o una sola marca (string). Si es None, importa todas las marcas asignadas.
+    """
+    marcas_list = _normalizar_marcas(marcas)
+    print(f"Importando datos ICG para marcas={marcas_list}, proveedor={provedor}, lote_id={lote_id}, user_id={user_id}")
+
+    # ------------------------ Inicio del proceso ------------------------
+    now = timezone.localtime(timezone.now())
+
+    if lote_id:
+        try:
+            proceso = SugeridoLote.objects.get(pk=lote_id)
+        except SugeridoLote.DoesNotExist:
+            return f"Lote con id={lote_id} no existe."
+    else:
+        nombre_lote = f"Lote {now.strftime('%Y-%m-%d %H:%M:%S')}"
+        proceso, _ = SugeridoLote.objects.get_or_create(
+            nombre=nombre_lote,
+            defaults={
+                "fecha_extraccion": now,
+                "creado_por": _resolve_usuario(user_id),
+            },
+        )
+
+    try:
+        df = extraer_sugerido_icg(marcas_list, provedor)
+    except ErrorImportacionICG as e:
+        return f"{e} Proceso #{proceso.pk}."
+
+    lineas, conteos = transformar_sugerido(df)
+    insertados, omitidos = cargar_lineas_sugerido(proceso, lineas)
+    actualizar_kpis_lote(proceso.pk)
 
     mensaje_final = (
         f"Proceso #{proceso.pk} -> líneas nuevas: {insertados}, "
-        f"omitidas (duplicadas en lote): {omitidos}"
+        f"omitidas (duplicadas en lote): {omitidos + conteos['omitidas']}"
     )
-    if errores > 0:
-        mensaje_final += f", errores: {errores}"
-    
+    if conteos["errores"] > 0:
+        mensaje_final += f", errores: {conteos['errores']}"
+
     return mensaje_final + "."
 
 
@@ -1,12 +1,17 @@
 # Compras/services/icg_pedidos.py
 from decimal import Decimal, ROUND_HALF_UP
 from math import floor, ceil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 
+import pyodbc
+
 from django.utils import timezone
 
 from Compras.models import SugeridoLote, SugeridoLinea
-from appMercaSur.conect import conectar_sql_server
+from appMercaSur.conect import PoolConexionesICG, conectar_sql_server
 from Compras.comodin.utils_pedido import (
     _round2, 
     _fmt_dtotexto, 
@@ -14,7 +19,6 @@ from Compras.comodin.utils_pedido import (
     _date_zero_today,
     _hora_excel_naive,
     _fecha_base_excel,
-    _next_numpedido,
     _elegir_cantidad,
     _precio_y_descuento,
     _impuestos_de_linea,
@@ -27,6 +31,8 @@ from Compras.comodin.utils_pedido import (
     _obtener_forma_pago_proveedor,
     )
 
+logger = logging.getLogger(__name__)
+
 
 # ----------------------------- Constantes por defecto -----------------------------
 
@@ -52,63 +58,33 @@ DEFAULT_CONTACTO = -1
 DEFAULT_CODEMPLEADO = -1
 DEFAULT_NUMIMPRESIONES = 0
 
-# ----------------------------- Flujo principal de creación ------------------------
-
-def crear_pedido_compra_desde_lote(
-    lote_id: int,
-    numserie: str = DEFAULT_NUMSERIE,
-    subserie_n: str = DEFAULT_SUBSERIE_N,
-    politica_cantidades: str = "prefer_interno",
-    ajuste_multiplo: str = "up",
-):
-    """
-    Crea pedidos en ICG agrupando líneas del lote por almacén.
-    - Inserta CAB, LIN, DTOSLIN, TOT y DTOS (cargos consolidados).
-    - Actualiza STOCKS.PEDIDO.
-    - Inserta TESORERIA por cada pedido creado.
-    """
-    lote = SugeridoLote.objects.select_related("proveedor").get(pk=lote_id)
-    if not lote.proveedor:
-        raise ValueError("El lote no tiene proveedor asignado.")
 
-    codprove = getattr(lote.proveedor, "cod_icg", None) or getattr(lote.proveedor, "codigo", None)
-    if codprove in (None, "", 0):
-        raise ValueError("El proveedor no tiene código ICG (campo 'cod_icg' o 'codigo').")
+# Máximo de almacenes procesados en paralelo (cada hilo con una conexión del pool)
+MAX_WORKERS_ALMACENES = 4
 
-    lineas = list(
-        lote.lineas.select_related("proveedor", "marca")
-        .filter(sugerido_interno__gt=0)
-        .all()
-    )
-    if not lineas:
-        raise ValueError("El lote no tiene líneas con sugerido interno > 0.")
+# Reintentos si otro proceso tomó el mismo NUMPEDIDO antes de confirmar
+MAX_INTENTOS_NUMPEDIDO = 5
 
-    print(f"DEBUG: Encontradas {len(lineas)} líneas con sugerido_interno > 0")
-    for i, lin in enumerate(lineas[:3]):
-        print(
-            f"DEBUG línea {i+1}: "
-            f"codigo={lin.codigo_articulo}, sugerido_interno={lin.sugerido_interno}, embalaje={lin.embalaje}"
-        )
+ESTADO_PEDIDO_OK = "OK"
+ESTADO_PEDIDO_ERROR = "ERROR"
 
-    # Agrupar por almacén
-    grupos: dict[str, list[SugeridoLinea]] = {}
-    for lin in lineas:
-        grupos.setdefault(lin.cod_almacen, []).append(lin)
-    print(f"DEBUG: Grupos por almacén: {list(grupos.keys())}")
+# Serializa la asignación de NUMPEDIDO entre los hilos de este proceso. Guarda el último
+# número entregado por serie para que dos hilos no tomen el mismo mientras sus pedidos
+# siguen sin confirmar; entre procesos, un número repetido falla con clave duplicada y se reintenta.
+_NUMPEDIDO_LOCK = threading.Lock()
+_ultimo_numpedido: dict[str, int] = {}
 
-    pedidos_creados = []
-    lineas_ordenadas_ids: list[int] = []
+# ----------------------------- Conexiones ICG -------------------------------------
 
-    # ------------------- Conexión segura -------------------
+def _abrir_conexion_icg():
+    """Abre una conexión nueva a ICG con autocommit desactivado."""
     conexion = conectar_sql_server()
     if not conexion:
         raise RuntimeError(
             "No se pudo obtener una conexión a SQL Server (conectar_sql_server() devolvió None). "
             "Verifica credenciales/DSN/red."
         )
-    try:
-        cursor = conexion.cursor()
-    except AttributeError:
+    if not hasattr(conexion, "cursor"):
         raise RuntimeError(
             "La conexión a SQL Server no es válida (no expone .cursor()). "
             "Revisa la implementación de conectar_sql_server()."
@@ -119,51 +95,58 @@ def crear_pedido_compra_desde_lote(
         conexion.autocommit = False
     except Exception:
         pass  # si el driver no soporta, continuamos con manejo manual
+    return conexion
 
-    try:
-        dt_now = _now_naive()
-        date_zero = _date_zero_today()
-        hora_excel = _hora_excel_naive()
-
-        for cod_almacen, lista in grupos.items():
-            print(f"DEBUG: Procesando almacén {cod_almacen} con {len(lista)} líneas")
-
-            # Filtrar/ajustar cantidades
-            lista_validas: list[SugeridoLinea] = []
-            for lin in lista:
-                cantidad = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
-                if cantidad > 0:
-                    lista_validas.append(lin)
-            if not lista_validas:
-                continue
 
-            # Ordenar por descripción del artículo
-            lista_validas.sort(key=lambda x: (x.descripcion or "").strip().upper())
+def _obtener_regimfact(cursor, codprove) -> str:
+    """REGIMFACT del proveedor o el valor por defecto."""
+    try:
+        cursor.execute(
+            """
+            SELECT REGIMFACT
+            FROM PROVEEDORES
+            WHERE CODPROVEEDOR = ?
+            """,
+            (int(codprove),),
+        )
+        row_prov = cursor.fetchone()
+        return str(row_prov[0]) if (row_prov and row_prov[0]) else DEFAULT_REGIMFACT
+    except Exception as e:
+        print(f"Error al obtener REGIMFACT del proveedor {codprove}: {e}")
+        return DEFAULT_REGIMFACT
 
-            # Obtener REGIMFACT del proveedor
-            try:
-                cursor.execute(
-                    """
-                    SELECT REGIMFACT
-                    FROM PROVEEDORES
-                    WHERE CODPROVEEDOR = ?
-                    """,
-                    (int(codprove),),
-                )
-                row_prov = cursor.fetchone()
-                regimfact = str(row_prov[0]) if (row_prov and row_prov[0]) else DEFAULT_REGIMFACT
-            except Exception as e:
-                print(f"Error al obtener REGIMFACT del proveedor {codprove}: {e}")
-                regimfact = DEFAULT_REGIMFACT
 
-            # CABECERA
-            numpedido = _next_numpedido(cursor, numserie)
-            supedido = f"-{numserie}-{numpedido}"
+def _asignar_numpedido(cursor, numserie: str) -> int:
+    """
+    Siguiente NUMPEDIDO de la serie. El MAX se lee sin bloqueos (READUNCOMMITTED) para ver
+    también las cabeceras de pedidos en curso de otros hilos/procesos sin esperar su commit.
+    """
+    with _NUMPEDIDO_LOCK:
+        cursor.execute(
+            """
+            SELECT ISNULL(MAX(NUMPEDIDO), 0)
+            FROM PEDCOMPRACAB WITH (READUNCOMMITTED)
+            WHERE NUMSERIE = ?
+            """,
+            (numserie,),
+        )
+        row = cursor.fetchone()
+        numpedido = max((row[0] or 0), _ultimo_numpedido.get(numserie, 0)) + 1
+        _ultimo_numpedido[numserie] = numpedido
+        return numpedido
 
-            tot_bruto = Decimal("0")
-            tot_impuestos = Decimal("0")
-            tot_neto = Decimal("0")
 
+def _insertar_cabecera(cursor, codprove, numserie: str, subserie_n: str, dt_now, date_zero, hora_excel) -> int:
+    """
+    Asigna NUMPEDIDO e inserta la cabecera (totales en 0; el detalle los actualiza) en la
+    transacción del pedido: hasta el commit nadie en ICG ve el pedido a medio armar.
+    Si otro proceso insertó el mismo número, se toma el siguiente.
+    """
+    regimfact = _obtener_regimfact(cursor, codprove)
+    for intento in range(1, MAX_INTENTOS_NUMPEDIDO + 1):
+        numpedido = _asignar_numpedido(cursor, numserie)
+        supedido = f"-{numserie}-{numpedido}"
+        try:
             cursor.execute(
                 """
                 INSERT INTO PEDCOMPRACAB (
@@ -187,163 +170,218 @@ def crear_pedido_compra_desde_lote(
                     DEFAULT_CODEMPLEADO, DEFAULT_CONTACTO, DEFAULT_FROMPEDVENTACENTRAL, dt_now, DEFAULT_NUMIMPRESIONES, regimfact
                 ),
             )
+            return numpedido
+        except pyodbc.IntegrityError:
+            # La cabecera es lo primero de la transacción: no hay nada más que deshacer
+            logger.warning("NUMPEDIDO %s-%s ya existe en ICG (intento %s); se toma el siguiente.",
+                           numserie, numpedido, intento)
+    raise RuntimeError(f"No se pudo asignar NUMPEDIDO en la serie {numserie} tras {MAX_INTENTOS_NUMPEDIDO} intentos.")
+
+
+# ----------------------------- Detalle de un pedido -------------------------------
+
+def _insertar_detalle_pedido(
+    cursor,
+    codprove,
+    cod_almacen: str,
+    lista_validas: list[SugeridoLinea],
+    numserie: str,
+    numpedido: int,
+    subserie_n: str,
+    politica_cantidades: str,
+    ajuste_multiplo: str,
+    dt_now,
+    date_zero,
+) -> tuple[dict, list[int]]:
+    """
+    Inserta LIN, DTOSLIN, TOT, DTOS, actualiza STOCKS/CAB e inserta TESORERIA
+    para la cabecera ya insertada. No hace commit. La clasificación de los artículos
+    se actualiza aparte (_actualizar_clasificaciones), con todos los pedidos ya confirmados.
+    """
+    supedido = f"-{numserie}-{numpedido}"
+    lineas_ordenadas_ids: list[int] = []
 
-            # TOTALES POR IMPUESTO
-            totales_por_impuesto: dict[tuple[int, Decimal], dict] = {}
-            numlinea = 0
-            contador_dtoslin = 0
-            numlin_global = 0
-            # Acumulador de base por cargo: suma de TOTALLINEA de las líneas que llevan ese cargo
-            bases_por_cargo = {f"CARGO{i}": Decimal("0") for i in range(1, 7)}
-            # LINEAS
-            for lin in lista_validas:
-                q = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
-                if q <= 0:
-                    continue
-
-                precio_base, dto_pct = _precio_y_descuento(lin)
-                tipoimp, iva_pct = _impuestos_de_linea(cursor, lin)
-
-                codart = int(lin.codigo_articulo) if str(lin.codigo_articulo).isdigit() else lin.codigo_articulo
-                cargos_pct = _obtener_cargos_articulo(cursor, str(codart))
-
-                total_linea_sin_iva = _round2(precio_base * (Decimal("1") - (dto_pct / Decimal("100"))) * q)
-                iva_linea = _round2(total_linea_sin_iva * (iva_pct / Decimal("100"))) if iva_pct else Decimal("0")
-                total_linea = total_linea_sin_iva + iva_linea
-
-                # Acumular totales del pedido
-                tot_bruto += total_linea_sin_iva
-                tot_impuestos += iva_linea
-                tot_neto += total_linea
-
-                # Agrupar por (tipoimp, iva_pct)
-                key_impuesto = (tipoimp, iva_pct)
-                if key_impuesto not in totales_por_impuesto:
-                    totales_por_impuesto[key_impuesto] = {
-                        "baseimponible": Decimal("0"),
-                        "totiva": Decimal("0"),
-                        "total": Decimal("0"),
-                        "tipoiva": tipoimp,
-                        "cargos": {f"CARGO{i}": Decimal("0") for i in range(1, 7)},
-                    }
-
-                totales_por_impuesto[key_impuesto]["baseimponible"] += total_linea_sin_iva
-                totales_por_impuesto[key_impuesto]["totiva"] += iva_linea
-                totales_por_impuesto[key_impuesto]["total"] += total_linea
-
-                # Sumar cargos por grupo de impuesto (consolidados) como UNID1 * cargo_unitario
-                for cargo_name, cargo_unit in cargos_pct.items():
-                    totales_por_impuesto[key_impuesto]["cargos"][cargo_name] += _round2(cargo_unit * q)
-                # Acumular base del cargo: suma del TOTALLINEA de las líneas que tengan ese cargo
-                for cargo_name, cargo_unit in cargos_pct.items():
-                    if cargo_unit > 0:
-                        bases_por_cargo[cargo_name] += total_linea
-                # Insert de línea
-                numlinea += 1
-                cursor.execute(
-                    """
-                    INSERT INTO PEDCOMPRALIN (
-                        NUMSERIE, NUMPEDIDO, N, NUMLINEA, CODARTICULO, REFERENCIA, TALLA, COLOR, DESCRIPCION,
-                        UNID1, UNID2, UNID3, UNID4, UNIDADESTOTAL, UNIDADESREC, UNIDADESPEN,
-                        PRECIO, DTO, TIPOIMPUESTO, IVA, REQ, TOTALLINEA, CODALMACEN, DEPOSITO, PRECIOVENTA,
-                        NUMKG, SUPEDIDO, CODCLIENTE, CARGO1, CARGO2, DTOTEXTO, ESOFERTA, FECHAENTREGA,
-                        CODENVIO, UDMEDIDA2, LINEAOCULTA, CODFORMATO, CARGO3, CARGO4, CARGO5, CARGO6,
-                        IMPORTEMASCARGOS, IMPORTEIVAMASCARGOS
-                    )
-                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                    """,
-                    (
-                        numserie, numpedido, subserie_n, numlinea,
-                        codart, (lin.referencia or ""), ".", ".", (lin.descripcion or "")[:250],
-                        float(q), 1.0, 1.0, 1.0, float(q), 0.0, float(q),
-                        float(precio_base), float(dto_pct), int(tipoimp), float(iva_pct), 0.0, float(total_linea),
-                        lin.cod_almacen, "F", 0.0,
-                        0.0, f"-{numserie}-{numpedido}", -1,
-                        float(cargos_pct.get("CARGO1", Decimal("0"))),
-                        float(cargos_pct.get("CARGO2", Decimal("0"))),
-                        _fmt_dtotexto(dto_pct), "F", date_zero,
-                        -1, 0.0, "F", 0,
-                        float(cargos_pct.get("CARGO3", Decimal("0"))),
-                        float(cargos_pct.get("CARGO4", Decimal("0"))),
-                        float(cargos_pct.get("CARGO5", Decimal("0"))),
-                        float(cargos_pct.get("CARGO6", Decimal("0"))),
-                        0.0, 0.0,
-                    ),
-                )
+    tot_bruto = Decimal("0")
+    tot_impuestos = Decimal("0")
+    tot_neto = Decimal("0")
+
+    # TOTALES POR IMPUESTO
+    totales_por_impuesto: dict[tuple[int, Decimal], dict] = {}
+    numlinea = 0
+    contador_dtoslin = 0
+    numlin_global = 0
+    # Acumulador de base por cargo: suma de TOTALLINEA de las líneas que llevan ese cargo
+    bases_por_cargo = {f"CARGO{i}": Decimal("0") for i in range(1, 7)}
+    # LINEAS
+    for lin in lista_validas:
+        q = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
+        if q <= 0:
+            continue
+
+        precio_base, dto_pct = _precio_y_descuento(lin)
+        tipoimp, iva_pct = _impuestos_de_linea(cursor, lin)
+
+        codart = int(lin.codigo_articulo) if str(lin.codigo_articulo).isdigit() else lin.codigo_articulo
+        cargos_pct = _obtener_cargos_articulo(cursor, str(codart))
+
+        total_linea_sin_iva = _round2(precio_base * (Decimal("1") - (dto_pct / Decimal("100"))) * q)
+        iva_linea = _round2(total_linea_sin_iva * (iva_pct / Decimal("100"))) if iva_pct else Decimal("0")
+        total_linea = total_linea_sin_iva + iva_linea
+
+        # Acumular totales del pedido
+        tot_bruto += total_linea_sin_iva
+        tot_impuestos += iva_linea
+        tot_neto += total_linea
+
+        # Agrupar por (tipoimp, iva_pct)
+        key_impuesto = (tipoimp, iva_pct)
+        if key_impuesto not in totales_por_impuesto:
+            totales_por_impuesto[key_impuesto] = {
+                "baseimponible": Decimal("0"),
+                "totiva": Decimal("0"),
+                "total": Decimal("0"),
+                "tipoiva": tipoimp,
+                "cargos": {f"CARGO{i}": Decimal("0") for i in range(1, 7)},
+            }
+
+        totales_por_impuesto[key_impuesto]["baseimponible"] += total_linea_sin_iva
+        totales_por_impuesto[key_impuesto]["totiva"] += iva_linea
+        totales_por_impuesto[key_impuesto]["total"] += total_linea
+
+        # Sumar cargos por grupo de impuesto (consolidados) como UNID1 * cargo_unitario
+        for cargo_name, cargo_unit in cargos_pct.items():
+            totales_por_impuesto[key_impuesto]["cargos"][cargo_name] += _round2(cargo_unit * q)
+        # Acumular base del cargo: suma del TOTALLINEA de las líneas que tengan ese cargo
+        for cargo_name, cargo_unit in cargos_pct.items():
+            if cargo_unit > 0:
+                bases_por_cargo[cargo_name] += total_linea
+        # Insert de línea
+        numlinea += 1
+        cursor.execute(
+            """
+            INSERT INTO PEDCOMPRALIN (
+                NUMSERIE, NUMPEDIDO, N, NUMLINEA, CODARTICULO, REFERENCIA, TALLA, COLOR, DESCRIPCION,
+                UNID1, UNID2, UNID3, UNID4, UNIDADESTOTAL, UNIDADESREC, UNIDADESPEN,
+                PRECIO, DTO, TIPOIMPUESTO, IVA, REQ, TOTALLINEA, CODALMACEN, DEPOSITO, PRECIOVENTA,
+                NUMKG, SUPEDIDO, CODCLIENTE, CARGO1, CARGO2, DTOTEXTO, ESOFERTA, FECHAENTREGA,
+                CODENVIO, UDMEDIDA2, LINEAOCULTA, CODFORMATO, CARGO3, CARGO4, CARGO5, CARGO6,
+                IMPORTEMASCARGOS, IMPORTEIVAMASCARGOS
+            )
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """,
+            (
+                numserie, numpedido, subserie_n, numlinea,
+                codart, (lin.referencia or ""), ".", ".", (lin.descripcion or "")[:250],
+                float(q), 1.0, 1.0, 1.0, float(q), 0.0, float(q),
+                float(precio_base), float(dto_pct), int(tipoimp), float(iva_pct), 0.0, float(total_linea),
+                lin.cod_almacen, "F", 0.0,
+                0.0, f"-{numserie}-{numpedido}", -1,
+                float(cargos_pct.get("CARGO1", Decimal("0"))),
+                float(cargos_pct.get("CARGO2", Decimal("0"))),
+                _fmt_dtotexto(dto_pct), "F", date_zero,
+                -1, 0.0, "F", 0,
+                float(cargos_pct.get("CARGO3", Decimal("0"))),
+                float(cargos_pct.get("CARGO4", Decimal("0"))),
+                float(cargos_pct.get("CARGO5", Decimal("0"))),
+                float(cargos_pct.get("CARGO6", Decimal("0"))),
+                0.0, 0.0,
+            ),
+        )
 
-                # DTOS/IMPUESTOS por línea (PEDCOMPRADTOSLIN) - 6 cargos obligatorios
-                cargo_code_map = {"CARGO1": 3, "CARGO2": 34, "CARGO3": 39, "CARGO4": 40, "CARGO5": 41, "CARGO6": 42}
-                
-                for cargo_name in ["CARGO1", "CARGO2", "CARGO3", "CARGO4", "CARGO5", "CARGO6"]:
-                    contador_dtoslin += 1
-                    numlin_global += 1
-                    codigo_cargo = cargo_code_map[cargo_name]
-                    
-                    # Valor del cargo (solo si es visible)
-                    cargo_unit = cargos_pct.get(cargo_name, Decimal("0"))
-                    importe_cargo = _round2(cargo_unit * q) if cargo_unit > 0 else Decimal("0")
-                    
-                    # CARGO2 lleva el IVA de la línea principal
-                    if cargo_name == "CARGO2":
-                        tipo_imp_cargo = int(tipoimp)
-                        iva_cargo_pct = iva_pct
-                        # IVA se calcula sobre el importe del cargo si existe, sino es 0
-                        iva_cargo_importe = _round2(importe_cargo * (iva_cargo_pct / Decimal("100"))) if importe_cargo > 0 else Decimal("0")
-                    else:
-                        # Los demás cargos tienen su propio IVA (si existe en CARGOSDTOS)
-                        if importe_cargo > 0:
-                            try:
-                                cursor.execute(
-                                    """
-                                    SELECT I.IVA, I.TIPOIVA
-                                    FROM CARGOSDTOS C
-                                    LEFT JOIN IMPUESTOS I ON I.TIPOIVA = C.TIPOIMPUESTO
-                                    WHERE C.CODIGO = ?
-                                    """,
-                                    (codigo_cargo,),
-                                )
-                                row_cargo_iva = cursor.fetchone()
-                                if row_cargo_iva and row_cargo_iva[0]:
-                                    iva_cargo_pct = Decimal(str(row_cargo_iva[0]))
-                                    tipo_imp_cargo = int(row_cargo_iva[1] or 0)
-                                    iva_cargo_importe = _round2(importe_cargo * (iva_cargo_pct / Decimal("100")))
-                                else:
-                                    iva_cargo_pct = Decimal("0")
-                                    tipo_imp_cargo = 0
-                                    iva_cargo_importe = Decimal("0")
-                            except Exception:
-                                iva_cargo_pct = Decimal("0")
-                                tipo_imp_cargo = 0
-                                iva_cargo_importe = Decimal("0")
+        # DTOS/IMPUESTOS por línea (PEDCOMPRADTOSLIN) - 6 cargos obligatorios
+        cargo_code_map = {"CARGO1": 3, "CARGO2": 34, "CARGO3": 39, "CARGO4": 40, "CARGO5": 41, "CARGO6": 42}
+        
+        for cargo_name in ["CARGO1", "CARGO2", "CARGO3", "CARGO4", "CARGO5", "CARGO6"]:
+            contador_dtoslin += 1
+            numlin_global += 1
+            codigo_cargo = cargo_code_map[cargo_name]
+            
+            # Valor del cargo (solo si es visible)
+            cargo_unit = cargos_pct.get(cargo_name, Decimal("0"))
+            importe_cargo = _round2(cargo_unit * q) if cargo_unit > 0 else Decimal("0")
+            
+            # CARGO2 lleva el IVA de la línea principal
+            if cargo_name == "CARGO2":
+                tipo_imp_cargo = int(tipoimp)
+                iva_cargo_pct = iva_pct
+                # IVA se calcula sobre el importe del cargo si existe, sino es 0
+                iva_cargo_importe = _round2(importe_cargo * (iva_cargo_pct / Decimal("100"))) if importe_cargo > 0 else Decimal("0")
+            else:
+                # Los demás cargos tienen su propio IVA (si existe en CARGOSDTOS)
+                if importe_cargo > 0:
+                    try:
+                        cursor.execute(
+                            """
+                            SELECT I.IVA, I.TIPOIVA
+                            FROM CARGOSDTOS C
+                            LEFT JOIN IMPUESTOS I ON I.TIPOIVA = C.TIPOIMPUESTO
+                            WHERE C.CODIGO = ?
+                            """,
+                            (codigo_cargo,),
+                        )
+                        row_cargo_iva = cursor.fetchone()
+                        if row_cargo_iva and row_cargo_iva[0]:
+                            iva_cargo_pct = Decimal(str(row_cargo_iva[0]))
+                            tipo_imp_cargo = int(row_cargo_iva[1] or 0)
+                            iva_cargo_importe = _round2(importe_cargo * (iva_cargo_pct / Decimal("100")))
                         else:
                             iva_cargo_pct = Decimal("0")
                             tipo_imp_cargo = 0
                             iva_cargo_importe = Decimal("0")
-                    
-                    # INSERT siempre, incluso si el importe es 0
-                    cursor.execute(
-                        """
-                        INSERT INTO PEDCOMPRADTOSLIN (
-                            NUMSERIE, NUMERO, N, NUMLINDOC, IMPORTE, IMPORTEIVA, NUMLIN, CODIMPUESTO, PORC1, PORC2
-                        )
-                        VALUES (?,?,?,?,?,?,?,?,?,?)
-                        """,
-                        (
-                            numserie, numpedido, subserie_n, numlinea,
-                            float(importe_cargo), float(iva_cargo_importe),
-                            numlin_global, tipo_imp_cargo, float(iva_cargo_pct), 0.0,
-                        ),
-                    )
+                    except Exception:
+                        iva_cargo_pct = Decimal("0")
+                        tipo_imp_cargo = 0
+                        iva_cargo_importe = Decimal("0")
+                else:
+                    iva_cargo_pct = Decimal("0")
+                    tipo_imp_cargo = 0
+                    iva_cargo_importe = Decimal("0")
+            
+            # INSERT siempre, incluso si el importe es 0
+            cursor.execute(
+                """
+                INSERT INTO PEDCOMPRADTOSLIN (
+                    NUMSERIE, NUMERO, N, NUMLINDOC, IMPORTE, IMPORTEIVA, NUMLIN, CODIMPUESTO, PORC1, PORC2
+                )
+                VALUES (?,?,?,?,?,?,?,?,?,?)
+                """,
+                (
+                    numserie, numpedido, subserie_n, numlinea,
+                    float(importe_cargo), float(iva_cargo_importe),
+                    numlin_global, tipo_imp_cargo, float(iva_cargo_pct), 0.0,
+                ),
+            )
 
-                _actualizar_clasificacion_si_activo(cursor, lin)
-                _actualizar_clasificacion_Almacen(cursor, lin)
-                lineas_ordenadas_ids.append(lin.id)
+        lineas_ordenadas_ids.append(lin.id)
+
+    # TOTALES (PEDCOMPRATOT)
+    numlinea_tot = 0
+    for (tipoimp, iva_pct), totales in totales_por_impuesto.items():
+        # 1) Base + IVA
+        numlinea_tot += 1
+        cursor.execute(
+            """
+            INSERT INTO PEDCOMPRATOT (
+                SERIE, NUMERO, N, NUMLINEA, BRUTO, DTOCOMERC, TOTDTOCOMERC, DTOPP, TOTDTOPP,
+                BASEIMPONIBLE, IVA, TOTIVA, REQ, TOTREQ, TOTAL, ESGASTO, CODDTO, DESCRIPCION, TIPOIVA
+            )
+            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+            """,
+            (
+                numserie, numpedido, subserie_n, numlinea_tot,
+                float(_round2(totales["baseimponible"])), 0.0, 0.0, 0.0, 0.0,
+                float(_round2(totales["baseimponible"])), float(iva_pct), float(_round2(totales["totiva"])),
+                0.0, 0.0, float(_round2(totales["baseimponible"] + totales["totiva"])),
+                "F", -1, "", int(tipoimp),
+            ),
+        )
 
-            # TOTALES (PEDCOMPRATOT)
-            numlinea_tot = 0
-            for (tipoimp, iva_pct), totales in totales_por_impuesto.items():
-                # 1) Base + IVA
+        # 2) Cargos individuales por código específico
+        cargo_code_map = {"CARGO1": 3, "CARGO2": 34, "CARGO3": 39, "CARGO4": 40, "CARGO5": 41, "CARGO6": 42}
+        for cargo_name, cargo_total in totales["cargos"].items():
+            if cargo_total > 0:
                 numlinea_tot += 1
+                codigo_cargo = cargo_code_map.get(cargo_name, 3)
                 cursor.execute(
                     """
                     INSERT INTO PEDCOMPRATOT (
@@ -354,291 +392,438 @@ def crear_pedido_compra_desde_lote(
                     """,
                     (
                         numserie, numpedido, subserie_n, numlinea_tot,
-                        float(_round2(totales["baseimponible"])), 0.0, 0.0, 0.0, 0.0,
-                        float(_round2(totales["baseimponible"])), float(iva_pct), float(_round2(totales["totiva"])),
-                        0.0, 0.0, float(_round2(totales["baseimponible"] + totales["totiva"])),
-                        "F", -1, "", int(tipoimp),
+                        float(_round2(cargo_total)), 0.0, 0.0, 0.0, 0.0,
+                        float(_round2(cargo_total)), 0.0, 0.0,
+                        0.0, 0.0, float(_round2(cargo_total)),
+                        "F", codigo_cargo, "", 0,
                     ),
                 )
 
-                # 2) Cargos individuales por código específico
-                cargo_code_map = {"CARGO1": 3, "CARGO2": 34, "CARGO3": 39, "CARGO4": 40, "CARGO5": 41, "CARGO6": 42}
-                for cargo_name, cargo_total in totales["cargos"].items():
-                    if cargo_total > 0:
-                        numlinea_tot += 1
-                        codigo_cargo = cargo_code_map.get(cargo_name, 3)
-                        cursor.execute(
-                            """
-                            INSERT INTO PEDCOMPRATOT (
-                                SERIE, NUMERO, N, NUMLINEA, BRUTO, DTOCOMERC, TOTDTOCOMERC, DTOPP, TOTDTOPP,
-                                BASEIMPONIBLE, IVA, TOTIVA, REQ, TOTREQ, TOTAL, ESGASTO, CODDTO, DESCRIPCION, TIPOIVA
-                            )
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                            """,
-                            (
-                                numserie, numpedido, subserie_n, numlinea_tot,
-                                float(_round2(cargo_total)), 0.0, 0.0, 0.0, 0.0,
-                                float(_round2(cargo_total)), 0.0, 0.0,
-                                0.0, 0.0, float(_round2(cargo_total)),
-                                "F", codigo_cargo, "", 0,
-                            ),
-                        )
-
-            # Añadir descuentos de proveedor a PEDCOMPRATOT (como cargos negativos)
-            # Base para el porcentaje: suma de base imponible de todos los grupos de impuesto
-            base_tot_tots = sum(t["baseimponible"] for t in totales_por_impuesto.values())
-            descuentos_proveedor = _obtener_descuentos_proveedor(cursor, int(codprove))
-            for codigo_desc, valor_pct in descuentos_proveedor:
-                if base_tot_tots > 0 and valor_pct > 0:
-                    importe_desc = _round2(base_tot_tots * (valor_pct / Decimal("100")))
-                    if importe_desc > 0:
-                        numlinea_tot += 1
-                        cursor.execute(
-                            """
-                            INSERT INTO PEDCOMPRATOT (
-                                SERIE, NUMERO, N, NUMLINEA, BRUTO, DTOCOMERC, TOTDTOCOMERC, DTOPP, TOTDTOPP,
-                                BASEIMPONIBLE, IVA, TOTIVA, REQ, TOTREQ, TOTAL, ESGASTO, CODDTO, DESCRIPCION, TIPOIVA
-                            )
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                            """,
-                            (
-                                numserie, numpedido, subserie_n, numlinea_tot,
-                                float(_round2(-importe_desc)), 0.0, 0.0, 0.0, 0.0,
-                                float(_round2(-importe_desc)), 0.0, 0.0,
-                                0.0, 0.0, float(_round2(-importe_desc)),
-                                "F", int(codigo_desc), "", 0,
-                            ),
-                        )
-
-            # DTOS/CARGOS Consolidados (PEDCOMPRADTOS)
-            total_base_imponible = sum(t["baseimponible"] for t in totales_por_impuesto.values())
-            cargos_consolidados = {f"CARGO{i}": Decimal("0") for i in range(1, 7)}
-            for totales in totales_por_impuesto.values():
-                for cargo_name, cargo_total in totales["cargos"].items():
-                    cargos_consolidados[cargo_name] += cargo_total
-
-            cargo_code_map = {"CARGO1": 3, "CARGO2": 34, "CARGO3": 39, "CARGO4": 40, "CARGO5": 41, "CARGO6": 42}
-
-            cursor.execute(
-                """
-                SELECT LINEA FROM PEDCOMPRADTOS
-                WHERE NUMSERIE = ? AND NUMERO = ? AND N = ?
-                """,
-                (numserie, numpedido, subserie_n),
-            )
-            lineas_existentes = {row[0] for row in cursor.fetchall()}
-
-            linea_consolidado = 0
-            for cargo_name, cargo_total in cargos_consolidados.items():
-                if cargo_total > 0:
-                    linea_consolidado += 1
-                    if linea_consolidado not in lineas_existentes:
-                        codigo_cargo = cargo_code_map.get(cargo_name, 3)
-                        secuencia = _obtener_secuencia_cargo(cursor, codigo_cargo)
-                        # BASE debe ser la suma de TOTALLINEA de las líneas que tienen ese cargo
-                        base_para_cargo = _round2(bases_por_cargo.get(cargo_name, Decimal("0")))
-                        cursor.execute(
-                            """
-                            INSERT INTO PEDCOMPRADTOS (
-                                NUMSERIE, NUMERO, N, LINEA, NUMLINDOC, CODDTO, TIPO, SECUENCIA,
-                                BASE, DTOCARGO, IMPORTE, UDSDTO, IMPORTEUNITARIODESC,
-                                TIPOIMPUESTO, IVA, REQ, TIPODTO
-                            )
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                            """,
-                            (
-                                numserie, numpedido, subserie_n, linea_consolidado, None, codigo_cargo, "C", secuencia,
-                                float(base_para_cargo), 0.0, float(_round2(cargo_total)),
-                                0.0, 0.0, 0, 0.0, 0.0, 0,
-                            ),
-                        )
+    # Añadir descuentos de proveedor a PEDCOMPRATOT (como cargos negativos)
+    # Base para el porcentaje: suma de base imponible de todos los grupos de impuesto
+    base_tot_tots = sum(t["baseimponible"] for t in totales_por_impuesto.values())
+    descuentos_proveedor = _obtener_descuentos_proveedor(cursor, int(codprove))
+    for codigo_desc, valor_pct in descuentos_proveedor:
+        if base_tot_tots > 0 and valor_pct > 0:
+            importe_desc = _round2(base_tot_tots * (valor_pct / Decimal("100")))
+            if importe_desc > 0:
+                numlinea_tot += 1
+                cursor.execute(
+                    """
+                    INSERT INTO PEDCOMPRATOT (
+                        SERIE, NUMERO, N, NUMLINEA, BRUTO, DTOCOMERC, TOTDTOCOMERC, DTOPP, TOTDTOPP,
+                        BASEIMPONIBLE, IVA, TOTIVA, REQ, TOTREQ, TOTAL, ESGASTO, CODDTO, DESCRIPCION, TIPOIVA
+                    )
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                    """,
+                    (
+                        numserie, numpedido, subserie_n, numlinea_tot,
+                        float(_round2(-importe_desc)), 0.0, 0.0, 0.0, 0.0,
+                        float(_round2(-importe_desc)), 0.0, 0.0,
+                        0.0, 0.0, float(_round2(-importe_desc)),
+                        "F", int(codigo_desc), "", 0,
+                    ),
+                )
 
-            # Descuentos de proveedor en PEDCOMPRADTOS (se mantienen basados en la base total imponible)
-            for codigo_desc, valor_pct in descuentos_proveedor:
-                if total_base_imponible > 0 and valor_pct > 0:
-                    importe_desc = _round2(total_base_imponible * (valor_pct / Decimal("100")))
-                    if importe_desc > 0:
-                        linea_consolidado += 1
-                        secuencia_desc = _obtener_secuencia_cargo(cursor, int(codigo_desc))
-                        cursor.execute(
-                            """
-                            INSERT INTO PEDCOMPRADTOS (
-                                NUMSERIE, NUMERO, N, LINEA, NUMLINDOC, CODDTO, TIPO, SECUENCIA,
-                                BASE, DTOCARGO, IMPORTE, UDSDTO, IMPORTEUNITARIODESC,
-                                TIPOIMPUESTO, IVA, REQ, TIPODTO
-                            )
-                            VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
-                            """,
-                            (
-                                numserie, numpedido, subserie_n, linea_consolidado, None, int(codigo_desc), "D", secuencia_desc,
-                                float(_round2(total_base_imponible)), float(valor_pct), float(_round2(-importe_desc)),
-                                0.0, 0.0, 0, 0.0, 0.0, 1,
-                            ),
-                        )
+    # DTOS/CARGOS Consolidados (PEDCOMPRADTOS)
+    total_base_imponible = sum(t["baseimponible"] for t in totales_por_impuesto.values())
+    cargos_consolidados = {f"CARGO{i}": Decimal("0") for i in range(1, 7)}
+    for totales in totales_por_impuesto.values():
+        for cargo_name, cargo_total in totales["cargos"].items():
+            cargos_consolidados[cargo_name] += cargo_total
+
+    cargo_code_map = {"CARGO1": 3, "CARGO2": 34, "CARGO3": 39, "CARGO4": 40, "CARGO5": 41, "CARGO6": 42}
+
+    cursor.execute(
+        """
+        SELECT LINEA FROM PEDCOMPRADTOS
+        WHERE NUMSERIE = ? AND NUMERO = ? AND N = ?
+        """,
+        (numserie, numpedido, subserie_n),
+    )
+    lineas_existentes = {row[0] for row in cursor.fetchall()}
+
+    linea_consolidado = 0
+    for cargo_name, cargo_total in cargos_consolidados.items():
+        if cargo_total > 0:
+            linea_consolidado += 1
+            if linea_consolidado not in lineas_existentes:
+                codigo_cargo = cargo_code_map.get(cargo_name, 3)
+                secuencia = _obtener_secuencia_cargo(cursor, codigo_cargo)
+                # BASE debe ser la suma de TOTALLINEA de las líneas que tienen ese cargo
+                base_para_cargo = _round2(bases_por_cargo.get(cargo_name, Decimal("0")))
+                cursor.execute(
+                    """
+                    INSERT INTO PEDCOMPRADTOS (
+                        NUMSERIE, NUMERO, N, LINEA, NUMLINDOC, CODDTO, TIPO, SECUENCIA,
+                        BASE, DTOCARGO, IMPORTE, UDSDTO, IMPORTEUNITARIODESC,
+                        TIPOIMPUESTO, IVA, REQ, TIPODTO
+                    )
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+                    """,
+                    (
+                        numserie, numpedido, subserie_n, linea_consolidado, None, codigo_cargo, "C", secuencia,
+                        float(base_para_cargo), 0.0, float(_round2(cargo_total)),
+                        0.0, 0.0, 0, 0.0, 0.0, 0,
+                    ),
+                )
 
-            # STOCKS: incrementar PEDIDO
-            for lin in lista_validas:
-                q = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
-                if q <= 0:
-                    continue
-                codart = int(lin.codigo_articulo) if str(lin.codigo_articulo).isdigit() else lin.codigo_articulo
+    # Descuentos de proveedor en PEDCOMPRADTOS (se mantienen basados en la base total imponible)
+    for codigo_desc, valor_pct in descuentos_proveedor:
+        if total_base_imponible > 0 and valor_pct > 0:
+            importe_desc = _round2(total_base_imponible * (valor_pct / Decimal("100")))
+            if importe_desc > 0:
+                linea_consolidado += 1
+                secuencia_desc = _obtener_secuencia_cargo(cursor, int(codigo_desc))
                 cursor.execute(
                     """
-                    UPDATE STOCKS
-                    SET PEDIDO = PEDIDO + ?, FECHAMODIFICADO = ?
-                    WHERE CODARTICULO = ? AND TALLA = ? AND COLOR = ? AND CODALMACEN = ?
+                    INSERT INTO PEDCOMPRADTOS (
+                        NUMSERIE, NUMERO, N, LINEA, NUMLINDOC, CODDTO, TIPO, SECUENCIA,
+                        BASE, DTOCARGO, IMPORTE, UDSDTO, IMPORTEUNITARIODESC,
+                        TIPOIMPUESTO, IVA, REQ, TIPODTO
+                    )
+                    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
                     """,
-                    (float(q), dt_now, codart, ".", ".", lin.cod_almacen),
+                    (
+                        numserie, numpedido, subserie_n, linea_consolidado, None, int(codigo_desc), "D", secuencia_desc,
+                        float(_round2(total_base_imponible)), float(valor_pct), float(_round2(-importe_desc)),
+                        0.0, 0.0, 0, 0.0, 0.0, 1,
+                    ),
                 )
 
-            # Actualizar totales de CAB
-            total_cargos_pedido = Decimal("0")
-            for totales in totales_por_impuesto.values():
-                total_cargos_pedido += sum(totales["cargos"].values())
+    # STOCKS: incrementar PEDIDO
+    for lin in lista_validas:
+        q = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
+        if q <= 0:
+            continue
+        codart = int(lin.codigo_articulo) if str(lin.codigo_articulo).isdigit() else lin.codigo_articulo
+        cursor.execute(
+            """
+            UPDATE STOCKS
+            SET PEDIDO = PEDIDO + ?, FECHAMODIFICADO = ?
+            WHERE CODARTICULO = ? AND TALLA = ? AND COLOR = ? AND CODALMACEN = ?
+            """,
+            (float(q), dt_now, codart, ".", ".", lin.cod_almacen),
+        )
 
-            # Incluir descuentos de proveedor (negativos) en TOTALCARGOSDTOS
-            total_descuentos_proveedor = Decimal("0")
-            if total_base_imponible > 0 and descuentos_proveedor:
-                for _, valor_pct in descuentos_proveedor:
-                    if valor_pct > 0:
-                        total_descuentos_proveedor += _round2(total_base_imponible * (valor_pct / Decimal("100")))
-            total_cargos_pedido = total_cargos_pedido - total_descuentos_proveedor  # restar descuentos
+    # Actualizar totales de CAB
+    total_cargos_pedido = Decimal("0")
+    for totales in totales_por_impuesto.values():
+        total_cargos_pedido += sum(totales["cargos"].values())
+
+    # Incluir descuentos de proveedor (negativos) en TOTALCARGOSDTOS
+    total_descuentos_proveedor = Decimal("0")
+    if total_base_imponible > 0 and descuentos_proveedor:
+        for _, valor_pct in descuentos_proveedor:
+            if valor_pct > 0:
+                total_descuentos_proveedor += _round2(total_base_imponible * (valor_pct / Decimal("100")))
+    total_cargos_pedido = total_cargos_pedido - total_descuentos_proveedor  # restar descuentos
+
+    # Ajustar tot_neto para incluir cargos y descuentos
+    tot_neto_final = tot_neto + total_cargos_pedido
+
+    cursor.execute(
+        """
+        UPDATE PEDCOMPRACAB
+        SET TOTBRUTO = ?, TOTIMPUESTOS = ?, TOTNETO = ?, TOTALCARGOSDTOS = ?
+        WHERE NUMSERIE = ? AND NUMPEDIDO = ? AND N = ?
+        """,
+        (
+            float(_round2(tot_bruto)),
+            float(_round2(tot_impuestos)),
+            float(_round2(tot_neto_final)),
+            float(_round2(total_cargos_pedido)),
+            numserie, numpedido, subserie_n
+        ),
+    )
 
-            # Ajustar tot_neto para incluir cargos y descuentos
-            tot_neto_final = tot_neto + total_cargos_pedido
+    # ---------------- TESORERIA por pedido ----------------
+    # Obtener forma de pago (por proveedor) con DIAS, CODFORMAPAGO y CODTIPOPAGO
+    datos_fpago = _obtener_forma_pago_proveedor(cursor, int(codprove))
+    codformapago = datos_fpago["codformapago"]
+    dias_vencimiento = datos_fpago["dias_vencimiento"]
+    codtipopago = datos_fpago["codtipopago"]
+
+    # Calcular FECHAVENCIMIENTO sumando días a FECHADOCUMENTO
+    fecha_vencimiento = date_zero + timedelta(days=dias_vencimiento)
+    
+    # FECHACARTERA siempre es la fecha base de Excel
+    fecha_cartera = _fecha_base_excel()
+
+    importe_tes = _round2(tot_neto_final)
+    values_tesoreria = (
+        # 1-8
+        "P", "P", numserie, numpedido, subserie_n, 1, date_zero, fecha_vencimiento,
+        # 9-16
+        "F", "22050501", int(codprove), float(importe_tes), "22050501", "F", codformapago, codtipopago,
+        # 17-24
+        "P", "", -1, "F", "F", None, fecha_cartera, None,
+        # 25-32
+        fecha_vencimiento, None, 0.0, None, 0, 3, "", 0,
+        # 33-40
+        0, "F", "VENCIMIENTO", 1.0, 1, "", "F", "",
+        # 41-48
+        "", 0.0, 0, dt_now, "", 0.0, "F", 0,
+        # 49-56
+        "", 0, "", -1, 0.0, -1, 0.0, 0.0,
+        # 57-64
+        0.0, 0.0, "", "", 1.0, "", "",
+        # 65-69
+        "", "", 0, 0, "", ""
+    )
 
-            cursor.execute(
-                """
-                UPDATE PEDCOMPRACAB
-                SET TOTBRUTO = ?, TOTIMPUESTOS = ?, TOTNETO = ?, TOTALCARGOSDTOS = ?
-                WHERE NUMSERIE = ? AND NUMPEDIDO = ? AND N = ?
-                """,
-                (
-                    float(_round2(tot_bruto)),
-                    float(_round2(tot_impuestos)),
-                    float(_round2(tot_neto_final)),
-                    float(_round2(total_cargos_pedido)),
-                    numserie, numpedido, subserie_n
-                ),
-            )
+    assert len(values_tesoreria) == 69, f"TESORERIA espera 69 valores (sin VERSION), llegaron {len(values_tesoreria)}"
+    placeholders = ", ".join(["?"] * len(values_tesoreria))
+    cursor.execute(
+        f"""
+        INSERT INTO TESORERIA (
+            ORIGEN, TIPODOCUMENTO, SERIE, NUMERO, N, POSICION, FECHADOCUMENTO, FECHAVENCIMIENTO,
+            REPOSICION, CUENTA, CODIGOINTERNO, IMPORTE, CONTRAPARTIDA, MARCABORRADO, CODFORMAPAGO,
+            CODTIPOPAGO, ESTADO, COMENTARIO, NUMEROREMESA, IMPRESO, TRASPASADO, FECHATRASPASO,
+            FECHACARTERA, FECHADESCONTADO, FECHASALDADO, FECHADEVUELTO, IMPORTEGASTOS, CUENTAGASTOS,
+            ENLACE_EJERCICIO, ENLACE_EMPRESA, ENLACE_USUARIO, ENLACE_ASIENTO, ENLACE_APUNTE,
+            FECHADIRECTA, GENAPUNTE, FACTORMONEDA, CODMONEDA, SUDOCUMENTO, MULTIPLE, NUMEFECTO,
+            CUENTAPUENTE, MORA, ZSALDADO, FECHAMODIFICADO, CAJASALDADO, DESCUADRE, BLOQUEADO,
+            COMPENSACION, COMENTARIOVISIBLE, RETENCION, SERIERECIBO, NUMRECIBO, BASE,
+            CODIMPUESTO, PORCIVA, CUOTAIVA, PORCREQ, CUOTAREQ, CUENTAIVA, CUENTAREQ,
+            FACTORMONEDAREAL, NUMTXNTEF, NUMRTSTEF, BINTARJETA, CAJACARTERA, ZCARTERA,
+            ECPARTIDA, COMENTARIOLARGO, ASIENTOCARTERA
+        )
+        VALUES ({placeholders})
+        """,
+        values_tesoreria,
+    )
 
-            # ---------------- TESORERIA por pedido ----------------
-            # Obtener forma de pago (por proveedor) con DIAS, CODFORMAPAGO y CODTIPOPAGO
-            datos_fpago = _obtener_forma_pago_proveedor(cursor, int(codprove))
-            codformapago = datos_fpago["codformapago"]
-            dias_vencimiento = datos_fpago["dias_vencimiento"]
-            codtipopago = datos_fpago["codtipopago"]
+    pedido = {
+        "cod_almacen": str(cod_almacen),
+        "numserie": numserie,
+        "numpedido": int(numpedido),
+        "subserie": subserie_n,
+        "supedido": supedido,
+        "totbruto": float(_round2(tot_bruto)),
+        "totimpuestos": float(_round2(tot_impuestos)),
+        "totneto": float(_round2(tot_neto)),
+    }
+    return pedido, lineas_ordenadas_ids
+
+
+def _procesar_almacen(
+    pool: PoolConexionesICG,
+    codprove,
+    cod_almacen: str,
+    lista_validas: list[SugeridoLinea],
+    numserie: str,
+    subserie_n: str,
+    politica_cantidades: str,
+    ajuste_multiplo: str,
+    dt_now,
+    date_zero,
+    hora_excel,
+) -> tuple[dict, list[int]]:
+    """
+    Genera el pedido de un almacén (cabecera y detalle) en una sola transacción sobre una
+    conexión del pool. Nunca lanza: devuelve el resultado con estado OK/ERROR para pedidos_icg.
+    """
+    try:
+        with pool.conexion() as conexion:
+            cursor = conexion.cursor()
+            try:
+                numpedido = _insertar_cabecera(cursor, codprove, numserie, subserie_n, dt_now, date_zero, hora_excel)
+                pedido, lineas_ids = _insertar_detalle_pedido(
+                    cursor, codprove, cod_almacen, lista_validas,
+                    numserie, numpedido, subserie_n,
+                    politica_cantidades, ajuste_multiplo,
+                    dt_now, date_zero,
+                )
+                conexion.commit()
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+
+        pedido.update({"estado": ESTADO_PEDIDO_OK, "error": None, "fecha": dt_now.isoformat()})
+        return pedido, lineas_ids
+
+    except Exception as e:
+        logger.exception("Almacén %s falló al generar pedido en ICG", cod_almacen)
+        resultado = {
+            "cod_almacen": str(cod_almacen),
+            "numserie": numserie,
+            "numpedido": None,
+            "subserie": subserie_n,
+            "estado": ESTADO_PEDIDO_ERROR,
+            "error": str(e)[:500],
+            "fecha": dt_now.isoformat(),
+        }
+        return resultado, []
+
+
+def _actualizar_clasificaciones(pool: PoolConexionesICG, lineas: list[SugeridoLinea]):
+    """
+    Marca la clasificación en ARTICULOSCAMPOSLIBRES de los artículos pedidos, en una
+    transacción corta después de confirmar todos los pedidos: los almacenes en paralelo
+    no compiten por las filas del mismo CODARTICULO.
+    Un fallo aquí no deshace los pedidos; queda en el log.
+    """
+    if not lineas:
+        return
+    try:
+        with pool.conexion() as conexion:
+            cursor = conexion.cursor()
+            try:
+                for lin in lineas:
+                    _actualizar_clasificacion_si_activo(cursor, lin)
+                    _actualizar_clasificacion_Almacen(cursor, lin)
+                conexion.commit()
+            finally:
+                try:
+                    cursor.close()
+                except Exception:
+                    pass
+    except Exception:
+        logger.exception("No se pudo actualizar la clasificación en ICG de %s líneas", len(lineas))
 
-            # Calcular FECHAVENCIMIENTO sumando días a FECHADOCUMENTO
-            fecha_vencimiento = date_zero + timedelta(days=dias_vencimiento)
-            
-            # FECHACARTERA siempre es la fecha base de Excel
-            fecha_cartera = _fecha_base_excel()
-
-            importe_tes = _round2(tot_neto_final)
-            values_tesoreria = (
-                # 1-8
-                "P", "P", numserie, numpedido, subserie_n, 1, date_zero, fecha_vencimiento,
-                # 9-16
-                "F", "22050501", int(codprove), float(importe_tes), "22050501", "F", codformapago, codtipopago,
-                # 17-24
-                "P", "", -1, "F", "F", None, fecha_cartera, None,
-                # 25-32
-                fecha_vencimiento, None, 0.0, None, 0, 3, "", 0,
-                # 33-40
-                0, "F", "VENCIMIENTO", 1.0, 1, "", "F", "",
-                # 41-48
-                "", 0.0, 0, dt_now, "", 0.0, "F", 0,
-                # 49-56
-                "", 0, "", -1, 0.0, -1, 0.0, 0.0,
-                # 57-64
-                0.0, 0.0, "", "", 1.0, "", "",
-                # 65-69
-                "", "", 0, 0, "", ""
-            )
 
-            assert len(values_tesoreria) == 69, f"TESORERIA espera 69 valores (sin VERSION), llegaron {len(values_tesoreria)}"
-            placeholders = ", ".join(["?"] * len(values_tesoreria))
-            cursor.execute(
-                f"""
-                INSERT INTO TESORERIA (
-                    ORIGEN, TIPODOCUMENTO, SERIE, NUMERO, N, POSICION, FECHADOCUMENTO, FECHAVENCIMIENTO,
-                    REPOSICION, CUENTA, CODIGOINTERNO, IMPORTE, CONTRAPARTIDA, MARCABORRADO, CODFORMAPAGO,
-                    CODTIPOPAGO, ESTADO, COMENTARIO, NUMEROREMESA, IMPRESO, TRASPASADO, FECHATRASPASO,
-                    FECHACARTERA, FECHADESCONTADO, FECHASALDADO, FECHADEVUELTO, IMPORTEGASTOS, CUENTAGASTOS,
-                    ENLACE_EJERCICIO, ENLACE_EMPRESA, ENLACE_USUARIO, ENLACE_ASIENTO, ENLACE_APUNTE,
-                    FECHADIRECTA, GENAPUNTE, FACTORMONEDA, CODMONEDA, SUDOCUMENTO, MULTIPLE, NUMEFECTO,
-                    CUENTAPUENTE, MORA, ZSALDADO, FECHAMODIFICADO, CAJASALDADO, DESCUADRE, BLOQUEADO,
-                    COMPENSACION, COMENTARIOVISIBLE, RETENCION, SERIERECIBO, NUMRECIBO, BASE,
-                    CODIMPUESTO, PORCIVA, CUOTAIVA, PORCREQ, CUOTAREQ, CUENTAIVA, CUENTAREQ,
-                    FACTORMONEDAREAL, NUMTXNTEF, NUMRTSTEF, BINTARJETA, CAJACARTERA, ZCARTERA,
-                    ECPARTIDA, COMENTARIOLARGO, ASIENTOCARTERA
-                )
-                VALUES ({placeholders})
-                """,
-                values_tesoreria,
-            )
+# ----------------------------- Flujo principal de creación ------------------------
 
-            pedidos_creados.append(
-                {
-                    "cod_almacen": str(cod_almacen),
-                    "numserie": numserie,
-                    "numpedido": int(numpedido),
-                    "subserie": subserie_n,
-                    "supedido": supedido,
-                    "totbruto": float(_round2(tot_bruto)),
-                    "totimpuestos": float(_round2(tot_impuestos)),
-                    "totneto": float(_round2(tot_neto)),
-                }
-            )
+def crear_pedido_compra_desde_lote(
+    lote_id: int,
+    numserie: str = DEFAULT_NUMSERIE,
+    subserie_n: str = DEFAULT_SUBSERIE_N,
+    politica_cantidades: str = "prefer_interno",
+    ajuste_multiplo: str = "up",
+    almacenes: list[str] | None = None,
+    paralelo: bool = True,
+):
+    """
+    Crea pedidos en ICG agrupando líneas del lote por almacén.
+    - Inserta CAB, LIN, DTOSLIN, TOT y DTOS (cargos consolidados).
+    - Actualiza STOCKS.PEDIDO.
+    - Inserta TESORERIA por cada pedido creado.
+    - Cada almacén usa su propia transacción (cabecera y detalle juntos) sobre una conexión
+      del pool, en paralelo si `paralelo`: un fallo en un almacén no revierte los pedidos de los demás.
+    - La clasificación de los artículos se actualiza al final, con los pedidos ya confirmados.
+    - El resultado por almacén (OK/ERROR) se acumula en SugeridoLote.pedidos_icg.
+    - `almacenes` limita la ejecución a esos códigos (p.ej. reintentar uno fallido).
+      Los almacenes que ya tienen pedido OK en el lote nunca se vuelven a generar.
+    Devuelve los resultados de esta ejecución.
+    """
+    lote = SugeridoLote.objects.select_related("proveedor").get(pk=lote_id)
+    if not lote.proveedor:
+        raise ValueError("El lote no tiene proveedor asignado.")
 
-        if not pedidos_creados:
-            # Debug ampliado si nada se generó
-            debug_info = []
-            for cod_almacen, lista in grupos.items():
-                for lin in lista:
-                    cantidad = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
-                    debug_info.append(
-                        f"Almacén {cod_almacen}, Artículo {lin.codigo_articulo}: "
-                        f"sugerido_interno={lin.sugerido_interno}, embalaje={lin.embalaje}, cantidad_elegida={cantidad}"
-                    )
-            raise ValueError("No se generaron pedidos (sin líneas válidas).\n" + "\n".join(debug_info))
+    codprove = getattr(lote.proveedor, "cod_icg", None) or getattr(lote.proveedor, "codigo", None)
+    if codprove in (None, "", 0):
+        raise ValueError("El proveedor no tiene código ICG (campo 'cod_icg' o 'codigo').")
 
-        # Commit final (todos los pedidos)
-        try:
-            conexion.commit()
-        except Exception:
-            try:
-                conexion.rollback()
-            except Exception:
-                pass
-            raise
+    lineas = list(
+        lote.lineas.select_related("proveedor", "marca")
+        .filter(sugerido_interno__gt=0)
+        .all()
+    )
+    if not lineas:
+        raise ValueError("El lote no tiene líneas con sugerido interno > 0.")
 
-    except Exception:
-        try:
-            conexion.rollback()
-        except Exception:
-            pass
-        raise
-    finally:
-        try:
-            cursor.close()
-        except Exception:
-            pass
-        try:
-            conexion.close()
-        except Exception:
-            pass
+    print(f"DEBUG: Encontradas {len(lineas)} líneas con sugerido_interno > 0")
+    for i, lin in enumerate(lineas[:3]):
+        print(
+            f"DEBUG línea {i+1}: "
+            f"codigo={lin.codigo_articulo}, sugerido_interno={lin.sugerido_interno}, embalaje={lin.embalaje}"
+        )
+
+    # Agrupar por almacén
+    grupos: dict[str, list[SugeridoLinea]] = {}
+    for lin in lineas:
+        grupos.setdefault(lin.cod_almacen, []).append(lin)
+    print(f"DEBUG: Grupos por almacén: {list(grupos.keys())}")
+
+    # Resultados previos por almacén (los registros antiguos sin 'estado' son pedidos OK)
+    previos: dict[str, dict] = {
+        str(p.get("cod_almacen")): p
+        for p in (lote.pedidos_icg or [])
+        if isinstance(p, dict) and p.get("cod_almacen") is not None
+    }
+    solicitados = {str(a) for a in almacenes} if almacenes else None
+
+    trabajos: list[tuple[str, list[SugeridoLinea]]] = []
+    for cod_almacen, lista in grupos.items():
+        if solicitados is not None and str(cod_almacen) not in solicitados:
+            continue
+        previo = previos.get(str(cod_almacen))
+        if previo and previo.get("estado", ESTADO_PEDIDO_OK) == ESTADO_PEDIDO_OK:
+            continue
+
+        # Filtrar/ajustar cantidades
+        lista_validas = [
+            lin for lin in lista
+            if _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo) > 0
+        ]
+        if not lista_validas:
+            continue
+
+        # Ordenar por descripción del artículo
+        lista_validas.sort(key=lambda x: (x.descripcion or "").strip().upper())
+        trabajos.append((cod_almacen, lista_validas))
+
+    if not trabajos:
+        if solicitados is not None or previos:
+            raise ValueError("No hay almacenes pendientes de generar pedido en ICG para este lote.")
+        # Debug ampliado si nada se generó
+        debug_info = []
+        for cod_almacen, lista in grupos.items():
+            for lin in lista:
+                cantidad = _elegir_cantidad(lin, politica_cantidades, ajuste_multiplo)
+                debug_info.append(
+                    f"Almacén {cod_almacen}, Artículo {lin.codigo_articulo}: "
+                    f"sugerido_interno={lin.sugerido_interno}, embalaje={lin.embalaje}, cantidad_elegida={cantidad}"
+                )
+        raise ValueError("No se generaron pedidos (sin líneas válidas).\n" + "\n".join(debug_info))
+
+    dt_now = _now_naive()
+    date_zero = _date_zero_today()
+    hora_excel = _hora_excel_naive()
+    comunes = (numserie, subserie_n, politica_cantidades, ajuste_multiplo, dt_now, date_zero, hora_excel)
+
+    # Solo se usa pyodbc dentro de los hilos; el ORM se toca antes y después
+    with PoolConexionesICG(maximo=MAX_WORKERS_ALMACENES, abrir=_abrir_conexion_icg) as pool:
+        if paralelo and len(trabajos) > 1:
+            with ThreadPoolExecutor(max_workers=min(MAX_WORKERS_ALMACENES, len(trabajos))) as executor:
+                futuros = [
+                    executor.submit(_procesar_almacen, pool, codprove, cod_almacen, lista_validas, *comunes)
+                    for cod_almacen, lista_validas in trabajos
+                ]
+                resultados = [f.result() for f in futuros]
+        else:
+            resultados = [
+                _procesar_almacen(pool, codprove, cod_almacen, lista_validas, *comunes)
+                for cod_almacen, lista_validas in trabajos
+            ]
+
+        # Clasificación de los artículos de los pedidos confirmados
+        confirmadas = {lin_id for resultado, lineas_ids in resultados for lin_id in lineas_ids}
+        _actualizar_clasificaciones(
+            pool, [lin for _, lista in trabajos for lin in lista if lin.id in confirmadas]
+        )
 
-    # Marcar líneas como ordenadas y cerrar lote en Django
+    pedidos_ejecucion = []
+    lineas_ordenadas_ids: list[int] = []
+    for resultado, lineas_ids in resultados:
+        pedidos_ejecucion.append(resultado)
+        previos[resultado["cod_almacen"]] = resultado
+        lineas_ordenadas_ids.extend(lineas_ids)
+
+    # Marcar líneas como ordenadas (solo almacenes confirmados en ICG)
     if lineas_ordenadas_ids:
         SugeridoLinea.objects.filter(id__in=lineas_ordenadas_ids).update(
             estado_linea=SugeridoLinea.EstadoLinea.ORDENADA
         )
 
-    SugeridoLote.objects.filter(pk=lote_id).update(
-        estado=SugeridoLote.Estado.COMPLETADO,
-        pedidos_icg=pedidos_creados,
-    )
+    # El lote solo se cierra cuando ningún almacén quedó con error
+    pedidos_icg = list(previos.values())
+    campos = {"pedidos_icg": pedidos_icg}
+    if all(p.get("estado", ESTADO_PEDIDO_OK) == ESTADO_PEDIDO_OK for p in pedidos_icg):
+        campos["estado"] = SugeridoLote.Estado.COMPLETADO
+    SugeridoLote.objects.filter(pk=lote_id).update(**campos)
 
-    return pedidos_creados
+    return pedidos_ejecucion
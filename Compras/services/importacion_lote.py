@@ -0,0 +1,204 @@
+"""
+Importación de lotes de sugerido desde ICG en segundo plano.
+
+Al asignar marcas a un lote nuevo (Compras.signals) se encola un chain de Celery con una
+tarea por etapa: EXTRACCION -> TRANSFORMACION -> CARGA -> KPIS -> NOTIFICACION. Cada etapa
+guarda su resultado en la caché (checkpoint) y registra el avance en el lote, que el admin
+muestra. Si una etapa falla, el lote queda FALLIDA en esa etapa y iniciar_importacion_lote
+la retoma desde ahí; si el checkpoint ya expiró, la etapa anterior se vuelve a ejecutar.
+La carga omite las líneas que el lote ya tiene, así que repetirla no duplica líneas.
+"""
+from datetime import timedelta
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import SugeridoLote
+from .icg_import import actualizar_kpis_lote, cargar_lineas_sugerido, extraer_sugerido_icg, transformar_sugerido
+
+ETAPAS = ["EXTRACCION", "TRANSFORMACION", "CARGA", "KPIS", "NOTIFICACION"]
+# Avance acumulado (%) al terminar cada etapa
+PROGRESO_ETAPA = {"EXTRACCION": 30, "TRANSFORMACION": 45, "CARGA": 75, "KPIS": 90, "NOTIFICACION": 100}
+CHECKPOINT_TIMEOUT = 60 * 60 * 24
+# Una importación en cola/en curso sin movimiento por más de esto se considera abandonada (worker caído)
+IMPORTACION_TIMEOUT = timedelta(minutes=30)
+
+Estado = SugeridoLote.EstadoImportacion
+
+
+def _clave_checkpoint(lote_id, etapa):
+    return f"compras:lote:{lote_id}:importacion:{etapa}"
+
+
+def etapas_pendientes(lote):
+    completadas = set((lote.importacion_detalle or {}).get("etapas", []))
+    return [etapa for etapa in ETAPAS if etapa not in completadas]
+
+
+def importacion_activa(lote):
+    """True si el lote tiene una importación en cola o en curso que no se haya quedado colgada."""
+    if lote.importacion_estado not in (Estado.EN_COLA, Estado.EN_CURSO):
+        return False
+    return lote.importacion_actualizada is None or timezone.now() - lote.importacion_actualizada < IMPORTACION_TIMEOUT
+
+
+def iniciar_importacion_lote(lote):
+    """
+    Encola las etapas pendientes del lote al confirmar la transacción.
+    :return: lista de etapas encoladas ([] si ya terminó o ya hay una importación activa)
+    """
+    if importacion_activa(lote):
+        return []
+    pendientes = etapas_pendientes(lote)
+    if not pendientes:
+        return []
+
+    lote.actualizar_importacion(
+        importacion_estado=Estado.EN_COLA,
+        importacion_etapa=pendientes[0],
+        importacion_error=None,
+    )
+    transaction.on_commit(lambda: _encolar_etapas(lote.pk, pendientes))
+    return pendientes
+
+
+def _encolar_etapas(lote_id, etapas):
+    from celery import chain
+    from Compras.tasks import importar_lote_icg_etapa_task
+
+    try:
+        chain(*(importar_lote_icg_etapa_task.si(lote_id, etapa) for etapa in etapas)).apply_async()
+    except Exception as e:
+        print(f"No se pudo encolar la importación del lote {lote_id}: {e}")
+        SugeridoLote.objects.filter(pk=lote_id).update(
+            importacion_estado=Estado.FALLIDA,
+            importacion_error=f"No se pudo encolar la importación: {e}",
+            importacion_actualizada=timezone.now(),
+        )
+
+
+# ─── Etapas ───
+
+def _extraccion(lote):
+    """DataFrame extraído de ICG: el checkpoint si sigue en caché o una extracción nueva."""
+    clave = _clave_checkpoint(lote.pk, "EXTRACCION")
+    df = cache.get(clave)
+    if df is None:
+        marcas = list(lote.marcas.values_list("nombre", flat=True))
+        proveedor = lote.proveedor.nombre if lote.proveedor_id else None
+        print(f"🔄 Extrayendo de ICG lote {lote.pk}: marcas={marcas}, proveedor={proveedor}")
+        df = extraer_sugerido_icg(marcas, proveedor)
+        cache.set(clave, df, CHECKPOINT_TIMEOUT)
+    return df
+
+
+def _lineas_transformadas(lote):
+    """(lineas, conteos) transformados: el checkpoint si sigue en caché o se recalculan."""
+    clave = _clave_checkpoint(lote.pk, "TRANSFORMACION")
+    datos = cache.get(clave)
+    if datos is None:
+        datos = transformar_sugerido(_extraccion(lote))
+        cache.set(clave, datos, CHECKPOINT_TIMEOUT)
+    return datos
+
+
+def _etapa_extraccion(lote):
+    cache.delete(_clave_checkpoint(lote.pk, "EXTRACCION"))
+    return {"filas_icg": len(_extraccion(lote))}
+
+
+def _etapa_transformacion(lote):
+    cache.delete(_clave_checkpoint(lote.pk, "TRANSFORMACION"))
+    lineas, conteos = _lineas_transformadas(lote)
+    return {"lineas_transformadas": len(lineas), "omitidas_extraccion": conteos["omitidas"], "errores": conteos["errores"]}
+
+
+def _etapa_carga(lote):
+    lineas, _ = _lineas_transformadas(lote)
+    base = PROGRESO_ETAPA["TRANSFORMACION"]
+    tramo = PROGRESO_ETAPA["CARGA"] - base
+
+    def progreso(insertadas, total):
+        lote.actualizar_importacion(importacion_progreso=base + tramo * insertadas // max(total, 1))
+
+    insertadas, omitidas = cargar_lineas_sugerido(lote, lineas, progreso=progreso)
+
+    # Recalcular totales y actualizar estado
+    lote.recalcular_totales()
+    lote.estado = SugeridoLote.Estado.ENVIADO if lote.total_lineas > 0 else SugeridoLote.Estado.PENDIENTE
+    SugeridoLote.objects.filter(pk=lote.pk).update(
+        total_lineas=lote.total_lineas,
+        total_costo=lote.total_costo,
+        estado=lote.estado,
+    )
+    return {"lineas_nuevas": insertadas, "omitidas_lote": omitidas}
+
+
+def _etapa_kpis(lote):
+    return {"kpis": actualizar_kpis_lote(lote.pk)}
+
+
+def _etapa_notificacion(lote):
+    from .notifications import notificar_vendedor_lote_asignado
+
+    # Las marcas ya notificadas quedan en el detalle: al reanudar no se repiten correos
+    notificadas = list((lote.importacion_detalle or {}).get("marcas_notificadas", []))
+    for marca in lote.marcas.exclude(pk__in=notificadas):
+        if lote.proveedor_id:
+            try:
+                notificar_vendedor_lote_asignado(proveedor=lote.proveedor, marca=marca, lote=lote)
+            except Exception as e:
+                print(f"Error notificando para marca {marca}: {e}")
+        notificadas.append(marca.pk)
+        lote.actualizar_importacion(importacion_detalle={**lote.importacion_detalle, "marcas_notificadas": notificadas})
+    return {"marcas_notificadas": notificadas}
+
+
+_FUNCIONES_ETAPA = {
+    "EXTRACCION": _etapa_extraccion,
+    "TRANSFORMACION": _etapa_transformacion,
+    "CARGA": _etapa_carga,
+    "KPIS": _etapa_kpis,
+    "NOTIFICACION": _etapa_notificacion,
+}
+
+
+def ejecutar_etapa_importacion(lote_id, etapa):
+    """
+    Ejecuta una etapa de la importación del lote y registra el avance. Si la etapa ya está
+    completada no hace nada; si falla, deja el lote FALLIDA en esa etapa y relanza la excepción
+    (el chain se detiene).
+    :return: dict con el resumen de la etapa
+    """
+    try:
+        lote = SugeridoLote.objects.select_related("proveedor").get(pk=lote_id)
+    except SugeridoLote.DoesNotExist:
+        print(f"Importación: lote {lote_id} no existe.")
+        return {"error": f"Lote {lote_id} no existe."}
+
+    if etapa not in etapas_pendientes(lote):
+        return {"etapa": etapa, "omitida": True}
+
+    lote.actualizar_importacion(importacion_estado=Estado.EN_CURSO, importacion_etapa=etapa, importacion_error=None)
+    try:
+        resumen = _FUNCIONES_ETAPA[etapa](lote)
+    except Exception as e:
+        print(f"❌ Importación lote {lote_id}: error en {etapa}: {e}")
+        lote.actualizar_importacion(importacion_estado=Estado.FALLIDA, importacion_error=str(e)[:2000])
+        raise
+
+    detalle = dict(lote.importacion_detalle or {})
+    detalle.update(resumen)
+    detalle["etapas"] = detalle.get("etapas", []) + [etapa]
+    final = all(e in detalle["etapas"] for e in ETAPAS)
+    lote.actualizar_importacion(
+        importacion_detalle=detalle,
+        importacion_progreso=PROGRESO_ETAPA[etapa],
+        importacion_estado=Estado.COMPLETADA if final else Estado.EN_CURSO,
+        importacion_etapa="" if final else etapa,
+    )
+    if final:
+        cache.delete_many([_clave_checkpoint(lote_id, e) for e in ("EXTRACCION", "TRANSFORMACION")])
+        print(f"✅ Importación completada lote {lote_id}: {lote.total_lineas} líneas, {detalle}")
+    return {"etapa": etapa, **resumen}
@@ -5,6 +5,8 @@ from django.urls import reverse
 from django.utils.html import strip_tags
 from django.utils.timezone import localtime
 
+from service.correo_saliente import encolar_correo, encolar_mensaje
+
 def _from_email():
     return getattr(settings, "DEFAULT_FROM_EMAIL", "notificaciones@mercasur.com.co")
 
@@ -36,7 +38,7 @@ def notificar_proveedor_lote_enviado(*, proveedor_nombre: str, lote, request=Non
     )
     # TODO: resolver email real del proveedor
     destinatarios = [getattr(settings, "COMPRAS_TEST_EMAIL", "compras@mercasur.com.co")]
-    send_mail(asunto, cuerpo, _from_email(), destinatarios, fail_silently=True)
+    encolar_correo(asunto, destinatarios, cuerpo, remitente=_from_email())
 
 
 def notificar_compras_respuesta_proveedor(*, proveedor_nombre: str, lineas, request=None):
@@ -46,7 +48,7 @@ def notificar_compras_respuesta_proveedor(*, proveedor_nombre: str, lineas, requ
         f"Revise el Admin para aprobar o rechazar."
     )
     destinatarios = [getattr(settings, "COMPRAS_TEST_EMAIL", "compras@mercasur.com.co")]
-    send_mail(asunto, cuerpo, _from_email(), destinatarios, fail_silently=True)
+    encolar_correo(asunto, destinatarios, cuerpo, remitente=_from_email())
 
 
 def _brand_assets(marca):
@@ -182,9 +184,5 @@ def notificar_vendedor_lote_asignado(*, proveedor, marca, lote, request=None):
         reply_to=[_from_email()],
     )
     msg.attach_alternative(html_body, "text/html")
-    try:
-        msg.send(fail_silently=True)
-    except Exception:
-        # Fallback ultra simple si algo sale mal con HTML
-        from django.core.mail import send_mail
-        send_mail(asunto, text_body, _from_email(), list(emails), fail_silently=True)
\ No newline at end of file
+    # Una marca se notifica una sola vez por lote aunque se reintente la importación
+    encolar_mensaje(msg, clave=f"lote:{lote.id}:marca:{_safe_get(marca, 'pk')}:asignado")
\ No newline at end of file
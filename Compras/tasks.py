@@ -1,12 +1,19 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
-from appMercaSur.conect import conectar_sql_server, ejecutar_consulta
+from appMercaSur.conect import conectar_sql_server, iterar_consulta
 from .utils import get_campo_clasificacion_por_almacen
 from Compras.models import ProcesoClasificacion, ArticuloClasificacionTemporal, ArticuloClasificacionFinal
 from celery import shared_task
 from .utils import notificar_proceso_finalizado, notificar_proceso_con_excel, procesar_clasificacion
 from datetime import date, timedelta
+from decimal import Decimal
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Filas por fetchmany / bulk_create al extraer el proceso de clasificación
+TAMANO_BLOQUE_CLASIFICACION = 5000
 
 @shared_task()
 def cargar_proceso_clasificacion_task( user_id: int | None = None):
@@ -35,8 +42,8 @@ def cargar_proceso_clasificacion_task( user_id: int | None = None):
     # Conectar a ICG
     conexion = conectar_sql_server()
     if not conexion:
-        proceso.estado = 'procesado'
-        proceso.save(update_fields=['estado'])
+        logger.error("Proceso de clasificación #%s: sin conexión a ICG", proceso.pk)
+        _marcar_proceso_error(proceso, "Sin conexión a ICG")
         return f"Fallo de conexión a ICG en Proceso #{proceso.pk}"
 
     # Calcular fechas: últimos 4 meses desde hoy
@@ -172,51 +179,72 @@ LEFT JOIN ALMACEN A
     ON A.CODALMACEN = BP.CODALMACEN
 LEFT JOIN VentasPrevias VP
     ON AR.CODARTICULO = VP.CODARTICULO
-ORDER BY A.NOMBREALMACEN;
+ORDER BY A.NOMBREALMACEN;   -- la clasificación en memoria necesita las filas agrupadas por almacén
 """
 
-    # Ejecutar y cargar datos
-    df = ejecutar_consulta(conexion, consulta)
-    if df is None:
-        return f"Error ejecutando consulta en Proceso #{proceso.pk}"
+    # Extraer por bloques: cada bloque se inserta y pasa directo a la clasificación,
+    # que solo retiene el almacén en curso (la consulta viene ordenada por almacén)
+    cargados = 0
+
+    def temporales_por_bloques():
+        nonlocal cargados
+        for filas in iterar_consulta(conexion, consulta, tamano_bloque=TAMANO_BLOQUE_CLASIFICACION):
+            articulos = [_articulo_temporal(proceso, fila) for fila in filas]
+            ArticuloClasificacionTemporal.objects.bulk_create(articulos, batch_size=TAMANO_BLOQUE_CLASIFICACION)
+            cargados += len(articulos)
+            print(f"Proceso #{proceso.pk}: {cargados} artículos cargados")
+            yield from articulos
+
+    try:
+        with transaction.atomic():
+            procesar_clasificacion(proceso, temporales=temporales_por_bloques())
+    except Exception as e:
+        # La transacción revirtió los temporales: el proceso queda en error, no en extracción
+        logger.exception("Error en extracción/clasificación del Proceso #%s", proceso.pk)
+        _marcar_proceso_error(proceso, str(e))
+        raise
+    finally:
+        conexion.close()
+
+    notificar_proceso_finalizado(proceso, cargados)
+    return f"Proceso #{proceso.pk} completado: {cargados} artículos cargados"
+
+
+def _marcar_proceso_error(proceso, detalle):
+    proceso.estado = 'error'
+    proceso.descripcion = f"{proceso.descripcion}\nError: {detalle}".strip()
+    proceso.save(update_fields=['estado', 'descripcion'])
 
-    # Bulk create de artículos temporales
-    articulos = []
-    for _, row in df.iterrows():
-        articulos.append(ArticuloClasificacionTemporal(
-            proceso=proceso,
-            codigo=row['Código'],
-            departamento=row['Departamento'],
-            seccion=row['Sección'],
-            familia=row['Familia'],
-            subfamilia=row['SubFamilia'],
-            marca=row['Marca'],
-            descripcion=row['Descripción'],
-            descat=row['Descat'],
-            tipo=row['Tipo'],
-            referencia=row['Referencia'],
-            clasificacion=row['CLASIFICACION'],
-            clasificacion2=row['CLASIFICACION2'],
-            clasificacion3=row['CLASIFICACION3'],
-            clasificacion5=row['CLASIFICACION5'],
-            unidades_compras=0,
-            unidades=row['Unidades'] or 0,
-            coste='0',
-            beneficio='0',
-            importe=row['IMPORTE'] or 0 ,
-            porcentaje_sv='0',
-            stock_actual=row['StockActual'],
-            valoracion_stock_actual='0',
-            almacen=row['Almacen'],
-            estado_nuevo=row['EstadoNuevo'],
-        ))
-    ArticuloClasificacionTemporal.objects.bulk_create(articulos)
-    # Cambia el estado a 'procesado' al finalizar correctamente
-    proceso.estado = 'extraccion'
-    proceso.save(update_fields=['estado'])
-    procesar_clasificacion(proceso= proceso)
-    notificar_proceso_finalizado(proceso, len(articulos))
-    return f"Proceso #{proceso.pk} completado: {len(articulos)} artículos cargados"
+
+def _articulo_temporal(proceso, row):
+    """ArticuloClasificacionTemporal a partir de una fila de la consulta de ICG."""
+    return ArticuloClasificacionTemporal(
+        proceso=proceso,
+        codigo=row['Código'],
+        departamento=row['Departamento'],
+        seccion=row['Sección'],
+        familia=row['Familia'],
+        subfamilia=row['SubFamilia'],
+        marca=row['Marca'],
+        descripcion=row['Descripción'],
+        descat=row['Descat'],
+        tipo=row['Tipo'],
+        referencia=row['Referencia'],
+        clasificacion=row['CLASIFICACION'],
+        clasificacion2=row['CLASIFICACION2'],
+        clasificacion3=row['CLASIFICACION3'],
+        clasificacion5=row['CLASIFICACION5'],
+        unidades_compras=0,
+        unidades=row['Unidades'] or 0,
+        coste=Decimal('0'),
+        beneficio=Decimal('0'),
+        importe=row['IMPORTE'] or Decimal('0'),
+        porcentaje_sv='0',
+        stock_actual=row['StockActual'],
+        valoracion_stock_actual=Decimal('0'),
+        almacen=row['Almacen'],
+        estado_nuevo=row['EstadoNuevo'],
+    )
 
 @shared_task(queue="cola_descuentos")
 def actualizar_clasificaciones_en_icg(proceso_id):
@@ -302,4 +330,21 @@ a2.CLASIFICACION2,
 a2.CLASIFICACION3,
 a2.CLASIFICACION5,
 a.DESCATALOGADO
-"""
\ No newline at end of file
+"""
+
+@shared_task(bind=True, max_retries=3)
+def importar_lote_icg_etapa_task(self, lote_id: int, etapa: str):
+    """
+    Ejecuta una etapa de la importación de un SugeridoLote desde ICG (ver
+    Compras.services.importacion_lote). Los fallos de conexión/consulta con ICG se
+    reintentan solos con espera creciente; otros errores dejan el lote FALLIDA.
+    """
+    from .services.icg_import import ErrorImportacionICG
+    from .services.importacion_lote import ejecutar_etapa_importacion
+
+    try:
+        return ejecutar_etapa_importacion(lote_id, etapa)
+    except ErrorImportacionICG as e:
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
+        raise
@@ -1,3 +1,99 @@
+import random
+from decimal import Decimal
+
 from django.test import TestCase
 
-# Create your tests here.
+from .models import (
+    ArticuloClasificacionProcesado,
+    ArticuloClasificacionTemporal,
+    ProcesoClasificacion,
+    ReglaClasificacion,
+)
+from .utils import procesar_clasificacion
+
+ALMACENES = ['MERCASUR CALDAS', 'MERCASUR CENTRO', 'MERCASUR CABECERA', 'MERCASUR SOTOMAYOR']
+CAMPOS_RESULTADO = (
+    'codigo', 'almacen', 'seccion', 'descripcion', 'referencia', 'marca', 'clasificacion_actual',
+    'suma_importe', 'importe_num', 'suma_unidades', 'porcentaje_acumulado', 'nueva_clasificacion',
+)
+
+
+class MotoresClasificacionTests(TestCase):
+    """El motor SQL (funciones de ventana) y el motor en Python deben clasificar igual."""
+
+    @classmethod
+    def setUpTestData(cls):
+        ReglaClasificacion.objects.create(clase='A', umbral_minimo=0, umbral_maximo=80, orden=1)
+        ReglaClasificacion.objects.create(clase='B', umbral_minimo=80, umbral_maximo=95, orden=2)
+        ReglaClasificacion.objects.create(clase='C', umbral_minimo=95, umbral_maximo=100, orden=3)
+        # Inactiva: no debe tenerse en cuenta
+        ReglaClasificacion.objects.create(clase='D', umbral_minimo=0, umbral_maximo=100, orden=0, activa=False)
+
+    def _cargar(self, proceso):
+        azar = random.Random(7)
+        articulos = []
+        for almacen in ALMACENES:
+            for i in range(300):
+                articulos.append(ArticuloClasificacionTemporal(
+                    proceso=proceso,
+                    codigo=f'{i:05d}',
+                    departamento=azar.choice(['ABARROTES', 'ASEO', 'CARTERA', None]),
+                    seccion=azar.choice(['LACTEOS', 'GRANOS', 'ASEO HOGAR', None]),
+                    marca=azar.choice(['MARCA 1', 'MARCA 2', 'MERCASUR FRUVER', None]),
+                    descripcion=f'Artículo {i}',
+                    descat=azar.choice(['F', 'F', 'F', 'T']),
+                    referencia=f'REF{i}',
+                    clasificacion=azar.choice(['A', 'B', 'C', 'I', None]),
+                    clasificacion2=azar.choice(['A', 'B', 'C']),
+                    clasificacion3=azar.choice(['A', 'B', 'I']),
+                    clasificacion5=azar.choice(['B', 'C']),
+                    # Ceros, importes repetidos (empates) y valores con centavos
+                    importe=azar.choice([
+                        Decimal('0'), Decimal('1500.00'), Decimal(azar.randint(0, 10 ** 7)) / 100,
+                    ]),
+                    unidades=azar.choice([0, 3, 12.75, None]),
+                    almacen=almacen,
+                ))
+        # Una sesión completa sin ventas: todo queda en E
+        for i in range(5):
+            articulos.append(ArticuloClasificacionTemporal(
+                proceso=proceso, codigo=f'Z{i}', departamento='ABARROTES', seccion='SIN VENTAS',
+                descat='F', clasificacion='A', importe=Decimal('0'), unidades=1, almacen='MERCASUR CALDAS',
+            ))
+        ArticuloClasificacionTemporal.objects.bulk_create(articulos)
+
+    def _resultado(self, proceso):
+        return sorted(
+            ArticuloClasificacionProcesado.objects.filter(proceso=proceso).values_list(*CAMPOS_RESULTADO)
+        )
+
+    def test_motores_clasifican_igual(self):
+        en_python = ProcesoClasificacion.objects.create()
+        en_sql = ProcesoClasificacion.objects.create()
+        self._cargar(en_python)
+        self._cargar(en_sql)
+
+        total_python = procesar_clasificacion(en_python, motor='python')
+        total_sql = procesar_clasificacion(en_sql, motor='sql')
+
+        self.assertEqual(total_python, total_sql)
+        self.assertGreater(total_sql, 0)
+        self.assertEqual(self._resultado(en_python), self._resultado(en_sql))
+        clases = set(
+            ArticuloClasificacionProcesado.objects.filter(proceso=en_sql).values_list('nueva_clasificacion', flat=True)
+        )
+        self.assertEqual(clases, {'A', 'B', 'C', 'E'})
+        en_sql.refresh_from_db()
+        self.assertEqual(en_sql.estado, 'procesado')
+
+    def test_motor_sql_reclasifica_en_python_si_ya_hay_procesados(self):
+        proceso = ProcesoClasificacion.objects.create()
+        self._cargar(proceso)
+        total = procesar_clasificacion(proceso, motor='sql')
+
+        self.assertEqual(procesar_clasificacion(proceso, motor='sql'), total)
+        self.assertEqual(ArticuloClasificacionProcesado.objects.filter(proceso=proceso).count(), total)
+
+    def test_motor_desconocido(self):
+        with self.assertRaises(ValueError):
+            procesar_clasificacion(ProcesoClasificacion.objects.create(), motor='pandas')
@@ -1,9 +1,12 @@
-from decimal import Decimal, getcontext
-from itertools import groupby
+from decimal import ROUND_HALF_UP, Decimal, getcontext, localcontext
+from collections import deque
 from operator import attrgetter
+from typing import NamedTuple
 
-from django.db.models import F, Value, CharField, FloatField, Case, When
-from django.db.models.functions import Cast, Replace
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Value, CharField, Case, When
+from django.utils import timezone
 
 from .models import (
     ProcesoClasificacion,
@@ -29,8 +32,13 @@ MARCAS_EXCLUIDAS = [
 ]
 CLASIFICACION_EXCLUIDAS = ['I']
 
-def calcular_clasificacion(acumulado: float, unidades: float):
-    reglas = ReglaClasificacion.objects.filter(activa=True).order_by('orden')
+def calcular_clasificacion(acumulado: float, unidades: float, reglas=None):
+    """
+    Clase que corresponde al porcentaje acumulado según las reglas activas.
+    :param reglas: reglas activas ya cargadas (opcional); si no se pasan se consultan.
+    """
+    if reglas is None:
+        reglas = ReglaClasificacion.objects.filter(activa=True).order_by('orden')
     for regla in reglas:
         if regla.umbral_minimo <= acumulado < regla.umbral_maximo:
             return regla.clase
@@ -58,21 +66,173 @@ def get_clasificacion_actual(temp):
     }.get(almacen)
 
 
-def procesar_clasificacion(proceso: ProcesoClasificacion):
+# ─── Motor de clasificación ───
+
+class CandidatoClasificacion(NamedTuple):
+    """Datos mínimos de un artículo temporal que entra a la clasificación."""
+    codigo: str
+    seccion: str
+    almacen: str
+    descripcion: str
+    referencia: str
+    marca: str
+    clasificacion_actual: str
+    importe_num: Decimal
+    unidades: int
+
+
+def _s(val):  # normaliza strings para ordenar/agrup
+    return val or ""
+
+
+def _dec(val):  # convierte a Decimal de forma segura
+    try:
+        return Decimal(str(val)) if val is not None else Decimal("0")
+    except Exception:
+        return Decimal("0")
+
+
+def candidato_clasificacion(temp):
     """
-    Extrae de ArticuloClasificacionTemporal, filtra, calcula el porcentaje de cada artículo
-    sobre el total de su sesión (sección+almacén) y el acumulado hasta 100%, y guarda en
-    ArticuloClasificacionProcesado.
+    Aplica a un artículo temporal los mismos filtros que la consulta de procesar_clasificacion.
+    :return: CandidatoClasificacion o None si el artículo queda por fuera
+    """
+    if temp.descat != 'F' or temp.departamento is None or temp.almacen is None:
+        return None
+    if temp.departamento in DEPARTAMENTOS_EXCLUIDOS or temp.marca in MARCAS_EXCLUIDAS:
+        return None
+    if temp.importe is None or temp.importe < 0:
+        return None
+    clasificacion_actual = get_clasificacion_actual(temp)
+    # El exclude sobre la anotación también deja por fuera los artículos sin clasificación
+    if clasificacion_actual is None or clasificacion_actual in CLASIFICACION_EXCLUIDAS:
+        return None
+    return CandidatoClasificacion(
+        codigo=_s(temp.codigo),
+        seccion=_s(temp.seccion),
+        almacen=_s(temp.almacen),
+        descripcion=_s(temp.descripcion),
+        referencia=_s(temp.referencia),
+        marca=_s(temp.marca),
+        clasificacion_actual=_s(clasificacion_actual),
+        importe_num=_dec(temp.importe),
+        unidades=int(temp.unidades or 0),
+    )
+
+
+def _clasificar_grupo(items, reglas):
+    """
+    Porcentaje, acumulado y nueva clase de los artículos de una sesión (sección+almacén).
+    El acumulado es importe acumulado * 100 / total, con 28 dígitos (no con la precisión global de
+    6, que acumulaba error), y se redondea igual que el motor SQL al guardarse.
+    :return: lista de (candidato, valores de ArticuloClasificacionProcesado)
+    """
+    items = sorted(items, key=lambda c: -c.importe_num)
+    resultado = []
+
+    with localcontext() as ctx:
+        ctx.prec = 28
+        total = sum(c.importe_num for c in items)
+        importe_acumulado = Decimal('0')
+
+        for c in items:
+            if total <= 0:
+                # Si TODO el grupo no tiene ventas: todos quedan en E y no hay acumulado
+                pct = acumulado = Decimal('0')
+                nueva_clas = 'E'
+            else:
+                # Ordenado desc por importe; importe=0 => E sin cambiar el acumulado
+                importe_acumulado += c.importe_num
+                pct = c.importe_num * 100 / total
+                acumulado = importe_acumulado * 100 / total
+                nueva_clas = calcular_clasificacion(acumulado, c.unidades, reglas) if c.importe_num > 0 else 'E'
+            resultado.append((c, {
+                'suma_importe':          pct.quantize(Decimal('0.01'), ROUND_HALF_UP),      # % del ítem
+                'importe_num':           c.importe_num,
+                'suma_unidades':         c.unidades,
+                'porcentaje_acumulado':  acumulado.quantize(Decimal('0.001'), ROUND_HALF_UP),
+                'nueva_clasificacion':   _s(nueva_clas),
+            }))
+    return resultado
+
+
+CAMPOS_CLASIFICADO = [
+    'seccion', 'descripcion', 'referencia', 'marca', 'clasificacion_actual',
+    'suma_importe', 'importe_num', 'suma_unidades', 'porcentaje_acumulado', 'nueva_clasificacion',
+]
+
+
+def _guardar_clasificados(proceso, almacen, clasificados, batch_size=1000):
+    """
+    Guarda los artículos clasificados de un almacén: actualiza los que el proceso ya tenía
+    (mismo código y almacén) y crea el resto, por lotes.
+    """
+    existentes = {
+        p.codigo: p
+        for p in ArticuloClasificacionProcesado.objects.filter(proceso=proceso, almacen=almacen)
+    }
+    nuevos, actualizados = [], []
+    for c, valores in clasificados:
+        campos = {
+            'seccion':               c.seccion,
+            'descripcion':           c.descripcion,
+            'referencia':            c.referencia,
+            'marca':                 c.marca,
+            'clasificacion_actual':  c.clasificacion_actual,
+            **valores,
+        }
+        procesado = existentes.get(c.codigo)
+        if procesado is None:
+            nuevos.append(ArticuloClasificacionProcesado(proceso=proceso, codigo=c.codigo, almacen=almacen, **campos))
+        else:
+            for campo, valor in campos.items():
+                setattr(procesado, campo, valor)
+            actualizados.append(procesado)
+
+    ArticuloClasificacionProcesado.objects.bulk_create(nuevos, batch_size=batch_size)
+    if actualizados:
+        ArticuloClasificacionProcesado.objects.bulk_update(
+            actualizados, CAMPOS_CLASIFICADO, batch_size=batch_size
+        )
+
+
+def clasificar_candidatos(proceso: ProcesoClasificacion, candidatos):
+    """
+    Clasifica candidatos que llegan agrupados por almacén (p. ej. ordenados por almacén).
+    Solo guarda en memoria los candidatos del almacén en curso: al cambiar de almacén
+    clasifica sus sesiones y las guarda.
+    :return: número de artículos clasificados
     """
-    def _s(val):  # normaliza strings para ordenar/agrup
-        return val or ""
-    def _dec(val):  # convierte a Decimal de forma segura
-        try:
-            return Decimal(str(val)) if val is not None else Decimal("0")
-        except Exception:
-            return Decimal("0")
-
-    qs = (
+    reglas = list(ReglaClasificacion.objects.filter(activa=True).order_by('orden', 'pk'))
+    cerrados = set()
+    almacen_actual = None
+    sesiones = {}
+    total = 0
+
+    def cerrar_almacen():
+        clasificados = []
+        for seccion in sorted(sesiones):
+            clasificados.extend(_clasificar_grupo(sesiones[seccion], reglas))
+        _guardar_clasificados(proceso, almacen_actual, clasificados)
+        cerrados.add(almacen_actual)
+        return len(clasificados)
+
+    for c in candidatos:
+        if c.almacen != almacen_actual:
+            if c.almacen in cerrados:
+                raise ValueError(f"Los artículos del almacén '{c.almacen}' no llegaron agrupados.")
+            if almacen_actual is not None:
+                total += cerrar_almacen()
+            almacen_actual, sesiones = c.almacen, {}
+        sesiones.setdefault(c.seccion, []).append(c)
+    if almacen_actual is not None:
+        total += cerrar_almacen()
+    return total
+
+
+def _temporales_clasificables(proceso):
+    """Artículos temporales del proceso que entran a la clasificación, con su clasificación actual."""
+    return (
         ArticuloClasificacionTemporal.objects
         .filter(
             proceso=proceso,
@@ -91,83 +251,182 @@ def procesar_clasificacion(proceso: ProcesoClasificacion):
                 default=Value(None),
                 output_field=CharField(),
             ),
-            importe_clean=Replace(F('importe'), Value(','), Value('')),
-            importe_num=Cast('importe_clean', FloatField()),
         )
-        .filter(importe_num__gte=0)
+        .filter(importe__gte=0)
         .exclude(clasificacion_actual__in=CLASIFICACION_EXCLUIDAS)
     )
 
-    temporales = list(qs)
-    temporales.sort(key=lambda t: (_s(t.seccion), _s(t.almacen), -_dec(t.importe_num)))
-
-    for (seccion, almacen), group in groupby(temporales, key=lambda t: (_s(t.seccion), _s(t.almacen))):
-        items = list(group)
-        total = sum(_dec(t.importe_num) for t in items)
-        acumulado = Decimal('0')
-
-        # Si TODO el grupo no tiene ventas: todos quedan en E y no hay acumulado
-        if total <= 0:
-            for temp in items:
-                ArticuloClasificacionProcesado.objects.update_or_create(
-                    proceso=proceso,
-                    codigo=_s(temp.codigo),
-                    almacen=_s(temp.almacen),
-                    defaults={
-                        'seccion':               _s(temp.seccion),
-                        'descripcion':           _s(temp.descripcion),
-                        'referencia':            _s(temp.referencia),
-                        'marca':                 _s(temp.marca),
-                        'clasificacion_actual':  _s(temp.clasificacion_actual),
-                        'suma_importe':          Decimal('0'),      # % del ítem
-                        'importe_num':           _dec(temp.importe_num),
-                        'suma_unidades':         int(temp.unidades or 0),
-                        'porcentaje_acumulado':  Decimal('0'),
-                        'nueva_clasificacion':   'E',
-                    }
-                )
-            continue  # siguiente grupo
 
-        # Con total > 0, ordena desc por importe y aplica la regla de importe=0 => E sin acumular
-        for temp in sorted(items, key=lambda t: -_dec(t.importe_num)):
-            importe_val = _dec(temp.importe_num)
-            unidades_val = int(temp.unidades or 0)
+# ─── Motor SQL (funciones de ventana) ───
 
-            if importe_val <= 0:
-                # No aporta porcentaje; no cambia el acumulado; clasifica como E
-                pct = Decimal('0')
-                porcentaje_acumulado = acumulado
-                nueva_clas = 'E'
-            else:
-                pct = (importe_val / total * Decimal('100'))
-                acumulado += pct
-                porcentaje_acumulado = acumulado
-                nueva_clas = calcular_clasificacion(porcentaje_acumulado, unidades_val)
-
-            ArticuloClasificacionProcesado.objects.update_or_create(
-                proceso=proceso,
-                codigo=_s(temp.codigo),
-                almacen=_s(temp.almacen),
-                defaults={
-                    'seccion':               _s(temp.seccion),
-                    'descripcion':           _s(temp.descripcion),
-                    'referencia':            _s(temp.referencia),
-                    'marca':                 _s(temp.marca),
-                    'clasificacion_actual':  _s(temp.clasificacion_actual),
-                    'suma_importe':          pct,                 # % del ítem
-                    'importe_num':           importe_val,
-                    'suma_unidades':         unidades_val,
-                    'porcentaje_acumulado':  porcentaje_acumulado,
-                    'nueva_clasificacion':   _s(nueva_clas),
-                }
+MOTORES_CLASIFICACION = ('python', 'sql')
+
+
+def motor_clasificacion(motor=None):
+    """Motor a usar: el indicado o settings.COMPRAS_MOTOR_CLASIFICACION ('python' por defecto)."""
+    motor = motor or getattr(settings, 'COMPRAS_MOTOR_CLASIFICACION', 'python')
+    if motor not in MOTORES_CLASIFICACION:
+        raise ValueError(f"Motor de clasificación desconocido: {motor}")
+    return motor
+
+
+def clasificar_en_bd(proceso: ProcesoClasificacion):
+    """
+    Clasifica el proceso dentro de la base de datos con un solo INSERT ... SELECT: el total por
+    sesión y el importe acumulado salen de SUM() OVER, y la clase de la primera regla activa
+    (por orden) cuyo rango contiene el acumulado. Mismo resultado que el motor en Python, sin
+    traer los artículos a la aplicación. Solo crea filas: el proceso no debe tener procesados.
+    :return: número de artículos clasificados
+    """
+    ops = connection.ops
+    base_sql, base_params = (
+        _temporales_clasificables(proceso)
+        .values('id', 'codigo', 'seccion', 'almacen', 'descripcion', 'referencia', 'marca',
+                'clasificacion_actual', 'importe', 'unidades')
+        .order_by()
+        .query.sql_with_params()
+    )
+    # int() de Python trunca; en PostgreSQL CAST(... AS INTEGER) redondea
+    unidades = 'TRUNC(COALESCE(b.unidades, 0))' if connection.vendor == 'postgresql' else 'COALESCE(b.unidades, 0)'
+    ahora = ops.adapt_datetimefield_value(timezone.now())
+
+    sql = f"""
+INSERT INTO {ops.quote_name(ArticuloClasificacionProcesado._meta.db_table)} (
+    proceso_id, codigo, almacen, seccion, descripcion, referencia, marca, clasificacion_actual,
+    suma_importe, importe_num, suma_unidades, porcentaje_acumulado, nueva_clasificacion,
+    confirmado, fecha_creacion, fecha_actualizacion
+)
+SELECT
+    %s, c.codigo, c.almacen, c.seccion, c.descripcion, c.referencia, c.marca, c.clasificacion_actual,
+    ROUND(c.pct, 2), c.importe, c.unidades, ROUND(c.acumulado, 3),
+    CASE
+        WHEN c.total <= 0 OR c.importe <= 0 THEN 'E'
+        ELSE COALESCE((
+            SELECT r.clase FROM {ops.quote_name(ReglaClasificacion._meta.db_table)} r
+            WHERE r.activa = %s AND r.umbral_minimo <= c.acumulado AND c.acumulado < r.umbral_maximo
+            ORDER BY r.orden, r.id
+            LIMIT 1
+        ), 'C')
+    END,
+    %s, %s, %s
+FROM (
+    SELECT s.*,
+        CASE WHEN s.total > 0 THEN s.importe * 100.0 / s.total ELSE 0 END AS pct,
+        CASE WHEN s.total > 0 THEN s.importe_acumulado * 100.0 / s.total ELSE 0 END AS acumulado
+    FROM (
+        SELECT
+            COALESCE(b.codigo, '') AS codigo,
+            b.almacen,
+            COALESCE(b.seccion, '') AS seccion,
+            COALESCE(b.descripcion, '') AS descripcion,
+            COALESCE(b.referencia, '') AS referencia,
+            COALESCE(b.marca, '') AS marca,
+            b.clasificacion_actual,
+            b.importe,
+            CAST({unidades} AS INTEGER) AS unidades,
+            SUM(b.importe) OVER (PARTITION BY COALESCE(b.seccion, ''), b.almacen) AS total,
+            SUM(b.importe) OVER (
+                PARTITION BY COALESCE(b.seccion, ''), b.almacen
+                ORDER BY b.importe DESC, b.id
+                ROWS UNBOUNDED PRECEDING
+            ) AS importe_acumulado
+        FROM ({base_sql}) b
+    ) s
+) c
+"""
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [proceso.pk, True, False, ahora, ahora, *base_params])
+        return cursor.rowcount
+
+
+def procesar_clasificacion(proceso: ProcesoClasificacion, temporales=None, motor=None):
+    """
+    Extrae de ArticuloClasificacionTemporal, filtra, calcula el porcentaje de cada artículo
+    sobre el total de su sesión (sección+almacén) y el acumulado hasta 100%, y guarda en
+    ArticuloClasificacionProcesado.
+    :param temporales: artículos temporales ya cargados, agrupados por almacén (opcional).
+        Si se pasan se clasifican en memoria sin volver a leer la tabla temporal.
+    :param motor: 'python' o 'sql' (por defecto settings.COMPRAS_MOTOR_CLASIFICACION). El motor
+        SQL solo aplica a procesos sin artículos procesados; si ya tiene, se usa el de Python.
+    :return: número de artículos clasificados
+    """
+    motor = motor_clasificacion(motor)
+    if motor == 'sql' and ArticuloClasificacionProcesado.objects.filter(proceso=proceso).exists():
+        print(f"Proceso #{proceso.pk} ya tiene artículos procesados: se reclasifica con el motor en Python.")
+        motor = 'python'
+
+    if motor == 'sql':
+        if temporales is not None:
+            deque(temporales, maxlen=0)  # recorrerlos termina de cargar la tabla temporal
+        total = clasificar_en_bd(proceso)
+    else:
+        if temporales is not None:
+            candidatos = filter(None, (candidato_clasificacion(t) for t in temporales))
+        else:
+            candidatos = (
+                CandidatoClasificacion(
+                    codigo=_s(t.codigo),
+                    seccion=_s(t.seccion),
+                    almacen=_s(t.almacen),
+                    descripcion=_s(t.descripcion),
+                    referencia=_s(t.referencia),
+                    marca=_s(t.marca),
+                    clasificacion_actual=_s(t.clasificacion_actual),
+                    importe_num=t.importe,
+                    unidades=int(t.unidades or 0),
+                )
+                for t in _temporales_clasificables(proceso)
+                .order_by('almacen', 'seccion', '-importe', 'pk')
+                .iterator(chunk_size=2000)
             )
+        total = clasificar_candidatos(proceso, candidatos)
 
     proceso.estado = 'procesado'
     proceso.save(update_fields=['estado'])
+    return total
+
+
+# ─── Migración de ArticuloClasificacionTemporal a columnas numéricas ───
+
+CAMPOS_NUMERICOS_TEMPORAL = ['importe_compras', 'coste', 'beneficio', 'importe', 'valoracion_stock_actual']
+_PATRON_NUMERICO = r'^-?[0-9]+(\.[0-9]+)?$'
+
+
+def normalizar_numericos_temporales(apps=None, schema_editor=None):
+    """
+    Deja los importes de texto de ArticuloClasificacionTemporal listos para convertir la columna a
+    numeric: quita las comas de miles (igual que hacía la clasificación) y pasa a NULL lo que no
+    sea un número. Se ejecuta ANTES del AlterField (p. ej. migrations.RunPython en la migración
+    generada); solo aplica a PostgreSQL y se puede repetir.
+    :return: filas actualizadas por campo
+    """
+    from django.apps import apps as apps_global
+    from django.db import connection
+
+    conexion = schema_editor.connection if schema_editor else connection
+    if conexion.vendor != 'postgresql':
+        return {}
+    tabla = conexion.ops.quote_name(
+        (apps or apps_global).get_model('Compras', 'ArticuloClasificacionTemporal')._meta.db_table
+    )
+    actualizadas = {}
+    with conexion.cursor() as cursor:
+        for campo in CAMPOS_NUMERICOS_TEMPORAL:
+            columna = conexion.ops.quote_name(campo)
+            limpio = f"REPLACE(BTRIM({columna}::text), ',', '')"
+            cursor.execute(
+                f"UPDATE {tabla} SET {columna} = CASE WHEN {limpio} ~ %s THEN {limpio} END "
+                f"WHERE {columna} IS NOT NULL AND {columna}::text !~ %s",
+                [_PATRON_NUMERICO, _PATRON_NUMERICO],
+            )
+            actualizadas[campo] = cursor.rowcount
+    print(f"Importes temporales normalizados: {actualizadas}")
+    return actualizadas
 
 
 from django.core.mail import EmailMultiAlternatives
 from django.utils.html import strip_tags
+from service.correo_saliente import encolar_mensaje
 
 
 def notificar_proceso_finalizado(proceso: ProcesoClasificacion, total: int):
@@ -217,8 +476,29 @@ def notificar_proceso_finalizado(proceso: ProcesoClasificacion, total: int):
         to=destinatarios,
     )
     msg.attach_alternative(html_content, "text/html")
-    msg.send()
-    print(f"Notificación enviada: Proceso #{proceso.pk} con {total} artículos procesados.")
+    encolar_mensaje(msg, clave=f"clasificacion:{proceso.pk}:extraccion")
+    print(f"Notificación encolada: Proceso #{proceso.pk} con {total} artículos procesados.")
+
+
+# Columnas del Excel de clasificación final (correo del proceso y exportación en segundo plano)
+CAMPOS_CLASIFICACION_FINAL = (
+    'seccion', 'codigo', 'descripcion', 'referencia',
+    'marca', 'clasificacion_actual', 'nueva_clasificacion',
+    'resultado_validacion', 'almacen',
+)
+
+
+def generar_excel_clasificacion_final(proceso_id):
+    """Excel (BytesIO) con la clasificación final de un proceso y el número de filas."""
+    qs = ArticuloClasificacionFinal.objects.filter(proceso_id=proceso_id).values(*CAMPOS_CLASIFICACION_FINAL)
+
+    # Generar archivo Excel en memoria
+    df = pd.DataFrame(qs)
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False, sheet_name='Clasificación Final')
+    output.seek(0)
+    return output, len(df)
 
 
 def notificar_proceso_con_excel(proceso, total):
@@ -249,19 +529,7 @@ def notificar_proceso_con_excel(proceso, total):
     """
     text_content = strip_tags(html_content)
 
-    # Query filtrada por proceso
-    qs = ArticuloClasificacionFinal.objects.filter(proceso=proceso).values(
-        'seccion', 'codigo', 'descripcion', 'referencia',
-        'marca', 'clasificacion_actual', 'nueva_clasificacion',
-        'resultado_validacion', 'almacen'
-    )
-
-    # Generar archivo Excel en memoria
-    df = pd.DataFrame(qs)
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Clasificación Final')
-    output.seek(0)
+    output, _ = generar_excel_clasificacion_final(proceso.pk)
 
     # Configurar correo
     destinatarios = [
@@ -280,9 +548,9 @@ def notificar_proceso_con_excel(proceso, total):
     )
     msg.attach_alternative(html_content, "text/html")
     msg.attach(f'clasificacion_final_proceso_{proceso.pk}.xlsx', output.read(), 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    msg.send()
+    encolar_mensaje(msg, clave=f"clasificacion:{proceso.pk}:final")
 
-    print(f"Correo enviado con Excel adjunto: Proceso #{proceso.pk}")
+    print(f"Correo con Excel adjunto encolado: Proceso #{proceso.pk}")
 
 
 
@@ -5,6 +5,7 @@ from django.utils.safestring import mark_safe
 from .models import Employee, Equipment, Department, EquipmentCategory,CategoryOfIncidence, Binnacle, Location, BinnacleDasboardProxy
 from .resources import EquipmentResource, BinnacleResource
 from import_export.admin import ImportExportModelAdmin
+from automatizaciones.service.exportaciones import accion_exportar_en_segundo_plano
 
 @admin.register(Location)
 class LocationAdmin(admin.ModelAdmin):
@@ -33,6 +34,7 @@ class EmployeeAdmin(admin.ModelAdmin):
 @admin.register(Equipment)
 class EquipmentAdmin(ImportExportModelAdmin):
     resource_class = EquipmentResource
+    actions = [accion_exportar_en_segundo_plano("equipos", "Exportar en segundo plano")]
     list_display = ('location_equipment','name','model_equipmet','serial_number','activo_fijo', 'status', 'category', 'assigned_to', 'photo_preview')
     list_filter = ('status', 'category', 'assigned_to', 'location_equipment')
     search_fields = ('name', 'serial_number')
@@ -52,6 +54,7 @@ class CategoryOfIncidenceAdmin(admin.ModelAdmin):
 @admin.register(Binnacle)
 class BinnacleAdmin(ImportExportModelAdmin):
     resource_class = BinnacleResource
+    actions = [accion_exportar_en_segundo_plano("bitacora", "Exportar en segundo plano")]
     list_display =('title','Category','location','employee_service','created_at', 'status','user','fechaSolicitud')
     list_filter =('status','Category', 'equipment_service_category', 'employee_service', 'location')
     search_fields = ('description','title',)
@@ -1,6 +1,7 @@
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.core.mail import EmailMessage, send_mail
+from service.correo_saliente import encolar_mensaje
 from .models import Binnacle
 from django.conf import settings
 import logging
@@ -147,7 +148,7 @@ def notify_employee_on_resolution(sender, instance, created, **kwargs):
         logger.error("Error al procesar imágenes embebidas: %s", e)
 
     try:
-        email.send(fail_silently=False)
-        logger.info("Correo de resolución enviado a %s", employee.email)
+        encolar_mensaje(email, clave=f"binnacle:{instance.pk}:resuelto")
+        logger.info("Correo de resolución encolado para %s", employee.email)
     except Exception as e:
-        logger.error("Error al enviar el correo: %s", e)
\ No newline at end of file
+        logger.error("Error al encolar el correo: %s", e)
\ No newline at end of file
@@ -1,5 +1,8 @@
 import pyodbc
+import queue
+import threading
 import warnings
+from contextlib import contextmanager
 from django.conf import settings
 # Configuración de conexión - MODIFICAR ESTOS VALORES
 import pandas as pd
@@ -27,11 +30,121 @@ def conectar_sql_server():
         print(f"Error de conexión: {str(e)}")
         return None
 
-def ejecutar_consulta(conexion, consulta):
-    """Ejecuta la consulta en SQL Server y retorna los resultados en un DataFrame."""
+# Conexiones abiertas a la vez por un PoolConexionesICG si no se indica otro máximo
+MAX_CONEXIONES_POOL_ICG = 4
+
+
+def _abrir_conexion_pool():
+    conexion = conectar_sql_server()
+    if conexion is None:
+        raise ConnectionError("Conexión a base de datos no disponible.")
+    return conexion
+
+
+class PoolConexionesICG:
+    """
+    Conexiones ICG reutilizadas por varios hilos durante un proceso (extracción por particiones,
+    pedidos por almacén...). Abre como mucho `maximo`, a demanda; con todas en uso, el hilo espera
+    a que otro devuelva la suya.
+
+        with PoolConexionesICG(maximo=4) as pool:
+            with pool.conexion() as conexion:
+                ...
+
+    Si el bloque falla se hace rollback y la conexión se cierra en lugar de volver al pool (puede
+    haber quedado rota); su cupo queda libre para abrir otra. Al salir del pool se cierran todas.
+    :param abrir: función que abre una conexión (por defecto conectar_sql_server); lanza
+        ConnectionError si ICG no responde
+    """
+
+    def __init__(self, maximo=MAX_CONEXIONES_POOL_ICG, abrir=None):
+        self.maximo = max(1, maximo)
+        self._abrir = abrir or _abrir_conexion_pool
+        self._libres = queue.Queue()
+        self._todas = []
+        self._abriendo = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cerrar()
+
+    @contextmanager
+    def conexion(self):
+        conexion = self._tomar()
+        try:
+            yield conexion
+        except BaseException:
+            try:
+                conexion.rollback()
+            except Exception:
+                pass
+            self._descartar(conexion)
+            raise
+        self._libres.put(conexion)
+
+    def _tomar(self):
+        while True:
+            try:
+                conexion = self._libres.get_nowait()
+            except queue.Empty:
+                conexion = self._abrir_o_esperar()
+            # None: se liberó un cupo (conexión descartada o apertura fallida), se vuelve a intentar
+            if conexion is not None:
+                return conexion
+
+    def _abrir_o_esperar(self):
+        with self._lock:
+            hay_cupo = len(self._todas) + self._abriendo < self.maximo
+            if hay_cupo:
+                self._abriendo += 1
+        if not hay_cupo:
+            return self._libres.get()
+        try:
+            conexion = self._abrir()
+        except BaseException:
+            with self._lock:
+                self._abriendo -= 1
+            self._libres.put(None)
+            raise
+        with self._lock:
+            self._abriendo -= 1
+            self._todas.append(conexion)
+        return conexion
+
+    def _descartar(self, conexion):
+        with self._lock:
+            if conexion in self._todas:
+                self._todas.remove(conexion)
+        try:
+            conexion.close()
+        except Exception:
+            pass
+        self._libres.put(None)
+
+    def cerrar(self):
+        with self._lock:
+            todas, self._todas = self._todas, []
+        for conexion in todas:
+            try:
+                conexion.close()
+            except Exception:
+                pass
+
+
+def ejecutar_consulta(conexion, consulta, params=None):
+    """
+    Ejecuta la consulta en SQL Server y retorna los resultados en un DataFrame.
+    :param params: valores para los marcadores '?' de la consulta (opcional)
+    """
     try:
         cursor = conexion.cursor()
-        cursor.execute(consulta)
+        if params:
+            cursor.execute(consulta, params)
+        else:
+            cursor.execute(consulta)
         columnas = [column[0] for column in cursor.description] 
         datos = cursor.fetchall() 
 
@@ -42,6 +155,27 @@ def ejecutar_consulta(conexion, consulta):
         print(f"⚠️ Error en consulta: {str(e)}")
         return None
 
+def iterar_consulta(conexion, consulta, params=None, tamano_bloque=5000):
+    """
+    Ejecuta la consulta en SQL Server y entrega los resultados por bloques (listas de dicts)
+    con fetchmany, sin cargar todo el resultado en memoria. Los errores se propagan.
+    :param params: valores para los marcadores '?' de la consulta (opcional)
+    """
+    cursor = conexion.cursor()
+    try:
+        if params:
+            cursor.execute(consulta, params)
+        else:
+            cursor.execute(consulta)
+        columnas = [column[0] for column in cursor.description]
+        while True:
+            filas = cursor.fetchmany(tamano_bloque)
+            if not filas:
+                break
+            yield [dict(zip(columnas, fila)) for fila in filas]
+    finally:
+        cursor.close()
+
 def ejecutar_consulta_data(conexion, consulta):
     """Ejecuta la consulta en SQL Server y retorna los resultados en un DataFrame."""
     try:
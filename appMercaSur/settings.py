@@ -122,6 +122,10 @@ REST_FRAMEWORK = {
         'rest_framework.filters.SearchFilter',
         'rest_framework.filters.OrderingFilter',
     ),
+    # Solo aplican a las vistas con throttle_scope (ScopedRateThrottle)
+    'DEFAULT_THROTTLE_RATES': {
+        'validar_documentos': '30/min',
+    },
 }
 
 
@@ -281,6 +285,14 @@ CELERY_RESULT_BACKEND = f"redis://127.0.0.1:{os.getenv('PORTREDIS')}/0"
 
 CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 
+# Caché compartida entre web y workers de Celery (la invalidación se hace desde ambos)
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": f"redis://127.0.0.1:{os.getenv('PORTREDIS')}/1",
+    }
+}
+
 CKEDITOR_UPLOAD_PATH = "uploads/"
 CKEDITOR_ALLOW_NONIMAGE_FILES = False
 
@@ -292,6 +304,9 @@ CELERY_QUEUES = (
     Queue('cola_descuentos',      routing_key='cola_descuentos'),
     Queue('cola_correo',          routing_key='cola_correo'),
     Queue('codigo_temporal',      routing_key='codigo_temporal'),
+    Queue('cola_exportaciones',   routing_key='cola_exportaciones'),
+    Queue('cola_clientes_icg',    routing_key='cola_clientes_icg'),
+    Queue('cola_sugeridos',       routing_key='cola_sugeridos'),
 )
 
 CELERY_ROUTES = {
@@ -312,8 +327,31 @@ CELERY_ROUTES = {
     },
      'clientes.tasks.generar_enviar_codigo_temporal':{
          'queue': 'codigo_temporal', 'routing_key': 'codigo_temporal'
-    }
+    },
+    'automatizaciones.tasks.ejecutar_exportacion_task': {
+        'queue': 'cola_exportaciones', 'routing_key': 'cola_exportaciones'
+    },
+    'clientes.tasks.drenar_sincronizacion_icg_task': {
+        'queue': 'cola_clientes_icg', 'routing_key': 'cola_clientes_icg'
+    },
+    'Compras.tasks.importar_lote_icg_etapa_task': {
+        'queue': 'cola_sugeridos', 'routing_key': 'cola_sugeridos'
+    },
+    'automatizaciones.tasks.drenar_correo_saliente_task': {
+        'queue': 'cola_correo', 'routing_key': 'cola_correo'
+    },
 }
 
+# Códigos de cliente: tamaño del bloque que reserva cada proceso y uso opcional de la
+# secuencia nativa de PostgreSQL (ejecutar clientes.utils.sincronizar_secuencia_codcliente al cambiarlo)
+CODCLIENTE_TAMANO_BLOQUE = int(os.getenv('CODCLIENTE_TAMANO_BLOQUE', 50))
+CODCLIENTE_USAR_SECUENCIA = os.getenv('CODCLIENTE_USAR_SECUENCIA', 'False') == 'True'
+
+# Motor de la clasificación ABC de Compras: 'python' (en memoria) o 'sql' (funciones de ventana en la BD)
+COMPRAS_MOTOR_CLASIFICACION = os.getenv('COMPRAS_MOTOR_CLASIFICACION', 'python')
+
+# Días que se conservan los archivos de exportaciones en segundo plano
+EXPORTACIONES_DIAS_EXPIRACION = int(os.getenv('EXPORTACIONES_DIAS_EXPIRACION', 3))
+
 # Aumentar límite de campos en formularios masivos (vista pivot sugeridos)
 DATA_UPLOAD_MAX_NUMBER_FIELDS = 20000  # antes valor por defecto (~1000)
\ No newline at end of file
@@ -5,6 +5,9 @@ from django.urls import reverse
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 from django.urls import path
+from django.http import FileResponse, Http404
+from django.shortcuts import get_object_or_404
+import os
 from import_export.admin import ExportMixin, ImportExportModelAdmin
 from import_export.widgets import DateWidget
 from import_export import resources, fields
@@ -169,6 +172,76 @@ class MissingRappiProductAdmin(admin.ModelAdmin):
 
 admin.site.register(MissingRappiProduct, MissingRappiProductAdmin)
 
+
+@admin.register(TrabajoExportacion)
+class TrabajoExportacionAdmin(admin.ModelAdmin):
+    list_display = ("id", "exportacion", "usuario", "estado", "progreso", "filas",
+                    "fecha_creacion", "fecha_expiracion", "descargar")
+    list_filter = ("estado", "exportacion")
+    search_fields = ("exportacion", "usuario__username")
+    readonly_fields = ("exportacion", "parametros", "usuario", "estado", "progreso", "filas", "archivo",
+                       "error_detalle", "task_id", "fecha_creacion", "fecha_fin", "fecha_expiracion")
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related("usuario")
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(usuario=request.user)
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('<int:trabajo_id>/descargar/', self.admin_site.admin_view(self.descargar_archivo),
+                 name='automatizaciones_trabajoexportacion_descargar'),
+        ]
+        return custom_urls + urls
+
+    @admin.display(description="Archivo")
+    def descargar(self, obj):
+        if obj.estado != 'COMPLETADO' or not obj.archivo:
+            return "-"
+        url = reverse("admin:automatizaciones_trabajoexportacion_descargar", args=[obj.pk])
+        return format_html('<a class="button" href="{}">Descargar</a>', url)
+
+    def descargar_archivo(self, request, trabajo_id):
+        trabajo = get_object_or_404(self.get_queryset(request), pk=trabajo_id)
+        if trabajo.estado != 'COMPLETADO' or not trabajo.archivo:
+            raise Http404("El archivo no está disponible.")
+        return FileResponse(trabajo.archivo.open("rb"), as_attachment=True,
+                            filename=os.path.basename(trabajo.archivo.name))
+
 admin.site.site_header = "mercasur"
 admin.site.site_title = "mercasur"
-admin.site.index_title = "Bienvenido a mercasur"
\ No newline at end of file
+admin.site.index_title = "Bienvenido a mercasur"
+
+class AdjuntoCorreoSalienteInline(admin.TabularInline):
+    model = AdjuntoCorreoSaliente
+    extra = 0
+    readonly_fields = ('nombre', 'archivo', 'mimetype')
+    can_delete = False
+
+
+@admin.register(CorreoSaliente)
+class CorreoSalienteAdmin(admin.ModelAdmin):
+    list_display = ('id', 'asunto', 'destinatarios', 'estado', 'intentos', 'proximo_intento', 'fecha_creacion', 'fecha_envio')
+    list_filter = ('estado', 'subtipo')
+    search_fields = ('asunto', 'destinatarios', 'clave_dedup')
+    readonly_fields = ('clave_dedup', 'fecha_creacion', 'fecha_actualizacion', 'fecha_envio')
+    inlines = [AdjuntoCorreoSalienteInline]
+    list_per_page = 50
+    actions = ['reintentar_envio']
+
+    @admin.action(description="Reintentar envío")
+    def reintentar_envio(self, request, queryset):
+        from django.db import transaction
+        from django.utils import timezone
+        from service.correo_saliente import disparar_drenado_correo
+
+        total = queryset.exclude(estado__in=['ENVIANDO', 'ENVIADO']).update(
+            estado='PENDIENTE', intentos=0, proximo_intento=timezone.now(), ultimo_error=None
+        )
+        transaction.on_commit(disparar_drenado_correo)
+        self.message_user(request, f"{total} correo(s) en cola.")
@@ -4,6 +4,7 @@ from django.utils.timezone import now
 from django_celery_beat.models import CrontabSchedule, IntervalSchedule, PeriodicTask
 import json
 from django.utils import timezone
+from django.conf import settings
 # Create your models here.
 class SQLQuery(models.Model):
     nombre = models.CharField(max_length=255, unique=True)
@@ -44,6 +45,16 @@ class Articulos(models.Model):
     
     class Meta:
         verbose_name_plural = "Artículos"
+        indexes = [
+            # Filtros por tienda (sincronización Rappi/Parze) y búsqueda de EAN dentro de la tienda
+            models.Index(fields=["store_id", "ean"], name="articulo_store_ean_idx"),
+            # Pendientes de envío: solo las filas modificadas, que son pocas frente al catálogo
+            models.Index(fields=["store_id", "tarifa"], condition=models.Q(modificado=True),
+                         name="articulo_modif_store_idx"),
+            # CSV de Parze y catálogo total: tienda + tarifa con precio
+            models.Index(fields=["store_id", "tarifa"], condition=models.Q(price__gt=0),
+                         name="articulo_store_tarifa_idx"),
+        ]
 
 from django.db import models
 from datetime import date
@@ -98,6 +109,18 @@ class DescuentoDiario(models.Model):
         fecha_info = f"({self.fecha_inicio} - {self.fecha_fin})" if self.fecha_inicio or self.fecha_fin else "(Siempre activo)"
         return f"{self.get_dia_display() if self.dia is not None else 'Todos los días'} - {' / '.join(filtros)} {fecha_info} ({self.porcentaje_descuento}%)"
 
+    class Meta:
+        # `ean` ya es único (indexado). Estos índices cubren los filtros de update_or_create_articles,
+        # generar_csv_articulos_modificados y actualizar_descuentos.
+        indexes = [
+            models.Index(fields=["dia", "activo"], name="descuento_dia_activo_idx"),
+            models.Index(fields=["dia"], condition=models.Q(activo=True, aplica_en_parze=True),
+                         name="descuento_parze_dia_idx"),
+            models.Index(fields=["dia"], condition=models.Q(activo=True, aplica_en_rappi=True),
+                         name="descuento_rappi_dia_idx"),
+            models.Index(fields=["activo", "fecha_inicio", "fecha_fin"], name="descuento_vigencia_idx"),
+        ]
+
 
 
 class APILogRappi(models.Model):
@@ -214,6 +237,30 @@ class CorreoEnviado(models.Model):
         help_text="Se debe usar Django Template para pasar la información dinámica."
     )
 
+    # Ejecución del reporte (ver automatizaciones/service/reportes.py)
+    FORMATO_ADJUNTO_CHOICES = [
+        ('csv', 'CSV comprimido (gzip)'),
+        ('xlsx', 'Excel (XLSX)'),
+    ]
+    cache_minutos = models.PositiveIntegerField(
+        default=0, verbose_name="Caché de la consulta (minutos)",
+        help_text="Los envíos con la misma consulta dentro de esta franja reutilizan el resultado. 0 desactiva la caché."
+    )
+    max_filas_cuerpo = models.PositiveIntegerField(
+        null=True, blank=True, verbose_name="Máximo de filas en el cuerpo",
+        help_text="Si la consulta devuelve más filas, el cuerpo muestra solo estas y el resultado completo va adjunto "
+                  "(la plantilla debe avisarlo con resultados_en_adjunto). En blanco: todas las filas en el cuerpo."
+    )
+    formato_adjunto = models.CharField(
+        max_length=10, choices=FORMATO_ADJUNTO_CHOICES, default='csv', verbose_name="Formato del adjunto"
+    )
+    max_filas_adjunto = models.PositiveIntegerField(
+        default=200000, verbose_name="Máximo de filas en el adjunto"
+    )
+    max_bytes_adjunto = models.PositiveIntegerField(
+        default=10 * 1024 * 1024, verbose_name="Tamaño máximo del adjunto (bytes)"
+    )
+
     # Referencia técnica y monitoreo
     periodic_task = models.OneToOneField(
         PeriodicTask, on_delete=models.SET_NULL, null=True, blank=True,
@@ -314,6 +361,113 @@ class MissingRappiProduct(models.Model):
 
     def __str__(self):
         return f"{self.ean} @ {self.store_local_id} (resolved={self.resolved})"
+
+
+class TrabajoExportacion(models.Model):
+    """
+    Exportación (XLSX/CSV) ejecutada en segundo plano por Celery.
+    El archivo queda en MEDIA_ROOT/exportaciones y se elimina al expirar.
+    """
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('COMPLETADO', 'Completado'),
+        ('ERROR', 'Error'),
+        ('EXPIRADO', 'Expirado'),
+    ]
+
+    exportacion = models.CharField(
+        max_length=100, db_index=True,
+        verbose_name="Exportación",
+        help_text="Nombre registrado en automatizaciones.service.exportaciones."
+    )
+    parametros = models.JSONField(default=dict, blank=True)
+    usuario = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='exportaciones'
+    )
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE', db_index=True)
+    progreso = models.PositiveSmallIntegerField(default=0, help_text="Porcentaje de avance (0-100).")
+    filas = models.PositiveIntegerField(default=0)
+    archivo = models.FileField(upload_to='exportaciones/%Y/%m/', null=True, blank=True)
+    error_detalle = models.TextField(blank=True, null=True)
+    task_id = models.CharField(max_length=100, blank=True, null=True, editable=False)
+
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    fecha_expiracion = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        ordering = ['-fecha_creacion']
+        verbose_name = 'Exportación en segundo plano'
+        verbose_name_plural = 'Exportaciones en segundo plano'
+
+    def __str__(self):
+        return f"#{self.pk} {self.exportacion} [{self.estado}] {self.progreso}%"
+
+    def actualizar(self, **campos):
+        """Actualiza campos sin disparar save()/señales (se llama desde la tarea)."""
+        for campo, valor in campos.items():
+            setattr(self, campo, valor)
+        TrabajoExportacion.objects.filter(pk=self.pk).update(**campos)
+
+
+class CorreoSaliente(models.Model):
+    """
+    Bandeja de salida de correos. Los flujos de negocio encolan aquí (service.correo_saliente)
+    y un worker de Celery los envía por lotes con una sola conexión SMTP por lote.
+    """
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('ENVIANDO', 'Enviando'),
+        ('ENVIADO', 'Enviado'),
+        ('DUPLICADO', 'Duplicado'),
+        ('ERROR', 'Error'),
+    ]
+    SUBTIPO_CHOICES = [
+        ('plain', 'Texto'),
+        ('html', 'HTML'),
+    ]
+
+    asunto = models.CharField(max_length=255)
+    remitente = models.CharField(max_length=255, blank=True)
+    destinatarios = models.JSONField(default=list)
+    cc = models.JSONField(default=list, blank=True)
+    bcc = models.JSONField(default=list, blank=True)
+    reply_to = models.JSONField(default=list, blank=True)
+    cuerpo = models.TextField(blank=True)
+    subtipo = models.CharField(max_length=10, choices=SUBTIPO_CHOICES, default='plain',
+                               help_text="Tipo del cuerpo principal.")
+    cuerpo_html = models.TextField(blank=True, null=True, help_text="Alternativa HTML del cuerpo de texto.")
+    clave_dedup = models.CharField(max_length=64, db_index=True,
+                                   help_text="Correos con la misma clave en la ventana de deduplicación se envían una vez.")
+
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE', db_index=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now, db_index=True)
+    ultimo_error = models.TextField(blank=True, null=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_envio = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-fecha_creacion']
+        verbose_name = 'Correo saliente'
+        verbose_name_plural = 'Correos salientes'
+        indexes = [models.Index(fields=['estado', 'proximo_intento'])]
+
+    def __str__(self):
+        return f"#{self.pk} {self.asunto} [{self.estado}]"
+
+
+class AdjuntoCorreoSaliente(models.Model):
+    correo = models.ForeignKey(CorreoSaliente, on_delete=models.CASCADE, related_name='adjuntos')
+    nombre = models.CharField(max_length=255)
+    archivo = models.FileField(upload_to='correo_saliente/%Y/%m/')
+    mimetype = models.CharField(max_length=255, blank=True, null=True)
+
+    def __str__(self):
+        return self.nombre
         
 from auditlog.registry import auditlog
 
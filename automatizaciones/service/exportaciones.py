@@ -0,0 +1,317 @@
+# services/exportaciones.py
+"""
+Exportaciones en segundo plano.
+
+Cada exportación se registra con un nombre y una función
+    fn(parametros: dict, destino, progreso) -> (nombre_archivo, filas)
+que escribe el archivo en `destino` (file-like binario). `progreso(filas, total)`
+permite informar el avance. La tarea `ejecutar_exportacion_task` la ejecuta,
+guarda el archivo en MEDIA_ROOT/exportaciones y avisa al usuario por correo.
+"""
+import csv
+import io
+import tempfile
+from datetime import timedelta
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.sites.models import Site
+from django.core.files import File
+from service.correo_saliente import encolar_correo
+from django.db import transaction
+from django.urls import reverse
+from django.utils import timezone
+
+from ..models import TrabajoExportacion
+
+# Días que se conserva un archivo generado antes de limpiarlo
+DIAS_EXPIRACION = getattr(settings, "EXPORTACIONES_DIAS_EXPIRACION", 3)
+
+# Escritura a BD del progreso como máximo cada N puntos porcentuales
+PASO_PROGRESO = 5
+
+# Filas por bloque en las exportaciones que no vienen de un resource
+TAMANO_BLOQUE_EXPORTACION = 2000
+
+EXPORTACIONES: dict[str, dict] = {}
+
+
+def registrar_exportacion(nombre: str, descripcion: str = ""):
+    """Decorador: registra una función de exportación bajo `nombre`."""
+    def decorator(fn):
+        EXPORTACIONES[nombre] = {"fn": fn, "descripcion": descripcion or nombre}
+        return fn
+    return decorator
+
+
+# ─── Ciclo de vida del trabajo ───
+
+def crear_trabajo_exportacion(exportacion: str, parametros: dict | None = None, usuario=None) -> TrabajoExportacion:
+    """Crea el trabajo y lo encola al confirmar la transacción."""
+    if exportacion not in EXPORTACIONES:
+        raise ValueError(f"Exportación no registrada: {exportacion}")
+
+    trabajo = TrabajoExportacion.objects.create(
+        exportacion=exportacion,
+        parametros=parametros or {},
+        usuario=usuario if getattr(usuario, "is_authenticated", False) else None,
+    )
+
+    from automatizaciones.tasks import ejecutar_exportacion_task
+    transaction.on_commit(lambda: ejecutar_exportacion_task.delay(trabajo.pk))
+    return trabajo
+
+
+def _reportador_progreso(trabajo: TrabajoExportacion):
+    """Callback progreso(filas, total) que solo escribe en BD cuando el avance cambia lo suficiente."""
+    ultimo = {"pct": -PASO_PROGRESO}
+
+    def progreso(filas: int, total: int | None = None):
+        pct = min(int(filas * 100 / total), 99) if total else trabajo.progreso
+        if pct - ultimo["pct"] >= PASO_PROGRESO:
+            ultimo["pct"] = pct
+            trabajo.actualizar(progreso=pct, filas=filas)
+
+    return progreso
+
+
+def ejecutar_exportacion(trabajo: TrabajoExportacion) -> TrabajoExportacion:
+    """Genera el archivo del trabajo. Deja el trabajo en COMPLETADO o ERROR."""
+    registro = EXPORTACIONES.get(trabajo.exportacion)
+    if registro is None:
+        trabajo.actualizar(estado='ERROR', error_detalle=f"Exportación no registrada: {trabajo.exportacion}",
+                           fecha_fin=timezone.now())
+        return trabajo
+
+    trabajo.actualizar(estado='PROCESANDO', progreso=0, error_detalle=None)
+    try:
+        # Archivo temporal en disco: la memoria no crece con el tamaño del export
+        with tempfile.TemporaryFile() as tmp:
+            nombre_archivo, filas = registro["fn"](trabajo.parametros or {}, tmp, _reportador_progreso(trabajo))
+            tmp.seek(0)
+            trabajo.archivo.save(nombre_archivo, File(tmp), save=False)
+
+        ahora = timezone.now()
+        trabajo.actualizar(
+            archivo=trabajo.archivo.name,
+            estado='COMPLETADO',
+            progreso=100,
+            filas=filas,
+            fecha_fin=ahora,
+            fecha_expiracion=ahora + timedelta(days=DIAS_EXPIRACION),
+        )
+        print(f"✅ Exportación #{trabajo.pk} ({trabajo.exportacion}) lista: {filas} filas -> {trabajo.archivo.name}")
+    except Exception as e:
+        print(f"❌ Error en exportación #{trabajo.pk} ({trabajo.exportacion}): {e}")
+        trabajo.actualizar(estado='ERROR', error_detalle=str(e)[:2000], fecha_fin=timezone.now())
+    return trabajo
+
+
+def url_descarga(trabajo: TrabajoExportacion) -> str:
+    dominio = Site.objects.get_current().domain
+    return f"https://{dominio}{reverse('admin:automatizaciones_trabajoexportacion_descargar', args=[trabajo.pk])}"
+
+
+def notificar_exportacion(trabajo: TrabajoExportacion):
+    """Avisa por correo al usuario que pidió la exportación (si tiene email)."""
+    email = getattr(trabajo.usuario, "email", None)
+    if not email:
+        return
+
+    descripcion = EXPORTACIONES.get(trabajo.exportacion, {}).get("descripcion", trabajo.exportacion)
+    if trabajo.estado == 'COMPLETADO':
+        asunto = f"🟢 Exportación lista: {descripcion}"
+        mensaje = (
+            f"La exportación #{trabajo.pk} ({descripcion}) terminó con {trabajo.filas} filas.\n\n"
+            f"Descárgala desde: {url_descarga(trabajo)}\n"
+            f"Disponible hasta: {timezone.localtime(trabajo.fecha_expiracion):%d/%m/%Y %H:%M}"
+        )
+    else:
+        asunto = f"🔴 Exportación fallida: {descripcion}"
+        mensaje = f"La exportación #{trabajo.pk} ({descripcion}) falló:\n\n{trabajo.error_detalle}"
+
+    encolar_correo(asunto, [email], mensaje, clave=f"exportacion:{trabajo.pk}:{trabajo.estado}")
+
+
+def limpiar_exportaciones_expiradas() -> int:
+    """Borra los archivos vencidos y marca sus trabajos como EXPIRADO."""
+    vencidos = TrabajoExportacion.objects.filter(
+        estado='COMPLETADO', fecha_expiracion__lte=timezone.now()
+    )
+    total = 0
+    for trabajo in vencidos.iterator():
+        if trabajo.archivo:
+            trabajo.archivo.delete(save=False)
+        trabajo.actualizar(estado='EXPIRADO', archivo=None)
+        total += 1
+    return total
+
+
+# ─── Acción de admin reutilizable ───
+
+def accion_exportar_en_segundo_plano(exportacion: str, descripcion: str):
+    """
+    Devuelve una acción de admin que encola `exportacion` con los ids seleccionados
+    (parametros={"ids": [...]}) en lugar de generar el archivo dentro de la petición.
+    """
+    def accion(modeladmin, request, queryset):
+        ids = list(queryset.values_list("pk", flat=True))
+        trabajo = crear_trabajo_exportacion(exportacion, {"ids": ids}, usuario=request.user)
+        url = reverse("admin:automatizaciones_trabajoexportacion_change", args=[trabajo.pk])
+        modeladmin.message_user(
+            request,
+            f"Exportación #{trabajo.pk} en proceso ({len(ids)} registro(s)). "
+            f"Recibirás un correo al terminar; también puedes seguirla en {url}",
+            messages.INFO,
+        )
+
+    accion.short_description = descripcion
+    accion.__name__ = f"exportar_{exportacion}_en_segundo_plano"
+    return accion
+
+
+# ─── Exportaciones registradas ───
+
+class _EscritorCSV:
+    """Filas del resource en CSV (UTF-8) directamente sobre el destino binario."""
+
+    def __init__(self, destino, cabeceras):
+        self.texto = io.TextIOWrapper(destino, encoding="utf-8", newline="")
+        self.writer = csv.writer(self.texto)
+        self.writer.writerow(cabeceras)
+
+    def escribir(self, filas):
+        self.writer.writerows(filas)
+
+    def cerrar(self):
+        self.texto.flush()
+        self.texto.detach()  # el destino lo cierra quien lo abrió
+
+
+class _EscritorXLSX:
+    """Filas del resource en un workbook write-only: la memoria no crece con el número de filas."""
+
+    def __init__(self, destino, cabeceras, titulo="Exportación"):
+        from openpyxl import Workbook
+
+        self.destino = destino
+        self.libro = Workbook(write_only=True)
+        self.hoja = self.libro.create_sheet(titulo)
+        self.hoja.append(cabeceras)
+
+    def escribir(self, filas):
+        for fila in filas:
+            self.hoja.append(fila)
+
+    def cerrar(self):
+        self.libro.save(self.destino)
+
+
+_ESCRITORES_RESOURCE = {"csv": _EscritorCSV, "xlsx": _EscritorXLSX}
+
+
+def _exportar_resource(resource_path: str, model_label: str, nombre_base: str, campo_ids: str = "pk"):
+    """
+    Construye una exportación basada en un ModelResource de import_export.
+    parametros: {"ids": [...]} (opcional, por defecto todo) y {"formato": "xlsx"|"csv"}.
+    `campo_ids` indica a qué campo corresponden los ids (p. ej. "proceso_id" cuando la acción
+    se lanza desde el admin del proceso y no desde el del propio modelo).
+    Recorre el queryset por bloques (chunk_size del resource) escribiendo cada bloque en el
+    archivo e informando el progreso, en lugar de armar todo el dataset de tablib en memoria.
+    """
+    def fn(parametros, destino, progreso):
+        formato = parametros.get("formato", "xlsx")
+        if formato not in _ESCRITORES_RESOURCE:
+            raise ValueError(f"Formato de exportación no soportado: {formato}")
+
+        modulo, clase = resource_path.rsplit(".", 1)
+        resource = getattr(import_module(modulo), clase)()
+        qs = apps.get_model(model_label).objects.all()
+        if parametros.get("ids"):
+            qs = qs.filter(**{f"{campo_ids}__in": parametros["ids"]})
+
+        total = qs.count()
+        progreso(0, total)
+        resource.before_export(qs)
+        qs = resource.filter_export(qs)
+
+        escritor = _ESCRITORES_RESOURCE[formato](destino, resource.get_export_headers())
+        tamano_bloque = resource.get_chunk_size()
+        bloque, filas = [], 0
+        for obj in resource.iter_queryset(qs):
+            bloque.append(resource.export_resource(obj))
+            if len(bloque) >= tamano_bloque:
+                escritor.escribir(bloque)
+                filas += len(bloque)
+                bloque = []
+                progreso(filas, total)
+        escritor.escribir(bloque)
+        filas += len(bloque)
+        escritor.cerrar()
+        progreso(filas, total)
+        return f"{nombre_base}_{timezone.localtime():%Y%m%d_%H%M}.{formato}", filas
+    return fn
+
+
+# Los ids de la acción son de ProcesoClasificacion: se exportan los temporales de esos procesos
+registrar_exportacion("clasificacion_temporal", "Artículos de clasificación (temporal)")(_exportar_resource(
+    "Compras.resources.ArticuloClasificacionTemporalResource", "Compras.ArticuloClasificacionTemporal",
+    "clasificacion_temporal", campo_ids="proceso_id",
+))
+
+for _nombre, _resource, _modelo, _descripcion in (
+    ("presupuesto_mensual", "presupuesto.resources.PresupuestoMensualCategoriaResource",
+     "presupuesto.PresupuestoMensualCategoria", "Presupuesto mensual por categoría"),
+    ("presupuesto_diario", "presupuesto.resources.PresupuestoDiarioCategoriaResource",
+     "presupuesto.PresupuestoDiarioCategoria", "Presupuesto diario por categoría"),
+    ("venta_diaria_real", "presupuesto.resources.VentaDiariaRealResource",
+     "presupuesto.VentaDiariaReal", "Venta diaria real"),
+    ("equipos", "SoporteTI.resources.EquipmentResource",
+     "SoporteTI.Equipment", "Equipos (Soporte TI)"),
+    ("bitacora", "SoporteTI.resources.BinnacleResource",
+     "SoporteTI.Binnacle", "Bitácora (Soporte TI)"),
+):
+    registrar_exportacion(_nombre, _descripcion)(_exportar_resource(_resource, _modelo, _nombre))
+
+
+@registrar_exportacion("sugerido_lotes", "Líneas de sugerido por lote")
+def _exportar_sugerido_lotes(parametros, destino, progreso):
+    """parametros: {"ids": [lote_id, ...]}"""
+    from Compras.models import SugeridoLinea
+    from Compras.services.exports import write_lines_xlsx
+
+    ids = parametros.get("ids") or []
+    lineas = SugeridoLinea.objects.filter(lote_id__in=ids)
+    total = lineas.count()
+    progreso(0, total)
+    filas = write_lines_xlsx(lineas, destino, progreso=lambda n: progreso(n, total))
+    return "sugerido_lotes_" + "_".join(map(str, ids[:10])) + ".xlsx", filas
+
+
+@registrar_exportacion("clasificacion_final", "Clasificación final de procesos")
+def _exportar_clasificacion_final(parametros, destino, progreso):
+    """parametros: {"ids": [proceso_id, ...]} o {"proceso_id": id}"""
+    from Compras.models import ArticuloClasificacionFinal
+    from Compras.utils import CAMPOS_CLASIFICACION_FINAL
+
+    ids = parametros.get("ids") or [parametros.get("proceso_id")]
+    filas = ArticuloClasificacionFinal.objects.filter(proceso_id__in=ids).order_by("proceso_id", "pk")
+    total = filas.count()
+    progreso(0, total)
+
+    escritor = _EscritorXLSX(destino, list(CAMPOS_CLASIFICACION_FINAL), titulo="Clasificación Final")
+    bloque, escritas = [], 0
+    for fila in filas.values_list(*CAMPOS_CLASIFICACION_FINAL).iterator(chunk_size=TAMANO_BLOQUE_EXPORTACION):
+        bloque.append(list(fila))
+        if len(bloque) >= TAMANO_BLOQUE_EXPORTACION:
+            escritor.escribir(bloque)
+            escritas += len(bloque)
+            bloque = []
+            progreso(escritas, total)
+    escritor.escribir(bloque)
+    escritas += len(bloque)
+    escritor.cerrar()
+    progreso(escritas, total)
+    return "clasificacion_final_proceso_" + "_".join(map(str, ids[:10])) + ".xlsx", escritas
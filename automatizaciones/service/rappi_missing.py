@@ -32,3 +32,90 @@ def log_missing_product(*, articulo, store_name: str | None, rappi_store_id: int
             for k, v in defaults.items():
                 setattr(obj, k, v)
             obj.save()
+
+
+# Campos que se actualizan cuando el (ean, tienda) ya estaba registrado
+CAMPOS_ACTUALIZADOS = [
+    "code", "store_name", "rappi_store_id", "name", "price", "discount_price", "stock",
+    "attempts", "last_error", "lookups_debug", "flagged_for_creation", "resolved", "last_seen",
+]
+
+
+class MissingProductBatch:
+    """
+    Acumula los faltantes de una sincronización y los guarda juntos con flush():
+    un solo bulk_create(update_conflicts=True) sobre (ean, store_local_id) en lugar de un
+    select_for_update().get_or_create por artículo. Igual que log_missing_product, un faltante
+    nuevo empieza con attempts=0 y cada repetición suma 1.
+    """
+
+    def __init__(self, batch_size: int = 1000):
+        self.batch_size = batch_size
+        self._pendientes: dict[tuple[str, str], tuple[MissingRappiProduct, int]] = {}
+
+    def __len__(self):
+        return len(self._pendientes)
+
+    def add(self, *, articulo, store_name: str | None, rappi_store_id: int | None,
+            error: str, lookups_debug: dict | list | None = None) -> None:
+        clave = (getattr(articulo, "ean", None) or "", str(getattr(articulo, "store_id", "")))
+        _, veces = self._pendientes.get(clave, (None, 0))
+        # Si el artículo se repite en la sincronización, queda la información más reciente
+        self._pendientes[clave] = (MissingRappiProduct(
+            ean=clave[0],
+            store_local_id=clave[1],
+            code=getattr(articulo, "code", None),
+            store_name=store_name,
+            rappi_store_id=rappi_store_id,
+            name=getattr(articulo, "name", None),
+            price=getattr(articulo, "price", 0) or 0,
+            discount_price=getattr(articulo, "discount_price", 0) or 0,
+            stock=getattr(articulo, "stock", 0) or 0,
+            last_error=error[:2000],  # evita textos gigantes
+            lookups_debug=lookups_debug,
+            flagged_for_creation=True,
+            resolved=False,
+        ), veces + 1)
+
+    def _intentos_actuales(self, claves):
+        """attempts de los faltantes ya registrados, por (ean, store_local_id); bloquea esas filas."""
+        por_tienda = {}
+        for ean, tienda in claves:
+            por_tienda.setdefault(tienda, []).append(ean)
+        intentos = {}
+        for tienda, eans in por_tienda.items():
+            for i in range(0, len(eans), self.batch_size):
+                intentos.update(
+                    ((ean, tienda), attempts)
+                    for ean, attempts in MissingRappiProduct.objects.select_for_update()
+                    .filter(store_local_id=tienda, ean__in=eans[i:i + self.batch_size])
+                    .values_list("ean", "attempts")
+                )
+        return intentos
+
+    def flush(self) -> dict:
+        """
+        Guarda los faltantes acumulados y vacía el lote.
+        :return: dict con faltantes, nuevos y actualizados
+        """
+        if not self._pendientes:
+            return {"faltantes": 0, "nuevos": 0, "actualizados": 0}
+
+        with transaction.atomic():
+            intentos = self._intentos_actuales(self._pendientes)
+            objetos = []
+            for clave, (obj, veces) in self._pendientes.items():
+                anteriores = intentos.get(clave)
+                obj.attempts = veces - 1 if anteriores is None else (anteriores or 0) + veces
+                objetos.append(obj)
+            MissingRappiProduct.objects.bulk_create(
+                objetos,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=["ean", "store_local_id"],
+                update_fields=CAMPOS_ACTUALIZADOS,
+            )
+
+        resumen = {"faltantes": len(objetos), "nuevos": len(objetos) - len(intentos), "actualizados": len(intentos)}
+        self._pendientes = {}
+        return resumen
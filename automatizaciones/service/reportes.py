@@ -0,0 +1,243 @@
+"""
+Ejecución de las consultas de los reportes programados (CorreoEnviado).
+
+ejecutar_reporte() corre la SQLQuery del envío en ICG leyendo por bloques (iterar_consulta) y
+devuelve un ResultadoReporte:
+  - las primeras `max_filas_cuerpo` filas (todas si no tiene límite), que la plantilla muestra
+    en el cuerpo del correo;
+  - si hay más filas, un adjunto comprimido (CSV en gzip o XLSX) con todas las filas hasta
+    `max_filas_adjunto` / `max_bytes_adjunto`; lo que pase de ahí queda truncado.
+
+Si el envío tiene `cache_minutos` (por defecto 0, sin caché), el resultado se guarda en la caché
+por (consulta, límites, franja de `cache_minutos`): los envíos que comparten la misma consulta en
+la misma franja van a ICG una sola vez. Mientras un worker ejecuta la consulta, los demás esperan
+su resultado en lugar de lanzarla de nuevo.
+"""
+import csv
+import gzip
+import hashlib
+import io
+import sys
+import time
+from typing import NamedTuple
+
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.text import slugify
+
+from appMercaSur.conect import conectar_sql_server, iterar_consulta
+
+REPORTE_TAMANO_BLOQUE = 2000
+# Tiempo máximo que un worker espera el resultado que otro está consultando
+REPORTE_ESPERA_MAXIMA = 120
+REPORTE_ESPERA_PASO = 2
+REPORTE_LOCK_TIMEOUT = 60 * 15
+
+FORMATO_CSV = "csv"
+FORMATO_XLSX = "xlsx"
+
+
+class ResultadoReporte(NamedTuple):
+    columnas: list
+    filas: list              # filas para el cuerpo del correo (como mucho max_filas_cuerpo)
+    total_filas: int         # filas leídas de ICG (hasta el límite del adjunto)
+    truncado: bool           # la consulta tenía más filas/bytes que los límites del reporte
+    adjunto: tuple | None    # (nombre, contenido, mimetype)
+    fecha: object
+
+    def contexto(self):
+        """Variables que el resultado aporta a la plantilla del correo."""
+        return {
+            "resultados": self.filas,
+            "columnas": self.columnas,
+            "total_filas": self.total_filas,
+            "resultados_en_adjunto": self.adjunto is not None,
+            "adjunto_nombre": self.adjunto[0] if self.adjunto else None,
+            "resultados_truncados": self.truncado,
+            "fecha_consulta": self.fecha,
+        }
+
+
+# ─── Escritores del adjunto ───
+
+class _AdjuntoCSV:
+    """CSV comprimido con gzip en memoria; el tamaño se controla sobre los bytes comprimidos."""
+    extension = "csv.gz"
+    mimetype = "application/gzip"
+
+    def __init__(self, columnas):
+        self.buffer = io.BytesIO()
+        self.gzip = gzip.GzipFile(fileobj=self.buffer, mode="wb")
+        self.texto = io.TextIOWrapper(self.gzip, encoding="utf-8-sig", newline="")
+        self.writer = csv.writer(self.texto)
+        self.writer.writerow(columnas)
+
+    def escribir(self, filas):
+        self.writer.writerows(filas)
+        self.texto.flush()
+        self.gzip.flush()  # vacía zlib para que tamano() refleje lo escrito
+
+    def tamano(self):
+        return self.buffer.tell()
+
+    def cerrar(self):
+        self.texto.close()  # cierra también el GzipFile
+        return self.buffer.getvalue()
+
+
+class _AdjuntoXLSX:
+    """XLSX en modo write_only (ya comprimido); el tamaño solo se conoce al cerrar."""
+    extension = "xlsx"
+    mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+    def __init__(self, columnas):
+        from openpyxl import Workbook
+
+        self.libro = Workbook(write_only=True)
+        self.hoja = self.libro.create_sheet("Reporte")
+        self.hoja.append(columnas)
+
+    def escribir(self, filas):
+        for fila in filas:
+            self.hoja.append(list(fila))
+
+    def tamano(self):
+        return 0
+
+    def cerrar(self):
+        buffer = io.BytesIO()
+        self.libro.save(buffer)
+        return buffer.getvalue()
+
+
+_ESCRITORES = {FORMATO_CSV: _AdjuntoCSV, FORMATO_XLSX: _AdjuntoXLSX}
+
+
+# ─── Ejecución ───
+
+def _leer_resultado(conexion, consulta, nombre, formato, max_filas_cuerpo, max_filas_adjunto, max_bytes_adjunto):
+    columnas = None
+    filas = []
+    escritor = None
+    total = 0
+    truncado = False
+    tamano_anterior = 0
+
+    for bloque in iterar_consulta(conexion, consulta, tamano_bloque=REPORTE_TAMANO_BLOQUE):
+        if columnas is None:
+            columnas = list(bloque[0].keys())
+        restantes = max_filas_adjunto - total
+        if len(bloque) > restantes:
+            bloque, truncado = bloque[:restantes], True
+        total += len(bloque)
+
+        if escritor is None and total > max_filas_cuerpo:
+            # Ya no cabe en el cuerpo: desde aquí todo va al adjunto
+            escritor = _ESCRITORES[formato](columnas)
+            escritor.escribir([list(fila.values()) for fila in filas])
+            escritor.escribir([list(fila.values()) for fila in bloque])
+        elif escritor is not None:
+            escritor.escribir([list(fila.values()) for fila in bloque])
+        filas.extend(bloque[:max_filas_cuerpo - len(filas)])
+
+        if truncado:
+            break
+        if escritor is not None:
+            # Se corta antes del bloque que, a este ritmo, ya no cabría en el límite de bytes
+            tamano = escritor.tamano()
+            if tamano + (tamano - tamano_anterior) > max_bytes_adjunto:
+                truncado = True
+                break
+            tamano_anterior = tamano
+
+    adjunto = None
+    if escritor is not None:
+        contenido = escritor.cerrar()
+        if len(contenido) > max_bytes_adjunto:
+            print(f"Reporte '{nombre}': el adjunto ({len(contenido)} bytes) supera el límite; no se adjunta.")
+            truncado = True
+        else:
+            nombre_archivo = f"{nombre}_{timezone.localtime():%Y%m%d_%H%M}.{escritor.extension}"
+            adjunto = (nombre_archivo, contenido, escritor.mimetype)
+
+    return ResultadoReporte(
+        columnas=columnas or [],
+        filas=filas,
+        total_filas=total,
+        truncado=truncado,
+        adjunto=adjunto,
+        fecha=timezone.now(),
+    )
+
+
+def _clave_resultado(envio, consulta):
+    huella = hashlib.sha256(
+        f"{consulta}|{envio.formato_adjunto}|{envio.max_filas_cuerpo}|"
+        f"{envio.max_filas_adjunto}|{envio.max_bytes_adjunto}".encode()
+    ).hexdigest()[:32]
+    segundos = envio.cache_minutos * 60
+    franja = int(time.time() // segundos)
+    return f"automatizaciones:reporte:{envio.consulta_id}:{huella}:{segundos}:{franja}", segundos
+
+
+def _consultar(envio, consulta):
+    conexion = conectar_sql_server()
+    if not conexion:
+        raise ConnectionError("Conexión a base de datos no disponible.")
+    if envio.max_filas_cuerpo is None:
+        # Sin límite de cuerpo: todas las filas van en el correo y nunca hay adjunto
+        max_filas_cuerpo = max_filas_adjunto = sys.maxsize
+    else:
+        max_filas_cuerpo, max_filas_adjunto = envio.max_filas_cuerpo, envio.max_filas_adjunto
+    try:
+        return _leer_resultado(
+            conexion, consulta,
+            nombre=slugify(envio.consulta.nombre) or f"consulta_{envio.consulta_id}",
+            formato=envio.formato_adjunto,
+            max_filas_cuerpo=max_filas_cuerpo,
+            max_filas_adjunto=max_filas_adjunto,
+            max_bytes_adjunto=envio.max_bytes_adjunto,
+        )
+    finally:
+        try:
+            conexion.close()
+        except Exception as e_close:
+            print(f"Error al cerrar conexión del reporte {envio.pk}: {e_close}")
+
+
+def ejecutar_reporte(envio):
+    """
+    Resultado de la consulta del envío, desde la caché si otro envío ya la ejecutó en la misma franja.
+    :raises ValueError: si la consulta está vacía; los errores de conexión/pyodbc se propagan
+    """
+    consulta = envio.consulta.consulta
+    if not consulta or not consulta.strip():
+        raise ValueError(f"La consulta SQL en SQLQuery ID {envio.consulta_id} está vacía.")
+    if not envio.cache_minutos:
+        return _consultar(envio, consulta)
+
+    clave, timeout = _clave_resultado(envio, consulta)
+    resultado = cache.get(clave)
+    if resultado is not None:
+        print(f"Reporte {envio.pk}: resultado de la consulta {envio.consulta_id} tomado de la caché.")
+        return resultado
+
+    clave_lock = f"{clave}:ejecutando"
+    if not cache.add(clave_lock, envio.pk, REPORTE_LOCK_TIMEOUT):
+        # Otro worker está ejecutando la misma consulta: esperar su resultado
+        espera = 0
+        while espera < REPORTE_ESPERA_MAXIMA and cache.get(clave_lock) is not None:
+            time.sleep(REPORTE_ESPERA_PASO)
+            espera += REPORTE_ESPERA_PASO
+            resultado = cache.get(clave)
+            if resultado is not None:
+                return resultado
+        print(f"Reporte {envio.pk}: no llegó el resultado compartido; se consulta directamente.")
+        return _consultar(envio, consulta)
+
+    try:
+        resultado = _consultar(envio, consulta)
+        cache.set(clave, resultado, timeout)
+        return resultado
+    finally:
+        cache.delete(clave_lock)
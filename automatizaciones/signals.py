@@ -10,7 +10,8 @@ import json # Para guardar args/kwargs como JSON en PeriodicTask
 
 # Importa tu modelo EnvioProgramado (ajusta la ruta si es necesario)
 # Ejemplo: from .models import EnvioProgramado
-from .models import CorreoEnviado
+from .models import CorreoEnviado, SQLQuery
+from .utils import invalidar_consulta_sql, invalidar_plantilla_envio
 from celery.signals import task_failure
 from django.core.mail import send_mail
 from django.conf import settings
@@ -28,6 +29,9 @@ def crear_o_actualizar_tarea_periodica_signal(sender, instance, created, **kwarg
     """
     print(f"--- Signal post_save detectado para EnvioProgramado ID: {instance.pk} ---")
 
+    # La plantilla compilada en caché puede haber quedado vieja
+    invalidar_plantilla_envio(instance.pk)
+
     # Determinar el schedule (Crontab o Intervalo)
     schedule = instance.crontab if instance.crontab else instance.intervalo
     # La tarea en Celery Beat debe estar habilitada solo si el EnvioProgramado está activo Y tiene un schedule definido
@@ -129,6 +133,7 @@ def eliminar_tarea_periodica_signal(sender, instance, **kwargs):
     Elimina la PeriodicTask correspondiente de django-celery-beat.
     """
     print(f"--- Signal post_delete detectado para EnvioProgramado ID: {instance.pk}, Nombre Tarea: {instance.nombre_tarea} ---")
+    invalidar_plantilla_envio(instance.pk)
 
     # Usa el nombre único que debería estar guardado
     task_name = instance.nombre_tarea
@@ -177,4 +182,10 @@ def on_task_failure(sender=None, task_id=None, exception=None,
         settings.SERVER_EMAIL,  # o DEFAULT_FROM_EMAIL
         recipients,
         fail_silently=False,
-    )
\ No newline at end of file
+    )
+
+
+@receiver([post_save, post_delete], sender=SQLQuery)
+def invalidar_consulta_sql_signal(sender, instance, **kwargs):
+    """Borra el texto en caché (automatizaciones.utils.obtener_consulta_sql) al editar una consulta."""
+    invalidar_consulta_sql(instance.pk)
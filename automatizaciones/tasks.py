@@ -4,16 +4,17 @@ from django.db import transaction
 from django.template import TemplateSyntaxError
 from django.utils import timezone
 
-from automatizaciones.service.rappi_missing import log_missing_product
+from automatizaciones.service.rappi_missing import MissingProductBatch
 from automatizaciones.service.rappi_update_state import RappiError, update_inventory_one_by_one
 from .service.upload import *
-from appMercaSur.conect import conectar_sql_server, ejecutar_consulta, ejecutar_consulta_data_auto
+from appMercaSur.conect import conectar_sql_server, ejecutar_consulta
 from .models import SQLQuery
 import pandas as pd
 import pyodbc
 from django.conf import settings
 from .models import CorreoEnviado
 from .utils import enviar_correo_renderizado
+from .service.reportes import ejecutar_reporte
 from .service.rappi_auth import get_rappi_token
 
 @shared_task
@@ -238,7 +239,6 @@ def procesar_y_enviar_correo_task(self, envio_id):
     task_id = self.request.id
     print(f"Iniciando tarea {task_id} para EnvioProgramado ID: {envio_id}")
     envio = None
-    conexion_db = None # Variable para la conexión
 
     try:
         envio = CorreoEnviado.objects.select_related('consulta').get(pk=envio_id)
@@ -252,6 +252,7 @@ def procesar_y_enviar_correo_task(self, envio_id):
 
         datos_consulta = {}
         contexto_final = {'fecha_actual': timezone.now()} # Contexto base
+        adjuntos = []
 
         # --- 1. Ejecutar Consulta (si aplica) ---
         if envio.consulta:
@@ -259,20 +260,14 @@ def procesar_y_enviar_correo_task(self, envio_id):
             if not SQLQuery: raise ImportError("Modelo SQLQuery no disponible.")
 
             try:
-                # --- Obtener conexión ---
-                conexion_db = conectar_sql_server() # Llama a tu función para conectar
-
-                # --- Obtener el SQL de tu modelo ---
-                consulta_sql_string = envio.consulta.consulta 
-                if not consulta_sql_string:
-                    raise ValueError(f"La consulta SQL en SQLQuery ID {envio.consulta.pk} está vacía.")
-
-                # --- Ejecutar usando tu función ---
-                datos_crudos = ejecutar_consulta_data_auto(conexion_db, consulta_sql_string)
-
-                # Prepara el contexto para la plantilla
-                contexto_final['resultados'] = datos_crudos # Añade los resultados al contexto
-                print(f"Tarea {task_id}: Consulta ejecutada.")
+                # Resultado desde la caché compartida o ejecutado en ICG por bloques;
+                # si hay demasiadas filas para el cuerpo, el resultado completo va adjunto
+                resultado = ejecutar_reporte(envio)
+                contexto_final.update(resultado.contexto())
+                if resultado.adjunto:
+                    adjuntos.append(resultado.adjunto)
+                print(f"Tarea {task_id}: Consulta ejecutada, {resultado.total_filas} filas"
+                      f"{' (truncado)' if resultado.truncado else ''}.")
 
             except (ImportError, AttributeError, ValueError, ConnectionError, pyodbc.Error) as e_query:
                  print(f"Error Tarea {task_id}: Fallo relacionado a consulta para envío {envio_id}. Error: {e_query}")
@@ -282,14 +277,6 @@ def procesar_y_enviar_correo_task(self, envio_id):
                  print(f"Error Tarea {task_id}: Error inesperado durante consulta {envio_id}. Error: {e_inesperado_query}")
                  actualizar_estado_envio(envio_id, 'ERROR_QUERY', error_msg=e_inesperado_query)
                  raise Ignore() # No reintentar
-            finally:
-                if conexion_db:
-                    try:
-                        if not conexion_db.closed:  # 👈 Evita cerrar si ya está cerrada
-                            conexion_db.close()
-                            print(f"Tarea {task_id}: Conexión a BD cerrada en finally.")
-                    except Exception as e_close:
-                        print(f"Tarea {task_id}: Error al cerrar conexión en finally: {e_close}")
         else:
              print(f"Tarea {task_id}: No hay consulta SQL asociada. Correo informativo.")
              # contexto_final ya tiene 'fecha_actual'
@@ -303,7 +290,10 @@ def procesar_y_enviar_correo_task(self, envio_id):
                 asunto=envio.asunto,
                 destinatarios=envio.destinatarios, # La función interna normaliza
                 template_html_string=envio.cuerpo_html,
-                contexto=contexto_final
+                contexto=contexto_final,
+                clave=f"correo_enviado:{envio_id}:{task_id}",
+                adjuntos=adjuntos,
+                envio_id=envio_id,
             )
 
             if envio_exitoso:
@@ -342,14 +332,6 @@ def procesar_y_enviar_correo_task(self, envio_id):
         except Exception as e_retry:
              print(f"Tarea {task_id}: Error inesperado durante reintento para {envio_id}. Error: {e_retry}")
              return f"Error en reintento: {envio_id}"
-    finally:
-        # Asegurarse de cerrar la conexión si sigue abierta por alguna razón
-        if conexion_db:
-            try:
-                conexion_db.close()
-                print(f"Tarea {task_id}: Conexión a BD cerrada en finally.")
-            except Exception as e_close:
-                print(f"Tarea {task_id}: Error al cerrar conexión en finally: {e_close}")
 
 
 @shared_task
@@ -375,29 +357,92 @@ def rappi_active_product():
 
     qs = Articulos.objects.all().order_by("store_id")
 
-    results = []
-    for art in qs:
-        print("Actualizando artículo:", art.ean, "en tienda local", art.store_id)
-        try:
-            res = update_inventory_one_by_one(
-                server=server,
-                token=token,
-                articulo=art,
-                local_to_name=LOCAL_TO_NAME,
-                name_to_rappi=NAME_TO_RAPPI,
-            )
-            results.append({"ean": art.ean, "store_id": art.store_id, "ok": True, "detail": res})
-        except RappiError as e:
-            err = str(e)
-            if "No encontré IDs" in err or "no devolvió ni productId ni listingId" in err:
-                store_name = LOCAL_TO_NAME.get(str(art.store_id).strip())
-                rappi_store_id = NAME_TO_RAPPI.get(store_name)
-                # si tu update_inventory_one_by_one devuelve 'lookups' en el dict de error, pásalo aquí
-                log_missing_product(
+    # Los artículos que Rappi no reconoce se acumulan y se registran juntos al final
+    faltantes = MissingProductBatch()
+    resumen = {"procesados": 0, "actualizados": 0, "errores": 0}
+    try:
+        for art in qs.iterator(chunk_size=2000):
+            print("Actualizando artículo:", art.ean, "en tienda local", art.store_id)
+            resumen["procesados"] += 1
+            try:
+                update_inventory_one_by_one(
+                    server=server,
+                    token=token,
                     articulo=art,
-                    store_name=store_name,
-                    rappi_store_id=rappi_store_id,
-                    error=err,
-                    lookups_debug=None,  # pon aquí el detalle si lo tienes
+                    local_to_name=LOCAL_TO_NAME,
+                    name_to_rappi=NAME_TO_RAPPI,
                 )
-            results.append({"ean": art.ean, "store_id": art.store_id, "ok": False, "error": str(e)})
\ No newline at end of file
+                resumen["actualizados"] += 1
+            except RappiError as e:
+                err = str(e)
+                resumen["errores"] += 1
+                if "No encontré IDs" in err or "no devolvió ni productId ni listingId" in err:
+                    store_name = LOCAL_TO_NAME.get(str(art.store_id).strip())
+                    rappi_store_id = NAME_TO_RAPPI.get(store_name)
+                    # si tu update_inventory_one_by_one devuelve 'lookups' en el dict de error, pásalo aquí
+                    faltantes.add(
+                        articulo=art,
+                        store_name=store_name,
+                        rappi_store_id=rappi_store_id,
+                        error=err,
+                        lookups_debug=None,  # pon aquí el detalle si lo tienes
+                    )
+    finally:
+        # Aunque la sincronización se corte, los faltantes encontrados quedan registrados
+        resumen["faltantes"] = faltantes.flush()
+
+    print(f"Sincronización de inventario Rappi: {resumen}")
+    return resumen
+
+# --- Exportaciones en segundo plano ---
+@shared_task(bind=True)
+def ejecutar_exportacion_task(self, trabajo_id):
+    """Genera el archivo de un TrabajoExportacion y notifica al usuario."""
+    from .models import TrabajoExportacion
+    from .service.exportaciones import ejecutar_exportacion, notificar_exportacion
+
+    try:
+        trabajo = TrabajoExportacion.objects.select_related("usuario").get(pk=trabajo_id)
+    except TrabajoExportacion.DoesNotExist:
+        print(f"Exportación #{trabajo_id} no encontrada.")
+        return None
+
+    trabajo.actualizar(task_id=self.request.id)
+    ejecutar_exportacion(trabajo)
+    try:
+        notificar_exportacion(trabajo)
+    except Exception as e:
+        print(f"Exportación #{trabajo_id}: error al notificar: {e}")
+    return {"trabajo_id": trabajo.pk, "estado": trabajo.estado, "filas": trabajo.filas}
+
+
+@shared_task
+def limpiar_exportaciones_expiradas_task():
+    """Programar en Celery Beat (p.ej. diario) para borrar archivos vencidos de MEDIA_ROOT."""
+    from .service.exportaciones import limpiar_exportaciones_expiradas
+
+    total = limpiar_exportaciones_expiradas()
+    print(f"Exportaciones expiradas eliminadas: {total}")
+    return total
+
+
+# --- Bandeja de salida de correos ---
+@shared_task
+def drenar_correo_saliente_task():
+    """
+    Envía los correos pendientes de CorreoSaliente. Se dispara al encolar un correo;
+    programarla también en Celery Beat (p.ej. cada minuto) para atender los reintentos.
+    """
+    from service.correo_saliente import drenar_correo_saliente
+
+    return drenar_correo_saliente()
+
+
+@shared_task
+def limpiar_correo_saliente_task():
+    """Programar en Celery Beat (p.ej. diario) para borrar los correos enviados antiguos y sus adjuntos."""
+    from service.correo_saliente import limpiar_correo_saliente
+
+    total = limpiar_correo_saliente()
+    print(f"Correos salientes eliminados: {total}")
+    return total
@@ -1,3 +1,172 @@
-from django.test import TestCase
+import os
+import random
+import time
+import unittest
+from datetime import date, timedelta
+from decimal import Decimal
 
-# Create your tests here.
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+
+from .models import Articulos, CorreoEnviado, DescuentoDiario
+from .utils import _plantillas_compiladas, obtener_plantilla
+from django.template import Context
+
+PLANTILLA_REPORTE = """
+<h2>Reporte {{ fecha_actual|date:"Y-m-d" }}</h2>
+<table>
+  <tr>{% for columna in columnas %}<th>{{ columna }}</th>{% endfor %}</tr>
+  {% for fila in resultados %}
+  <tr class="{% cycle 'par' 'impar' %}">
+    <td>{{ fila.codigo }}</td><td>{{ fila.descripcion|upper }}</td>
+    <td>{% if fila.stock > 10 %}{{ fila.stock }}{% else %}<b>{{ fila.stock|default:0 }}</b>{% endif %}</td>
+  </tr>
+  {% empty %}<tr><td>Sin resultados</td></tr>
+  {% endfor %}
+</table>
+{% if resultados_en_adjunto %}<p>Resultado completo en {{ adjunto_nombre }}</p>{% endif %}
+""" * 10
+
+
+class PlantillasCompiladasTests(TestCase):
+    """Caché de plantillas compiladas de CorreoEnviado (automatizaciones.utils.obtener_plantilla)."""
+
+    def setUp(self):
+        _plantillas_compiladas.clear()
+        self.envio = CorreoEnviado.objects.create(
+            nombre_tarea='reporte prueba', asunto='Reporte', destinatarios='a@x.com', cuerpo_html=PLANTILLA_REPORTE,
+        )
+
+    def test_reutiliza_y_se_invalida_al_guardar(self):
+        plantilla = obtener_plantilla(self.envio.cuerpo_html, self.envio.pk)
+        self.assertIs(obtener_plantilla(self.envio.cuerpo_html, self.envio.pk), plantilla)
+
+        self.envio.cuerpo_html = "<p>{{ total_filas }} filas</p>"
+        self.envio.save()
+        self.assertFalse([clave for clave in _plantillas_compiladas if clave[0] == self.envio.pk])
+        nueva = obtener_plantilla(self.envio.cuerpo_html, self.envio.pk)
+        self.assertEqual(nueva.render(Context({'total_filas': 3})), "<p>3 filas</p>")
+
+    def test_benchmark_renderizado(self):
+        """Compara compilar en cada envío contra la plantilla en caché (imprime los tiempos)."""
+        from django.template import Template
+
+        contexto = {
+            'columnas': ['codigo', 'descripcion', 'stock'],
+            'resultados': [{'codigo': i, 'descripcion': f'artículo {i}', 'stock': i % 20} for i in range(5)],
+        }
+        repeticiones = 100
+
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            sin_cache = Template(self.envio.cuerpo_html).render(Context(contexto))
+        tiempo_sin_cache = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        for _ in range(repeticiones):
+            con_cache = obtener_plantilla(self.envio.cuerpo_html, self.envio.pk).render(Context(contexto))
+        tiempo_con_cache = time.perf_counter() - inicio
+
+        print(f"\nRenderizado x{repeticiones}: compilando {tiempo_sin_cache:.3f}s, en caché {tiempo_con_cache:.3f}s "
+              f"({tiempo_sin_cache / tiempo_con_cache:.1f}x)")
+        self.assertEqual(sin_cache, con_cache)
+        self.assertEqual(len(_plantillas_compiladas), 1)
+
+
+TIENDAS = ['900175315', '900175197', '900175196', '900174620']
+ARTICULOS_POR_TIENDA = int(os.getenv('BENCHMARK_ARTICULOS_POR_TIENDA', 25000))
+
+
+@unittest.skipUnless(os.getenv('BENCHMARK_INDICES'), "Benchmark de índices: definir BENCHMARK_INDICES=1 para ejecutarlo")
+class IndicesSincronizacionBenchmark(TransactionTestCase):
+    """
+    Tiempos de las consultas de sincronización sobre un catálogo realista, sin y con los índices
+    de Articulos y DescuentoDiario (imprime los tiempos y el plan de cada consulta).
+        BENCHMARK_INDICES=1 python manage.py test automatizaciones.tests.IndicesSincronizacionBenchmark
+    """
+
+    def setUp(self):
+        from .service.upload import articulosMoficados
+
+        azar = random.Random(50)
+        hoy = date.today()
+        articulos = []
+        for tienda in TIENDAS:
+            for i in range(ARTICULOS_POR_TIENDA):
+                articulos.append(Articulos(
+                    id_articulo=str(i), store_id=tienda, ean=f'77{i:011d}', code=f'{tienda}-{i}', stock=azar.randint(0, 50),
+                    price=Decimal(azar.choice([0, 1500, 2900, 12000])), tarifa=Decimal(azar.choice([1, 1, 4])),
+                    # En un ciclo normal solo una fracción pequeña del catálogo queda modificada
+                    modificado=azar.random() < 0.02,
+                ))
+        Articulos.objects.bulk_create(articulos, batch_size=5000)
+
+        descuentos = []
+        for i in range(0, ARTICULOS_POR_TIENDA, 10):
+            activo = azar.random() < 0.3
+            descuentos.append(DescuentoDiario(
+                ean=f'77{i:011d}', porcentaje_descuento=10, dia=azar.choice([None, 0, 1, 2, 3, 4, 5, 6]),
+                fecha_inicio=hoy - timedelta(days=azar.randint(0, 10)), fecha_fin=hoy + timedelta(days=azar.randint(-5, 10)),
+                activo=activo, aplica_en_parze=azar.random() < 0.8, aplica_en_rappi=azar.random() < 0.3,
+            ))
+        DescuentoDiario.objects.bulk_create(descuentos, batch_size=5000)
+
+        hoy_dia = hoy.weekday()
+        eans = [f'77{i:011d}' for i in range(0, ARTICULOS_POR_TIENDA, 25)]
+        self.consultas = {
+            'articulos modificados': lambda: list(articulosMoficados().values_list('pk', flat=True)),
+            'modificados de una tienda': lambda: Articulos.objects.filter(store_id=TIENDAS[1], modificado=True).count(),
+            'CSV Parze (tienda, tarifa, precio)': lambda: list(
+                Articulos.objects.filter(store_id=TIENDAS[0], tarifa=4, price__gt=0).values_list('pk', flat=True)),
+            'EAN de una tienda': lambda: [
+                Articulos.objects.filter(store_id=TIENDAS[2], ean=ean).values_list('pk', flat=True).first() for ean in eans],
+            'descuento por EAN activo': lambda: [
+                DescuentoDiario.objects.filter(ean=ean, activo=True, aplica_en_parze=True).first() for ean in eans],
+            'descuentos del día Parze': lambda: list(
+                DescuentoDiario.objects.filter(dia=hoy_dia, activo=True, aplica_en_parze=True)),
+            'descuentos vigentes': lambda: DescuentoDiario.objects.filter(
+                activo=True, fecha_inicio__lte=hoy, fecha_fin__gte=hoy).count(),
+            'próximo día con descuentos': lambda: DescuentoDiario.objects.filter(dia=(hoy_dia + 1) % 7).exists(),
+        }
+        self.planes = {
+            'modificados de una tienda': Articulos.objects.filter(store_id=TIENDAS[1], modificado=True),
+            'CSV Parze (tienda, tarifa, precio)': Articulos.objects.filter(store_id=TIENDAS[0], tarifa=4, price__gt=0),
+            'descuentos del día Parze': DescuentoDiario.objects.filter(dia=hoy_dia, activo=True, aplica_en_parze=True),
+            'descuentos vigentes': DescuentoDiario.objects.filter(activo=True, fecha_inicio__lte=hoy, fecha_fin__gte=hoy),
+        }
+
+    def _medir(self, repeticiones=5):
+        tiempos = {}
+        for nombre, consulta in self.consultas.items():
+            consulta()  # calienta la caché de páginas
+            inicio = time.perf_counter()
+            for _ in range(repeticiones):
+                consulta()
+            tiempos[nombre] = (time.perf_counter() - inicio) / repeticiones * 1000
+        return tiempos
+
+    def _planes(self):
+        return {nombre: qs.explain() for nombre, qs in self.planes.items()}
+
+    def test_consultas_con_y_sin_indices(self):
+        indices = [(modelo, indice) for modelo in (Articulos, DescuentoDiario) for indice in modelo._meta.indexes]
+
+        with connection.schema_editor() as editor:
+            for modelo, indice in indices:
+                editor.remove_index(modelo, indice)
+        sin_indices, planes_antes = self._medir(), self._planes()
+
+        with connection.schema_editor() as editor:
+            for modelo, indice in indices:
+                editor.add_index(modelo, indice)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        con_indices, planes_despues = self._medir(), self._planes()
+
+        print(f"\nCatálogo: {Articulos.objects.count()} artículos, {DescuentoDiario.objects.count()} descuentos")
+        for nombre in self.consultas:
+            print(f"{nombre:<38} {sin_indices[nombre]:9.2f} ms -> {con_indices[nombre]:9.2f} ms")
+        for nombre in self.planes:
+            print(f"\n{nombre}\n  antes:   {planes_antes[nombre]}\n  después: {planes_despues[nombre]}")
+
+        self.assertTrue(any(indice.name in plan for plan in planes_despues.values() for _, indice in indices))
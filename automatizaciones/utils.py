@@ -1,18 +1,71 @@
 # Puedes poner esto en un archivo utils.py o al inicio de tasks.py
+import hashlib
+import threading
+from collections import OrderedDict
+
 from django.template import Template, Context, TemplateSyntaxError
-from django.core.mail import EmailMessage
+from service.correo_saliente import encolar_correo
 from django.conf import settings
+from django.core.cache import cache
+from .models import SQLQuery
+
+# ─── Plantillas compiladas en caché ───
+# Compilar el cuerpo_html de un CorreoEnviado en cada ejecución es lo más caro del renderizado.
+# Las plantillas compiladas se guardan en memoria del proceso por (id del envío, hash del texto):
+# si el texto cambia, el hash cambia y se compila de nuevo; la señal post_save/post_delete de
+# CorreoEnviado borra además las versiones viejas del envío.
+PLANTILLAS_CACHE_MAX = 256
+
+_plantillas_compiladas = OrderedDict()
+_plantillas_lock = threading.Lock()
+
+
+def _huella_plantilla(template_html_string):
+    return hashlib.sha256(template_html_string.encode()).hexdigest()
+
 
-def enviar_correo_renderizado(asunto="", destinatarios=None, template_html_string="", contexto=None):
+def obtener_plantilla(template_html_string, envio_id=None):
     """
-    Renderiza una plantilla HTML string con un contexto y envía el correo.
+    Plantilla compilada para el texto dado, desde la caché si ya se compiló.
+    :raises TemplateSyntaxError: si la plantilla es inválida (no se guarda en caché)
+    """
+    clave = (envio_id, _huella_plantilla(template_html_string))
+    with _plantillas_lock:
+        template = _plantillas_compiladas.get(clave)
+        if template is not None:
+            _plantillas_compiladas.move_to_end(clave)
+            return template
+
+    template = Template(template_html_string)
+    with _plantillas_lock:
+        _plantillas_compiladas[clave] = template
+        while len(_plantillas_compiladas) > PLANTILLAS_CACHE_MAX:
+            _plantillas_compiladas.popitem(last=False)
+    return template
+
+
+def invalidar_plantilla_envio(envio_id):
+    """Borra de la caché las plantillas compiladas del envío."""
+    with _plantillas_lock:
+        for clave in [clave for clave in _plantillas_compiladas if clave[0] == envio_id]:
+            del _plantillas_compiladas[clave]
+
+
+def enviar_correo_renderizado(asunto="", destinatarios=None, template_html_string="", contexto=None, clave=None, adjuntos=None,
+                              envio_id=None):
+    """
+    Renderiza una plantilla HTML string con un contexto y encola el correo en la bandeja de
+    salida (service.correo_saliente); el envío SMTP y sus reintentos los hace el worker de correo.
 
     :param asunto: Asunto del correo.
     :param destinatarios: Lista de correos o string separados por coma.
     :param template_html_string: String que contiene la plantilla HTML.
     :param contexto: Diccionario para renderizar el template.
-    :return: True si el envío fue exitoso, False en caso contrario.
-    :raises: TemplateSyntaxError si la plantilla es inválida, Exception para errores de envío.
+    :param clave: Clave de deduplicación del correo (opcional).
+    :param adjuntos: Lista de (nombre, contenido, mimetype) (opcional).
+    :param envio_id: ID del CorreoEnviado, para reutilizar su plantilla compilada (opcional).
+    :return: True si el correo quedó encolado, False en caso contrario.
+    :raises: TemplateSyntaxError si la plantilla es inválida, Exception si no se pudo encolar.
     """
     if destinatarios is None:
         destinatarios = []
@@ -31,7 +84,7 @@ def enviar_correo_renderizado(asunto="", destinatarios=None, template_html_strin
     try:
         if not template_html_string:
              raise ValueError("La plantilla HTML (cuerpo_html) no puede estar vacía.")
-        template = Template(template_html_string)
+        template = obtener_plantilla(template_html_string, envio_id)
         context_obj = Context(contexto)
         cuerpo_renderizado = template.render(context_obj)
     except TemplateSyntaxError as e_template:
@@ -44,18 +97,44 @@ def enviar_correo_renderizado(asunto="", destinatarios=None, template_html_strin
         print(f"Error inesperado al renderizar plantilla: {e_render}")
         raise # Re-lanza para captura genérica
 
-    # Intenta enviar el correo
+    # Encola el correo
     try:
-        correo = EmailMessage(
-            subject=asunto,
-            body=cuerpo_renderizado, # Usa el cuerpo renderizado
-            from_email=settings.DEFAULT_FROM_EMAIL, # Usa la configuración de Django
-            to=destinatarios
+        correo = encolar_correo(
+            asunto=asunto,
+            destinatarios=destinatarios,
+            cuerpo=cuerpo_renderizado, # Usa el cuerpo renderizado
+            subtipo="html",
+            remitente=settings.DEFAULT_FROM_EMAIL, # Usa la configuración de Django
+            adjuntos=adjuntos,
+            clave=clave,
         )
-        correo.content_subtype = "html"
-        sent_count = correo.send(fail_silently=False) # Lanza excepción si falla
-        print(f"Correo enviado a {sent_count} destinatarios.")
-        return sent_count > 0
+        print(f"Correo encolado para {len(destinatarios)} destinatarios.")
+        return correo is not None
     except Exception as e_send:
-        print(f"Error al enviar correo: {e_send}")
-        raise # Re-lanza la excepción para que Celery la maneje
\ No newline at end of file
+        print(f"Error al encolar correo: {e_send}")
+        raise # Re-lanza la excepción para que Celery la maneje
+
+
+# ─── Texto de SQLQuery en caché ───
+# Las consultas ICG guardadas en SQLQuery casi nunca cambian; se leen de la caché y la señal
+# post_save/post_delete de SQLQuery borra la entrada.
+SQLQUERY_CACHE_TIMEOUT = 60 * 60
+
+
+def _clave_consulta_sql(pk):
+    return f"automatizaciones:sqlquery:{pk}"
+
+
+def obtener_consulta_sql(pk):
+    """Texto de la SQLQuery indicada (None si no existe)."""
+    clave = _clave_consulta_sql(pk)
+    consulta = cache.get(clave)
+    if consulta is None:
+        consulta = SQLQuery.objects.filter(pk=pk).values_list('consulta', flat=True).first()
+        if consulta is not None:
+            cache.set(clave, consulta, SQLQUERY_CACHE_TIMEOUT)
+    return consulta
+
+
+def invalidar_consulta_sql(pk):
+    cache.delete(_clave_consulta_sql(pk))
@@ -1,16 +1,27 @@
 from django.contrib import admin, messages
 
 from service.clientICG import crearClienteICG, getClienteICG
-from .models import RegistroCliente, ZonaPermitida, barrio, CodigoTemporal, SecuenciaCodCliente
+from .models import RegistroCliente, ZonaPermitida, barrio, CodigoTemporal, SecuenciaCodCliente, SincronizacionClienteICG, ResumenDiarioClientes
+from .utils import sincronizar_secuencia_codcliente
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources
 from import_export.fields import Field
 from import_export.widgets import DateWidget
 from import_export.formats.base_formats import XLS, XLSX
 from django.db import transaction
+from django.utils import timezone
 
 
 
+@admin.action(description="Sincronizar secuencia PostgreSQL de códigos")
+def action_sincronizar_secuencia(modeladmin, request, queryset):
+    try:
+        ultimo = sincronizar_secuencia_codcliente()
+    except ValueError as e:
+        modeladmin.message_user(request, str(e), level=messages.ERROR)
+        return
+    modeladmin.message_user(request, f"Secuencia sincronizada en el código {ultimo}.", level=messages.SUCCESS)
+
 @admin.register(SecuenciaCodCliente)
 class SecuenciaCodClienteAdmin(admin.ModelAdmin):
     list_display = ('id', 'ultimo_codigo', 'rango_maximo')
@@ -18,6 +29,7 @@ class SecuenciaCodClienteAdmin(admin.ModelAdmin):
     ordering = ('id',)
     list_per_page = 20
     list_filter = ('id',)
+    actions = [action_sincronizar_secuencia]
 
 @admin.register(CodigoTemporal)
 class CodigoTemporalAdmin(admin.ModelAdmin):
@@ -171,6 +183,43 @@ class RegistroClienteAdmin(admin.ModelAdmin):
     list_per_page = 20
     actions = [action_crear_desde_admin]
 
+@admin.action(description="Reintentar sincronización con ICG")
+def action_reintentar_sincronizacion(modeladmin, request, queryset):
+    from service.sincronizacion import disparar_drenado_icg
+
+    total = queryset.exclude(estado='PROCESANDO').update(
+        estado='PENDIENTE', intentos=0, proximo_intento=timezone.now(), ultimo_error=None
+    )
+    transaction.on_commit(disparar_drenado_icg)
+    modeladmin.message_user(request, f"{total} sincronización(es) en cola.", level=messages.SUCCESS)
+
+@admin.register(SincronizacionClienteICG)
+class SincronizacionClienteICGAdmin(admin.ModelAdmin):
+    list_display = ('numero_documento', 'operacion', 'estado', 'intentos', 'proximo_intento', 'resultado', 'fecha_sincronizacion')
+    list_filter = ('estado', 'operacion')
+    search_fields = ('numero_documento',)
+    readonly_fields = ('cliente', 'fecha_creacion', 'fecha_actualizacion', 'fecha_sincronizacion')
+    list_per_page = 50
+    actions = [action_reintentar_sincronizacion]
+
+@admin.action(description="Recalcular días seleccionados")
+def action_recalcular_resumen(modeladmin, request, queryset):
+    from .metricas import actualizar_resumen_clientes
+
+    fechas = sorted(queryset.values_list('fecha', flat=True))
+    if not fechas:
+        return
+    dias = actualizar_resumen_clientes(fechas[0], fechas[-1])
+    modeladmin.message_user(request, f"Resumen recalculado: {dias} día(s) entre {fechas[0]} y {fechas[-1]}.", level=messages.SUCCESS)
+
+@admin.register(ResumenDiarioClientes)
+class ResumenDiarioClientesAdmin(admin.ModelAdmin):
+    list_display = ('fecha', 'total', 'creados_icg', 'actualizados', 'pendientes', 'icg_con_firma', 'actualizado')
+    date_hierarchy = 'fecha'
+    ordering = ('-fecha',)
+    list_per_page = 50
+    actions = [action_recalcular_resumen]
+
 @admin.register(ZonaPermitida)
 class ZonaPermitidaAdmin(admin.ModelAdmin):
     list_display = (
@@ -1,4 +1,5 @@
 from django.core.mail import EmailMessage
+from service.correo_saliente import encolar_mensaje
 from django.template.loader import render_to_string
 from django.conf import settings
 
@@ -39,10 +40,9 @@ def enviar_correo(cliente):
     # Adjunta el contenido HTML
     correo.content_subtype = "html"
 
-    # Envía el correo
-    print("Correo Se Envio")
-    correo.send()
-    print("Correo Se Envio")
+    # Encola el correo (lo envía el worker de correo)
+    encolar_mensaje(correo)
+    print("Correo encolado")
 
 def enviar_correo_html(asunto="", destinatarios=None, cuerpo_html="", contexto=None):
     """
@@ -76,7 +76,7 @@ def enviar_correo_html(asunto="", destinatarios=None, cuerpo_html="", contexto=N
             to=destinatarios
         )
         correo.content_subtype = "html" 
-        correo.send()
+        encolar_mensaje(correo)
 
     except Exception as e:
         print(e)
@@ -100,4 +100,4 @@ def enviar_correo_con_template(asunto,destinatario, template_path, contexto):
         to= list(destinatario)
     )
     email.content_subtype = "html"  # Para enviar como HTML
-    email.send()
\ No newline at end of file
+    encolar_mensaje(email)
\ No newline at end of file
@@ -0,0 +1,192 @@
+# clientes/metricas.py
+"""
+Métricas de registro de clientes para dashboard_clientes.
+
+Los contadores salen de un solo aggregate condicional (Count con filter) en lugar de un
+count() por métrica. Los rangos cortos se calculan directo sobre RegistroCliente; los largos
+se sirven desde ResumenDiarioClientes, que se mantiene al guardar cada registro.
+"""
+import datetime
+
+from django.db import transaction
+from django.db.models import Count, F, Func, IntegerField, Q
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import RegistroCliente, ResumenDiarioClientes
+
+# Rangos de hasta estos días se calculan sobre los registros; los más largos, desde el resumen diario
+DIAS_MAXIMOS_CONSULTA_DIRECTA = 31
+
+
+class OctetLength(Func):
+    """
+    Tamaño en bytes de firma_base64. En PostgreSQL OCTET_LENGTH lee el tamaño del valor TOAST sin
+    descomprimirlo, a diferencia de comparar el texto con ''.
+    """
+    function = 'OCTET_LENGTH'
+    output_field = IntegerField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(compiler, connection, function='LENGTH', **extra_context)
+
+
+# nombre -> condición; cada uno es un campo de ResumenDiarioClientes
+CONTADORES = {
+    'creados_icg': Q(creadoICG=True),
+    'actualizados': Q(Actualizado=True),
+    'pendientes': Q(creadoICG=False, Actualizado=False),
+    'icg_con_firma': Q(creadoICG=True, firma_bytes__gt=0),
+    'pref_email': Q(preferencias_email=True),
+    'pref_whatsapp': Q(preferencias_whatsapp=True),
+    'pref_sms': Q(preferencias_sms=True),
+    'pref_redes': Q(preferencias_redes_sociales=True),
+    'pref_llamada': Q(preferencias_llamada=True),
+    'pref_ninguna': Q(preferencias_ninguna=True),
+    'formato_fisico': Q(creado_desde_fisico=True),
+    'desde_admin': Q(creado_desde_admin=True),
+    'sin_codigo': Q(codcliente__isnull=True),
+    'icg_sin_ip': Q(codcliente__isnull=False, ip_usuario__isnull=True),
+    'no_fidelizados': Q(fidelizacion=False, tipocliente='Cliente', creadoICG=True),
+}
+CAMPOS_CONTADORES = ['total'] + list(CONTADORES)
+
+
+def _agregados():
+    return {'total': Count('id'), **{nombre: Count('id', filter=q) for nombre, q in CONTADORES.items()}}
+
+
+def _registros_en_rango(fecha_inicio, fecha_fin):
+    """Registros entre dos días locales, filtrando por límites datetime (aprovecha el índice)."""
+    desde = timezone.make_aware(datetime.datetime.combine(fecha_inicio, datetime.time.min))
+    hasta = timezone.make_aware(datetime.datetime.combine(fecha_fin + datetime.timedelta(days=1), datetime.time.min))
+    return RegistroCliente.objects.filter(fecha_registro__gte=desde, fecha_registro__lt=hasta) \
+        .annotate(firma_bytes=OctetLength(F('firma_base64')))
+
+
+def _ordenar_distribucion(conteos):
+    # Mismo orden que order_by() en PostgreSQL: ascendente con los nulos al final
+    return sorted(conteos.items(), key=lambda par: (par[0] is None, par[0] or ''))
+
+
+def _metricas_directas(fecha_inicio, fecha_fin):
+    qs = _registros_en_rango(fecha_inicio, fecha_fin)
+    contadores = qs.aggregate(**_agregados())
+
+    serie = list(
+        qs.annotate(fecha=TruncDate('fecha_registro'))
+        .values('fecha')
+        .annotate(**_agregados())
+        .order_by('fecha')
+    )
+
+    tipos, puntos = {}, {}
+    for fila in qs.values('tipocliente', 'punto_compra').annotate(n=Count('id')).order_by():
+        tipos[fila['tipocliente']] = tipos.get(fila['tipocliente'], 0) + fila['n']
+        puntos[fila['punto_compra']] = puntos.get(fila['punto_compra'], 0) + fila['n']
+
+    return contadores, serie, tipos, puntos
+
+
+def _metricas_desde_resumen(fecha_inicio, fecha_fin):
+    contadores = dict.fromkeys(CAMPOS_CONTADORES, 0)
+    serie, tipos, puntos = [], {}, {}
+    for resumen in ResumenDiarioClientes.objects.filter(fecha__range=(fecha_inicio, fecha_fin)).order_by('fecha'):
+        dia = {'fecha': resumen.fecha}
+        for campo in CAMPOS_CONTADORES:
+            valor = getattr(resumen, campo)
+            contadores[campo] += valor
+            dia[campo] = valor
+        serie.append(dia)
+        for tipo, n in resumen.por_tipocliente:
+            tipos[tipo] = tipos.get(tipo, 0) + n
+        for punto, n in resumen.por_punto_compra:
+            puntos[punto] = puntos.get(punto, 0) + n
+    return contadores, serie, tipos, puntos
+
+
+def metricas_clientes(fecha_inicio, fecha_fin):
+    """
+    Métricas del dashboard para un rango de días (inclusive).
+    :return: dict con los contadores de CAMPOS_CONTADORES, 'serie' (lista por día con los mismos
+        contadores), 'por_tipocliente' y 'por_punto_compra' (listas [(valor, conteo)]) y 'origen'
+    """
+    if (fecha_fin - fecha_inicio).days + 1 <= DIAS_MAXIMOS_CONSULTA_DIRECTA:
+        origen = 'registros'
+        contadores, serie, tipos, puntos = _metricas_directas(fecha_inicio, fecha_fin)
+    else:
+        origen = 'resumen'
+        contadores, serie, tipos, puntos = _metricas_desde_resumen(fecha_inicio, fecha_fin)
+
+    return {
+        **contadores,
+        'serie': serie,
+        'por_tipocliente': _ordenar_distribucion(tipos),
+        'por_punto_compra': _ordenar_distribucion(puntos),
+        'origen': origen,
+    }
+
+
+# ─── Mantenimiento de ResumenDiarioClientes ───
+
+def fecha_local(fecha_hora):
+    """Día local (TIME_ZONE) de un datetime, el mismo que usa TruncDate."""
+    return timezone.localtime(fecha_hora).date() if timezone.is_aware(fecha_hora) else fecha_hora.date()
+
+
+def actualizar_resumen_clientes(fecha_inicio, fecha_fin=None):
+    """Recalcula los resúmenes de los días del rango: 2 consultas agrupadas y un upsert."""
+    fecha_fin = fecha_fin or fecha_inicio
+    qs = _registros_en_rango(fecha_inicio, fecha_fin).annotate(fecha=TruncDate('fecha_registro'))
+
+    resumenes = {
+        fila['fecha']: ResumenDiarioClientes(**fila, por_tipocliente=[], por_punto_compra=[])
+        for fila in qs.values('fecha').annotate(**_agregados()).order_by()
+    }
+
+    distribuciones = {}
+    for fila in qs.values('fecha', 'tipocliente', 'punto_compra').annotate(n=Count('id')).order_by():
+        tipos, puntos = distribuciones.setdefault(fila['fecha'], ({}, {}))
+        tipos[fila['tipocliente']] = tipos.get(fila['tipocliente'], 0) + fila['n']
+        puntos[fila['punto_compra']] = puntos.get(fila['punto_compra'], 0) + fila['n']
+    for fecha, (tipos, puntos) in distribuciones.items():
+        resumenes[fecha].por_tipocliente = [list(par) for par in _ordenar_distribucion(tipos)]
+        resumenes[fecha].por_punto_compra = [list(par) for par in _ordenar_distribucion(puntos)]
+
+    with transaction.atomic():
+        ResumenDiarioClientes.objects.filter(fecha__range=(fecha_inicio, fecha_fin)) \
+            .exclude(fecha__in=list(resumenes)).delete()
+        if resumenes:
+            ResumenDiarioClientes.objects.bulk_create(
+                list(resumenes.values()),
+                update_conflicts=True,
+                unique_fields=['fecha'],
+                update_fields=CAMPOS_CONTADORES + ['por_tipocliente', 'por_punto_compra', 'actualizado'],
+            )
+    return len(resumenes)
+
+
+def marcar_resumen_clientes(fecha_hora):
+    """Recalcula el día del registro al confirmar la transacción (llamado desde las señales)."""
+    fecha = fecha_local(fecha_hora)
+    transaction.on_commit(lambda: actualizar_resumen_clientes(fecha))
+
+
+def reconstruir_resumen_clientes(fecha_inicio=None, fecha_fin=None):
+    """Reconstruye el resumen diario (por defecto, toda la historia) en ventanas de 31 días."""
+    if fecha_inicio is None or fecha_fin is None:
+        rango = RegistroCliente.objects.order_by('fecha_registro').values_list('fecha_registro', flat=True)
+        primero, ultimo = rango.first(), rango.last()
+        if primero is None:
+            return 0
+        fecha_inicio = fecha_inicio or fecha_local(primero)
+        fecha_fin = fecha_fin or fecha_local(ultimo)
+
+    dias = 0
+    inicio = fecha_inicio
+    while inicio <= fecha_fin:
+        fin = min(inicio + datetime.timedelta(days=30), fecha_fin)
+        dias += actualizar_resumen_clientes(inicio, fin)
+        inicio = fin + datetime.timedelta(days=1)
+    print(f"Resumen diario de clientes reconstruido: {dias} día(s) entre {fecha_inicio} y {fecha_fin}.")
+    return dias
@@ -79,7 +79,86 @@ class RegistroCliente(models.Model):
         db_table = 'RegistroCliente'
         unique_together = ('numero_documento','codcliente')
         ordering = ['-fecha_registro']
+        indexes = [
+            # Rangos por fecha del dashboard y del resumen diario (clientes.metricas)
+            models.Index(fields=['fecha_registro'], name='registrocliente_fecha_idx'),
+        ]
      
+class SincronizacionClienteICG(models.Model):
+    """
+    Bandeja de salida (outbox) de clientes pendientes de crear/actualizar en ICG.
+    La API guarda el cliente y encola aquí; un worker de Celery drena la cola por lotes.
+    Hay una sola fila por número de documento: volver a encolar reutiliza la fila.
+    """
+    OPERACION_CHOICES = [
+        ('CREAR', 'Crear'),
+        ('ACTUALIZAR', 'Actualizar'),
+    ]
+    ESTADO_CHOICES = [
+        ('PENDIENTE', 'Pendiente'),
+        ('PROCESANDO', 'Procesando'),
+        ('COMPLETADO', 'Completado'),
+        ('ERROR', 'Error'),
+    ]
+
+    cliente = models.ForeignKey(RegistroCliente, on_delete=models.CASCADE, related_name='sincronizaciones_icg')
+    numero_documento = models.CharField(max_length=50, unique=True)
+    operacion = models.CharField(max_length=20, choices=OPERACION_CHOICES, default='CREAR')
+    estado = models.CharField(max_length=20, choices=ESTADO_CHOICES, default='PENDIENTE', db_index=True)
+    intentos = models.PositiveSmallIntegerField(default=0)
+    proximo_intento = models.DateTimeField(default=timezone.now, db_index=True)
+    resultado = models.CharField(max_length=255, blank=True, null=True)
+    ultimo_error = models.TextField(blank=True, null=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+    fecha_sincronizacion = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['proximo_intento']
+        verbose_name = 'Sincronización de cliente ICG'
+        verbose_name_plural = 'Sincronizaciones de clientes ICG'
+        indexes = [models.Index(fields=['estado', 'proximo_intento'])]
+
+    def __str__(self):
+        return f"{self.numero_documento} {self.operacion} [{self.estado}]"
+
+
+class ResumenDiarioClientes(models.Model):
+    """
+    Conteos diarios de RegistroCliente (por día local de fecha_registro) para el dashboard de
+    clientes. Se mantiene al guardar/borrar registros (clientes.signals) y se reconstruye con
+    clientes.metricas.reconstruir_resumen_clientes.
+    """
+    fecha = models.DateField(unique=True)
+    total = models.PositiveIntegerField(default=0)
+    creados_icg = models.PositiveIntegerField(default=0)
+    actualizados = models.PositiveIntegerField(default=0)
+    pendientes = models.PositiveIntegerField(default=0)
+    icg_con_firma = models.PositiveIntegerField(default=0)
+    pref_email = models.PositiveIntegerField(default=0)
+    pref_whatsapp = models.PositiveIntegerField(default=0)
+    pref_sms = models.PositiveIntegerField(default=0)
+    pref_redes = models.PositiveIntegerField(default=0)
+    pref_llamada = models.PositiveIntegerField(default=0)
+    pref_ninguna = models.PositiveIntegerField(default=0)
+    formato_fisico = models.PositiveIntegerField(default=0)
+    desde_admin = models.PositiveIntegerField(default=0)
+    sin_codigo = models.PositiveIntegerField(default=0)
+    icg_sin_ip = models.PositiveIntegerField(default=0)
+    no_fidelizados = models.PositiveIntegerField(default=0)
+    por_tipocliente = models.JSONField(default=list, blank=True, help_text="[[tipocliente, conteo], ...]")
+    por_punto_compra = models.JSONField(default=list, blank=True, help_text="[[punto_compra, conteo], ...]")
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['fecha']
+        verbose_name = 'Resumen diario de clientes'
+        verbose_name_plural = 'Resúmenes diarios de clientes'
+
+    def __str__(self):
+        return f"{self.fecha}: {self.total} registros"
+
+
 class ZonaPermitida(models.Model):
     """
     Representa una zona geográfica permitida definida por un punto central
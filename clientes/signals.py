@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from service.zonas import invalidar_zonas
+from .metricas import marcar_resumen_clientes
+from .models import RegistroCliente, ZonaPermitida
+
+
+# ─── Caché en memoria de zonas activas (service.zonas) ───
+
+@receiver([post_save, post_delete], sender=ZonaPermitida)
+def zonas_por_zona_permitida(sender, instance, **kwargs):
+    invalidar_zonas()
+
+
+# ─── Resumen diario del dashboard de clientes (clientes.metricas) ───
+
+@receiver([post_save, post_delete], sender=RegistroCliente)
+def resumen_por_registro_cliente(sender, instance, **kwargs):
+    if instance.fecha_registro:
+        marcar_resumen_clientes(instance.fecha_registro)
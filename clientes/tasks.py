@@ -31,4 +31,28 @@ def generar_enviar_codigo_temporal():
     except Exception as e:
         print(f"Error al generar o enviar el código temporal: {e}")
         raise
-    
\ No newline at end of file
+    
+
+@shared_task
+def drenar_sincronizacion_icg_task():
+    """
+    Drena la cola de sincronización de clientes con ICG. Se dispara al encolar un cliente;
+    programarla también en Celery Beat (p.ej. cada minuto) para atender los reintentos.
+    """
+    from service.sincronizacion import drenar_sincronizacion_icg
+
+    return drenar_sincronizacion_icg()
+
+
+@shared_task
+def reconstruir_resumen_clientes_task(fecha_inicio=None, fecha_fin=None):
+    """
+    Reconstruye ResumenDiarioClientes (fechas 'YYYY-MM-DD'; sin fechas, toda la historia).
+    Útil tras cargas masivas (bulk_create/update no disparan las señales) o al desplegar el resumen.
+    """
+    import datetime
+    from .metricas import reconstruir_resumen_clientes
+
+    fecha_inicio = datetime.date.fromisoformat(fecha_inicio) if fecha_inicio else None
+    fecha_fin = datetime.date.fromisoformat(fecha_fin) if fecha_fin else None
+    return reconstruir_resumen_clientes(fecha_inicio, fecha_fin)
@@ -1,3 +1,340 @@
-from django.test import TestCase
+import threading
+import unittest
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from service import sincronizacion
+
+from . import utils
+from .models import RegistroCliente, SecuenciaCodCliente, SincronizacionClienteICG
+
+
+def _crear_cliente(numero_documento, **campos):
+    return RegistroCliente.objects.create(
+        numero_documento=numero_documento, primer_apellido='Pérez', primer_nombre='Ana',
+        fecha_nacimiento='1990-01-01', **campos
+    )
+
+
+class ConexionFalsa:
+    def close(self):
+        pass
+
+
+class SincronizacionICGTests(TestCase):
+    """Bandeja de salida de clientes hacia ICG (service.sincronizacion) con ICG simulado."""
+
+    def setUp(self):
+        self.icg = {}  # numero_documento -> codcliente
+        self.fallos = 0
+        parches = [
+            mock.patch.object(sincronizacion, 'conectar_sql_server', return_value=ConexionFalsa()),
+            mock.patch.object(sincronizacion, 'getClienteICG', side_effect=self._get_cliente),
+            mock.patch.object(sincronizacion, 'crearClienteICG', side_effect=self._crear_cliente),
+            mock.patch.object(sincronizacion, 'actualizarClienteICG', return_value='Cliente actualizado exitosamente'),
+        ]
+        self.mocks = {}
+        for parche in parches:
+            self.mocks[parche.attribute] = parche.start()
+            self.addCleanup(parche.stop)
+
+    def _get_cliente(self, numero_documento, conexion=None):
+        self.assertIsNotNone(conexion, "La sincronización debe reutilizar la conexión del lote")
+        return [(self.icg[numero_documento],)] if numero_documento in self.icg else []
+
+    def _crear_cliente(self, cliente, conexion=None):
+        if self.fallos:
+            self.fallos -= 1
+            return "error: timeout"
+        self.icg[cliente.numero_documento] = cliente.codcliente = 1000 + len(self.icg)
+        cliente.save(update_fields=['codcliente'])
+        return 'ok'
+
+    def _vencer(self, sync):
+        SincronizacionClienteICG.objects.filter(pk=sync.pk).update(proximo_intento=timezone.now())
+
+    # ─── Reclamo de lotes ───
+
+    def test_reclamar_lote_marca_procesando_y_no_repite(self):
+        syncs = [sincronizacion.encolar_sincronizacion_icg(_crear_cliente(str(i))) for i in range(3)]
+        futuro = sincronizacion.encolar_sincronizacion_icg(_crear_cliente('99'))
+        SincronizacionClienteICG.objects.filter(pk=futuro.pk).update(proximo_intento=timezone.now() + timedelta(hours=1))
+
+        testigo, lote = sincronizacion._reclamar_lote(10)
+
+        self.assertEqual({s.pk for s in lote}, {s.pk for s in syncs})
+        self.assertTrue(all(s.estado == 'PROCESANDO' and s.fecha_actualizacion == testigo for s in lote))
+        # Otro worker no vuelve a reclamar lo que ya está en proceso ni lo que aún no vence
+        self.assertEqual(sincronizacion._reclamar_lote(10)[1], [])
+
+    def test_reclamar_lote_recupera_procesando_abandonado(self):
+        sync = sincronizacion.encolar_sincronizacion_icg(_crear_cliente('1'))
+        sincronizacion._reclamar_lote(10)
+        SincronizacionClienteICG.objects.filter(pk=sync.pk).update(
+            fecha_actualizacion=timezone.now() - sincronizacion.SINCRONIZACION_TIMEOUT_PROCESANDO - timedelta(minutes=1)
+        )
+
+        self.assertEqual([s.pk for s in sincronizacion._reclamar_lote(10)[1]], [sync.pk])
+
+    # ─── Reintentos ───
+
+    def test_fallo_reintenta_con_espera_exponencial(self):
+        self.fallos = 2
+        sync = sincronizacion.encolar_sincronizacion_icg(_crear_cliente('222'))
+
+        esperas = []
+        for _ in range(2):
+            antes = timezone.now()
+            resumen = sincronizacion.drenar_sincronizacion_icg()
+            sync.refresh_from_db()
+            self.assertEqual(resumen['reintentos'], 1)
+            self.assertEqual(sync.estado, 'PENDIENTE')
+            self.assertEqual(sync.ultimo_error, "error: timeout")
+            esperas.append((sync.proximo_intento - antes).total_seconds())
+            # Antes de la espera no se vuelve a intentar
+            self.assertEqual(sincronizacion.drenar_sincronizacion_icg()['procesados'], 0)
+            self._vencer(sync)
+
+        self.assertEqual(sync.intentos, 2)
+        base = sincronizacion.SINCRONIZACION_ESPERA_BASE
+        self.assertAlmostEqual(esperas[0], base, delta=5)
+        self.assertAlmostEqual(esperas[1], base * 2, delta=5)
+
+        self.assertEqual(sincronizacion.drenar_sincronizacion_icg()['completados'], 1)
+        sync.refresh_from_db()
+        self.assertEqual(sync.estado, 'COMPLETADO')
+        self.assertIsNone(sync.ultimo_error)
+        self.assertEqual(self.icg, {'222': 1000})
+
+    def test_fallo_definitivo_tras_max_intentos(self):
+        self.fallos = 99
+        sync = sincronizacion.encolar_sincronizacion_icg(_crear_cliente('444'))
+
+        for _ in range(sincronizacion.SINCRONIZACION_MAX_INTENTOS):
+            self._vencer(sync)
+            sincronizacion.drenar_sincronizacion_icg()
+
+        sync.refresh_from_db()
+        self.assertEqual(sync.estado, 'ERROR')
+        self.assertEqual(sync.intentos, sincronizacion.SINCRONIZACION_MAX_INTENTOS)
+        self._vencer(sync)
+        self.assertEqual(sincronizacion.drenar_sincronizacion_icg()['procesados'], 0)
+
+    def test_sin_conexion_reintenta(self):
+        sync = sincronizacion.encolar_sincronizacion_icg(_crear_cliente('555'))
+        self.mocks['conectar_sql_server'].return_value = None
+
+        self.assertEqual(sincronizacion.drenar_sincronizacion_icg()['reintentos'], 1)
+        sync.refresh_from_db()
+        self.assertEqual((sync.estado, sync.intentos), ('PENDIENTE', 1))
+        self.mocks['crearClienteICG'].assert_not_called()
+
+    # ─── Operación ───
+
+    def test_actualizar_no_degrada_crear_pendiente(self):
+        cliente = _crear_cliente('333')
+        sincronizacion.encolar_sincronizacion_icg(cliente, 'CREAR')
+        sync = sincronizacion.encolar_sincronizacion_icg(cliente, 'ACTUALIZAR')
+
+        self.assertEqual(sync.operacion, 'CREAR')
+        self.assertEqual(SincronizacionClienteICG.objects.get(numero_documento='333').operacion, 'CREAR')
+
+        sincronizacion.drenar_sincronizacion_icg()
+        self.mocks['crearClienteICG'].assert_called_once()
+        self.assertIn('333', self.icg)
+
+        # Ya creado: una edición posterior sí es una actualización
+        sync = sincronizacion.encolar_sincronizacion_icg(cliente, 'ACTUALIZAR')
+        self.assertEqual((sync.operacion, sync.estado), ('ACTUALIZAR', 'PENDIENTE'))
+
+    def test_crear_en_error_no_se_degrada(self):
+        self.fallos = 99
+        cliente = _crear_cliente('666')
+        sync = sincronizacion.encolar_sincronizacion_icg(cliente, 'CREAR')
+        SincronizacionClienteICG.objects.filter(pk=sync.pk).update(estado='ERROR', intentos=6)
+
+        sync = sincronizacion.encolar_sincronizacion_icg(cliente, 'ACTUALIZAR')
+
+        self.assertEqual((sync.operacion, sync.estado, sync.intentos), ('CREAR', 'PENDIENTE', 0))
+
+    def test_reencolar_durante_el_proceso_no_se_pierde(self):
+        cliente = _crear_cliente('777')
+        sincronizacion.encolar_sincronizacion_icg(cliente)
+        testigo, (sync,) = sincronizacion._reclamar_lote(10)
+
+        # Llega una edición mientras el worker envía la versión anterior
+        sincronizacion.encolar_sincronizacion_icg(cliente, 'ACTUALIZAR')
+        self.assertEqual(sincronizacion._cerrar(sync, testigo, estado='COMPLETADO'), 0)
+
+        sync.refresh_from_db()
+        self.assertEqual(sync.estado, 'PENDIENTE')
+
+    def test_crear_idempotente_si_ya_existe_en_icg(self):
+        # Un intento anterior alcanzó a insertar el cliente en ICG antes de fallar
+        self.icg['888'] = 77
+        cliente = _crear_cliente('888')
+        sync = sincronizacion.encolar_sincronizacion_icg(cliente, 'CREAR')
+
+        resumen = sincronizacion.drenar_sincronizacion_icg()
+
+        self.assertEqual(resumen['completados'], 1)
+        self.mocks['crearClienteICG'].assert_not_called()
+        self.mocks['actualizarClienteICG'].assert_called_once()
+        cliente.refresh_from_db()
+        self.assertEqual((cliente.codcliente, cliente.creadoICG), (77, True))
+        sync.refresh_from_db()
+        self.assertEqual((sync.estado, sync.resultado), ('COMPLETADO', 'Cliente actualizado exitosamente'))
+        self.assertEqual(self.icg, {'888': 77})
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', "SKIP LOCKED requiere PostgreSQL")
+class SincronizacionICGConcurrenteTests(TransactionTestCase):
+    """Dos workers drenando a la vez: las filas bloqueadas por uno no las reclama el otro."""
+
+    def test_reclamar_lote_salta_filas_bloqueadas(self):
+        syncs = [sincronizacion.encolar_sincronizacion_icg(_crear_cliente(str(i))) for i in range(4)]
+        bloqueada = syncs[0]
+        bloqueo_tomado, liberar = threading.Event(), threading.Event()
+
+        def otro_worker():
+            try:
+                with transaction.atomic():
+                    SincronizacionClienteICG.objects.select_for_update().get(pk=bloqueada.pk)
+                    bloqueo_tomado.set()
+                    liberar.wait(10)
+            finally:
+                connection.close()
+
+        hilo = threading.Thread(target=otro_worker)
+        hilo.start()
+        try:
+            self.assertTrue(bloqueo_tomado.wait(10))
+            _, lote = sincronizacion._reclamar_lote(10)
+        finally:
+            liberar.set()
+            hilo.join()
+
+        self.assertEqual({s.pk for s in lote}, {s.pk for s in syncs[1:]})
+        bloqueada.refresh_from_db()
+        self.assertEqual(bloqueada.estado, 'PENDIENTE')
+
+
+# ─── Asignación de códigos de cliente ───
+
+def _reiniciar_bloque():
+    utils._bloque.update(pid=None, siguiente=0, fin=-1)
+
+
+def _ultimo_codigo():
+    return SecuenciaCodCliente.objects.get(pk=1).ultimo_codigo
+
+
+@override_settings(CODCLIENTE_TAMANO_BLOQUE=10, CODCLIENTE_USAR_SECUENCIA=False)
+class CodClienteBloqueTests(TransactionTestCase):
+    """
+    Reserva de códigos por bloques en memoria (clientes.utils.generar_nuevo_codcliente).
+    TransactionTestCase: dentro de la transacción de TestCase nunca se usaría el bloque.
+    """
+
+    def setUp(self):
+        _reiniciar_bloque()
+        self.addCleanup(_reiniciar_bloque)
+        SecuenciaCodCliente.objects.create(pk=1, ultimo_codigo=1000, rango_maximo=2000)
+
+    def test_entrega_desde_el_bloque_reservado(self):
+        codigos = [utils.generar_nuevo_codcliente() for _ in range(25)]
+
+        self.assertEqual(codigos, list(range(1001, 1026)))
+        # Tres reservas de 10: la secuencia va por delante de lo entregado
+        self.assertEqual(_ultimo_codigo(), 1030)
+
+    def test_dentro_de_transaccion_reserva_solo_un_codigo(self):
+        utils.generar_nuevo_codcliente()  # bloque 1001-1010 en memoria
+        with transaction.atomic():
+            codigo = utils.generar_nuevo_codcliente()
+
+        # No sale del bloque: si la transacción externa se deshace, el bloque no queda repetido
+        self.assertEqual(codigo, 1011)
+        self.assertEqual(_ultimo_codigo(), 1011)
+        self.assertEqual(utils.generar_nuevo_codcliente(), 1002)
+
+    def test_reserva_deshecha_con_la_transaccion_no_repite_codigos(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            utils.generar_nuevo_codcliente()
+            raise RuntimeError("falla el registro")
+
+        self.assertEqual(_ultimo_codigo(), 1000)
+        codigos = [utils.generar_nuevo_codcliente() for _ in range(12)]
+        self.assertEqual(len(set(codigos)), 12)
+        self.assertTrue(all(c <= _ultimo_codigo() for c in codigos))
+
+    def test_fallo_al_reservar_bloque_no_altera_el_bloque(self):
+        self.assertEqual(utils.generar_nuevo_codcliente(), 1001)
+        utils._bloque['siguiente'] = utils._bloque['fin'] + 1  # bloque agotado
+
+        with mock.patch.object(utils, '_reservar_rango', side_effect=DatabaseError("deadlock")):
+            with self.assertRaises(DatabaseError):
+                utils.generar_nuevo_codcliente()
+
+        # El siguiente intento reserva un bloque nuevo sin reutilizar el anterior
+        self.assertEqual(utils.generar_nuevo_codcliente(), 1011)
+
+    def test_limite_de_codigos(self):
+        SecuenciaCodCliente.objects.filter(pk=1).update(ultimo_codigo=1995)
+
+        # El último bloque se recorta al rango máximo
+        self.assertEqual([utils.generar_nuevo_codcliente() for _ in range(5)], list(range(1996, 2001)))
+        with self.assertRaisesMessage(ValueError, utils.LIMITE_CODIGOS_MSG):
+            utils.generar_nuevo_codcliente()
+
+    def test_generar_codclientes_sin_cupo_no_reserva(self):
+        SecuenciaCodCliente.objects.filter(pk=1).update(ultimo_codigo=1990)
+
+        with self.assertRaisesMessage(ValueError, utils.LIMITE_CODIGOS_MSG):
+            utils.generar_codclientes(11)
+        self.assertEqual(_ultimo_codigo(), 1990)
+        self.assertEqual(utils.generar_codclientes(10), list(range(1991, 2001)))
+
+
+@override_settings(CODCLIENTE_TAMANO_BLOQUE=7, CODCLIENTE_USAR_SECUENCIA=False)
+class CodClienteConcurrenteTests(TransactionTestCase):
+    """Varios hilos pidiendo códigos a la vez: ninguno se repite y todos quedan reservados."""
+
+    HILOS = 4
+    CODIGOS_POR_HILO = 40
+
+    def setUp(self):
+        _reiniciar_bloque()
+        self.addCleanup(_reiniciar_bloque)
+        SecuenciaCodCliente.objects.create(pk=1, ultimo_codigo=1000, rango_maximo=100000)
+
+    def test_hilos_sin_codigos_duplicados(self):
+        codigos, errores = [], []
+        inicio = threading.Barrier(self.HILOS)
+
+        def registrar():
+            try:
+                inicio.wait()
+                for _ in range(self.CODIGOS_POR_HILO):
+                    codigos.append(utils.generar_nuevo_codcliente())
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=registrar) for _ in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        total = self.HILOS * self.CODIGOS_POR_HILO
+        self.assertEqual(len(codigos), total)
+        self.assertEqual(len(set(codigos)), total)
+        self.assertEqual(min(codigos), 1001)
+        self.assertLessEqual(max(codigos), _ultimo_codigo())
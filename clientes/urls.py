@@ -1,10 +1,12 @@
 from django.urls import path
-from .views import RegistroFormularioAPIView, ZonaPermitidaListView, barrioListView, validar_codigo_acceso, dashboard_clientes
+from .views import RegistroFormularioAPIView, SincronizacionClienteICGAPIView, ValidarDocumentosAPIView, ZonaPermitidaListView, barrioListView, validar_codigo_acceso, dashboard_clientes
 from  SoporteTI.views import sugerencias_binnacle
 urlpatterns = [
     path('clientes/', RegistroFormularioAPIView.as_view(), name='registro-formulario'),
     path('clientes/', RegistroFormularioAPIView.as_view(), name='registro-formulario-detalle'),
     path('clientes/<int:numero_documento>/', RegistroFormularioAPIView.as_view(), name='registro-formulario-actualizar'),
+    path('clientes/validar-documentos/', ValidarDocumentosAPIView.as_view(), name='registro-formulario-validar-documentos'),
+    path('clientes/<str:numero_documento>/sincronizacion-icg/', SincronizacionClienteICGAPIView.as_view(), name='registro-formulario-sincronizacion'),
     path('zonas-permitidas/', ZonaPermitidaListView.as_view(), name='zonas-permitidas'),
     path('barrios/', barrioListView.as_view(), name='barrios'),
     path('validar-codigo-acceso/',validar_codigo_acceso,name='CodigoAcceso'),
@@ -1,10 +1,66 @@
-from django.db import transaction
+import os
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
 from .models import SecuenciaCodCliente
 from django.utils import timezone
-from django.db.models import F
 
 
 
+# ─── Asignación de códigos de cliente ───
+# Cada proceso reserva un bloque de códigos (CODCLIENTE_TAMANO_BLOQUE) con una sola actualización
+# de SecuenciaCodCliente y los entrega desde memoria, así los registros concurrentes no compiten
+# por el bloqueo de la fila en cada código. Con CODCLIENTE_USAR_SECUENCIA (PostgreSQL) los
+# códigos salen de una secuencia nativa, que no bloquea filas ni se deshace con la transacción.
+# Los códigos de un bloque sin usar se pierden al reiniciar el proceso (quedan huecos).
+
+SECUENCIA_CODCLIENTE_SQL = 'secuencia_cod_cliente_seq'
+LIMITE_CODIGOS_MSG = "Se ha alcanzado el límite de códigos disponibles."
+
+_bloque = {'pid': None, 'siguiente': 0, 'fin': -1}
+_bloque_lock = threading.Lock()
+
+
+def _secuencia_bloqueada():
+    # IMPORTANTE: Los valores por defecto deben coincidir con el modelo
+    obj, _ = SecuenciaCodCliente.objects.get_or_create(
+        pk=1,
+        defaults={"ultimo_codigo": 51500001, "rango_maximo": 545000000}
+    )
+    return SecuenciaCodCliente.objects.select_for_update().get(pk=obj.pk)
+
+
+def _reservar_rango(cantidad, completo=False):
+    """
+    Reserva hasta `cantidad` códigos consecutivos en SecuenciaCodCliente.
+    :param completo: si es True y no quedan suficientes códigos, no reserva nada
+    :return: (primer código, último código)
+    """
+    with transaction.atomic():
+        obj = _secuencia_bloqueada()
+        inicio = obj.ultimo_codigo + 1
+        fin = min(obj.ultimo_codigo + cantidad, obj.rango_maximo)
+        if inicio > fin or (completo and fin - inicio + 1 < cantidad):
+            raise ValueError(LIMITE_CODIGOS_MSG)
+        SecuenciaCodCliente.objects.filter(pk=obj.pk).update(ultimo_codigo=fin)
+    return inicio, fin
+
+
+def _usar_secuencia_sql():
+    return getattr(settings, 'CODCLIENTE_USAR_SECUENCIA', False) and connection.vendor == 'postgresql'
+
+
+def _codigos_desde_secuencia(cantidad):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT nextval(%s) FROM generate_series(1, %s)", [SECUENCIA_CODCLIENTE_SQL, cantidad])
+        codigos = [fila[0] for fila in cursor.fetchall()]
+    rango_maximo = SecuenciaCodCliente.objects.filter(pk=1).values_list('rango_maximo', flat=True).first()
+    if codigos[-1] > (rango_maximo or 545000000):
+        raise ValueError(LIMITE_CODIGOS_MSG)
+    return codigos
+
+
 def generar_nuevo_codcliente():
     """
     Genera un nuevo código de cliente de forma atómica y thread-safe.
@@ -15,34 +71,59 @@ def generar_nuevo_codcliente():
     Raises:
         ValueError: Si se ha alcanzado el límite de códigos disponibles.
     """
+    if _usar_secuencia_sql():
+        return _codigos_desde_secuencia(1)[0]
+
+    if connection.in_atomic_block:
+        # La reserva se desharía con la transacción externa y el bloque en memoria quedaría
+        # repetido: se reserva solo este código, como antes
+        return _reservar_rango(1)[0]
+
+    with _bloque_lock:
+        # El pid evita que los hijos de un fork (workers de Celery) hereden el mismo bloque
+        if _bloque['pid'] != os.getpid() or _bloque['siguiente'] > _bloque['fin']:
+            inicio, fin = _reservar_rango(settings.CODCLIENTE_TAMANO_BLOQUE)
+            _bloque.update(pid=os.getpid(), siguiente=inicio, fin=fin)
+        codigo = _bloque['siguiente']
+        _bloque['siguiente'] += 1
+        return codigo
+
+
+def generar_codclientes(cantidad):
+    """
+    Genera `cantidad` códigos de una vez para importaciones masivas (consecutivos salvo con la
+    secuencia de PostgreSQL, que puede tener huecos). No toca el bloque en memoria del proceso.
+    
+    Raises:
+        ValueError: Si no quedan códigos suficientes (no se reserva ninguno).
+    """
+    if cantidad <= 0:
+        return []
+    if _usar_secuencia_sql():
+        return _codigos_desde_secuencia(cantidad)
+    inicio, fin = _reservar_rango(cantidad, completo=True)
+    return list(range(inicio, fin + 1))
+
+
+def sincronizar_secuencia_codcliente():
+    """
+    Crea (si no existe) la secuencia de PostgreSQL y deja secuencia y SecuenciaCodCliente en el
+    mayor de los dos valores. Ejecutar al activar o desactivar CODCLIENTE_USAR_SECUENCIA.
+    :return: último código asignado
+    """
+    if connection.vendor != 'postgresql':
+        raise ValueError("La secuencia de códigos solo está disponible en PostgreSQL.")
+
     with transaction.atomic():
-        # Crea el registro si no existe (y luego lo bloquea)
-        # IMPORTANTE: Los valores por defecto deben coincidir con el modelo
-        obj, created = SecuenciaCodCliente.objects.get_or_create(
-            pk=1,
-            defaults={"ultimo_codigo": 51500001, "rango_maximo": 545000000}
-        )
-
-        # Asegura el bloqueo de fila (si el engine lo soporta)
-        obj = (
-            SecuenciaCodCliente.objects
-            .select_for_update()
-            .get(pk=obj.pk)
-        )
-
-        # Incremento atómico con validación de rango (un solo statement)
-        updated = (
-            SecuenciaCodCliente.objects
-            .filter(pk=obj.pk, ultimo_codigo__lt=F("rango_maximo"))
-            .update(ultimo_codigo=F("ultimo_codigo") + 1)
-        )
-        if updated == 0:
-            # No se actualizó: ya estabas en el máximo
-            raise ValueError("Se ha alcanzado el límite de códigos disponibles.")
-
-        # Leer el valor ya incrementado (sin carreras)
-        obj.refresh_from_db(fields=["ultimo_codigo"])
-        return obj.ultimo_codigo
+        obj = _secuencia_bloqueada()
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {SECUENCIA_CODCLIENTE_SQL} MINVALUE 1")
+            cursor.execute(f"SELECT last_value, is_called FROM {SECUENCIA_CODCLIENTE_SQL}")
+            last_value, is_called = cursor.fetchone()
+            ultimo = max(obj.ultimo_codigo, last_value if is_called else 0)
+            cursor.execute("SELECT setval(%s, %s, true)", [SECUENCIA_CODCLIENTE_SQL, ultimo])
+        SecuenciaCodCliente.objects.filter(pk=obj.pk).update(ultimo_codigo=ultimo)
+    return ultimo
 
 
 def calcular_edad(fecha_nacimiento):
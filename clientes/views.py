@@ -3,10 +3,12 @@ from rest_framework.response import Response
 from rest_framework import status
 from .api.serializers import RegistroClienteSerializer, ZonaPermitidaSerializer, barrioSerializer, ClienteGetSerializer
 from django.shortcuts import get_object_or_404
-from .models import RegistroCliente , ZonaPermitida, barrio
+from .models import RegistroCliente , ZonaPermitida, barrio, SincronizacionClienteICG
 from automatizaciones.models import CorreoEnviado
 from rest_framework import generics, permissions
-from service.clientICG import ConsultarClienteICG, crearClienteICG, actualizarClienteICG
+from rest_framework.throttling import ScopedRateThrottle
+from service.clientICG import ConsultarClienteICG, buscar_clientes_icg
+from service.sincronizacion import encolar_sincronizacion_icg, estado_sincronizacion_icg
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
@@ -17,8 +19,7 @@ from .correo import enviar_correo, enviar_correo_html
 from django.http import HttpResponse
 from django.utils import timezone
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Q
-from django.db.models.functions import TruncDate
+from .metricas import metricas_clientes
 from django.shortcuts import render
 import datetime
 
@@ -50,18 +51,14 @@ class RegistroFormularioAPIView(APIView):
                 if cliente.creado_desde_fisico == True:
                     mensaje = 'Cliente registrado exitosamente de forma local'
                     print("Cliente Creado localmente de forma exitosa")
-                else:
-                    try:
-                        resultado = crearClienteICG(cliente)
-                        if resultado == 'ok':
-                            mensaje = 'Cliente registrado exitosamente en ICG'
-                        else:
-                            mensaje = f'Cliente creado localmente, pero hubo un error en ICG: {resultado}'
-                    except Exception as e:
-                        print(f"Error al crear cliente en ICG: {e}")
-                        mensaje = f'Cliente creado localmente, pero falló la sincronización con ICG: {str(e)}'
-                
-                return Response({'mensaje': mensaje}, status=status.HTTP_201_CREATED)
+                    return Response({'mensaje': mensaje}, status=status.HTTP_201_CREATED)
+
+                # La creación en ICG la hace el worker; el estado se consulta en .../sincronizacion-icg/
+                sync = encolar_sincronizacion_icg(cliente, 'CREAR')
+                return Response({
+                    'mensaje': 'Cliente registrado; sincronización con ICG en cola',
+                    'sincronizacion_icg': estado_sincronizacion_icg(sync),
+                }, status=status.HTTP_201_CREATED)
             else:
                 return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     def get_object(self):
@@ -74,10 +71,12 @@ class RegistroFormularioAPIView(APIView):
             serializer = RegistroClienteSerializer(cliente, data=request.data, partial=True)
             print(f"Datos recibidos para actualizar: {request.data}")
             if serializer.is_valid():
-                serializer.save()
                 instancia = serializer.save()
-                actualizarClienteICG(instancia)
-                return Response({'mensaje': 'Cliente actualizado correctamente'}, status=status.HTTP_200_OK)
+                sync = encolar_sincronizacion_icg(instancia, 'ACTUALIZAR')
+                return Response({
+                    'mensaje': 'Cliente actualizado correctamente',
+                    'sincronizacion_icg': estado_sincronizacion_icg(sync),
+                }, status=status.HTTP_200_OK)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
         except RegistroCliente.DoesNotExist:
             return Response({'error': 'Cliente no encontrado'}, status=status.HTTP_404_NOT_FOUND)
@@ -98,6 +97,59 @@ class RegistroFormularioAPIView(APIView):
             return Response({'existe': False}, status=status.HTTP_200_OK)
 
 
+class ValidarDocumentosAPIView(APIView):
+    """
+    Valida varios documentos a la vez: primero en RegistroCliente y, los que no están en local,
+    en ICG (consulta por lote con caché, ver service.clientICG.buscar_clientes_icg).
+    Espera {"documentos": ["123", "456", ...]}.
+    Devuelve el codcliente de cada documento: solo para usuarios autenticados y con límite de
+    peticiones (scope "validar_documentos" en REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']).
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    throttle_classes = [ScopedRateThrottle]
+    throttle_scope = 'validar_documentos'
+    MAX_DOCUMENTOS = 50
+
+    def post(self, request):
+        documentos = request.data.get('documentos')
+        if not isinstance(documentos, list) or not documentos:
+            return Response({'error': 'Debe enviar "documentos" como una lista'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(documentos) > self.MAX_DOCUMENTOS:
+            return Response({'error': f'Máximo {self.MAX_DOCUMENTOS} documentos por consulta'}, status=status.HTTP_400_BAD_REQUEST)
+
+        documentos = list(dict.fromkeys(str(d).strip() for d in documentos if d is not None and str(d).strip()))
+        locales = dict(
+            RegistroCliente.objects.filter(numero_documento__in=documentos).values_list('numero_documento', 'codcliente')
+        )
+        en_icg = buscar_clientes_icg([d for d in documentos if d not in locales])
+
+        resultados = {}
+        for documento in documentos:
+            if documento in locales:
+                resultados[documento] = {'existe': True, 'origen': 'local', 'codcliente': locales[documento]}
+                continue
+            filas = en_icg.get(documento)
+            if filas is None:
+                resultados[documento] = {'existe': None, 'origen': None, 'error': 'No se pudo consultar ICG'}
+            elif filas:
+                resultados[documento] = {'existe': True, 'origen': 'icg', 'codcliente': filas[0][0]}
+            else:
+                resultados[documento] = {'existe': False, 'origen': None}
+        return Response({'resultados': resultados}, status=status.HTTP_200_OK)
+
+
+class SincronizacionClienteICGAPIView(APIView):
+    """
+    Estado de la sincronización con ICG de un cliente (para consultar tras el registro).
+    """
+    permission_classes = [permissions.AllowAny]
+    def get(self, request, numero_documento):
+        sync = SincronizacionClienteICG.objects.filter(numero_documento=numero_documento).first()
+        if not sync:
+            return Response({'error': 'No hay sincronización registrada para este documento'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(estado_sincronizacion_icg(sync), status=status.HTTP_200_OK)
+
+
 class ZonaPermitidaListView(generics.ListAPIView):
     """
     Vista de API para listar todas las Zonas Permitidas *activas*.
@@ -192,79 +244,52 @@ def dashboard_clientes(request):
     start_date_input = start_date.strftime('%Y-%m-%d')
     end_date_input   = end_date.strftime('%Y-%m-%d')
 
-    # 2. QUERYSERVICE BASE FILTRADO POR EL RANGO SOBRE 'fecha_registro'
-    base_qs = RegistroCliente.objects.filter(
-        fecha_registro__date__gte=start_date,
-        fecha_registro__date__lte=end_date
-    )
+    # 2. MÉTRICAS DEL RANGO (clientes.metricas): un solo aggregate condicional; los rangos
+    #    largos se leen del resumen diario en lugar de recorrer RegistroCliente
+    metricas = metricas_clientes(start_date, end_date)
 
     # 3. MÉTRICAS GENERALES SOBRE EL RANGO
-    total_clients     = base_qs.count()
-    created_icg       = base_qs.filter(creadoICG=True).count()
-    updated_clients   = base_qs.filter(Actualizado=True).count()
-    pending_clients   = base_qs.filter(
-        creadoICG=False,
-        Actualizado=False
-    ).count()
+    total_clients     = metricas['total']
+    created_icg       = metricas['creados_icg']
+    updated_clients   = metricas['actualizados']
+    pending_clients   = metricas['pendientes']
 
     # 4. MÉTRICA “ICG + FIRMA” (creadoICG=True y firma_base64 no vacía)
-    icg_con_firma = base_qs.filter(
-        creadoICG=True
-    ).exclude(
-        Q(firma_base64='') | Q(firma_base64__isnull=True)
-    ).count()
+    icg_con_firma = metricas['icg_con_firma']
 
     # 5. SERIE TEMPORAL DIARIA (creadosICG, actualizados, ICG+FIRMA) DENTRO DEL RANGO
-    qs_diaria = (
-        base_qs
-        .annotate(fecha=TruncDate('fecha_registro'))
-        .values('fecha')
-        .annotate(
-            creados_icg  = Count('id', filter=Q(creadoICG=True)),
-            actualizados = Count('id', filter=Q(Actualizado=True)),
-            icg_firma    = Count('id', filter=Q(creadoICG=True) & ~Q(firma_base64='') & Q(firma_base64__isnull=False)),
-            total        = Count('id'),
-        )
-        .order_by('fecha')
-    )
-    fechas_list       = [entry['fecha'].strftime('%Y-%m-%d') for entry in qs_diaria]
-    creados_icg_list  = [entry['creados_icg'] for entry in qs_diaria]
-    actualizados_list = [entry['actualizados'] for entry in qs_diaria]
-    icg_firma_list    = [entry['icg_firma'] for entry in qs_diaria]
+    serie = metricas['serie']
+    fechas_list       = [entry['fecha'].strftime('%Y-%m-%d') for entry in serie]
+    creados_icg_list  = [entry['creados_icg'] for entry in serie]
+    actualizados_list = [entry['actualizados'] for entry in serie]
+    icg_firma_list    = [entry['icg_con_firma'] for entry in serie]
 
     # 6. DISTRIBUCIÓN POR TIPOCLIENTE (bar chart) DENTRO DEL RANGO
-    qs_tipo = (
-        base_qs
-        .values('tipocliente')
-        .annotate(count=Count('id'))
-        .order_by('tipocliente')
-    )
-    tipos       = [entry['tipocliente'] or 'Sin tipo' for entry in qs_tipo]
-    tipo_counts = [entry['count'] for entry in qs_tipo]
+    tipos       = [tipo or 'Sin tipo' for tipo, _ in metricas['por_tipocliente']]
+    tipo_counts = [count for _, count in metricas['por_tipocliente']]
 
     # 7. CONTEO DE PREFERENCIAS DE CONTACTO (pie chart) DENTRO DEL RANGO
-    pref_email     = base_qs.filter(preferencias_email=True).count()
-    pref_whatsapp  = base_qs.filter(preferencias_whatsapp=True).count()
-    pref_sms       = base_qs.filter(preferencias_sms=True).count()
-    pref_redes     = base_qs.filter(preferencias_redes_sociales=True).count()
-    pref_llamada   = base_qs.filter(preferencias_llamada=True).count()
-    pref_ninguna   = base_qs.filter(preferencias_ninguna=True).count()
+    pref_email     = metricas['pref_email']
+    pref_whatsapp  = metricas['pref_whatsapp']
+    pref_sms       = metricas['pref_sms']
+    pref_redes     = metricas['pref_redes']
+    pref_llamada   = metricas['pref_llamada']
+    pref_ninguna   = metricas['pref_ninguna']
 
     # 8. NUEVAS MÉTRICAS SOLICITADAS DENTRO DEL RANGO
-    clientes_formato_fisico = base_qs.filter(creado_desde_fisico=True).count()
-    clientes_desde_admin    = base_qs.filter(creado_desde_admin=True).count()
-    clientes_sin_cod        = base_qs.filter(codcliente__isnull=True).count()
-    clientes_icg_sin_ip     = base_qs.filter(
-        codcliente__isnull=False,
-        ip_usuario__isnull=True
-    ).count()
-    client_no_fidelizados   = base_qs.filter(
-        fidelizacion=False,
-        tipocliente='Cliente',
-        creadoICG=True
-    ).count()
-
-    # Listados para tablas de detalle
+    clientes_formato_fisico = metricas['formato_fisico']
+    clientes_desde_admin    = metricas['desde_admin']
+    clientes_sin_cod        = metricas['sin_codigo']
+    clientes_icg_sin_ip     = metricas['icg_sin_ip']
+    client_no_fidelizados   = metricas['no_fidelizados']
+
+    # Listados para tablas de detalle (siempre sobre los registros del rango)
+    base_qs = RegistroCliente.objects.filter(
+        fecha_registro__gte=timezone.make_aware(datetime.datetime.combine(start_date, datetime.time.min)),
+        fecha_registro__lt=timezone.make_aware(
+            datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)
+        ),
+    )
     clientes_sin_cod_list = base_qs.filter(codcliente__isnull=True).values(
         'id', 'primer_nombre', 'primer_apellido', 'numero_documento'
     )
@@ -273,14 +298,8 @@ def dashboard_clientes(request):
     ).values('id', 'primer_nombre', 'primer_apellido', 'codcliente', 'numero_documento')
 
     # 9. DISTRIBUCIÓN POR PUNTO DE COMPRA (bar chart) DENTRO DEL RANGO
-    qs_punto = (
-        base_qs
-        .values('punto_compra')
-        .annotate(count=Count('id'))
-        .order_by('punto_compra')
-    )
-    puntos_labels = [entry['punto_compra'] or 'Sin punto' for entry in qs_punto]
-    puntos_counts = [entry['count'] for entry in qs_punto]
+    puntos_labels = [punto or 'Sin punto' for punto, _ in metricas['por_punto_compra']]
+    puntos_counts = [count for _, count in metricas['por_punto_compra']]
 
     # 10. CONSTRUCCIÓN DEL CONTEXTO
     context = {
@@ -1,23 +1,19 @@
 from django.contrib import admin
 from django.contrib import messages
-from .utils import calcular_presupuesto_diario_forecast
+from .forecast import calcular_presupuestos_diarios_forecast
 
 
 def calcular_presupuesto_diario_action(modeladmin, request, queryset):
     """
     Acción personalizada para calcular el presupuesto diario forecast.
+    Todos los seleccionados se calculan en un solo lote (modelos en caché y ajuste en paralelo).
     """
-    exitos = 0
-    errores = 0
-    for presupuesto in queryset:
-        try:
-            print(presupuesto)
-            resultado = calcular_presupuesto_diario_forecast(presupuesto)
-            exitos += 1
-            messages.success(request, f'Presupuesto diario calculado para {presupuesto}: {resultado}')
-        except Exception as e:
-            errores += 1
-            messages.error(request, f'Error para {presupuesto}: {e}')
-    messages.success(request, f'¡{exitos} presupuestos diarios calculados correctamente! {errores} errores.')
+    resultado = calcular_presupuestos_diarios_forecast(queryset)
+    por_pk = {p.pk: p for p in queryset}
+    for pk, mensaje in resultado['detalle'].items():
+        messages.success(request, f'Presupuesto diario calculado para {por_pk[pk]}: {mensaje}')
+    for pk, error in resultado['detalle_errores'].items():
+        messages.error(request, f'Error para {por_pk[pk]}: {error}')
+    messages.success(request, f'¡{resultado["exitosos"]} presupuestos diarios calculados correctamente! {resultado["errores"]} errores.')
 
 calcular_presupuesto_diario_action.short_description = "Calcular Presupuesto Diario Forecast"
@@ -16,7 +16,8 @@ from .models import VentaDiariaReal, ventapollos, Sede, CategoriaVenta, Porcenta
 from .resources import SedeResource, CategoriaVentaResource, PorcentajeDiarioConfigResource, PresupuestoMensualCategoriaResource, PresupuestoDiarioCategoriaResource, VentapollosResource, VentaDiariaRealResource
 from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth import get_user_model
-from .models import PerfilUsuario
+from .models import PerfilUsuario, CargaHistoricaVentas
+from automatizaciones.service.exportaciones import accion_exportar_en_segundo_plano
 
 @admin.register(Eventos)
 class EventosAdmin(admin.ModelAdmin):
@@ -33,7 +34,8 @@ class SedeAdmin(ImportExportModelAdmin):
 @admin.register(CategoriaVenta)
 class CategoriaVentaAdmin(ImportExportModelAdmin):
     resource_class = CategoriaVentaResource
-    list_display = ('nombre',)
+    list_display = ('nombre', 'metodo_forecast')
+    list_editable = ('metodo_forecast',)
     search_fields = ('nombre',)
     filter_horizontal = ('usuarios_permitidos',)  # Permite seleccionar usuarios en el admin
 
@@ -66,7 +68,10 @@ class PresupuestoMensualCategoriaAdmin(ImportExportModelAdmin):
     search_fields = ('sede__nombre', 'categoria__nombre')
     ordering = ('sede__nombre', 'anio', 'mes', 'categoria__nombre')
     list_per_page = 31
-    actions = [calcular_presupuesto_diario_action]
+    actions = [
+        calcular_presupuesto_diario_action,
+        accion_exportar_en_segundo_plano("presupuesto_mensual", "Exportar en segundo plano"),
+    ]
 
     @admin.display(description='valor ($)', ordering='presupuesto_total_categoria')
     def presupuesto_total_categoria_format(self, obj):
@@ -102,6 +107,7 @@ class PresupuestoMensualCategoriaAdmin(ImportExportModelAdmin):
 @admin.register(PresupuestoDiarioCategoria)
 class PresupuestoDiarioCategoriaAdmin(ImportExportModelAdmin):
     resource_class = PresupuestoDiarioCategoriaResource
+    actions = [accion_exportar_en_segundo_plano("presupuesto_diario", "Exportar en segundo plano")]
     list_display = (
         'fecha', 'get_sede', 'get_categoria', 'dia_semana_nombre',
         'porcentaje_dia_especifico', 'presupuesto_calculado_format'
@@ -159,6 +165,7 @@ class VentapollosAdmin(ImportExportModelAdmin):
 @admin.register(VentaDiariaReal)
 class VentaDiariaRealAdmin(ImportExportModelAdmin):
     resource_class = VentaDiariaRealResource
+    actions = [accion_exportar_en_segundo_plano("venta_diaria_real", "Exportar en segundo plano")]
     list_display = ('fecha', 'get_sede_nombre', 'get_categoria_nombre', 'venta_real_formatted', 'Eventos',)
     list_filter = ('fecha', 'sede__nombre', 'categoria__nombre')
     search_fields = ('sede__nombre', 'categoria__nombre', 'fecha')
@@ -179,6 +186,12 @@ class VentaDiariaRealAdmin(ImportExportModelAdmin):
     def venta_real_formatted(self, obj):
         return f"${obj.venta_real:,.2f}"
 
+@admin.register(CargaHistoricaVentas)
+class CargaHistoricaVentasAdmin(admin.ModelAdmin):
+    list_display = ('fecha_inicio', 'fecha_fin', 'estado', 'actualizado')
+    list_filter = ('estado',)
+    readonly_fields = ('ventanas_completadas', 'errores', 'resultado', 'creado', 'actualizado')
+
 class PerfilUsuarioInline(admin.StackedInline):
     model = PerfilUsuario
     can_delete = False
@@ -0,0 +1,281 @@
+# presupuesto/forecast.py
+"""
+Forecast de presupuesto diario en lote.
+
+En lugar de un ajuste de Prophet por presupuesto mensual, en serie y con un
+update_or_create por día:
+  1. Se carga el histórico de ventas de todos los presupuestos en una sola consulta.
+  2. Se reutilizan los modelos ya ajustados para la misma ventana (ModeloForecast).
+  3. Los que faltan se ajustan con el método de la categoría (CategoriaVenta.metodo_forecast);
+     los de Prophet en un pool de hilos (ver forecasters.ejecutar_pronostico).
+  4. Los días se guardan con un único upsert en bloque.
+"""
+import hashlib
+import os
+import time
+from calendar import monthrange
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal, localcontext
+
+import numpy as np
+from django.db import transaction
+
+from .forecasters import ejecutar_pronostico
+from .models import ModeloForecast, PresupuestoDiarioCategoria, VentaDiariaReal
+from .utils import invalidar_consulta_presupuesto_mensual, marcar_resumen_presupuesto, resumen_diferido
+
+# Hilos para ajustar modelos en paralelo
+MAX_WORKERS_FORECAST = min(4, os.cpu_count() or 1)
+
+# Mínimo de días con venta para ajustar un modelo
+MIN_DIAS_HISTORIA = 30
+
+# Cambiar la versión de un método si cambia su configuración: invalida su caché
+VERSION_MODELO = {
+    'prophet': "prophet-semanal-evento-v1",
+    'estacional': "estacional-semanal-evento-v1",
+}
+
+DIAS_SEMANA_ES = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+
+
+def ventana_entrenamiento(presupuesto_mensual):
+    """Histórico usado para el mes: desde el 1 de enero hasta el cierre del mes anterior."""
+    anio, mes = presupuesto_mensual.anio, presupuesto_mensual.mes
+    if mes == 1:
+        raise ValueError("No hay histórico suficiente para calcular enero.")
+    return date(anio, 1, 1), date(anio, mes - 1, monthrange(anio, mes - 1)[1])
+
+
+def hash_ventana(fecha_inicio, fecha_fin, historia, metodo='prophet'):
+    """Huella de la ventana de entrenamiento: rango, datos y versión del modelo."""
+    h = hashlib.sha256(f"{VERSION_MODELO[metodo]}|{fecha_inicio}|{fecha_fin}".encode())
+    for fecha, venta, evento in historia:
+        h.update(f"|{fecha},{venta},{evento}".encode())
+    return h.hexdigest()
+
+
+def _cargar_historia(presupuestos, ventanas):
+    """Una sola consulta para todas las series: {(sede_id, categoria_id): [(fecha, venta, evento)]}."""
+    if not ventanas:
+        return {}
+    series = {}
+    ventas = VentaDiariaReal.objects.filter(
+        sede_id__in={pm.sede_id for pm in presupuestos},
+        categoria_id__in={pm.categoria_id for pm in presupuestos},
+        fecha__gte=min(v[0] for v in ventanas.values()),
+        fecha__lte=max(v[1] for v in ventanas.values()),
+    ).order_by('fecha').values_list('sede_id', 'categoria_id', 'fecha', 'venta_real', 'Eventos_id')
+    for sede_id, categoria_id, fecha, venta, evento_id in ventas:
+        series.setdefault((sede_id, categoria_id), []).append((fecha, venta, int(evento_id is not None)))
+    return series
+
+
+def _ejecutar_tareas(tareas, max_workers):
+    """Ajusta las tareas de Prophet en un pool de hilos; las del método estacional, en serie."""
+    # El método estacional ajusta en milisegundos: no compensa enviarlo al pool
+    rapidas, lentas = [], []
+    for tarea in tareas:
+        (rapidas if tarea.get('metodo') == 'estacional' or tarea.get('modelo_json') else lentas).append(tarea)
+    return [ejecutar_pronostico(t) for t in rapidas] + _ejecutar_en_pool(lentas, max_workers)
+
+
+def _ejecutar_en_pool(tareas, max_workers):
+    # Hilos y no procesos: los workers prefork de Celery son daemon y no pueden crear hijos.
+    # Prophet ajusta en el ejecutable de Stan (cmdstanpy lo lanza como subproceso), así que
+    # los ajustes corren en paralelo aunque los hilos compartan el GIL.
+    if max_workers > 1 and len(tareas) > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(tareas))) as executor:
+            return list(executor.map(ejecutar_pronostico, tareas))
+    return [ejecutar_pronostico(t) for t in tareas]
+
+
+def calcular_presupuestos_diarios_forecast(presupuestos_mensuales, max_workers=MAX_WORKERS_FORECAST):
+    """
+    Calcula el presupuesto diario por forecast para varios PresupuestoMensualCategoria a la vez.
+    :return: dict con total, exitosos, desde_cache, errores y el detalle por presupuesto {pk: mensaje}
+    """
+    presupuestos = list(presupuestos_mensuales.select_related('sede', 'categoria')
+                        if hasattr(presupuestos_mensuales, 'select_related') else presupuestos_mensuales)
+    detalle, errores = {}, {}
+
+    ventanas = {}
+    for pm in presupuestos:
+        try:
+            ventanas[pm.pk] = ventana_entrenamiento(pm)
+        except ValueError as e:
+            errores[pm.pk] = str(e)
+
+    series = _cargar_historia(presupuestos, ventanas)
+
+    # ─── Preparar tareas (reutilizando modelos en caché) ───
+    tareas, hashes = [], {}
+    for pm in presupuestos:
+        if pm.pk in errores:
+            continue
+        inicio, fin = ventanas[pm.pk]
+        historia = [
+            (fecha.isoformat(), float(venta), evento)
+            for fecha, venta, evento in series.get((pm.sede_id, pm.categoria_id), [])
+            if inicio <= fecha <= fin
+        ]
+        if len(historia) < MIN_DIAS_HISTORIA:
+            errores[pm.pk] = "No hay suficiente historial para hacer forecast diario."
+            continue
+        metodo = pm.categoria.metodo_forecast
+        hashes[pm.pk] = hash_ventana(inicio, fin, historia, metodo)
+        dias_mes = monthrange(pm.anio, pm.mes)[1]
+        tareas.append({
+            'clave': pm.pk,
+            'metodo': metodo,
+            'historia': historia,
+            'fechas': [date(pm.anio, pm.mes, d).isoformat() for d in range(1, dias_mes + 1)],
+        })
+
+    en_cache = {
+        (sede_id, categoria_id, h): modelo
+        for sede_id, categoria_id, h, modelo in ModeloForecast.objects.filter(
+            hash_ventana__in=set(hashes.values())
+        ).values_list('sede_id', 'categoria_id', 'hash_ventana', 'modelo')
+    }
+    por_pk = {pm.pk: pm for pm in presupuestos}
+    desde_cache = 0
+    for tarea in tareas:
+        pm = por_pk[tarea['clave']]
+        modelo_json = en_cache.get((pm.sede_id, pm.categoria_id, hashes[pm.pk]))
+        if modelo_json:
+            tarea['modelo_json'] = modelo_json
+            tarea['historia'] = []
+            desde_cache += 1
+
+    print(f"Forecast diario: {len(tareas)} presupuesto(s), {desde_cache} con modelo en caché, "
+          f"{len(tareas) - desde_cache} por ajustar.")
+    resultados = _ejecutar_tareas(tareas, max_workers)
+
+    # ─── Guardar días y modelos nuevos ───
+    nuevos_dias, nuevos_modelos = [], []
+    # Contexto Decimal propio: Compras.utils fija getcontext().prec = 6 para todo el proceso
+    with localcontext() as ctx:
+        ctx.prec = 28
+        for resultado in resultados:
+            pm = por_pk[resultado['clave']]
+            if 'error' in resultado:
+                errores[pm.pk] = resultado['error']
+                continue
+            total_mes = sum(resultado['yhat'])
+            if total_mes == 0:
+                errores[pm.pk] = "La predicción del mes objetivo es cero. Revisa los datos históricos."
+                continue
+
+            for dia, yhat in enumerate(resultado['yhat'], start=1):
+                fecha_dia = date(pm.anio, pm.mes, dia)
+                pct = Decimal(yhat / total_mes * 100).quantize(Decimal('0.01'))
+                nuevos_dias.append(PresupuestoDiarioCategoria(
+                    presupuesto_mensual=pm,
+                    fecha=fecha_dia,
+                    dia_semana_nombre=DIAS_SEMANA_ES[fecha_dia.weekday()],
+                    porcentaje_dia_especifico=pct,
+                    # Mismo cálculo que PresupuestoDiarioCategoria.save()
+                    presupuesto_calculado=(pm.presupuesto_total_categoria * pct / Decimal('100.00')).quantize(Decimal('0.01')),
+                ))
+            if resultado.get('modelo_json'):
+                inicio, fin = ventanas[pm.pk]
+                nuevos_modelos.append(ModeloForecast(
+                    sede_id=pm.sede_id, categoria_id=pm.categoria_id, hash_ventana=hashes[pm.pk],
+                    metodo=pm.categoria.metodo_forecast, fecha_inicio=inicio, fecha_fin=fin, modelo=resultado['modelo_json'],
+                ))
+            detalle[pm.pk] = f"Presupuesto diario calculado para {pm.sede} / {pm.categoria} en {pm.anio}-{pm.mes}"
+
+    with transaction.atomic(), resumen_diferido():
+        PresupuestoDiarioCategoria.objects.bulk_create(
+            nuevos_dias,
+            batch_size=1000,
+            update_conflicts=True,
+            unique_fields=['presupuesto_mensual', 'fecha'],
+            update_fields=['dia_semana_nombre', 'porcentaje_dia_especifico', 'presupuesto_calculado'],
+        )
+        for pm_pk in detalle:
+            pm = por_pk[pm_pk]
+            marcar_resumen_presupuesto(pm.sede_id, pm.categoria_id, date(pm.anio, pm.mes, 1),
+                                       date(pm.anio, pm.mes, monthrange(pm.anio, pm.mes)[1]))
+        invalidar_consulta_presupuesto_mensual([por_pk[pm_pk] for pm_pk in detalle])
+
+        # Solo se conserva el último modelo por sede/categoría
+        for modelo in nuevos_modelos:
+            ModeloForecast.objects.filter(sede_id=modelo.sede_id, categoria_id=modelo.categoria_id) \
+                .exclude(hash_ventana=modelo.hash_ventana).delete()
+        ModeloForecast.objects.bulk_create(nuevos_modelos, ignore_conflicts=True)
+
+    for pk, error in errores.items():
+        print(f"[✖] Forecast de {por_pk[pk]}: {error}")
+
+    return {
+        'total': len(presupuestos),
+        'exitosos': len(detalle),
+        'desde_cache': desde_cache,
+        'errores': len(errores),
+        'detalle': detalle,
+        'detalle_errores': errores,
+    }
+
+
+# ─── Backtest de métodos ───
+
+def backtest_forecast(sede, categoria, meses, metodos=('estacional', 'prophet')):
+    """
+    Compara los métodos sobre meses ya vendidos: entrena con la misma ventana que el cálculo
+    real (enero → mes anterior), predice el mes y mide el error de la distribución diaria
+    (WAPE de la participación de cada día sobre el total del mes) y el tiempo de ajuste.
+    :param meses: lista de (anio, mes)
+    :return: {'meses': [dict por mes y método], 'resumen': {metodo: {'wape_pct', 'segundos', 'meses'}}}
+    """
+    meses = sorted(m for m in meses if m[1] > 1)
+    if not meses:
+        return {'meses': [], 'resumen': {}}
+
+    historia_total = list(VentaDiariaReal.objects.filter(
+        sede=sede, categoria=categoria,
+        fecha__gte=date(meses[0][0], 1, 1),
+        fecha__lte=date(meses[-1][0], meses[-1][1], monthrange(*meses[-1])[1]),
+    ).order_by('fecha').values_list('fecha', 'venta_real', 'Eventos_id'))
+
+    detalle = []
+    for anio, mes in meses:
+        inicio, fin = date(anio, 1, 1), date(anio, mes - 1, monthrange(anio, mes - 1)[1])
+        historia = [(f.isoformat(), float(v), int(e is not None)) for f, v, e in historia_total if inicio <= f <= fin]
+        real = {f: float(v) for f, v, _ in historia_total if f.year == anio and f.month == mes}
+        fechas = [date(anio, mes, d) for d in range(1, monthrange(anio, mes)[1] + 1)]
+        total_real = sum(real.values())
+        if len(historia) < MIN_DIAS_HISTORIA or len(real) < len(fechas) or total_real == 0:
+            print(f"Backtest {sede}/{categoria} {mes}/{anio}: datos incompletos, se omite.")
+            continue
+
+        participacion_real = np.array([real[f] for f in fechas]) / total_real
+        for metodo in metodos:
+            t0 = time.perf_counter()
+            resultado = ejecutar_pronostico({
+                'clave': (anio, mes), 'metodo': metodo, 'historia': historia,
+                'fechas': [f.isoformat() for f in fechas],
+            })
+            segundos = time.perf_counter() - t0
+            if 'error' in resultado or sum(resultado['yhat']) == 0:
+                detalle.append({'anio': anio, 'mes': mes, 'metodo': metodo, 'wape_pct': None,
+                                'segundos': round(segundos, 4), 'error': resultado.get('error', 'predicción cero')})
+                continue
+            participacion = np.array(resultado['yhat']) / sum(resultado['yhat'])
+            wape = float(np.abs(participacion - participacion_real).sum() * 100)
+            detalle.append({'anio': anio, 'mes': mes, 'metodo': metodo,
+                            'wape_pct': round(wape, 2), 'segundos': round(segundos, 4)})
+
+    resumen = {}
+    for metodo in metodos:
+        filas = [d for d in detalle if d['metodo'] == metodo and d['wape_pct'] is not None]
+        if filas:
+            resumen[metodo] = {
+                'wape_pct': round(sum(d['wape_pct'] for d in filas) / len(filas), 2),
+                'segundos': round(sum(d['segundos'] for d in filas), 3),
+                'meses': len(filas),
+            }
+    print(f"Backtest {sede}/{categoria}: {resumen}")
+    return {'meses': detalle, 'resumen': resumen}
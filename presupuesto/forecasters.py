@@ -0,0 +1,118 @@
+# presupuesto/forecasters.py
+"""
+Modelos de pronóstico diario sin dependencias de Django.
+
+Las funciones de este módulo reciben y devuelven datos simples (listas, str) y no
+tocan la base de datos, para poder ejecutarse en paralelo en un pool de hilos.
+
+Prophet solo se importa dentro de sus funciones: elegir el método 'estacional'
+(NumPy) evita cargarlo por completo.
+"""
+import json
+from datetime import date
+
+import numpy as np
+
+
+def ajustar_prophet(historia):
+    """
+    Ajusta Prophet con estacionalidad semanal y el regresor binario 'evento'.
+    :param historia: lista de (fecha 'YYYY-MM-DD', venta, evento 0/1)
+    """
+    import pandas as pd
+    from prophet import Prophet
+
+    df = pd.DataFrame(historia, columns=['ds', 'y', 'evento'])
+    df['ds'] = pd.to_datetime(df['ds'])
+
+    modelo = Prophet(yearly_seasonality=False, daily_seasonality=False, weekly_seasonality=True)
+    modelo.add_regressor('evento')
+    modelo.fit(df)
+    return modelo
+
+
+def predecir_prophet(modelo, fechas):
+    """Predice las fechas dadas asumiendo que no hay eventos conocidos en el futuro. Devuelve yhat >= 0."""
+    import pandas as pd
+
+    futuro = pd.DataFrame({'ds': pd.to_datetime(fechas)})
+    futuro['evento'] = 0
+    return modelo.predict(futuro)['yhat'].clip(lower=0).tolist()
+
+
+def prophet_a_json(modelo):
+    from prophet.serialize import model_to_json
+    return model_to_json(modelo)
+
+
+def prophet_desde_json(modelo_json):
+    from prophet.serialize import model_from_json
+    return model_from_json(modelo_json)
+
+
+# ─── Estacional semanal + eventos (NumPy) ───
+
+def _matriz_estacional(ordinales, eventos, origen):
+    """Columnas: 7 indicadores de día de la semana, tendencia lineal (días desde origen) y evento."""
+    ordinales = np.asarray(ordinales, dtype=np.int64)
+    # El ordinal 1 (01/01/0001) fue lunes: (ordinal - 1) % 7 da 0 = lunes ... 6 = domingo
+    dia_semana = (ordinales - 1) % 7
+    X = np.zeros((len(ordinales), 9))
+    X[np.arange(len(ordinales)), dia_semana] = 1.0
+    X[:, 7] = (ordinales - origen) / 365.0
+    X[:, 8] = eventos
+    return X
+
+
+def ajustar_estacional(historia):
+    """
+    Mínimos cuadrados sobre la historia: nivel por día de la semana, tendencia y efecto evento.
+    :param historia: lista de (fecha 'YYYY-MM-DD', venta, evento 0/1)
+    :return: dict serializable {'coef': [...], 'origen': ordinal}
+    """
+    ordinales = np.array([date.fromisoformat(f).toordinal() for f, _, _ in historia])
+    y = np.array([float(v) for _, v, _ in historia])
+    eventos = np.array([float(e) for _, _, e in historia])
+    origen = int(ordinales.min())
+
+    X = _matriz_estacional(ordinales, eventos, origen)
+    coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+    return {'coef': coef.tolist(), 'origen': origen}
+
+
+def predecir_estacional(modelo, fechas):
+    """Predice las fechas dadas sin eventos futuros. Devuelve yhat >= 0."""
+    ordinales = np.array([date.fromisoformat(str(f)[:10]).toordinal() for f in fechas])
+    X = _matriz_estacional(ordinales, np.zeros(len(ordinales)), modelo['origen'])
+    return np.clip(X @ np.array(modelo['coef']), 0, None).tolist()
+
+
+# nombre -> (ajustar, predecir, a_json, desde_json)
+METODOS = {
+    'prophet': (ajustar_prophet, predecir_prophet, prophet_a_json, prophet_desde_json),
+    'estacional': (ajustar_estacional, predecir_estacional, json.dumps, json.loads),
+}
+
+
+def ejecutar_pronostico(tarea):
+    """
+    Punto de entrada del pool de hilos.
+    :param tarea: dict con 'clave', 'metodo', 'historia', 'fechas' y opcionalmente 'modelo_json' (modelo en caché)
+    :return: dict con 'clave', 'yhat', 'modelo_json' (solo si se ajustó uno nuevo) o 'error'
+    """
+    try:
+        ajustar, predecir, a_json, desde_json = METODOS[tarea.get('metodo', 'prophet')]
+        if tarea.get('modelo_json'):
+            modelo = desde_json(tarea['modelo_json'])
+            modelo_json = None
+        else:
+            modelo = ajustar(tarea['historia'])
+            modelo_json = a_json(modelo)
+        return {
+            'clave': tarea['clave'],
+            'yhat': predecir(modelo, tarea['fechas']),
+            'modelo_json': modelo_json,
+        }
+    except Exception as e:
+        # Un ajuste fallido no debe cortar el resto del lote
+        return {'clave': tarea['clave'], 'error': str(e)}
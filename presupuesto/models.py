@@ -10,7 +10,15 @@ class Sede(models.Model):
     def __str__(self): return self.nombre
 
 class CategoriaVenta(models.Model):
+    METODO_FORECAST_CHOICES = (
+        ('prophet', 'Prophet'),
+        ('estacional', 'Estacional semanal (NumPy)'),
+    )
     nombre = models.CharField(max_length=100, unique=True) # Fruver, Carnes, Panadería, "Total Sede"
+    metodo_forecast = models.CharField(
+        max_length=20, choices=METODO_FORECAST_CHOICES, default='prophet',
+        help_text="Modelo usado para distribuir el presupuesto diario por forecast."
+    )
     def __str__(self): return self.nombre
 
 class Eventos(models.Model):
@@ -174,6 +182,110 @@ class PerfilUsuario(models.Model):
     def __str__(self):
         return f"Perfil de {self.user.username}"
 
+class CargaHistoricaVentas(models.Model):
+    """
+    Checkpoint de la carga histórica de ventas desde ICG por ventanas mensuales.
+    Permite reanudar un backfill interrumpido sin repetir los meses ya cargados.
+    """
+    ESTADOS = (
+        ('EN_PROCESO', 'En proceso'),
+        ('COMPLETADA', 'Completada'),
+        ('CON_ERRORES', 'Con errores'),
+    )
+    fecha_inicio = models.DateField()
+    fecha_fin = models.DateField()
+    ventanas_completadas = models.JSONField(default=list, blank=True, help_text="Inicio (YYYY-MM-DD) de cada ventana cargada.")
+    errores = models.JSONField(default=dict, blank=True, help_text="Ventana -> mensaje de error.")
+    resultado = models.JSONField(default=dict, blank=True, help_text="Conteos acumulados por cargador.")
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='EN_PROCESO')
+    creado = models.DateTimeField(auto_now_add=True)
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('fecha_inicio', 'fecha_fin')
+        verbose_name = "Carga Histórica de Ventas"
+        verbose_name_plural = "Cargas Históricas de Ventas"
+
+    def __str__(self):
+        return f"{self.fecha_inicio} → {self.fecha_fin} ({self.estado})"
+
+class ResumenDiarioPresupuesto(models.Model):
+    """
+    Tabla de hechos precalculada: presupuesto vs venta por sede, categoría y día.
+    Se mantiene incrementalmente desde los cargadores de ventas y el recálculo de
+    presupuestos (ver utils.actualizar_resumen_presupuesto); los dashboards leen de aquí.
+    """
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE, related_name='resumen_diario')
+    categoria = models.ForeignKey(CategoriaVenta, on_delete=models.CASCADE, related_name='resumen_diario')
+    fecha = models.DateField()
+    anio = models.IntegerField()
+    mes = models.IntegerField()
+    presupuesto = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    venta_real = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    venta_anio_anterior = models.DecimalField(
+        max_digits=15, decimal_places=2, default=Decimal('0.00'),
+        help_text="Venta real del mismo día del año anterior."
+    )
+    margen_sin_post_pct = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.0'))
+    margen_con_post_pct = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.0'))
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('sede', 'categoria', 'fecha')
+        indexes = [
+            models.Index(fields=['fecha', 'sede']),
+            models.Index(fields=['sede', 'categoria', 'anio', 'mes']),
+        ]
+        ordering = ['fecha', 'sede', 'categoria']
+        verbose_name = "Resumen Diario Presupuesto vs Venta"
+        verbose_name_plural = "Resumen Diario Presupuesto vs Venta"
+
+    def __str__(self):
+        return f"{self.fecha} - {self.sede_id}/{self.categoria_id} - Ppto: {self.presupuesto} - Venta: {self.venta_real}"
+
+class ResumenMensualPresupuesto(models.Model):
+    """Acumulado mensual de ResumenDiarioPresupuesto (gráfica anual del reporte de cumplimiento)."""
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE, related_name='resumen_mensual')
+    categoria = models.ForeignKey(CategoriaVenta, on_delete=models.CASCADE, related_name='resumen_mensual')
+    anio = models.IntegerField()
+    mes = models.IntegerField()
+    presupuesto = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    venta_real = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    venta_anio_anterior = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
+    actualizado = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('sede', 'categoria', 'anio', 'mes')
+        ordering = ['anio', 'mes', 'sede', 'categoria']
+        verbose_name = "Resumen Mensual Presupuesto vs Venta"
+        verbose_name_plural = "Resumen Mensual Presupuesto vs Venta"
+
+    def __str__(self):
+        return f"{self.mes}/{self.anio} - {self.sede_id}/{self.categoria_id} - Ppto: {self.presupuesto} - Venta: {self.venta_real}"
+
+class ModeloForecast(models.Model):
+    """
+    Caché de modelos de forecast ya ajustados por sede/categoría y ventana de entrenamiento.
+    hash_ventana resume el rango y los datos usados: si las ventas no cambian, el
+    siguiente cálculo del mes reutiliza el modelo en lugar de volver a ajustarlo.
+    """
+    sede = models.ForeignKey(Sede, on_delete=models.CASCADE, related_name='modelos_forecast')
+    categoria = models.ForeignKey(CategoriaVenta, on_delete=models.CASCADE, related_name='modelos_forecast')
+    hash_ventana = models.CharField(max_length=64)
+    metodo = models.CharField(max_length=20, default='prophet')
+    fecha_inicio = models.DateField()
+    fecha_fin = models.DateField()
+    modelo = models.TextField(help_text="Modelo serializado (JSON) según el método.")
+    creado = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('sede', 'categoria', 'hash_ventana')
+        verbose_name = "Modelo de Forecast en Caché"
+        verbose_name_plural = "Modelos de Forecast en Caché"
+
+    def __str__(self):
+        return f"{self.sede_id}/{self.categoria_id} {self.fecha_inicio} → {self.fecha_fin} ({self.hash_ventana[:8]})"
+
 # Señal para crear perfil automáticamente
 from django.db.models.signals import post_save
 from django.dispatch import receiver
@@ -4,7 +4,7 @@ from import_export import resources, fields, widgets
 from import_export.formats.base_formats import XLS, XLSX
 import logging
 logger = logging.getLogger(__name__)
-from .utils import recalcular_presupuestos_diarios_para_periodo
+from .utils import recalcular_presupuestos_diarios_para_periodo, resumen_diferido
 from django.db import transaction
 from .models import (
     Sede, CategoriaVenta, PorcentajeDiarioConfig,
@@ -12,6 +12,22 @@ from .models import (
     ventapollos, VentaDiariaReal
 )
 
+class ResumenDiferidoMixin:
+    """
+    Las importaciones guardan fila a fila y las señales recalcularían el resumen presupuesto vs
+    venta en cada una: se acumulan y se recalcula una vez al terminar la importación.
+    """
+
+    def import_data(self, dataset, dry_run=False, **kwargs):
+        with resumen_diferido() as pendientes:
+            resultado = super().import_data(dataset, dry_run=dry_run, **kwargs)
+            if dry_run and pendientes is not None:
+                # La vista previa no guarda nada: no hay nada que recalcular
+                for marcas in pendientes.values():
+                    marcas.clear()
+        return resultado
+
+
 class SedeResource(resources.ModelResource):
     class Meta:
         model = Sede
@@ -50,7 +66,7 @@ class PorcentajeDiarioConfigResource(resources.ModelResource):
         report_skipped = True
         formats = [XLS, XLSX]
 
-class PresupuestoMensualCategoriaResource(resources.ModelResource):
+class PresupuestoMensualCategoriaResource(ResumenDiferidoMixin, resources.ModelResource):
     sede = fields.Field(column_name='sede', attribute='sede',
                         widget=widgets.ForeignKeyWidget(Sede, field='nombre'))
     categoria = fields.Field(column_name='categoria', attribute='categoria',
@@ -87,7 +103,7 @@ class PresupuestoMensualCategoriaResource(resources.ModelResource):
         report_skipped = True
         formats = [XLS, XLSX]
         
-class PresupuestoDiarioCategoriaResource(resources.ModelResource):
+class PresupuestoDiarioCategoriaResource(ResumenDiferidoMixin, resources.ModelResource):
     # Campo calculado para mostrar el nombre de la sede
     sede_nombre = fields.Field(
         column_name='sede',
@@ -123,7 +139,7 @@ class VentapollosResource(resources.ModelResource):
         report_skipped = True
         formats = [XLS, XLSX]
 
-class VentaDiariaRealResource(resources.ModelResource):
+class VentaDiariaRealResource(ResumenDiferidoMixin, resources.ModelResource):
     sede = fields.Field(
         column_name='sede',
         attribute='sede',
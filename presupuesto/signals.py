@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import PresupuestoDiarioCategoria, PresupuestoMensualCategoria, VentaDiariaReal
+from .utils import (
+    invalidar_consulta_presupuesto, invalidar_consulta_presupuesto_mensual,
+    marcar_resumen_presupuesto, marcar_resumen_presupuesto_mensual,
+)
+
+
+# ─── Mantenimiento incremental del resumen presupuesto vs venta ───
+# Cubre los guardados fila a fila (admin, importaciones, ventapollos). Las cargas en
+# bloque (bulk_create) marcan sus claves explícitamente desde utils.
+
+@receiver([post_save, post_delete], sender=VentaDiariaReal)
+def resumen_por_venta_diaria(sender, instance, **kwargs):
+    marcar_resumen_presupuesto(instance.sede_id, instance.categoria_id, instance.fecha)
+
+
+@receiver([post_save, post_delete], sender=PresupuestoDiarioCategoria)
+def resumen_por_presupuesto_diario(sender, instance, **kwargs):
+    marcar_resumen_presupuesto_mensual(instance.presupuesto_mensual_id, instance.fecha)
+
+
+# ─── Caché de la consulta de presupuesto por sede/año/mes ───
+
+@receiver([post_save, post_delete], sender=PresupuestoMensualCategoria)
+def consulta_por_presupuesto_mensual(sender, instance, **kwargs):
+    invalidar_consulta_presupuesto(instance.sede_id, instance.anio, instance.mes)
+
+
+@receiver([post_save, post_delete], sender=PresupuestoDiarioCategoria)
+def consulta_por_presupuesto_diario(sender, instance, **kwargs):
+    if PresupuestoDiarioCategoria.presupuesto_mensual.is_cached(instance):
+        invalidar_consulta_presupuesto_mensual([instance.presupuesto_mensual])
+    else:
+        invalidar_consulta_presupuesto_mensual([instance.presupuesto_mensual_id])
@@ -1,8 +1,8 @@
-from presupuesto.models import CategoriaVenta, PresupuestoMensualCategoria
-from .utils import calcular_presupuesto_diario_forecast, cargar_ventas_reales_carne, cargasr_ventas_reales_ecenarios, cargar_ventas_reales_marca_mercasur
+from presupuesto.models import CategoriaVenta, PresupuestoMensualCategoria, Sede
+from .forecast import backtest_forecast, calcular_presupuestos_diarios_forecast
+from .utils import cargar_ventas_reales_carne, cargasr_ventas_reales_ecenarios, cargar_ventas_historicas_rango, reconstruir_resumen_presupuesto, recalcular_presupuestos_diarios_anio
 from datetime import date, timedelta
 from celery import shared_task
-import calendar
 from django.utils.timezone import now
 
 @shared_task
@@ -18,31 +18,61 @@ def cargar_ventas_hoy_ecenarios():
     cargasr_ventas_reales_ecenarios(hoy, hoy)
     
 @shared_task
-def cargar_ventas_historicas():
+def cargar_ventas_historicas(fecha_inicio=None, fecha_fin=None, concurrencia=2, reanudar=None):
     """
-    Tarea Celery: ejecuta cargar_ventas_reales dia a dia,
-    recorriendo meses y días mediante el módulo calendar
-    desde enero de 2024 hasta la fecha actual.
+    Tarea Celery: carga las ventas reales de ICG entre fecha_inicio y fecha_fin
+    ('YYYY-MM-DD') por ventanas mensuales. Sin fechas carga el mes actual hasta hoy.
+    Con fechas es reanudable: relanzarla con el mismo rango continúa desde el último mes
+    cargado. Sin fechas (refresco programado del día) recarga siempre el mes actual.
     """
-    mes = date.today().month
-    año = date.today().year
-    inicio = date(año, mes, 1)
-    fin = date.today()
-
-    # Iterar años, meses y días con calendar
-    for año in range(inicio.year, fin.year + 1):
-        mes_inicio = inicio.month if año == inicio.year else 1
-        mes_fin = fin.month if año == fin.year else 12
-        for mes in range(mes_inicio, mes_fin + 1):
-            _, dias_en_mes = calendar.monthrange(año, mes)
-            dia_inicio = inicio.day if (año == inicio.year and mes == inicio.month) else 1
-            dia_fin = fin.day if (año == fin.year and mes == fin.month) else dias_en_mes
-            for dia in range(dia_inicio, dia_fin + 1):
-                fecha_actual = date(año, mes, dia)
-                cargar_ventas_reales_carne(fecha_actual, fecha_actual)
-                cargasr_ventas_reales_ecenarios(fecha_actual, fecha_actual)
-                cargar_ventas_reales_marca_mercasur(fecha_actual, fecha_actual)
-    print(f"Ventas cargadas desde {inicio} hasta {fin}.")
+    hoy = date.today()
+    inicio = date.fromisoformat(fecha_inicio) if fecha_inicio else date(hoy.year, hoy.month, 1)
+    fin = date.fromisoformat(fecha_fin) if fecha_fin else hoy
+    if reanudar is None:
+        reanudar = bool(fecha_inicio or fecha_fin)
+
+    resultado = cargar_ventas_historicas_rango(inicio, fin, concurrencia=concurrencia, reanudar=reanudar)
+    print(f"Ventas cargadas desde {inicio} hasta {fin}: {resultado['estado']}.")
+    return resultado
+
+
+@shared_task
+def reconstruir_resumen_presupuesto_task(fecha_inicio=None, fecha_fin=None):
+    """
+    Tarea Celery: reconstruye la tabla de hechos presupuesto vs venta ('YYYY-MM-DD').
+    Sin fechas la reconstruye completa (carga inicial o reparación).
+    """
+    inicio = date.fromisoformat(fecha_inicio) if fecha_inicio else None
+    fin = date.fromisoformat(fecha_fin) if fecha_fin else None
+    resultado = reconstruir_resumen_presupuesto(inicio, fin)
+    print(f"Resumen presupuesto reconstruido: {resultado}")
+    return resultado
+
+
+@shared_task
+def recalcular_presupuestos_diarios_anio_task(anio=None, sede_ids=None):
+    """
+    Tarea Celery: recalcula en lote los presupuestos diarios por porcentajes de todas
+    las sedes (o `sede_ids`) para `anio` (por defecto el año actual).
+    """
+    return recalcular_presupuestos_diarios_anio(anio or now().year, sede_ids=sede_ids)
+
+
+@shared_task
+def backtest_forecast_task(sede_id, categoria_id, anio=None, metodos=None):
+    """
+    Tarea Celery: compara la precisión y el tiempo de los métodos de forecast
+    sobre los meses cerrados de `anio` (por defecto el año actual).
+    """
+    hoy = now().date()
+    anio = anio or hoy.year
+    ultimo_mes = 12 if anio < hoy.year else hoy.month - 1
+    return backtest_forecast(
+        Sede.objects.get(pk=sede_id),
+        CategoriaVenta.objects.get(pk=categoria_id),
+        [(anio, m) for m in range(2, ultimo_mes + 1)],
+        metodos=tuple(metodos or ('estacional', 'prophet')),
+    )
 
 
 @shared_task
@@ -50,8 +80,6 @@ def calcular_presupuesto_diario_mes_actual():
     """
     Task para calcular el presupuesto diario de todos los registros del mes actual.
     """
-    exitos = 0
-    errores = 0
     hoy = now().date()
     anio_actual = hoy.year
     mes_actual = hoy.month
@@ -60,19 +88,12 @@ def calcular_presupuesto_diario_mes_actual():
 
     presupuestos = PresupuestoMensualCategoria.objects.filter(anio=anio_actual, mes=mes_actual, categoria= categoria )
 
-    for presupuesto in presupuestos:
-        try:
-            resultado = calcular_presupuesto_diario_forecast(presupuesto)
-            print(f"[✔] {presupuesto}: {resultado}")
-            exitos += 1
-        except Exception as e:
-            print(f"[✖] Error en {presupuesto}: {e}")
-            errores += 1
-
+    resultado = calcular_presupuestos_diarios_forecast(presupuestos)
     return {
-        "total": presupuestos.count(),
-        "exitosos": exitos,
-        "errores": errores
+        "total": resultado["total"],
+        "exitosos": resultado["exitosos"],
+        "errores": resultado["errores"],
+        "desde_cache": resultado["desde_cache"],
     }
 
 @shared_task
@@ -80,9 +101,6 @@ def calcular_presupuesto_diario_marca_mercasur():
     """
     Task para calcular el presupuesto diario de la categoría MARCA mercasur del mes actual.
     """
-    exitos = 0
-    errores = 0
-    
     hoy = now().date()
     anio = hoy.year
     mes = hoy.month
@@ -103,19 +121,12 @@ def calcular_presupuesto_diario_marca_mercasur():
         categoria=categoria
     )
 
-    for presupuesto in presupuestos:
-        try:
-            resultado = calcular_presupuesto_diario_forecast(presupuesto)
-            print(f"[✔] {presupuesto}: {resultado}")
-            exitos += 1
-        except Exception as e:
-            print(f"[✖] Error en {presupuesto}: {e}")
-            errores += 1
-
+    resultado = calcular_presupuestos_diarios_forecast(presupuestos)
     return {
-        "total": presupuestos.count(),
-        "exitosos": exitos,
-        "errores": errores,
+        "total": resultado["total"],
+        "exitosos": resultado["exitosos"],
+        "errores": resultado["errores"],
+        "desde_cache": resultado["desde_cache"],
         "anio": anio,
         "mes": mes
     }
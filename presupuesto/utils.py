@@ -1,18 +1,138 @@
 # tu_app/utils.py
 import calendar
 from datetime import date, timedelta
-from decimal import Decimal, ROUND_HALF_UP, InvalidOperation
+from decimal import Decimal, ROUND_HALF_UP, InvalidOperation, localcontext
 
 from appMercaSur.conect import conectar_sql_server
 from .models import CategoriaVenta, PorcentajeDiarioConfig, PresupuestoDiarioCategoria, PresupuestoMensualCategoria, Sede # Importar modelos necesarios
-import pandas as pd
-from prophet import Prophet
-from .models import VentaDiariaReal
+from .models import VentaDiariaReal, CargaHistoricaVentas, ResumenDiarioPresupuesto, ResumenMensualPresupuesto
 from calendar import monthrange
-from django.db import transaction
+from contextlib import contextmanager
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Max, Min, Q, Sum
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 
+import numpy as np
 
-def calcular_presupuesto_con_porcentajes_dinamicos(sede_id, anio, mes, presupuestos_input_por_categoria):
+
+# ─── Motor de distribución mensual → diaria ───
+
+NOMBRES_DIAS = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo')
+CATEGORIA_TOTAL_SEDE = "Total Sede"
+
+
+def cargar_porcentajes_diarios(sede_ids, categorias=None):
+    """
+    Todas las configuraciones de porcentaje de las sedes en una sola consulta.
+    :return: {sede_id: {nombre_categoria: {dia_semana: porcentaje}}}
+    """
+    configs = PorcentajeDiarioConfig.objects.filter(sede_id__in=sede_ids)
+    if categorias is not None:
+        configs = configs.filter(categoria__nombre__in=categorias)
+    porcentajes = {}
+    for sede_id, nombre_cat, dia_semana, porcentaje in configs.values_list(
+        'sede_id', 'categoria__nombre', 'dia_semana', 'porcentaje'
+    ):
+        porcentajes.setdefault(sede_id, {}).setdefault(nombre_cat, {})[dia_semana] = porcentaje
+    return porcentajes
+
+
+def distribuir_presupuesto_mensual(anio, mes, presupuestos_por_categoria, porcentajes_por_categoria):
+    # Contexto Decimal propio: Compras.utils fija getcontext().prec = 6 para todo el proceso
+    with localcontext() as ctx:
+        ctx.prec = 28
+        return _distribuir_presupuesto_mensual(anio, mes, presupuestos_por_categoria, porcentajes_por_categoria)
+
+
+def _distribuir_presupuesto_mensual(anio, mes, presupuestos_por_categoria, porcentajes_por_categoria):
+    """
+    Reparte cada presupuesto mensual entre los días del mes según el porcentaje de su día
+    de la semana dividido entre las veces que ese día ocurre en el mes (Método A).
+
+    La matriz días × categorías se calcula en centavos enteros con NumPy. El redondeo se
+    concilia de forma exacta con el método del mayor residuo: cada día queda a menos de un
+    centavo de su valor exacto y la suma del mes es exactamente el presupuesto. Si los
+    porcentajes de una categoría no suman 100 se reparten de forma proporcional.
+
+    :param presupuestos_por_categoria: {'NombreCategoria': Decimal}
+    :param porcentajes_por_categoria: {'NombreCategoria': {0: PctLunes, ..., 6: PctDomingo}}
+    :return: (resultados_por_dia, totales_finales_categoria, gran_total_componentes) como
+             calcular_presupuesto_con_porcentajes_dinamicos; (None, None, None) si no hay categorías válidas.
+    """
+    num_dias = calendar.monthrange(anio, mes)[1]
+    fechas = [date(anio, mes, d) for d in range(1, num_dias + 1)]
+    dia_semana = np.array([f.weekday() for f in fechas])
+    ocurrencias = np.bincount(dia_semana, minlength=7)
+
+    categorias = []
+    for nombre_cat, presupuesto in presupuestos_por_categoria.items():
+        porcentajes_cat = porcentajes_por_categoria.get(nombre_cat) or {}
+        if len(porcentajes_cat) != 7:
+            print(f"Error Crítico: '{nombre_cat}' no tiene 7 porcentajes diarios configurados.")
+            continue
+        suma_pct = sum(porcentajes_cat.values())
+        if suma_pct <= 0:
+            print(f"Error Crítico: los porcentajes de '{nombre_cat}' suman {suma_pct}.")
+            continue
+        if suma_pct != Decimal('100.00'):
+            print(f"Advertencia: Los porcentajes para '{nombre_cat}' no suman 100.00 (Suma: {suma_pct}). Se reparten de forma proporcional.")
+        categorias.append(nombre_cat)
+
+    if not categorias:
+        print("Error: No hay categorías válidas con porcentajes configurados para procesar.")
+        return None, None, None
+
+    # Centavos y puntos básicos (porcentaje × 100) como enteros: sin pérdidas de Decimal/float
+    presupuesto_cent = np.array([int(presupuestos_por_categoria[c] * 100) for c in categorias], dtype=object)
+    pct_bp = np.array([[int(porcentajes_por_categoria[c].get(d, 0) * 100) for d in range(7)] for c in categorias], dtype=object)
+
+    # valor_exacto[c, d] = P[c] · pct[c, dow(d)] / (Σpct[c] · ocurrencias[dow(d)])
+    numerador = presupuesto_cent[:, None] * pct_bp[:, dia_semana]
+    denominador = pct_bp.sum(axis=1)[:, None] * ocurrencias[dia_semana].astype(object)[None, :]
+    base = numerador // denominador
+    residuo = (numerador % denominador).astype(float) / denominador.astype(float)
+
+    # Centavos que faltan por categoría -> a los días con mayor residuo (empate: el primer día)
+    faltantes = presupuesto_cent - base.sum(axis=1)
+    orden = np.argsort(-residuo, axis=1, kind='stable')
+    rango = np.arange(num_dias)[None, :]
+    extra = np.zeros_like(residuo, dtype=int)
+    np.put_along_axis(extra, orden, (rango < faltantes.astype(int)[:, None]).astype(int), axis=1)
+    valores_cent = base + extra
+
+    centavo = Decimal('0.01')
+    es_componente = [c != CATEGORIA_TOTAL_SEDE for c in categorias]
+    resultados_por_dia = []
+    for j, fecha in enumerate(fechas):
+        budgets = {}
+        total_dia = 0
+        for i, nombre_cat in enumerate(categorias):
+            valor = int(valores_cent[i, j])
+            budgets[nombre_cat] = {
+                'valor': Decimal(valor) * centavo,
+                'porcentaje_usado': porcentajes_por_categoria[nombre_cat].get(int(dia_semana[j]), Decimal('0')),
+            }
+            if es_componente[i]:
+                total_dia += valor
+        resultados_por_dia.append({
+            'fecha': fecha,
+            'dia_semana_nombre': NOMBRES_DIAS[dia_semana[j]],
+            'budgets_by_category': budgets,
+            'total_dia_componentes': Decimal(total_dia) * centavo,
+        })
+
+    totales_finales_por_categoria = {
+        nombre_cat: Decimal(int(valores_cent[i].sum())) * centavo for i, nombre_cat in enumerate(categorias)
+    }
+    gran_total_componentes = sum(
+        (totales_finales_por_categoria[c] for c, comp in zip(categorias, es_componente) if comp), Decimal('0.00')
+    )
+    return resultados_por_dia, totales_finales_por_categoria, gran_total_componentes
+
+
+def calcular_presupuesto_con_porcentajes_dinamicos(sede_id, anio, mes, presupuestos_input_por_categoria, porcentajes=None):
     """
     Calcula presupuestos diarios usando el Método A:
     ValorDiario = (PresupuestoMensual * PctDia / 100) / NumOcurrenciasDia.
@@ -22,6 +142,8 @@ def calcular_presupuesto_con_porcentajes_dinamicos(sede_id, anio, mes, presupues
         mes (int): El mes (1-12).
         presupuestos_input_por_categoria (dict):
             {'NombreCategoria1': Decimal('PresupuestoMensual1'), ...}
+        porcentajes (dict, opcional): {'NombreCategoria': {dia: pct}} ya cargados
+            (cálculos en lote); por defecto se leen de la sede en una sola consulta.
 
     Returns:
         tuple: (resultados_por_dia, totales_finales_categoria, gran_total_componentes)
@@ -31,175 +153,24 @@ def calcular_presupuesto_con_porcentajes_dinamicos(sede_id, anio, mes, presupues
                Retorna (None, None, None) si hay error fundamental.
     """
     print(f"Iniciando cálculo (Método A) para Sede ID: {sede_id}, Periodo: {mes}/{anio}")
-    if not (1 <= mes <= 12):
-        print("Error: Mes inválido.")
-        return None, None, None
-
     try:
-        primer_dia_mes = date(anio, mes, 1)
-        num_dias_en_mes = calendar.monthrange(anio, mes)[1]
-    except ValueError:
+        calendar.monthrange(anio, mes)
+    except (ValueError, calendar.IllegalMonthError):
         print(f"Error: Año ({anio}) o mes ({mes}) inválido.")
         return None, None, None
 
-    # 1. Obtener configuraciones de porcentaje y validar (igual que antes)
-    mapa_porcentajes_categoria = {} # {'NombreCategoria': {0: PctLu, 1: PctMa, ...}}
-    categorias_validas = []
     for nombre_cat, presupuesto_val in presupuestos_input_por_categoria.items():
         try:
             presupuesto_decimal = Decimal(presupuesto_val) if presupuesto_val is not None else Decimal('0.00')
-            if presupuesto_decimal < 0: presupuesto_decimal = Decimal('0.00')
-            presupuestos_input_por_categoria[nombre_cat] = presupuesto_decimal # Asegurar Decimal
-
-            categoria_obj = CategoriaVenta.objects.get(nombre=nombre_cat)
-            configs = PorcentajeDiarioConfig.objects.filter(categoria=categoria_obj, sede =sede_id)
-            if configs.count() != 7:
-                print(f"Error Crítico: '{nombre_cat}' no tiene 7 porcentajes diarios configurados.")
-                continue # Saltar categoría
-
-            mapa_porcentajes_categoria[nombre_cat] = {c.dia_semana: c.porcentaje for c in configs}
-            suma_pct = sum(mapa_porcentajes_categoria[nombre_cat].values())
-            if suma_pct != Decimal('100.00'):
-                print(f"Advertencia: Los porcentajes para '{nombre_cat}' no suman 100.00 (Suma: {suma_pct}). Los resultados podrían no ser los esperados conceptualmente.")
-
-            categorias_validas.append(nombre_cat)
-
-        except CategoriaVenta.DoesNotExist:
-            print(f"Error: Categoría '{nombre_cat}' no encontrada.")
         except (InvalidOperation, TypeError):
             print(f"Error: Valor de presupuesto inválido para '{nombre_cat}'. Se usará 0.")
-            presupuestos_input_por_categoria[nombre_cat] = Decimal('0.00')
-
-    if not categorias_validas:
-         print("Error: No hay categorías válidas con porcentajes configurados para procesar.")
-         return None, None, None
-
-    # 2. Calcular número de ocurrencias de cada día de la semana en el mes (igual que antes)
-    dias_semana_ocurrencias = {i: 0 for i in range(7)}
-    fechas_del_mes_info = []
-    nombres_dias_map = {0: 'Lunes', 1: 'Martes', 2: 'Miércoles', 3: 'Jueves', 4: 'Viernes', 5: 'Sábado', 6: 'Domingo'}
-    for i in range(num_dias_en_mes):
-        fecha_actual = primer_dia_mes + timedelta(days=i)
-        dia_idx = fecha_actual.weekday()
-        dias_semana_ocurrencias[dia_idx] += 1
-        fechas_del_mes_info.append({
-            'fecha': fecha_actual,
-            'dia_semana_idx': dia_idx,
-            'dia_semana_nombre': nombres_dias_map[dia_idx]
-        })
-
-    # 3. Calcular la TARIFA DIARIA BRUTA para cada tipo de día (Lun, Mar...) para cada categoría
-    mapa_tarifas_diarias_brutas = {} # {'NombreCat': {0: TarifaLun, 1: TarifaMar, ...}}
-    for nombre_cat in categorias_validas:
-        mapa_tarifas_diarias_brutas[nombre_cat] = {}
-        presupuesto_mensual_cat = presupuestos_input_por_categoria[nombre_cat]
-        porcentajes_cat = mapa_porcentajes_categoria[nombre_cat]
-
-        for dia_idx in range(7): # 0 a 6
-            porcentaje_dia = porcentajes_cat.get(dia_idx, Decimal('0'))
-            num_ocurrencias = dias_semana_ocurrencias[dia_idx]
-
-            # Calcular porción del presupuesto para este tipo de día
-            presupuesto_total_para_tipo_dia = presupuesto_mensual_cat * (porcentaje_dia / Decimal('100'))
-
-            # Calcular tarifa diaria bruta
-            tarifa_diaria_bruta = Decimal('0.00')
-            if num_ocurrencias > 0:
-                # Dividir la porción entre el número de veces que ocurre el día
-                tarifa_diaria_bruta = (presupuesto_total_para_tipo_dia / Decimal(num_ocurrencias)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            # Si num_ocurrencias es 0, la tarifa se queda en 0 (ese día no existe en el mes)
-
-            mapa_tarifas_diarias_brutas[nombre_cat][dia_idx] = tarifa_diaria_bruta
-
-    # 4. Construir resultados diarios brutos y calcular sumas brutas
-    resultados_brutos_por_dia = []
-    sumas_brutas_por_categoria = {nombre_cat: Decimal('0') for nombre_cat in categorias_validas}
-
-    for info_dia in fechas_del_mes_info:
-        dia_idx_actual = info_dia['dia_semana_idx']
-        dia_actual_data_bruta = {
-            'fecha': info_dia['fecha'],
-            'dia_semana_nombre': info_dia['dia_semana_nombre'],
-            'budgets_by_category': {},
-            'total_dia_componentes': Decimal('0')
-        }
+            presupuesto_decimal = Decimal('0.00')
+        presupuestos_input_por_categoria[nombre_cat] = max(presupuesto_decimal, Decimal('0.00')) # Asegurar Decimal
 
-        for nombre_cat_loop in categorias_validas:
-            # Obtener la tarifa diaria precalculada para este día/categoría
-            tarifa_calculada = mapa_tarifas_diarias_brutas[nombre_cat_loop].get(dia_idx_actual, Decimal('0.00'))
-            # Obtener el porcentaje usado (para mostrarlo)
-            porcentaje_usado = mapa_porcentajes_categoria[nombre_cat_loop].get(dia_idx_actual, Decimal('0'))
+    if porcentajes is None:
+        porcentajes = cargar_porcentajes_diarios([sede_id], list(presupuestos_input_por_categoria)).get(sede_id, {})
 
-            dia_actual_data_bruta['budgets_by_category'][nombre_cat_loop] = {
-                'valor': tarifa_calculada,
-                'porcentaje_usado': porcentaje_usado
-            }
-            sumas_brutas_por_categoria[nombre_cat_loop] += tarifa_calculada
-
-            if nombre_cat_loop != "Total Sede":
-                 dia_actual_data_bruta['total_dia_componentes'] += tarifa_calculada
-
-        resultados_brutos_por_dia.append(dia_actual_data_bruta)
-
-    # 5. Pase de Ajuste para cuadrar totales por categoría (AÚN RECOMENDADO por posibles redondeos)
-    resultados_ajustados_por_dia = []
-    totales_finales_por_categoria = {nombre_cat: Decimal('0') for nombre_cat in categorias_validas}
-    gran_total_componentes_final = Decimal('0')
-
-    for i, dia_data_bruta in enumerate(resultados_brutos_por_dia):
-        # Copiar datos básicos del día
-        data_dia_ajustado = {
-            'fecha': dia_data_bruta['fecha'],
-            'dia_semana_nombre': dia_data_bruta['dia_semana_nombre'],
-            'budgets_by_category': {},
-            'total_dia_componentes': Decimal('0')
-        }
-        for nombre_cat, data_cat_bruta in dia_data_bruta['budgets_by_category'].items():
-            presupuesto_bruto_cat_dia = data_cat_bruta['valor']
-            presupuesto_final_cat_dia = presupuesto_bruto_cat_dia
-
-            # Ajustar en el último día del mes para esta categoría
-            if i == num_dias_en_mes - 1:
-                presupuesto_mensual_input_cat = presupuestos_input_por_categoria[nombre_cat]
-                suma_bruta_actual = sumas_brutas_por_categoria[nombre_cat]
-                diferencia = presupuesto_mensual_input_cat - suma_bruta_actual
-                # Solo aplicar si la diferencia es significativa para evitar cambios por precisión de Decimal
-                # if abs(diferencia) > Decimal('0.005') * len(resultados_brutos_por_dia): # Heurística opcional
-                presupuesto_final_cat_dia += diferencia
-                if diferencia != Decimal('0.00'):
-                     print(f"Ajuste último día para '{nombre_cat}': {diferencia:.2f}")
-
-
-            # Redondeo final del valor diario ajustado
-            presupuesto_final_cat_dia = presupuesto_final_cat_dia.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-            data_dia_ajustado['budgets_by_category'][nombre_cat] = {
-                'valor': presupuesto_final_cat_dia,
-                'porcentaje_usado': data_cat_bruta['porcentaje_usado']
-            }
-            # Acumular suma final por categoría
-            totales_finales_por_categoria[nombre_cat] += presupuesto_final_cat_dia
-
-            # Acumular suma de componentes del día (excluyendo "Total Sede")
-            if nombre_cat != "Total Sede":
-                 data_dia_ajustado['total_dia_componentes'] += presupuesto_final_cat_dia
-
-        # Redondear suma del día de componentes
-        data_dia_ajustado['total_dia_componentes'] = data_dia_ajustado['total_dia_componentes'].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        resultados_ajustados_por_dia.append(data_dia_ajustado)
-        # Acumular gran total de componentes
-        gran_total_componentes_final += data_dia_ajustado['total_dia_componentes']
-
-    # Redondeo final de los totales acumulados por categoría
-    for cat_n in totales_finales_por_categoria:
-        totales_finales_por_categoria[cat_n] = totales_finales_por_categoria[cat_n].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-    print("Cálculo finalizado (Método A).")
-    return (
-        resultados_ajustados_por_dia,
-        totales_finales_por_categoria,
-        gran_total_componentes_final.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-    )
+    return distribuir_presupuesto_mensual(anio, mes, presupuestos_input_por_categoria, porcentajes)
 
 def obtener_clase_semaforo(cumplimiento_pct):
     """
@@ -229,7 +200,7 @@ def recalcular_presupuestos_diarios_para_periodo(sede_id, anio, mes):
     # 1. Recolectar todos los presupuestos mensuales para el periodo/sede dados.
     presupuestos_mensuales = PresupuestoMensualCategoria.objects.filter(
         sede_id=sede_id, anio=anio, mes=mes
-    )
+    ).select_related('categoria')
     
     if not presupuestos_mensuales.exists():
         print("No se encontraron presupuestos mensuales para este periodo. No se hace nada.")
@@ -250,40 +221,320 @@ def recalcular_presupuestos_diarios_para_periodo(sede_id, anio, mes):
         print("El cálculo falló. Revisa la configuración de porcentajes.")
         return False, "Falló el cálculo. Revisa la configuración de porcentajes."
 
-    # 3. Guardar los nuevos resultados en la base de datos (lógica extraída de tu vista).
-    # Primero, borrar los registros diarios antiguos para este periodo y sede.
-    PresupuestoDiarioCategoria.objects.filter(
-        presupuesto_mensual__in=presupuestos_mensuales
-    ).delete()
-
-    # Luego, crear los nuevos registros diarios en bloque.
-    nuevos_diarios = []
-    for dia_data in resultados_diarios:
-        for cat_nombre, datos_cat_dia in dia_data['budgets_by_category'].items():
-            try:
-                # Encontrar el objeto PresupuestoMensualCategoria correspondiente
-                presup_mensual_obj = next(
-                    pm for pm in presupuestos_mensuales if pm.categoria.nombre == cat_nombre
-                )
-                
-                nuevos_diarios.append(PresupuestoDiarioCategoria(
-                    presupuesto_mensual=presup_mensual_obj,
-                    fecha=dia_data['fecha'],
-                    dia_semana_nombre=dia_data['dia_semana_nombre'],
-                    porcentaje_dia_especifico=datos_cat_dia['porcentaje_usado'],
-                    presupuesto_calculado=datos_cat_dia['valor']
-                ))
-            except StopIteration:
-                print(f"Advertencia: No se encontró PresupuestoMensual para {cat_nombre} al guardar diarios.")
-
-    if nuevos_diarios:
-        PresupuestoDiarioCategoria.objects.bulk_create(nuevos_diarios)
-        print(f"Cálculo exitoso: {len(nuevos_diarios)} registros diarios guardados/actualizados.")
+    # 3. Guardar solo los días que cambiaron
+    conteos = guardar_presupuestos_diarios(presupuestos_mensuales, resultados_diarios)
+    if conteos['creados'] or conteos['actualizados'] or conteos['sin_cambios']:
+        print(f"Cálculo exitoso: {conteos}")
         return True, "Cálculo realizado y guardado con éxito."
-    
+
     return False, "No se generaron nuevos registros diarios."
 
 
+def guardar_presupuestos_diarios(presupuestos_mensuales, resultados_diarios):
+    """
+    Sincroniza PresupuestoDiarioCategoria de los presupuestos mensuales dados con el resultado
+    del cálculo: crea los días nuevos, actualiza solo los que cambiaron y borra los que sobran.
+    Los presupuestos mensuales de categorías que no están en el resultado quedan sin días (igual
+    que el borrado completo anterior).
+    :param resultados_diarios: lista de días (ver calcular_presupuesto_con_porcentajes_dinamicos),
+        o dict {(sede_id, anio, mes): lista de días} para guardar varios periodos a la vez.
+    :return: dict con creados, actualizados, sin_cambios y borrados
+    """
+    presupuestos_mensuales = list(presupuestos_mensuales)
+    if not isinstance(resultados_diarios, dict):
+        resultados_diarios = {
+            (pm.sede_id, pm.anio, pm.mes): resultados_diarios for pm in presupuestos_mensuales
+        }
+
+    deseados = {}  # (pm_id, fecha) -> (dia_semana_nombre, porcentaje, valor)
+    for pm in presupuestos_mensuales:
+        nombre_cat = pm.categoria.nombre
+        for dia_data in resultados_diarios.get((pm.sede_id, pm.anio, pm.mes)) or []:
+            datos_cat_dia = dia_data['budgets_by_category'].get(nombre_cat)
+            if datos_cat_dia is not None:
+                deseados[(pm.pk, dia_data['fecha'])] = (
+                    dia_data['dia_semana_nombre'], datos_cat_dia['porcentaje_usado'], datos_cat_dia['valor']
+                )
+
+    existentes = {
+        (d.presupuesto_mensual_id, d.fecha): d
+        for d in PresupuestoDiarioCategoria.objects.filter(presupuesto_mensual__in=presupuestos_mensuales)
+    }
+
+    por_pk = {pm.pk: pm for pm in presupuestos_mensuales}
+    nuevos, cambiados, sobrantes = [], [], []
+    tocados = set()  # (pm_id, fecha) para el resumen
+    for clave, (dia_nombre, pct, valor) in deseados.items():
+        actual = existentes.get(clave)
+        if actual is None:
+            nuevos.append(PresupuestoDiarioCategoria(
+                presupuesto_mensual=por_pk[clave[0]], fecha=clave[1], dia_semana_nombre=dia_nombre,
+                porcentaje_dia_especifico=pct, presupuesto_calculado=valor,
+            ))
+        elif (actual.dia_semana_nombre, actual.porcentaje_dia_especifico, actual.presupuesto_calculado) != (dia_nombre, pct, valor):
+            actual.dia_semana_nombre = dia_nombre
+            actual.porcentaje_dia_especifico = pct
+            actual.presupuesto_calculado = valor
+            cambiados.append(actual)
+        else:
+            continue
+        tocados.add(clave)
+    for clave, actual in existentes.items():
+        if clave not in deseados:
+            sobrantes.append(actual.pk)
+            tocados.add(clave)
+
+    with transaction.atomic(), resumen_diferido():
+        if sobrantes:
+            PresupuestoDiarioCategoria.objects.filter(pk__in=sobrantes).delete()
+        if cambiados:
+            PresupuestoDiarioCategoria.objects.bulk_update(
+                cambiados, ['dia_semana_nombre', 'porcentaje_dia_especifico', 'presupuesto_calculado'],
+                batch_size=VENTA_DIARIA_BATCH_SIZE,
+            )
+        if nuevos:
+            PresupuestoDiarioCategoria.objects.bulk_create(nuevos, batch_size=VENTA_DIARIA_BATCH_SIZE)
+        for pm_id, fecha in tocados:
+            pm = por_pk[pm_id]
+            marcar_resumen_presupuesto(pm.sede_id, pm.categoria_id, fecha)
+        invalidar_consulta_presupuesto_mensual([por_pk[pm_id] for pm_id, _ in tocados])
+
+    return {
+        'creados': len(nuevos),
+        'actualizados': len(cambiados),
+        'sin_cambios': len(deseados) - len(nuevos) - len(cambiados),
+        'borrados': len(sobrantes),
+    }
+
+
+def recalcular_presupuestos_diarios_anio(anio, sede_ids=None):
+    """
+    Recalcula en lote los presupuestos diarios de todas las sedes (o las indicadas) para un año:
+    una consulta de presupuestos mensuales, una de porcentajes, el motor vectorizado por
+    sede/mes y un único guardado que solo toca los días que cambiaron.
+    """
+    presupuestos = PresupuestoMensualCategoria.objects.filter(anio=anio).select_related('categoria')
+    if sede_ids:
+        presupuestos = presupuestos.filter(sede_id__in=sede_ids)
+    presupuestos = list(presupuestos)
+    if not presupuestos:
+        return {'periodos': 0, 'errores': [], 'creados': 0, 'actualizados': 0, 'sin_cambios': 0, 'borrados': 0}
+
+    porcentajes = cargar_porcentajes_diarios({pm.sede_id for pm in presupuestos})
+
+    periodos = {}
+    for pm in presupuestos:
+        periodos.setdefault((pm.sede_id, pm.anio, pm.mes), {})[pm.categoria.nombre] = pm.presupuesto_total_categoria
+
+    resultados, errores = {}, []
+    for (sede_id, anio_p, mes), presupuestos_input in sorted(periodos.items()):
+        resultados_diarios, _, _ = distribuir_presupuesto_mensual(
+            anio_p, mes, presupuestos_input, porcentajes.get(sede_id, {})
+        )
+        if resultados_diarios is None:
+            # Igual que recalcular_presupuestos_diarios_para_periodo: el periodo no se toca
+            errores.append({'sede_id': sede_id, 'mes': mes, 'error': "Revisa la configuración de porcentajes."})
+            continue
+        resultados[(sede_id, anio_p, mes)] = resultados_diarios
+
+    conteos = guardar_presupuestos_diarios(
+        [pm for pm in presupuestos if (pm.sede_id, pm.anio, pm.mes) in resultados], resultados
+    )
+    print(f"Recálculo de presupuestos diarios {anio}: {len(resultados)} periodo(s), {conteos}, {len(errores)} error(es).")
+    return {'periodos': len(resultados), 'errores': errores, **conteos}
+
+
+
+# ─── Consulta de presupuesto guardado (caché por sede/año/mes) ───
+# La consulta se arma con una sola lectura de PresupuestoDiarioCategoria pivotada en memoria
+# (días × categorías) y se guarda en caché. Cualquier cambio en los presupuestos mensuales o
+# diarios del mes borra la entrada (señales para los guardados fila a fila y llamadas explícitas
+# desde las cargas en bloque).
+
+CONSULTA_PRESUPUESTO_TIMEOUT = 60 * 60 * 24
+
+
+def _clave_consulta_presupuesto(sede_id, anio, mes):
+    return f"presupuesto:consulta:{sede_id}:{anio}:{mes}"
+
+
+def invalidar_consulta_presupuesto(sede_id, anio, mes):
+    """Borra la consulta en caché del mes; dentro de una transacción espera al commit."""
+    clave = _clave_consulta_presupuesto(sede_id, anio, mes)
+    transaction.on_commit(lambda: cache.delete(clave))
+
+
+def invalidar_consulta_presupuesto_mensual(presupuestos_mensuales):
+    """Igual que invalidar_consulta_presupuesto para una lista de PresupuestoMensualCategoria (o sus ids)."""
+    periodos = {(pm.sede_id, pm.anio, pm.mes) for pm in presupuestos_mensuales if not isinstance(pm, int)}
+    ids = [pm for pm in presupuestos_mensuales if isinstance(pm, int)]
+    if ids:
+        periodos.update(PresupuestoMensualCategoria.objects.filter(pk__in=ids).values_list('sede_id', 'anio', 'mes'))
+    for sede_id, anio, mes in periodos:
+        invalidar_consulta_presupuesto(sede_id, anio, mes)
+
+
+def consultar_presupuesto_mes(sede_id, anio, mes):
+    """
+    Presupuesto guardado de una sede en un mes, con el formato de la vista de consulta.
+    :return: None si no hay presupuestos mensuales, o dict con 'categorias_nombres',
+        'presupuestos_input', 'resultados' (None si no hay días calculados),
+        'totales_finales_categoria' y 'gran_total_componentes'
+    """
+    clave = _clave_consulta_presupuesto(sede_id, anio, mes)
+    consulta = cache.get(clave)
+    if consulta is not None:
+        return consulta or None
+
+    filas = list(
+        PresupuestoDiarioCategoria.objects
+        .filter(presupuesto_mensual__sede_id=sede_id, presupuesto_mensual__anio=anio, presupuesto_mensual__mes=mes)
+        .order_by('fecha')
+        .values_list('fecha', 'dia_semana_nombre', 'presupuesto_mensual__categoria__nombre',
+                     'presupuesto_calculado', 'porcentaje_dia_especifico')
+    )
+    # Los totales mensuales se leen aparte: un mes puede tener presupuesto sin días calculados
+    presupuestos_input = dict(
+        PresupuestoMensualCategoria.objects.filter(sede_id=sede_id, anio=anio, mes=mes)
+        .values_list('categoria__nombre', 'presupuesto_total_categoria')
+    )
+    if not presupuestos_input:
+        # Se guarda un vacío para no repetir las consultas en meses sin presupuesto
+        cache.set(clave, {}, CONSULTA_PRESUPUESTO_TIMEOUT)
+        return None
+
+    categorias_nombres = sorted(presupuestos_input)
+    consulta = {
+        'categorias_nombres': categorias_nombres,
+        'presupuestos_input': presupuestos_input,
+        'resultados': None,
+        'totales_finales_categoria': None,
+        'gran_total_componentes': None,
+    }
+
+    if filas:
+        cero = Decimal('0.00')
+        centavo = Decimal('0.01')
+        dias = {}  # fecha -> {'dia_semana_nombre', 'categorias': {nombre: (valor, pct)}}
+        for fecha, dia_nombre, cat_nombre, valor, pct in filas:
+            dia = dias.setdefault(fecha, {'dia_semana_nombre': dia_nombre, 'categorias': {}})
+            dia['categorias'][cat_nombre] = (valor, pct)
+
+        with localcontext() as ctx:
+            ctx.prec = 28
+            totales = {cat_nombre: cero for cat_nombre in categorias_nombres}
+            gran_total = cero
+            resultados = []
+            for fecha, dia in dias.items():
+                budgets = {}
+                total_dia = cero
+                for cat_nombre in categorias_nombres:
+                    valor, pct = dia['categorias'].get(cat_nombre, (cero, cero))
+                    budgets[cat_nombre] = {'valor': valor, 'porcentaje_usado': pct}
+                    totales[cat_nombre] += valor
+                    if cat_nombre != CATEGORIA_TOTAL_SEDE:
+                        total_dia += valor
+                total_dia = total_dia.quantize(centavo, rounding=ROUND_HALF_UP)
+                gran_total += total_dia
+                resultados.append({
+                    'fecha': fecha, 'dia_semana_nombre': dia['dia_semana_nombre'],
+                    'budgets_by_category': budgets, 'total_dia_componentes': total_dia,
+                })
+
+            consulta['resultados'] = resultados
+            consulta['totales_finales_categoria'] = {
+                cat_nombre: total.quantize(centavo, rounding=ROUND_HALF_UP) for cat_nombre, total in totales.items()
+            }
+            consulta['gran_total_componentes'] = gran_total.quantize(centavo, rounding=ROUND_HALF_UP)
+
+    cache.set(clave, consulta, CONSULTA_PRESUPUESTO_TIMEOUT)
+    return consulta
+
+
+# ─── Carga masiva de VentaDiariaReal ───
+
+VENTA_DIARIA_BATCH_SIZE = 1000
+
+
+def _consultar_ventas_icg(sql, fecha_inicio, fecha_fin):
+    """Ejecuta la consulta de ventas en ICG con el rango de fechas y devuelve las filas."""
+    conexion = conectar_sql_server()
+    try:
+        cursor = conexion.cursor()
+        cursor.execute(sql, [fecha_inicio, fecha_fin])
+        return cursor.fetchall()
+    finally:
+        conexion.close()
+
+
+def upsert_ventas_diarias(filas, fecha_defecto=None, batch_size=VENTA_DIARIA_BATCH_SIZE):
+    """
+    Inserta o actualiza VentaDiariaReal en bloque (ON CONFLICT sobre sede, categoria, fecha).
+    :param filas: iterable de (sede_nombre, categoria_nombre, fecha, venta_real, margen_sin, margen_con)
+    :param fecha_defecto: fecha usada cuando la fila no trae fecha
+    :return: dict con conteos de insertadas, actualizadas y omitidas
+    """
+    campo_fecha = VentaDiariaReal._meta.get_field('fecha')
+    sedes = dict(Sede.objects.values_list('nombre', 'id'))
+    categorias = dict(CategoriaVenta.objects.values_list('nombre', 'id'))
+
+    # Una fila por clave: si ICG repite la clave gana la última (igual que update_or_create)
+    registros = {}
+    omitidas = 0
+    for sede_nombre, categoria_nombre, fecha_raw, venta_real, margen_sin, margen_con in filas:
+        sede_id = sedes.get(sede_nombre)
+        if sede_id is None:
+            print(f"Advertencia: Sede '{sede_nombre}' no existe, fila omitida.")
+            omitidas += 1
+            continue
+        categoria_id = categorias.get(categoria_nombre)
+        if categoria_id is None:
+            categoria_id = CategoriaVenta.objects.get_or_create(nombre=categoria_nombre)[0].id
+            categorias[categoria_nombre] = categoria_id
+        # ICG puede devolver datetime o texto; la clave se normaliza a date
+        fecha = campo_fecha.to_python(fecha_raw or fecha_defecto)
+        registros[(sede_id, categoria_id, fecha)] = VentaDiariaReal(
+            sede_id=sede_id,
+            categoria_id=categoria_id,
+            fecha=fecha,
+            venta_real=Decimal(venta_real or 0),
+            margen_sin_post_pct=Decimal(margen_sin or 0),
+            margen_con_post_pct=Decimal(margen_con or 0),
+        )
+
+    if not registros:
+        return {'insertadas': 0, 'actualizadas': 0, 'omitidas': omitidas}
+
+    # Una sola consulta para saber cuáles claves ya existían (solo para el reporte)
+    fechas = {k[2] for k in registros}
+    existentes = set(
+        VentaDiariaReal.objects.filter(
+            sede_id__in={k[0] for k in registros},
+            categoria_id__in={k[1] for k in registros},
+            fecha__gte=min(fechas), fecha__lte=max(fechas),
+        ).values_list('sede_id', 'categoria_id', 'fecha')
+    )
+    actualizadas = sum(1 for k in registros if k in existentes)
+
+    with transaction.atomic():
+        VentaDiariaReal.objects.bulk_create(
+            registros.values(),
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['sede', 'categoria', 'fecha'],
+            update_fields=['venta_real', 'margen_sin_post_pct', 'margen_con_post_pct'],
+        )
+
+    with resumen_diferido():
+        for sede_id, categoria_id, fecha in registros:
+            marcar_resumen_presupuesto(sede_id, categoria_id, fecha)
+
+    return {
+        'insertadas': len(registros) - actualizadas,
+        'actualizadas': actualizadas,
+        'omitidas': omitidas,
+    }
+
 
 def cargar_ventas_reales_carne(fecha_inicio, fecha_fin):
     """
@@ -351,38 +602,16 @@ def cargar_ventas_reales_carne(fecha_inicio, fecha_fin):
             ELSE 4
         END;
     '''
-    conexion = conectar_sql_server()
-    cursor =conexion.cursor()
-    cursor.execute(sql, [fecha_inicio, fecha_fin])
-    filas = cursor.fetchall()
+    filas = _consultar_ventas_icg(sql, fecha_inicio, fecha_fin)
 
-    # Asumiendo que existe una sola categoría con nombre 'CONCESION CARNE'
-    categoria_obj, _ = CategoriaVenta.objects.get_or_create(
-        nombre='CONCESION CARNE'
+    # Todas las filas van a la categoría 'CONCESION CARNE'
+    resultado = upsert_ventas_diarias(
+        ((sede, 'CONCESION CARNE', fecha, venta, m_sin, m_con)
+         for sede, _, fecha, venta, m_sin, m_con in filas),
+        fecha_defecto=fecha_inicio,
     )
-
-    with transaction.atomic():
-        for sede_nombre, _, fecha_raw, venta_real, margen_sin, margen_con in filas:
-            sede_obj = Sede.objects.get(nombre=sede_nombre)
-            fecha = fecha_raw or fecha_inicio
-            # Intentamos obtener el registro existente
-            obj, created = VentaDiariaReal.objects.update_or_create(
-                sede=sede_obj,
-                categoria=categoria_obj,
-                fecha=fecha,
-                defaults={
-                    'venta_real': Decimal(venta_real),
-                    'margen_sin_post_pct': Decimal(margen_sin),
-                    'margen_con_post_pct': Decimal(margen_con),
-                }
-            )
-            if not created:
-                # Si ya existía, simplemente actualizamos los campos y guardamos
-                obj.venta_real = Decimal(venta_real)
-                obj.margen_sin_post_pct = Decimal(margen_sin)
-                obj.margen_con_post_pct = Decimal(margen_con)
-                obj.save()
-    print(f"Cargadas {len(filas)} filas de ventas reales entre {fecha_inicio} y {fecha_fin}.")
+    print(f"Cargadas {len(filas)} filas de ventas reales entre {fecha_inicio} y {fecha_fin}: {resultado}")
+    return resultado
 
 def cargasr_ventas_reales_ecenarios(fecha_inicio, fecha_fin):
     """
@@ -505,127 +734,29 @@ LEFT JOIN Categorias C ON AI.Cod = C.CODALMACEN
 WHERE C.fechaVenta IS NOT NULL
 ORDER BY AI.Nombre, C.fechaVenta, C.CATEGORIA
     '''
-    conexion = conectar_sql_server()
-    cursor = conexion.cursor()
-    cursor.execute(sql, [fecha_inicio, fecha_fin])
-    filas = cursor.fetchall()
-    print(filas)
-    with transaction.atomic():
-        for sede_nombre, categoria_nombre, venta_real, margen_sin, margen_con, fecha_raw,  in filas:
-            # Obtener o crear la sede
-            sede_obj = Sede.objects.get(nombre=sede_nombre)
-            # Obtener o crear la categoría (¡aquí es donde cambia!)
-            categoria_obj, _ = CategoriaVenta.objects.get_or_create(
-                nombre=categoria_nombre
-            )
-            fecha = fecha_raw or fecha_inicio
-            # Actualiza o crea
-            obj, created = VentaDiariaReal.objects.update_or_create(
-                sede=sede_obj,
-                categoria=categoria_obj,
-                fecha=fecha,
-                defaults={
-                    'venta_real': Decimal(venta_real),
-                    'margen_sin_post_pct': Decimal(margen_sin),
-                    'margen_con_post_pct': Decimal(margen_con),
-                }
-            )
-            if not created:
-                obj.venta_real = Decimal(venta_real)
-                obj.margen_sin_post_pct = Decimal(margen_sin)
-                obj.margen_con_post_pct = Decimal(margen_con)
-                obj.save()
-    print(f"Cargadas {len(filas)} filas de ventas reales de todas las categorías entre {fecha_inicio} y {fecha_fin}.")
+    filas = _consultar_ventas_icg(sql, fecha_inicio, fecha_fin)
+
+    # La consulta devuelve (ALMACEN, CATEGORIA, VALOR, PCT_SIN, PCT_CON, fecha)
+    resultado = upsert_ventas_diarias(
+        ((sede, categoria, fecha, venta, m_sin, m_con)
+         for sede, categoria, venta, m_sin, m_con, fecha in filas),
+        fecha_defecto=fecha_inicio,
+    )
+    print(f"Cargadas {len(filas)} filas de ventas reales de todas las categorías entre {fecha_inicio} y {fecha_fin}: {resultado}")
+    return resultado
 
 def calcular_presupuesto_diario_forecast(presupuesto_mensual_obj):
     """
     Calcula y actualiza el presupuesto diario para una categoría/sede usando Prophet,
     incorporando el efecto de eventos históricos si existen.
+    Para varios presupuestos usar forecast.calcular_presupuestos_diarios_forecast (lote + caché de modelos).
     """
+    from .forecast import calcular_presupuestos_diarios_forecast
 
-    anio_obj = presupuesto_mensual_obj.anio
-    mes_obj = presupuesto_mensual_obj.mes
-    sede = presupuesto_mensual_obj.sede
-    categoria = presupuesto_mensual_obj.categoria
-    valor_mes = float(presupuesto_mensual_obj.presupuesto_total_categoria) 
-
-    fecha_inicio = date(anio_obj, 1, 1)
-    if mes_obj == 1:
-        raise Exception("No hay histórico suficiente para calcular enero.")
-    else:
-        fecha_fin = date(anio_obj, mes_obj - 1, monthrange(anio_obj, mes_obj - 1)[1])
-
-    # Obtener ventas históricas y eventos asociados
-    ventas = list(VentaDiariaReal.objects.filter(
-        sede=sede,
-        categoria=categoria,
-        fecha__gte=fecha_inicio,
-        fecha__lte=fecha_fin
-    ).values('fecha', 'venta_real', 'Eventos'))
-
-    if not ventas or len(ventas) < 30:
-        raise Exception("No hay suficiente historial para hacer forecast diario.")
-
-    df = pd.DataFrame(ventas)
-    df = df.rename(columns={'fecha': 'ds', 'venta_real': 'y'})
-    df['ds'] = pd.to_datetime(df['ds'])
-
-    # Crear columna binaria 'evento' para Prophet
-    df['evento'] = df['Eventos'].notnull().astype(int)
-    df = df.drop(columns=['Eventos'])
-
-    # Configurar modelo Prophet con regresor de evento
-    modelo = Prophet(yearly_seasonality=False, daily_seasonality=False, weekly_seasonality=True)
-    modelo.add_regressor('evento')
-    modelo.fit(df)
-
-    # Generar fechas del mes objetivo
-    primer_dia = date(anio_obj, mes_obj, 1)
-    ultimo_dia = date(anio_obj, mes_obj, monthrange(anio_obj, mes_obj)[1])
-    fechas_mes = pd.date_range(primer_dia, ultimo_dia)
-
-    # Preparar input de predicción con columna evento=0 (si no se conocen eventos futuros)
-    futuro = pd.DataFrame({'ds': fechas_mes})
-    futuro['evento'] = 0  # Asume que no hay eventos conocidos en el futuro
-
-    forecast = modelo.predict(futuro)
-    forecast['yhat'] = forecast['yhat'].clip(lower=0)
-
-    total_mes = forecast['yhat'].sum()
-    if total_mes == 0:
-        raise Exception("La predicción del mes objetivo es cero. Revisa los datos históricos.")
-    forecast['pct_dia'] = forecast['yhat'] / total_mes
-
-    # Mapeo de eventos históricos por fecha
-    eventos_por_fecha = {
-        v['fecha']: v.get('Eventos') for v in ventas if v.get('Eventos')
-    }
-
-    # Nombres de días en español
-    nombres_es = {
-        'Monday': 'Lunes', 'Tuesday': 'Martes', 'Wednesday': 'Miércoles',
-        'Thursday': 'Jueves', 'Friday': 'Viernes', 'Saturday': 'Sábado', 'Sunday': 'Domingo'
-    }
-
-    # Guardar presupuestos diarios
-    for _, row in forecast.iterrows():
-        fecha_dia = row['ds'].date()
-        pct = Decimal(row['pct_dia'] * 100).quantize(Decimal('0.01'))
-        valor = Decimal(row['pct_dia'] * valor_mes).quantize(Decimal('0.01'))
-        dia_semana = nombres_es[row['ds'].day_name()]
-        evento_asociado = eventos_por_fecha.get(fecha_dia)
-
-        PresupuestoDiarioCategoria.objects.update_or_create(
-            presupuesto_mensual=presupuesto_mensual_obj,
-            fecha=fecha_dia,
-            defaults={
-                'dia_semana_nombre': dia_semana,
-                'porcentaje_dia_especifico': pct,
-                'presupuesto_calculado': valor
-            }
-        )
-
-    return f"Presupuesto diario calculado para {sede} / {categoria} en {anio_obj}-{mes_obj}"
+    resultado = calcular_presupuestos_diarios_forecast([presupuesto_mensual_obj], max_workers=1)
+    if resultado['detalle_errores']:
+        raise Exception(resultado['detalle_errores'][presupuesto_mensual_obj.pk])
+    return resultado['detalle'][presupuesto_mensual_obj.pk]
 
 from decimal import Decimal, ROUND_HALF_UP
 
@@ -682,9 +813,10 @@ def ajustar_presupuesto_diario(presupuesto_mensual_obj, dia_modificado, nuevo_po
 
     # Recalcular los valores diarios para que sumen el presupuesto mensual
     presupuesto_mensual = presupuesto_mensual_obj.presupuesto_total_categoria
-    for d in dias:
-        d.presupuesto_calculado = (presupuesto_mensual * d.porcentaje_dia_especifico / Decimal('100.00')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-        d.save()
+    with resumen_diferido():
+        for d in dias:
+            d.presupuesto_calculado = (presupuesto_mensual * d.porcentaje_dia_especifico / Decimal('100.00')).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+            d.save()
 
     return True, "Presupuesto diario ajustado correctamente."
 
@@ -781,31 +913,352 @@ def cargar_ventas_reales_marca_mercasur(fecha_inicio, fecha_fin):
     WHERE C.fechaVenta IS NOT NULL
     ORDER BY AI.Nombre, C.fechaVenta, C.CATEGORIA
     '''
-    conexion = conectar_sql_server()
-    cursor = conexion.cursor()
-    cursor.execute(sql, [fecha_inicio, fecha_fin])
-    filas = cursor.fetchall()
+    filas = _consultar_ventas_icg(sql, fecha_inicio, fecha_fin)
+
+    resultado = upsert_ventas_diarias(
+        ((sede, 'MARCA mercasur', fecha, venta, m_sin, m_con)
+         for sede, _, venta, m_sin, m_con, fecha in filas),
+        fecha_defecto=fecha_inicio,
+    )
+    print(f"Cargadas {len(filas)} filas de ventas MARCA mercasur entre {fecha_inicio} y {fecha_fin}: {resultado}")
+    return resultado
+
+# ─── Carga histórica por ventanas mensuales ───
+
+CARGADORES_VENTAS = (
+    ('carne', cargar_ventas_reales_carne),
+    ('escenarios', cargasr_ventas_reales_ecenarios),
+    ('marca_mercasur', cargar_ventas_reales_marca_mercasur),
+)
+
+
+def ventanas_mensuales(fecha_inicio, fecha_fin):
+    """Divide [fecha_inicio, fecha_fin] en ventanas (inicio, fin) que no cruzan de mes."""
+    ventanas = []
+    actual = fecha_inicio
+    while actual <= fecha_fin:
+        fin_mes = date(actual.year, actual.month, monthrange(actual.year, actual.month)[1])
+        ventanas.append((actual, min(fin_mes, fecha_fin)))
+        actual = fin_mes + timedelta(days=1)
+    return ventanas
+
+
+def _cargar_ventana(inicio, fin):
+    """Ejecuta los tres cargadores sobre una ventana. Corre en un hilo: cierra su conexión al terminar."""
+    try:
+        return {nombre: cargador(inicio, fin) for nombre, cargador in CARGADORES_VENTAS}
+    finally:
+        connection.close()
+
 
-    # Asegura existencia de la categoría
-    categoria_obj, _ = CategoriaVenta.objects.get_or_create(nombre='MARCA mercasur')
+def cargar_ventas_historicas_rango(fecha_inicio, fecha_fin, concurrencia=2, reanudar=True):
+    """
+    Backfill de VentaDiariaReal entre dos fechas consultando ICG por meses completos
+    (una consulta por cargador y mes en lugar de una por día).
+    El avance se guarda en CargaHistoricaVentas tras cada ventana: si se interrumpe,
+    volver a llamar con el mismo rango continúa desde las ventanas pendientes.
+    La ventana que contiene hoy se recarga siempre: sus ventas siguen cambiando durante el día.
+    :param concurrencia: ventanas que se consultan en paralelo contra ICG
+    :param reanudar: False ignora el checkpoint y vuelve a cargar todo el rango
+    """
+    checkpoint, _ = CargaHistoricaVentas.objects.get_or_create(
+        fecha_inicio=fecha_inicio, fecha_fin=fecha_fin
+    )
+    if not reanudar:
+        checkpoint.ventanas_completadas = []
+        checkpoint.resultado = {}
+    checkpoint.errores = {}
+    checkpoint.estado = 'EN_PROCESO'
+    checkpoint.save()
+
+    completadas = set(checkpoint.ventanas_completadas)
+    hoy = date.today()
+    pendientes = [
+        (inicio, fin) for inicio, fin in ventanas_mensuales(fecha_inicio, fecha_fin)
+        if inicio.isoformat() not in completadas or inicio <= hoy <= fin
+    ]
+    print(f"Carga histórica {fecha_inicio} → {fecha_fin}: {len(pendientes)} ventana(s) pendiente(s), "
+          f"{len(completadas)} ya cargada(s).")
+
+    lock = threading.Lock()
+
+    def registrar(inicio, resultado=None, error=None):
+        with lock:
+            if error is None:
+                if inicio.isoformat() not in checkpoint.ventanas_completadas:
+                    checkpoint.ventanas_completadas.append(inicio.isoformat())
+                for nombre, conteos in resultado.items():
+                    acumulado = checkpoint.resultado.setdefault(nombre, {})
+                    for clave, valor in (conteos or {}).items():
+                        acumulado[clave] = acumulado.get(clave, 0) + valor
+            else:
+                checkpoint.errores[inicio.isoformat()] = str(error)[:500]
+            checkpoint.save(update_fields=['ventanas_completadas', 'resultado', 'errores', 'actualizado'])
+
+    with ThreadPoolExecutor(max_workers=max(1, int(concurrencia))) as executor:
+        futuros = {executor.submit(_cargar_ventana, inicio, fin): (inicio, fin) for inicio, fin in pendientes}
+        for futuro in as_completed(futuros):
+            inicio, fin = futuros[futuro]
+            try:
+                registrar(inicio, resultado=futuro.result())
+                print(f"[✔] Ventana {inicio} → {fin} cargada.")
+            except Exception as e:
+                registrar(inicio, error=e)
+                print(f"[✖] Ventana {inicio} → {fin}: {e}")
+
+    checkpoint.estado = 'CON_ERRORES' if checkpoint.errores else 'COMPLETADA'
+    checkpoint.save(update_fields=['estado', 'actualizado'])
+    return {
+        'estado': checkpoint.estado,
+        'ventanas_cargadas': len(checkpoint.ventanas_completadas),
+        'errores': checkpoint.errores,
+        'resultado': checkpoint.resultado,
+    }
+
+
+# ─── Resumen presupuesto vs venta (tabla de hechos) ───
+
+_resumen_local = threading.local()
+
+
+def _mismo_dia_anio_anterior(fecha):
+    """Misma fecha un año antes; el 29 de febrero se compara con el 28."""
+    try:
+        return fecha.replace(year=fecha.year - 1)
+    except ValueError:
+        return fecha.replace(year=fecha.year - 1, day=28)
+
+
+def _mismo_dia_anio_siguiente(fecha):
+    try:
+        return fecha.replace(year=fecha.year + 1)
+    except ValueError:
+        return fecha.replace(year=fecha.year + 1, day=28)
+
+
+def _recalcular_resumen_rango(fecha_inicio, fecha_fin, sede_ids=None, categoria_ids=None):
+    """
+    Recalcula ResumenDiarioPresupuesto para [fecha_inicio, fecha_fin] (opcionalmente
+    limitado a sedes/categorías) y el ResumenMensualPresupuesto de los meses tocados.
+    Tres consultas agrupadas a las tablas origen + upsert en bloque.
+    """
+    filtro_ppto = {'fecha__gte': fecha_inicio, 'fecha__lte': fecha_fin}
+    filtro_venta = {'fecha__gte': fecha_inicio, 'fecha__lte': fecha_fin}
+    filtro_resumen = {}
+    if sede_ids:
+        filtro_ppto['presupuesto_mensual__sede_id__in'] = sede_ids
+        filtro_venta['sede_id__in'] = sede_ids
+        filtro_resumen['sede_id__in'] = sede_ids
+    if categoria_ids:
+        filtro_ppto['presupuesto_mensual__categoria_id__in'] = categoria_ids
+        filtro_venta['categoria_id__in'] = categoria_ids
+        filtro_resumen['categoria_id__in'] = categoria_ids
+
+    filas = {}
+
+    def fila(sede_id, categoria_id, fecha):
+        return filas.setdefault((sede_id, categoria_id, fecha), {
+            'presupuesto': Decimal('0.00'), 'venta_real': Decimal('0.00'), 'venta_anio_anterior': Decimal('0.00'),
+            'margen_sin_post_pct': Decimal('0.0'), 'margen_con_post_pct': Decimal('0.0'),
+        })
+
+    presupuestos = (
+        PresupuestoDiarioCategoria.objects.filter(**filtro_ppto)
+        .values_list('presupuesto_mensual__sede_id', 'presupuesto_mensual__categoria_id', 'fecha')
+        .annotate(total=Sum('presupuesto_calculado'))
+        .order_by()
+    )
+    for sede_id, categoria_id, fecha, total in presupuestos:
+        fila(sede_id, categoria_id, fecha)['presupuesto'] = total or Decimal('0.00')
+
+    ventas = VentaDiariaReal.objects.filter(**filtro_venta).values_list(
+        'sede_id', 'categoria_id', 'fecha', 'venta_real', 'margen_sin_post_pct', 'margen_con_post_pct'
+    )
+    for sede_id, categoria_id, fecha, venta, margen_sin, margen_con in ventas:
+        datos = fila(sede_id, categoria_id, fecha)
+        datos['venta_real'] = venta
+        datos['margen_sin_post_pct'] = margen_sin
+        datos['margen_con_post_pct'] = margen_con
+
+    # Venta del año anterior: fecha anterior -> fechas del rango que la usan como referencia
+    dias_por_fecha_anterior = {}
+    dia = fecha_inicio
+    while dia <= fecha_fin:
+        dias_por_fecha_anterior.setdefault(_mismo_dia_anio_anterior(dia), []).append(dia)
+        dia += timedelta(days=1)
+    filtro_anterior = dict(filtro_venta,
+                           fecha__gte=_mismo_dia_anio_anterior(fecha_inicio),
+                           fecha__lte=_mismo_dia_anio_anterior(fecha_fin))
+    for sede_id, categoria_id, fecha, venta in VentaDiariaReal.objects.filter(**filtro_anterior).values_list(
+        'sede_id', 'categoria_id', 'fecha', 'venta_real'
+    ):
+        for dia in dias_por_fecha_anterior.get(fecha, []):
+            fila(sede_id, categoria_id, dia)['venta_anio_anterior'] = venta
+
+    existentes = ResumenDiarioPresupuesto.objects.filter(
+        fecha__gte=fecha_inicio, fecha__lte=fecha_fin, **filtro_resumen
+    ).values_list('id', 'sede_id', 'categoria_id', 'fecha')
+    sobrantes = [pk for pk, *clave in existentes if tuple(clave) not in filas]
 
     with transaction.atomic():
-        for sede_nombre, categoria_nombre, venta_real, margen_sin, margen_con, fecha_raw in filas:
-            sede_obj = Sede.objects.get(nombre=sede_nombre)
-            fecha = fecha_raw or fecha_inicio
-            obj, created = VentaDiariaReal.objects.update_or_create(
-                sede=sede_obj,
-                categoria=categoria_obj,
-                fecha=fecha,
-                defaults={
-                    'venta_real': Decimal(venta_real),
-                    'margen_sin_post_pct': Decimal(margen_sin),
-                    'margen_con_post_pct': Decimal(margen_con),
-                }
+        if sobrantes:
+            ResumenDiarioPresupuesto.objects.filter(pk__in=sobrantes).delete()
+        ResumenDiarioPresupuesto.objects.bulk_create(
+            [
+                ResumenDiarioPresupuesto(
+                    sede_id=sede_id, categoria_id=categoria_id, fecha=fecha,
+                    anio=fecha.year, mes=fecha.month, **datos
+                )
+                for (sede_id, categoria_id, fecha), datos in filas.items()
+            ],
+            batch_size=VENTA_DIARIA_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['sede', 'categoria', 'fecha'],
+            update_fields=['presupuesto', 'venta_real', 'venta_anio_anterior',
+                           'margen_sin_post_pct', 'margen_con_post_pct', 'actualizado'],
+        )
+        _recalcular_resumen_mensual(fecha_inicio, fecha_fin, filtro_resumen)
+
+    return len(filas)
+
+
+def _recalcular_resumen_mensual(fecha_inicio, fecha_fin, filtro_resumen):
+    """Rehace ResumenMensualPresupuesto de los meses que cubre el rango a partir del resumen diario."""
+    inicio = date(fecha_inicio.year, fecha_inicio.month, 1)
+    fin = date(fecha_fin.year, fecha_fin.month, monthrange(fecha_fin.year, fecha_fin.month)[1])
+
+    totales = (
+        ResumenDiarioPresupuesto.objects.filter(fecha__gte=inicio, fecha__lte=fin, **filtro_resumen)
+        .values_list('sede_id', 'categoria_id', 'anio', 'mes')
+        .annotate(ppto=Sum('presupuesto'), venta=Sum('venta_real'), venta_aa=Sum('venta_anio_anterior'))
+        .order_by()
+    )
+    mensuales = {
+        (sede_id, categoria_id, anio, mes): (ppto, venta, venta_aa)
+        for sede_id, categoria_id, anio, mes, ppto, venta, venta_aa in totales
+    }
+
+    filtro_meses = Q()
+    for ventana_inicio, _ in ventanas_mensuales(inicio, fin):
+        filtro_meses |= Q(anio=ventana_inicio.year, mes=ventana_inicio.month)
+    existentes = ResumenMensualPresupuesto.objects.filter(filtro_meses, **filtro_resumen).values_list(
+        'id', 'sede_id', 'categoria_id', 'anio', 'mes'
+    )
+    sobrantes = [pk for pk, *clave in existentes if tuple(clave) not in mensuales]
+    if sobrantes:
+        ResumenMensualPresupuesto.objects.filter(pk__in=sobrantes).delete()
+
+    ResumenMensualPresupuesto.objects.bulk_create(
+        [
+            ResumenMensualPresupuesto(
+                sede_id=sede_id, categoria_id=categoria_id, anio=anio, mes=mes,
+                presupuesto=ppto, venta_real=venta, venta_anio_anterior=venta_aa,
             )
-            if not created:
-                obj.venta_real = Decimal(venta_real)
-                obj.margen_sin_post_pct = Decimal(margen_sin)
-                obj.margen_con_post_pct = Decimal(margen_con)
-                obj.save()
-    print(f"Cargadas {len(filas)} filas de ventas MARCA mercasur entre {fecha_inicio} y {fecha_fin}.")
\ No newline at end of file
+            for (sede_id, categoria_id, anio, mes), (ppto, venta, venta_aa) in mensuales.items()
+        ],
+        batch_size=VENTA_DIARIA_BATCH_SIZE,
+        update_conflicts=True,
+        unique_fields=['sede', 'categoria', 'anio', 'mes'],
+        update_fields=['presupuesto', 'venta_real', 'venta_anio_anterior', 'actualizado'],
+    )
+
+
+def actualizar_resumen_presupuesto(fecha_inicio, fecha_fin, sede_ids=None, categoria_ids=None):
+    """
+    Mantiene la tabla de hechos tras un cambio en presupuestos o ventas entre fecha_inicio y fecha_fin.
+    También recalcula el mismo rango del año siguiente, cuya venta_anio_anterior sale de estas ventas.
+    """
+    filas = _recalcular_resumen_rango(fecha_inicio, fecha_fin, sede_ids, categoria_ids)
+    # +1 día: el 29 de febrero del año siguiente también toma como referencia el 28
+    filas += _recalcular_resumen_rango(
+        _mismo_dia_anio_siguiente(fecha_inicio),
+        _mismo_dia_anio_siguiente(fecha_fin) + timedelta(days=1),
+        sede_ids, categoria_ids,
+    )
+    return filas
+
+
+def _aplicar_resumen_pendiente(pendientes):
+    """Agrupa las claves marcadas por sede y recalcula una vez el rango mínimo que las cubre."""
+    claves = set(pendientes['claves'])
+    if pendientes['mensuales']:
+        mensuales = dict(
+            (pk, (sede_id, categoria_id))
+            for pk, sede_id, categoria_id in PresupuestoMensualCategoria.objects.filter(
+                pk__in={pm_id for pm_id, _, _ in pendientes['mensuales']}
+            ).values_list('id', 'sede_id', 'categoria_id')
+        )
+        for pm_id, desde, hasta in pendientes['mensuales']:
+            if pm_id in mensuales:
+                claves.add((*mensuales[pm_id], desde, hasta))
+
+    por_sede = {}
+    for sede_id, categoria_id, desde, hasta in claves:
+        rango = por_sede.setdefault(sede_id, [desde, hasta, set()])
+        rango[0] = min(rango[0], desde)
+        rango[1] = max(rango[1], hasta)
+        rango[2].add(categoria_id)
+
+    for sede_id, (desde, hasta, categoria_ids) in por_sede.items():
+        actualizar_resumen_presupuesto(desde, hasta, [sede_id], list(categoria_ids))
+
+
+def _registrar_resumen_pendiente(tipo, clave):
+    pendientes = getattr(_resumen_local, 'pendientes', None)
+    if pendientes is not None:
+        pendientes[tipo].add(clave)
+    else:
+        _aplicar_resumen_pendiente({'claves': set(), 'mensuales': set(), tipo: {clave}})
+
+
+def marcar_resumen_presupuesto(sede_id, categoria_id, fecha_inicio, fecha_fin=None):
+    """Marca (sede, categoría, rango) para recalcular: al instante o al salir de resumen_diferido()."""
+    _registrar_resumen_pendiente('claves', (sede_id, categoria_id, fecha_inicio, fecha_fin or fecha_inicio))
+
+
+def marcar_resumen_presupuesto_mensual(presupuesto_mensual_id, fecha_inicio, fecha_fin=None):
+    """Igual que marcar_resumen_presupuesto, resolviendo sede/categoría desde el presupuesto mensual."""
+    _registrar_resumen_pendiente('mensuales', (presupuesto_mensual_id, fecha_inicio, fecha_fin or fecha_inicio))
+
+
+@contextmanager
+def resumen_diferido():
+    """
+    Acumula las marcas (señales incluidas) y recalcula el resumen una sola vez al salir.
+    Usar alrededor de procesos que guardan o borran muchos días seguidos.
+    Entrega las marcas acumuladas (None si ya había un bloque diferido abierto); vaciarlas
+    descarta el recálculo, p. ej. cuando los cambios se revirtieron.
+    """
+    if getattr(_resumen_local, 'pendientes', None) is not None:
+        yield None
+        return
+    pendientes = _resumen_local.pendientes = {'claves': set(), 'mensuales': set()}
+    try:
+        yield pendientes
+    finally:
+        _resumen_local.pendientes = None
+    _aplicar_resumen_pendiente(pendientes)
+
+
+def reconstruir_resumen_presupuesto(fecha_inicio=None, fecha_fin=None):
+    """
+    Reconstruye la tabla de hechos completa (o un rango) por ventanas mensuales.
+    Sin fechas toma desde el primer dato hasta el último de presupuestos o ventas.
+    """
+    if fecha_inicio is None or fecha_fin is None:
+        rango_ppto = PresupuestoDiarioCategoria.objects.aggregate(min=Min('fecha'), max=Max('fecha'))
+        rango_venta = VentaDiariaReal.objects.aggregate(min=Min('fecha'), max=Max('fecha'))
+        minimos = [f for f in (rango_ppto['min'], rango_venta['min']) if f]
+        maximos = [f for f in (rango_ppto['max'], rango_venta['max']) if f]
+        if not minimos:
+            return {'ventanas': 0, 'filas': 0}
+        fecha_inicio = fecha_inicio or min(minimos)
+        # Las ventas del último año alimentan la venta_anio_anterior del siguiente
+        fecha_fin = fecha_fin or max(max(maximos), _mismo_dia_anio_siguiente(rango_venta['max'] or max(maximos)))
+
+    ventanas = ventanas_mensuales(fecha_inicio, fecha_fin)
+    filas = 0
+    for inicio, fin in ventanas:
+        filas += _recalcular_resumen_rango(inicio, fin)
+        print(f"Resumen presupuesto {inicio} → {fin} reconstruido.")
+    return {'ventanas': len(ventanas), 'filas': filas}
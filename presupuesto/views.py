@@ -6,19 +6,19 @@ from .serializers import CustomTokenObtainPairSerializer, VentapollosSerializer
 from rest_framework import generics, permissions
 from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
-from .models import VentaDiariaReal, ventapollos, CategoriaVenta
+from .models import ventapollos, CategoriaVenta
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.utils.safestring import mark_safe
 from django.shortcuts import render
 from django.contrib import messages # Para mostrar mensajes al usuario
 from .forms import FiltroCumplimientoForm, SedeAñoMesForm, PresupuestoCategoriaFormSet, FiltroRangoFechasForm
-from .models import Sede, CategoriaVenta, PresupuestoMensualCategoria, PresupuestoDiarioCategoria
-from .utils import calcular_presupuesto_con_porcentajes_dinamicos, obtener_clase_semaforo
+from .models import Sede, CategoriaVenta, PresupuestoMensualCategoria, PresupuestoDiarioCategoria, ResumenDiarioPresupuesto, ResumenMensualPresupuesto
+from .utils import calcular_presupuesto_con_porcentajes_dinamicos, obtener_clase_semaforo, guardar_presupuestos_diarios, consultar_presupuesto_mes
 from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
 from django.db.models import Sum, F
 from appMercaSur.decorators import smart_jwt_login_required
 from django.utils.timezone import now
-from datetime import date, datetime, timedelta
+from datetime import date, datetime
 
 from django.views.decorators.csrf import csrf_exempt
 
@@ -143,7 +143,7 @@ def vista_presupuesto_por_categoria(request):
                     messages.warning(request, "No se ingresaron presupuestos para procesar.")
                 else:
                     resultados_diarios, totales_finales_categoria, gran_total_componentes = \
-                        calcular_presupuesto_con_porcentajes_dinamicos(anio, mes, presupuestos_input)
+                        calcular_presupuesto_con_porcentajes_dinamicos(sede.id, anio, mes, presupuestos_input)
 
                     if resultados_diarios is not None:
                         messages.success(request, "Cálculo de presupuesto diario realizado y datos guardados con éxito.")
@@ -153,25 +153,9 @@ def vista_presupuesto_por_categoria(request):
                             'presupuestos_input': presupuestos_input
                         }
                         # Guardar Resultados Diarios en BD
-                        qs_mensuales = PresupuestoMensualCategoria.objects.filter(sede=sede, anio=anio, mes=mes)
-                        PresupuestoDiarioCategoria.objects.filter(presupuesto_mensual__in=qs_mensuales).delete()
-                        nuevos_diarios = []
-                        for dia_data in resultados_diarios:
-                            for cat_nombre, datos_cat_dia in dia_data['budgets_by_category'].items():
-                                try:
-                                    presup_mensual_cat_obj = qs_mensuales.get(categoria__nombre=cat_nombre)
-                                    nuevos_diarios.append(PresupuestoDiarioCategoria(
-                                        presupuesto_mensual=presup_mensual_cat_obj,
-                                        fecha=dia_data['fecha'],
-                                        dia_semana_nombre=dia_data['dia_semana_nombre'],
-                                        porcentaje_dia_especifico=datos_cat_dia['porcentaje_usado'],
-                                        presupuesto_calculado=datos_cat_dia['valor']
-                                    ))
-                                except PresupuestoMensualCategoria.DoesNotExist:
-                                    print(f"Advertencia: No se encontró PresupuestoMensual para {sede.nombre}/{cat_nombre}/{mes}/{anio} al guardar diarios.")
-                        if nuevos_diarios:
-                            PresupuestoDiarioCategoria.objects.bulk_create(nuevos_diarios)
-                            print(f"Guardados {len(nuevos_diarios)} registros diarios.")
+                        qs_mensuales = PresupuestoMensualCategoria.objects.filter(sede=sede, anio=anio, mes=mes).select_related('categoria')
+                        conteos = guardar_presupuestos_diarios(qs_mensuales, resultados_diarios)
+                        print(f"Registros diarios guardados: {conteos}")
                     else:
                         messages.error(request, "Falló el cálculo del presupuesto diario. Revise la configuración de porcentajes (¿suman 100%?, ¿están los 7 días para cada categoría activa?).")
         else: # Formularios principales no válidos
@@ -208,68 +192,24 @@ def vista_consultar_presupuesto(request):
         mes = filter_form.cleaned_data['mes']
         print(f"Consultando para: Sede={sede}, Año={anio}, Mes={mes}")
 
-        presupuestos_mensuales_guardados = PresupuestoMensualCategoria.objects.filter(
-            sede=sede, anio=anio, mes=mes
-        ).select_related('categoria').order_by('categoria__nombre')
+        # Una sola consulta pivotada en memoria; en caché hasta que cambien los presupuestos del mes
+        consulta = consultar_presupuesto_mes(sede.id, anio, mes)
 
-        if not presupuestos_mensuales_guardados.exists():
+        if consulta is None:
             messages.info(request, f"No se encontraron datos de presupuesto guardados para {sede.nombre} en {mes}/{anio}.")
         else:
-            input_presupuestos = {pm.categoria.nombre: pm.presupuesto_total_categoria for pm in presupuestos_mensuales_guardados}
-            categorias_consultadas_nombres = sorted(list(input_presupuestos.keys()))
-            
             contexto_presupuesto_input = {
                 'sede_nombre': sede.nombre, 'anio': anio, 'mes': mes,
-                'categorias_nombres': categorias_consultadas_nombres,
-                'presupuestos_input': input_presupuestos
+                'categorias_nombres': consulta['categorias_nombres'],
+                'presupuestos_input': consulta['presupuestos_input']
             }
-            print(f"Contexto Input reconstruido: {contexto_presupuesto_input}")
-
-            fechas_con_datos = PresupuestoDiarioCategoria.objects.filter(
-                presupuesto_mensual__in=presupuestos_mensuales_guardados
-            ).values_list('fecha', flat=True).distinct().order_by('fecha')
 
-            if not fechas_con_datos:
+            if not consulta['resultados']:
                 messages.warning(request, f"Presupuestos mensuales encontrados para {sede.nombre} en {mes}/{anio}, pero no hay datos diarios calculados asociados.")
             else:
-                resultados_diarios_list = []
-                totales_finales_categoria_dict = {cat_nombre: Decimal('0.00') for cat_nombre in categorias_consultadas_nombres}
-                gran_total_componentes_val = Decimal('0.00')
-
-                for fecha_dia in fechas_con_datos:
-                    dia_data = {
-                        'fecha': fecha_dia, 'dia_semana_nombre': '',
-                        'budgets_by_category': {}, 'total_dia_componentes': Decimal('0.00')
-                    }
-                    registros_diarios_del_dia = PresupuestoDiarioCategoria.objects.filter(
-                        presupuesto_mensual__in=presupuestos_mensuales_guardados, fecha=fecha_dia
-                    ).select_related('presupuesto_mensual__categoria')
-
-                    if registros_diarios_del_dia:
-                         dia_data['dia_semana_nombre'] = registros_diarios_del_dia.first().dia_semana_nombre
-
-                    for cat_nombre in categorias_consultadas_nombres:
-                        registro_cat_dia = next((r for r in registros_diarios_del_dia if r.presupuesto_mensual.categoria.nombre == cat_nombre), None)
-                        if registro_cat_dia:
-                            valor = registro_cat_dia.presupuesto_calculado
-                            pct_usado = registro_cat_dia.porcentaje_dia_especifico
-                            dia_data['budgets_by_category'][cat_nombre] = {'valor': valor, 'porcentaje_usado': pct_usado}
-                            totales_finales_categoria_dict[cat_nombre] += valor
-                            if cat_nombre != "Total Sede": # Nombre exacto de tu categoría global
-                                dia_data['total_dia_componentes'] += valor
-                        else:
-                            dia_data['budgets_by_category'][cat_nombre] = {'valor': Decimal('0.00'), 'porcentaje_usado': Decimal('0.00')}
-                    
-                    dia_data['total_dia_componentes'] = dia_data['total_dia_componentes'].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                    resultados_diarios_list.append(dia_data)
-                    gran_total_componentes_val += dia_data['total_dia_componentes']
-                
-                for cat_n in totales_finales_categoria_dict:
-                    totales_finales_categoria_dict[cat_n] = totales_finales_categoria_dict[cat_n].quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-                
-                resultados_diarios = resultados_diarios_list
-                totales_finales_categoria = totales_finales_categoria_dict
-                gran_total_componentes = gran_total_componentes_val.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+                resultados_diarios = consulta['resultados']
+                totales_finales_categoria = consulta['totales_finales_categoria']
+                gran_total_componentes = consulta['gran_total_componentes']
                 messages.success(request, f"Mostrando datos guardados para {sede.nombre} en {mes}/{anio}.")
     else:
         if request.GET and not filter_form.is_valid():
@@ -327,63 +267,33 @@ def vista_reporte_cumplimiento(request):
         else:
             todas_las_categorias = CategoriaVenta.objects.none()
 
-        for cat_obj in todas_las_categorias:
-            filtro_presupuesto = {
-                'presupuesto_mensual__sede': sede,
-                'presupuesto_mensual__categoria': cat_obj
-            }
-            filtro_venta = {
-                'sede': sede,
-                'categoria': cat_obj
-            }
+        # Resumen por categoría: una consulta agrupada sobre la tabla de hechos.
+        # venta_anio_anterior ya es la venta del mismo día del año anterior.
+        filtro_resumen = {'sede': sede, 'categoria__in': todas_las_categorias}
+        if fecha_inicio:
+            filtro_resumen['fecha__gte'] = fecha_inicio
+        if fecha_fin:
+            filtro_resumen['fecha__lte'] = fecha_fin
+        if not fecha_inicio and not fecha_fin:
+            filtro_resumen['anio'] = anio
+            filtro_resumen['mes'] = mes
+            filtro_resumen['fecha__lte'] = limite_fecha
+
+        totales_por_categoria = (
+            ResumenDiarioPresupuesto.objects.filter(**filtro_resumen)
+            .values('categoria__nombre')
+            .annotate(
+                total_presupuesto=Sum('presupuesto'),
+                total_venta=Sum('venta_real'),
+                total_venta_anio_anterior=Sum('venta_anio_anterior'),
+            )
+            .order_by()
+        )
 
-            if fecha_inicio:
-                filtro_presupuesto['fecha__gte'] = fecha_inicio
-                filtro_venta['fecha__gte'] = fecha_inicio
-            if fecha_fin:
-                filtro_presupuesto['fecha__lte'] = fecha_fin
-                filtro_venta['fecha__lte'] = fecha_fin
-            if not fecha_inicio and not fecha_fin:
-                filtro_presupuesto['presupuesto_mensual__anio'] = anio
-                filtro_presupuesto['presupuesto_mensual__mes'] = mes
-                filtro_presupuesto['fecha__lte'] = limite_fecha
-
-                filtro_venta['fecha__year'] = anio
-                filtro_venta['fecha__month'] = mes
-                filtro_venta['fecha__lte'] = limite_fecha
-
-            presupuesto_total_cat = PresupuestoDiarioCategoria.objects.filter(**filtro_presupuesto).aggregate(
-                total_presupuesto=Sum('presupuesto_calculado')
-            )['total_presupuesto'] or Decimal('0.00')
-
-            venta_total_cat = VentaDiariaReal.objects.filter(**filtro_venta).aggregate(
-                total_venta=Sum('venta_real')
-            )['total_venta'] or Decimal('0.00')
-            # Venta del año anterior para el mismo rango
-            filtro_venta_anio_anterior = {
-                'sede': sede,
-                'categoria': cat_obj,
-            }
-            if fecha_inicio:
-                try:
-                    filtro_venta_anio_anterior['fecha__gte'] = fecha_inicio.replace(year=fecha_inicio.year - 1)
-                except ValueError:
-                    filtro_venta_anio_anterior['fecha__gte'] = fecha_inicio - timedelta(days=365)
-            if fecha_fin:
-                try:
-                    filtro_venta_anio_anterior['fecha__lte'] = fecha_fin.replace(year=fecha_fin.year - 1)
-                except ValueError:
-                    filtro_venta_anio_anterior['fecha__lte'] = fecha_fin - timedelta(days=365)
-            if not fecha_inicio and not fecha_fin:
-                filtro_venta_anio_anterior['fecha__year'] = anio - 1
-                filtro_venta_anio_anterior['fecha__month'] = mes
-                ultimo_dia_anio_anterior = calendar.monthrange(anio - 1, mes)[1]
-                limite_fecha_anio_anterior = date(anio - 1, mes, min(limite_fecha.day, ultimo_dia_anio_anterior))
-                filtro_venta_anio_anterior['fecha__lte'] = limite_fecha_anio_anterior
-
-            venta_anio_anterior = VentaDiariaReal.objects.filter(**filtro_venta_anio_anterior).aggregate(
-                total_venta=Sum('venta_real')
-            )['total_venta'] or Decimal('0.00')
+        for totales in totales_por_categoria:
+            presupuesto_total_cat = totales['total_presupuesto'] or Decimal('0.00')
+            venta_total_cat = totales['total_venta'] or Decimal('0.00')
+            venta_anio_anterior = totales['total_venta_anio_anterior'] or Decimal('0.00')
 
             diferencia_cat = venta_total_cat - presupuesto_total_cat
             cumplimiento_cat_pct = None
@@ -395,7 +305,7 @@ def vista_reporte_cumplimiento(request):
 
             if presupuesto_total_cat > 0:
                 resumen_por_categoria.append({
-                    'nombre_indicador': cat_obj.nombre,
+                    'nombre_indicador': totales['categoria__nombre'],
                     'presupuesto_mes': presupuesto_total_cat,
                     'venta_mes': venta_total_cat,
                     'venta_anio_anterior': venta_anio_anterior,
@@ -407,32 +317,21 @@ def vista_reporte_cumplimiento(request):
 
         resumen_por_categoria = sorted(resumen_por_categoria, key=lambda x: x['presupuesto_mes'], reverse=True)
 
-        # GRAFICA ANUAL PRESUPUESTO VS VENTA
+        # GRAFICA ANUAL PRESUPUESTO VS VENTA (acumulados mensuales precalculados)
         chart_labels_anual = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
         chart_ppto_anual = []
         chart_venta_anual = []
         chart_cumplimiento_anual = []
 
+        mensuales = {
+            r.mes: r for r in ResumenMensualPresupuesto.objects.filter(
+                sede=sede, categoria=categoria_seleccionada, anio=anio
+            )
+        }
         for m in range(1, 13):
-            filtro_ppto_mensual = {
-                'presupuesto_mensual__sede': sede,
-                'presupuesto_mensual__categoria': categoria_seleccionada,
-                'presupuesto_mensual__anio': anio,
-                'presupuesto_mensual__mes': m
-            }
-            filtro_venta_mensual = {
-                'sede': sede,
-                'categoria': categoria_seleccionada,
-                'fecha__year': anio,
-                'fecha__month': m
-            }
-
-
-
-            ppto_qs = PresupuestoDiarioCategoria.objects.filter(**filtro_ppto_mensual).aggregate(total_ppto=Sum('presupuesto_calculado'))
-            total_ppto = ppto_qs['total_ppto'] or Decimal('0.00')
-
-            total_venta = VentaDiariaReal.objects.filter(**filtro_venta_mensual).aggregate(total_venta=Sum('venta_real'))['total_venta'] or Decimal('0.00')
+            resumen_mes = mensuales.get(m)
+            total_ppto = resumen_mes.presupuesto if resumen_mes else Decimal('0.00')
+            total_venta = resumen_mes.venta_real if resumen_mes else Decimal('0.00')
 
             chart_ppto_anual.append(float(total_ppto))
             chart_venta_anual.append(float(total_venta))
@@ -452,13 +351,12 @@ def vista_reporte_cumplimiento(request):
         if not presupuestos_diarios.exists():
             messages.info(request, f"No se encontraron presupuestos diarios para {categoria_seleccionada.nombre} en {sede.nombre} para {mes}/{anio}.")
         else:
-            ventas_diarias_qs = VentaDiariaReal.objects.filter(
-                sede=sede,
-                categoria=categoria_seleccionada,
-                fecha__year=anio,
-                fecha__month=mes
-            )
-            ventas_map = {v.fecha: v for v in ventas_diarias_qs}
+            # Venta, márgenes y venta del año anterior de cada día salen del resumen
+            ventas_map = {
+                r.fecha: r for r in ResumenDiarioPresupuesto.objects.filter(
+                    sede=sede, categoria=categoria_seleccionada, anio=anio, mes=mes
+                )
+            }
 
             total_ppto_mes_detalle = Decimal('0.00')
             total_venta_mes_detalle = Decimal('0.00')
@@ -475,10 +373,12 @@ def vista_reporte_cumplimiento(request):
                     venta_dia_real = venta_obj.venta_real
                     margen_sin_pos   = venta_obj.margen_sin_post_pct
                     margen_con_pos   = venta_obj.margen_con_post_pct
+                    venta_anio_pasado = venta_obj.venta_anio_anterior
                 else:
                     venta_dia_real = Decimal('0.00')
                     margen_sin_pos = Decimal('0.0')
                     margen_con_pos = Decimal('0.0')
+                    venta_anio_pasado = Decimal('0.00')
 
                 nombre_dia = ppto_dia.dia_semana_nombre
                 if nombre_dia in resumen_semanal_detalle:
@@ -489,13 +389,6 @@ def vista_reporte_cumplimiento(request):
                 cumplimiento_pct_dia = None
                 if ppto_dia.presupuesto_calculado > 0:
                     cumplimiento_pct_dia = (venta_dia_real / ppto_dia.presupuesto_calculado * Decimal('100')).quantize(Decimal('0.1'), rounding=ROUND_HALF_UP)
-                fecha_aa = ppto_dia.fecha.replace(year=ppto_dia.fecha.year - 1)
-                venta_aa_obj = VentaDiariaReal.objects.filter(
-                    sede=sede,
-                    categoria=categoria_seleccionada,
-                    fecha=fecha_aa
-                ).first()
-                venta_anio_pasado = venta_aa_obj.venta_real if venta_aa_obj else Decimal('0.00')
                 datos_reporte.append({
                     'fecha': ppto_dia.fecha,
                     'dia_semana': ppto_dia.dia_semana_nombre,
@@ -523,17 +416,12 @@ def vista_reporte_cumplimiento(request):
             resumen_mensual = {
                 'total_presupuesto': total_ppto_mes_detalle,
                 'total_venta': total_venta_mes_detalle,
-                'total_venta_anio_pasado': VentaDiariaReal.objects.filter(
-                    sede=sede,
-                    categoria=categoria_seleccionada,
-                    fecha__year=anio - 1,
-                    fecha__month=mes
-                ).aggregate(total_venta=Sum('venta_real'))['total_venta'] or Decimal('0.00'),
+                'total_venta_anio_pasado': mensuales[mes].venta_anio_anterior if mes in mensuales else Decimal('0.00'),
                 'total_diferencia': total_venta_mes_detalle - total_ppto_mes_detalle,
                 'cumplimiento_pct': cumplimiento_total_mes_detalle,
                 'semaforo_clase': obtener_clase_semaforo(cumplimiento_total_mes_detalle),
-                'margen_sin_pos': ventas_diarias_qs.aggregate(Sum('margen_sin_post_pct'))['margen_sin_post_pct__sum'] or Decimal('0.0'),
-                'margen_con_pos': ventas_diarias_qs.aggregate(Sum('margen_con_post_pct'))['margen_con_post_pct__sum'] or Decimal('0.0')
+                'margen_sin_pos': sum((r.margen_sin_post_pct for r in ventas_map.values()), Decimal('0.0')),
+                'margen_con_pos': sum((r.margen_con_post_pct for r in ventas_map.values()), Decimal('0.0'))
             }
 
             if not datos_reporte and presupuestos_diarios.exists():
@@ -607,36 +495,25 @@ def dasboard_presupuesto(request):
         ff = form.cleaned_data['fecha_fin']
         cat = form.cleaned_data['categoria']
 
-        # Filtros base para el rango de fechas
-        filtro_venta = {'fecha__range': (fi, ff)}
-        filtro_presu = {'fecha__range': (fi, ff)}
-        if cat:
-            filtro_venta['categoria'] = cat
-            filtro_presu['presupuesto_mensual__categoria'] = cat
-
-        # Filtros para año anterior (mismo rango de días pero año anterior)
-        fi_anterior = fi.replace(year=fi.year - 1) if fi else None
-        ff_anterior = ff.replace(year=ff.year - 1) if ff else None
-        filtro_venta_anterior = {'fecha__range': (fi_anterior, ff_anterior)} if fi_anterior and ff_anterior else {}
+        # Tabla resumen: una consulta agrupada por sede sobre la tabla de hechos.
+        # La venta del año anterior corresponde al mismo rango de días del año anterior.
+        filtro_resumen = {'fecha__range': (fi, ff)}
         if cat:
-            filtro_venta_anterior['categoria'] = cat
-
-        # Tabla resumen
-        qs_ppto = PresupuestoDiarioCategoria.objects.filter(**filtro_presu) \
-            .values(sede_nombre=F('presupuesto_mensual__sede__nombre')) \
-            .annotate(total_ppto=Sum('presupuesto_calculado'))
+            filtro_resumen['categoria'] = cat
 
-        qs_venta = VentaDiariaReal.objects.filter(**filtro_venta) \
+        qs_resumen = ResumenDiarioPresupuesto.objects.filter(**filtro_resumen) \
             .values(sede_nombre=F('sede__nombre')) \
-            .annotate(total_venta=Sum('venta_real'))
-
-        qs_venta_anterior = VentaDiariaReal.objects.filter(**filtro_venta_anterior) \
-            .values(sede_nombre=F('sede__nombre')) \
-            .annotate(total_venta=Sum('venta_real'))
-
-        dict_ppto  = {r['sede_nombre']: r['total_ppto'] for r in qs_ppto}
-        dict_venta = {r['sede_nombre']: r['total_venta'] for r in qs_venta}
-        dict_venta_anterior = {r['sede_nombre']: r['total_venta'] for r in qs_venta_anterior}
+            .annotate(total_ppto=Sum('presupuesto'), total_venta=Sum('venta_real'),
+                      total_venta_anterior=Sum('venta_anio_anterior')) \
+            .order_by()
+
+        dict_ppto, dict_venta, dict_venta_anterior = {}, {}, {}
+        for r in qs_resumen:
+            # Solo sedes con presupuesto o venta en el rango (la venta anterior no basta)
+            if r['total_ppto'] or r['total_venta']:
+                dict_ppto[r['sede_nombre']] = r['total_ppto']
+                dict_venta[r['sede_nombre']] = r['total_venta']
+                dict_venta_anterior[r['sede_nombre']] = r['total_venta_anterior']
         sedes = sorted(set(dict_ppto) | set(dict_venta))
 
         total_ppto_all = 0
@@ -1,41 +1,142 @@
-from appMercaSur.conect import conectar_sql_server, ejecutar_consulta_data
-from clientes.models import RegistroCliente, ZonaPermitida
+import re
+
+from appMercaSur.conect import conectar_sql_server
+from clientes.models import RegistroCliente
 from automatizaciones.models import SQLQuery
-from geopy.distance import geodesic
+from automatizaciones.utils import obtener_consulta_sql
+from service.zonas import determinar_zona
 from datetime import datetime
 from clientes.correo import enviar_correo
 from clientes.utils import generar_nuevo_codcliente, calcular_edad, bool_a_tf
+from django.core.cache import cache
 from django.db import transaction
 from django.db.models import F
 
-def getClienteICG(numero_documento):
+# ─── Consulta de clientes en ICG ───
+# La consulta (SQLQuery pk=3) se lee de la caché y se ejecuta parametrizada: pyodbc prepara la
+# sentencia una vez por cursor y la reutiliza mientras el texto no cambie (consultas por lote).
+# buscar_clientes_icg guarda además el resultado por documento, incluidos los "no existe".
+
+CLIENTE_ICG_CACHE_TIMEOUT = 5 * 60
+CLIENTE_ICG_CACHE_TIMEOUT_NEGATIVO = 60
+SQLQUERY_CLIENTE_ICG = 3
+
+_MARCADOR_DOCUMENTO = re.compile(r"N?'\{0?\}'|\{0?\}")
+
+
+def _clave_cliente_icg(numero_documento):
+    return f"clientes:icg:{numero_documento}"
+
+
+def invalidar_cliente_icg(numero_documento):
+    cache.delete(_clave_cliente_icg(str(numero_documento).strip()))
+
+
+def _preparar_consulta_cliente():
+    """
+    (sql, número de parámetros) a partir del texto con marcadores '{}' de SQLQuery.
+    Si el marcador está dentro de un literal más largo (p. ej. LIKE '%{}%') no se puede
+    parametrizar y se devuelve (texto, None): se formatea escapando comillas, como antes.
+    """
+    texto = obtener_consulta_sql(SQLQUERY_CLIENTE_ICG)
+    sin_literales_simples = re.sub(r"N?'\{0?\}'", '', texto)
+    # Tras partir por comillas, los tramos impares están dentro de un literal
+    if any(re.search(r"\{0?\}", tramo) for tramo in sin_literales_simples.split("'")[1::2]):
+        return texto, None
+    sql, total = _MARCADOR_DOCUMENTO.subn('?', texto)
+    return sql.replace('{{', '{').replace('}}', '}'), total
+
+
+def _ejecutar_consulta_cliente(cursor, consulta, numero_documento):
+    sql, total = consulta
+    if total is None:
+        cursor.execute(sql.format(str(numero_documento).replace("'", "''")))
+    else:
+        cursor.execute(sql, (numero_documento,) * total)
+    return cursor.fetchall()
+
+
+def getClienteICG(numero_documento, conexion=None):
     """
-    Obtiene información del cliente desde la base de datos SQL Server.
+    Obtiene información del cliente desde la base de datos SQL Server (sin caché: la usan
+    la creación y la sincronización, que necesitan el estado real de ICG).
     Args:
         numero_documento: El número de documento del cliente a consultar.
+        conexion: Conexión ICG a reutilizar (opcional; por defecto abre una nueva).
     Returns:
         list: Lista de datos del cliente.
     """
     try:
-        conexion = conectar_sql_server()
-        consulta = SQLQuery.objects.filter(pk=3).first()
-        consulta = consulta.consulta.format(numero_documento)
-        data = ejecutar_consulta_data(conexion, consulta)
+        conexion = conexion or conectar_sql_server()
+        consulta = _preparar_consulta_cliente()
+        try:
+            data = _ejecutar_consulta_cliente(conexion.cursor(), consulta, numero_documento)
+        except Exception as e:
+            print(f"⚠️ Error en consulta: {str(e)}")
+            return None
         print(data)
         return data
     except:
         return "error Data"
 
-def create_fidelizacion(cliente):
+
+def buscar_clientes_icg(documentos):
+    """
+    Consulta por lote de clientes en ICG con caché por documento.
+    Una sola conexión y un cursor (sentencia preparada) para todos los documentos que no están en caché.
+    Returns:
+        dict {numero_documento: lista de filas ([] si no existe) o None si falló la consulta}
+    """
+    documentos = list(dict.fromkeys(str(d).strip() for d in documentos if d is not None and str(d).strip()))
+    claves = {d: _clave_cliente_icg(d) for d in documentos}
+    en_cache = cache.get_many(list(claves.values()))
+    resultado = {d: en_cache[claves[d]] for d in documentos if claves[d] in en_cache}
+
+    faltantes = [d for d in documentos if d not in resultado]
+    if not faltantes:
+        return resultado
+
+    conexion = conectar_sql_server()
+    if conexion is None:
+        resultado.update({d: None for d in faltantes})
+        return resultado
+
+    encontrados, no_encontrados = {}, {}
+    try:
+        consulta = _preparar_consulta_cliente()
+        cursor = conexion.cursor()
+        for documento in faltantes:
+            try:
+                filas = [tuple(f) for f in _ejecutar_consulta_cliente(cursor, consulta, documento)]
+            except Exception as e:
+                print(f"⚠️ Error consultando cliente {documento} en ICG: {e}")
+                resultado[documento] = None
+                continue
+            resultado[documento] = filas
+            (encontrados if filas else no_encontrados)[claves[documento]] = filas
+    finally:
+        conexion.close()
+
+    cache.set_many(encontrados, CLIENTE_ICG_CACHE_TIMEOUT)
+    cache.set_many(no_encontrados, CLIENTE_ICG_CACHE_TIMEOUT_NEGATIVO)
+    return resultado
+
+
+def buscar_cliente_icg(numero_documento):
+    """Igual que getClienteICG pero pasando por la caché de consultas."""
+    return buscar_clientes_icg([numero_documento]).get(str(numero_documento).strip())
+
+def create_fidelizacion(cliente, conexion=None):
     """
     Crea una tarjeta de fidelización para el cliente si cumple con los requisitos.
     Args:
         cliente: Instancia del cliente a procesar.
+        conexion: Conexión ICG a reutilizar (opcional).
     Returns:
         str: Mensaje indicando el resultado de la operación.
     """
     try:
-        conexion = conectar_sql_server()
+        conexion = conexion or conectar_sql_server()
         cursor = conexion.cursor()
                 # Verificar si ya tiene tarjeta
         cursor = conexion.cursor()
@@ -70,7 +171,7 @@ def create_fidelizacion(cliente):
                         'T',  # ENTREGADA
                         cliente.numero_documento
                     )
-                    existe_cliente = getClienteICG(cliente.numero_documento)
+                    existe_cliente = getClienteICG(cliente.numero_documento, conexion)
                     if existe_cliente:
                         # Ejecutar la consulta de inserción
                         cursor.execute(consulta, valores)
@@ -89,6 +190,7 @@ def determinar_sucursal(latitud, longitud) -> str:
     """
     Determina la sucursal (zona) a partir de la ubicación del cliente.
     Retorna el nombre de la zona si se encuentra dentro de alguna, o 'CALDAS' si no.
+    Las zonas activas se resuelven desde la caché en memoria de service.zonas.
 
     Args:
         latitud: La latitud del cliente (puede ser None o un número).
@@ -97,73 +199,16 @@ def determinar_sucursal(latitud, longitud) -> str:
     Returns:
         El nombre de la zona o 'CALDAS' como valor por defecto.
     """
-    print(f"DEBUG: Iniciando determinar_sucursal con latitud={latitud}, longitud={longitud}") # Depuración
-
-    # 1. Validación de latitud y longitud nulas
-    if latitud is None or longitud is None:
-        print("DEBUG: Coordenadas nulas, retornando 'CALDAS'.") # Depuración
-        return 'CALDAS'
-
-    # 2. Validar tipo y rango de coordenadas
-    try:
-        lat_float = float(latitud)
-        lon_float = float(longitud)
-        if not (-90 <= lat_float <= 90) or not (-180 <= lon_float <= 180):
-            print(f"DEBUG: Coordenadas fuera de rango: lat={lat_float}, lon={lon_float}. Retornando 'CALDAS'.") # Depuración
-            return 'CALDAS'
-    except (ValueError, TypeError):
-         print(f"DEBUG: Coordenadas no son números válidos: lat='{latitud}', lon='{longitud}'. Retornando 'CALDAS'.") # Depuración
-         return 'CALDAS' # Si no se pueden convertir a float, retorna el default
-
-    cliente_ubicacion = (lat_float, lon_float)
-    print(f"DEBUG: Ubicación cliente procesada: {cliente_ubicacion}") # Depuración
-
     try:
-        # 3. Obtener zonas activas (optimizando: solo las columnas necesarias)
-        zonas = ZonaPermitida.objects.filter(activa=True).values(
-            'nombre', 'latitude', 'longitude', 'max_distance'
-        )
-        print(f"DEBUG: Zonas activas encontradas: {list(zonas)}") # Depuración
-
-        # 4. Iterar sobre las zonas y calcular distancia
-        for zona in zonas:
-            try:
-                # Validar datos de la zona antes de usarlos
-                if None in (zona['latitude'], zona['longitude'], zona['max_distance']):
-                    print(f"DEBUG: Datos incompletos para zona {zona['nombre']}. Saltando...") # Depuración
-                    continue
-
-                centro_zona = (float(zona['latitude']), float(zona['longitude']))
-                distancia_max = int(zona['max_distance']) # Asegurar que sea entero para comparar
-
-                # Calcular distancia geodésica
-                distancia = geodesic(cliente_ubicacion, centro_zona).meters
-                print(f"DEBUG: Calculando para Zona '{zona['nombre']}' ({centro_zona}): Distancia={distancia:.2f}m, Max={distancia_max}m") # Depuración
-
-                # 5. Comprobar si está dentro del radio
-                if distancia <= distancia_max:
-                    print(f"DEBUG: ¡Encontrado! Cliente dentro de '{zona['nombre']}'.") # Depuración
-                    return zona['nombre'] # Encontramos una zona
-
-            except (ValueError, TypeError, KeyError) as e_zona:
-                # Error procesando una zona específica (datos inválidos?)
-                print(f"DEBUG: Error procesando datos de zona {zona.get('nombre', 'Desconocida')}: {e_zona}. Saltando esta zona.") # Depuración
-                continue # Pasar a la siguiente zona
-
+        return determinar_zona(latitud, longitud)
     except Exception as e_db:
-        # Capturar error general al acceder a la BD
         print(f"ERROR: No se pudieron obtener las Zonas Permitidas de la BD: {e_db}")
-        # Decide si retornar default o relanzar el error dependiendo de tu lógica
         return 'CALDAS' # Retornar default en caso de error de BD
 
-    # 6. Si el bucle termina sin encontrar zona
-    print("DEBUG: Cliente fuera de todas las zonas activas. Retornando 'CALDAS'.") # Depuración
-    return 'CALDAS'
 
-
-def actualizar_campos_libres_cliente(cliente):
+def actualizar_campos_libres_cliente(cliente, conexion=None):
     try:
-        conexion = conectar_sql_server()
+        conexion = conexion or conectar_sql_server()
         cursor = conexion.cursor()
         if cliente.tipocliente == 'Colaborador':
             validar = 'T'
@@ -234,35 +279,38 @@ def actualizar_campos_libres_cliente(cliente):
 
 
 def ConsultarClienteICG(numero_documento):
+    """
+    Trae a RegistroCliente un cliente que existe en ICG y aún no está en local.
+    Si ya está en local no consulta ICG.
+    """
     try:
-        data = getClienteICG(numero_documento)
-        print(data)
-        cliente = RegistroCliente.objects.filter(numero_documento = numero_documento)
-        if cliente:
+        if RegistroCliente.objects.filter(numero_documento = numero_documento).exists():
             print("Cliente Existe")
             return
-        else:
-            cliente = RegistroCliente(
-                codcliente = data[0][0],
-                numero_documento = data[0][1],
-                primer_nombre = data[0][2],
-                segundo_nombre = data[0][3],
-                primer_apellido = data[0][4],
-                segundo_apellido = data[0][5],
-                fecha_nacimiento = data[0][6],
-            )
-            cliente.save()
+        data = buscar_cliente_icg(numero_documento)
+        print(data)
+        cliente = RegistroCliente(
+            codcliente = data[0][0],
+            numero_documento = data[0][1],
+            primer_nombre = data[0][2],
+            segundo_nombre = data[0][3],
+            primer_apellido = data[0][4],
+            segundo_apellido = data[0][5],
+            fecha_nacimiento = data[0][6],
+        )
+        cliente.save()
     except:
         return "error"
     return data
 
 
-def crearClienteICG(intanse_cliente):
+def crearClienteICG(intanse_cliente, conexion=None):
     """
     Crea un cliente en la base de datos ICG (SQL Server).
     
     Args:
         intanse_cliente: Instancia del modelo RegistroCliente
+        conexion: Conexión ICG a reutilizar (opcional; la cola de sincronización comparte una por lote)
         
     Returns:
         str: 'ok' si fue exitoso, mensaje de error en caso contrario
@@ -280,15 +328,15 @@ def crearClienteICG(intanse_cliente):
         tipocliente = 14
     
     try:
+        # Generar nuevo código de cliente (fuera de la transacción para usar el bloque reservado del proceso)
+        secuencia = generar_nuevo_codcliente()
+        print(f"Código de cliente generado: {secuencia}")
+
         with transaction.atomic():
-            conexion = conectar_sql_server()
+            conexion = conexion or conectar_sql_server()
             cursor = conexion.cursor()
             consulta = SQLQuery.objects.filter(pk=6).first().consulta
             
-            # Generar nuevo código de cliente
-            secuencia = generar_nuevo_codcliente()
-            print(f"Código de cliente generado: {secuencia}")
-            
             valores = (
                 secuencia,                     # CODCLIENTE (Usamos el mismo que el número de documento)
                 '13050501',                                     # CODCONTABLE (Valor predeterminado del SQL)
@@ -354,18 +402,19 @@ def crearClienteICG(intanse_cliente):
                 return f"Error al ejecutar la consulta: {e}"
             
             # Verificar que el cliente se creó correctamente
-            cliente = getClienteICG(intanse_cliente.numero_documento)
+            cliente = getClienteICG(intanse_cliente.numero_documento, conexion)
             if cliente:
                 print("Cliente validado en ICG")
+                invalidar_cliente_icg(intanse_cliente.numero_documento)
                 intanse_cliente.codcliente = cliente[0][0]
                 intanse_cliente.creadoICG = True
                 intanse_cliente.save()
                 
                 # Actualizar campos libres
-                actualizar_campos_libres_cliente(intanse_cliente)
+                actualizar_campos_libres_cliente(intanse_cliente, conexion)
                 
                 # Crear fidelización
-                create_fidelizacion(intanse_cliente)
+                create_fidelizacion(intanse_cliente, conexion)
                 
                 intanse_cliente.Actualizado = False
                 intanse_cliente.save()
@@ -394,8 +443,8 @@ def crearClienteICG(intanse_cliente):
         return f"error: {e}"
 
 
-def actualizarClienteICG(intanse_cliente):
-    conexion = conectar_sql_server()
+def actualizarClienteICG(intanse_cliente, conexion=None):
+    conexion = conexion or conectar_sql_server()
     cursor = conexion.cursor()
 
     nombreCompleto = f'{intanse_cliente.primer_nombre or ''} {intanse_cliente.segundo_nombre or  ''} {intanse_cliente.primer_apellido or  ''} {intanse_cliente.segundo_apellido or ''}'.strip()
@@ -471,8 +520,8 @@ def actualizarClienteICG(intanse_cliente):
         conexion.commit()
         intanse_cliente.Actualizado = True
         intanse_cliente.save()
-        actualizar_campos_libres_cliente(intanse_cliente)
-        create_fidelizacion(intanse_cliente)
+        actualizar_campos_libres_cliente(intanse_cliente, conexion)
+        create_fidelizacion(intanse_cliente, conexion)
         if intanse_cliente.correo_notificacion == True:
             enviar_correo(intanse_cliente)
         return 'Cliente actualizado exitosamente'
@@ -0,0 +1,267 @@
+"""
+Envío asíncrono de correos (bandeja de salida).
+
+Los flujos de negocio llaman a encolar_correo() / encolar_mensaje() en lugar de EmailMessage.send():
+el correo se guarda en CorreoSaliente y, al confirmar la transacción, se dispara el drenado en
+Celery. drenar_correo_saliente() reclama lotes de la cola (SKIP LOCKED), abre una sola conexión
+SMTP por lote con get_connection() y reintenta con espera exponencial. Un correo con la misma
+clave de deduplicación que otro encolado o enviado dentro de la ventana no se vuelve a enviar.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from automatizaciones.models import AdjuntoCorreoSaliente, CorreoSaliente
+
+CORREO_TAMANO_LOTE = 50
+CORREO_MAX_LOTES = 20
+CORREO_MAX_INTENTOS = 6
+CORREO_ESPERA_BASE = 60                # segundos; se duplica en cada intento
+CORREO_ESPERA_MAXIMA = 60 * 60
+CORREO_VENTANA_DEDUP = timedelta(hours=1)
+# Un correo en ENVIANDO más de este tiempo se considera abandonado (worker caído)
+CORREO_TIMEOUT_ENVIANDO = timedelta(minutes=15)
+# Días que se conservan los correos enviados (y sus adjuntos)
+CORREO_DIAS_RETENCION = 30
+
+
+def _lista(valor):
+    if not valor:
+        return []
+    if isinstance(valor, str):
+        valor = valor.split(",")
+    return [email.strip() for email in valor if email and email.strip()]
+
+
+def clave_dedup_correo(asunto, destinatarios, cuerpo, cuerpo_html=None, adjuntos=()):
+    """Huella del contenido: dos correos iguales a los mismos destinatarios tienen la misma clave."""
+    huella = hashlib.sha256()
+    huella.update(json.dumps([asunto, sorted(destinatarios), cuerpo, cuerpo_html or ""]).encode())
+    for nombre, contenido, _ in adjuntos:
+        huella.update(nombre.encode())
+        huella.update(contenido if isinstance(contenido, bytes) else str(contenido).encode())
+    return huella.hexdigest()
+
+
+def encolar_correo(asunto, destinatarios, cuerpo="", cuerpo_html=None, remitente=None, subtipo="plain",
+                   cc=None, bcc=None, reply_to=None, adjuntos=None, clave=None):
+    """
+    Guarda el correo en la bandeja de salida y dispara el drenado al confirmar la transacción.
+    :param destinatarios: lista de correos o string separado por comas
+    :param subtipo: 'html' si `cuerpo` ya es HTML; `cuerpo_html` es una alternativa HTML de un cuerpo de texto
+    :param adjuntos: lista de (nombre, contenido, mimetype)
+    :param clave: clave de deduplicación (por defecto, la huella del contenido)
+    :return: el CorreoSaliente encolado, el ya existente con la misma clave, o None si no hay destinatarios
+    """
+    destinatarios = _lista(destinatarios)
+    if not destinatarios:
+        print(f"Correo '{asunto}' sin destinatarios válidos: no se encola.")
+        return None
+    adjuntos = list(adjuntos or [])
+    clave = clave or clave_dedup_correo(asunto, destinatarios, cuerpo, cuerpo_html, adjuntos)
+    if clave and len(clave) > 64:
+        clave = hashlib.sha256(clave.encode()).hexdigest()
+
+    existente = (
+        CorreoSaliente.objects
+        .filter(clave_dedup=clave, fecha_creacion__gte=timezone.now() - CORREO_VENTANA_DEDUP)
+        .exclude(estado__in=['ERROR', 'DUPLICADO'])
+        .first()
+    )
+    if existente:
+        print(f"Correo '{asunto}' ya encolado (#{existente.pk}): se omite el duplicado.")
+        return existente
+
+    with transaction.atomic():
+        correo = CorreoSaliente.objects.create(
+            asunto=asunto[:255],
+            remitente=remitente or settings.DEFAULT_FROM_EMAIL or "",
+            destinatarios=destinatarios,
+            cc=_lista(cc),
+            bcc=_lista(bcc),
+            reply_to=_lista(reply_to),
+            cuerpo=cuerpo or "",
+            subtipo=subtipo,
+            cuerpo_html=cuerpo_html,
+            clave_dedup=clave,
+        )
+        for nombre, contenido, mimetype in adjuntos:
+            adjunto = AdjuntoCorreoSaliente(correo=correo, nombre=nombre, mimetype=mimetype)
+            if isinstance(contenido, str):
+                contenido = contenido.encode()
+            adjunto.archivo.save(nombre, ContentFile(contenido), save=True)
+
+    transaction.on_commit(disparar_drenado_correo)
+    return correo
+
+
+def encolar_mensaje(mensaje, clave=None):
+    """
+    Encola un EmailMessage / EmailMultiAlternatives ya armado (reemplaza a mensaje.send()).
+    Se conservan el cuerpo, su subtipo, la alternativa HTML y los adjuntos (nombre, contenido, mimetype).
+    """
+    cuerpo_html = next(
+        (contenido for contenido, mimetype in getattr(mensaje, "alternatives", []) if mimetype == "text/html"),
+        None,
+    )
+    adjuntos = [adjunto for adjunto in mensaje.attachments if isinstance(adjunto, tuple)]
+    return encolar_correo(
+        asunto=mensaje.subject,
+        destinatarios=mensaje.to,
+        cuerpo=mensaje.body,
+        cuerpo_html=cuerpo_html,
+        remitente=mensaje.from_email,
+        subtipo=mensaje.content_subtype,
+        cc=mensaje.cc,
+        bcc=mensaje.bcc,
+        reply_to=mensaje.reply_to,
+        adjuntos=adjuntos,
+        clave=clave,
+    )
+
+
+def disparar_drenado_correo():
+    """Encola el drenado en Celery; si el broker no responde, el correo espera al drenado periódico."""
+    from automatizaciones.tasks import drenar_correo_saliente_task
+
+    try:
+        drenar_correo_saliente_task.delay()
+    except Exception as e:
+        # El correo ya quedó en la bandeja: el drenado periódico de Celery Beat lo recoge
+        print(f"No se pudo disparar el drenado de correos: {e}")
+
+
+def _reclamar_lote(tamano):
+    """Marca como ENVIANDO un lote vencido; la marca de tiempo sirve de testigo al cerrar cada correo."""
+    ahora = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            CorreoSaliente.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(estado='PENDIENTE', proximo_intento__lte=ahora)
+                | Q(estado='ENVIANDO', fecha_actualizacion__lt=ahora - CORREO_TIMEOUT_ENVIANDO)
+            )
+            .order_by('proximo_intento')
+            .values_list('pk', flat=True)[:tamano]
+        )
+        if not ids:
+            return ahora, []
+        CorreoSaliente.objects.filter(pk__in=ids).update(estado='ENVIANDO', fecha_actualizacion=ahora)
+    return ahora, list(CorreoSaliente.objects.filter(pk__in=ids).prefetch_related('adjuntos').order_by('pk'))
+
+
+def _mensaje(correo, conexion):
+    mensaje = EmailMultiAlternatives(
+        subject=correo.asunto,
+        body=correo.cuerpo,
+        from_email=correo.remitente or None,
+        to=correo.destinatarios,
+        cc=correo.cc,
+        bcc=correo.bcc,
+        reply_to=correo.reply_to,
+        connection=conexion,
+    )
+    mensaje.content_subtype = correo.subtipo
+    if correo.cuerpo_html:
+        mensaje.attach_alternative(correo.cuerpo_html, "text/html")
+    for adjunto in correo.adjuntos.all():
+        with adjunto.archivo.open("rb") as archivo:
+            mensaje.attach(adjunto.nombre, archivo.read(), adjunto.mimetype or None)
+    return mensaje
+
+
+def _ya_enviado(correo):
+    """Otro correo con la misma clave ya salió dentro de la ventana (p. ej. dos encolados simultáneos)."""
+    return CorreoSaliente.objects.filter(
+        clave_dedup=correo.clave_dedup,
+        estado='ENVIADO',
+        fecha_envio__gte=timezone.now() - CORREO_VENTANA_DEDUP,
+    ).exclude(pk=correo.pk).exists()
+
+
+def _cerrar(correo, testigo, **campos):
+    campos['fecha_actualizacion'] = timezone.now()
+    return CorreoSaliente.objects.filter(
+        pk=correo.pk, estado='ENVIANDO', fecha_actualizacion=testigo
+    ).update(**campos)
+
+
+def _registrar_fallo(correo, testigo, error):
+    intentos = correo.intentos + 1
+    if intentos >= CORREO_MAX_INTENTOS:
+        _cerrar(correo, testigo, estado='ERROR', intentos=intentos, ultimo_error=str(error))
+        return 'ERROR'
+    espera = min(CORREO_ESPERA_BASE * 2 ** (intentos - 1), CORREO_ESPERA_MAXIMA)
+    _cerrar(correo, testigo, estado='PENDIENTE', intentos=intentos, ultimo_error=str(error),
+            proximo_intento=timezone.now() + timedelta(seconds=espera))
+    return 'PENDIENTE'
+
+
+def drenar_correo_saliente(tamano_lote=CORREO_TAMANO_LOTE, max_lotes=CORREO_MAX_LOTES):
+    """
+    Envía la bandeja de salida por lotes con una conexión SMTP por lote.
+    :return: dict con procesados, enviados, duplicados, reintentos y errores
+    """
+    resumen = {'procesados': 0, 'enviados': 0, 'duplicados': 0, 'reintentos': 0, 'errores': 0}
+
+    for _ in range(max_lotes):
+        testigo, lote = _reclamar_lote(tamano_lote)
+        if not lote:
+            break
+
+        conexion = get_connection(fail_silently=False)
+        abierta = False
+        try:
+            for correo in lote:
+                resumen['procesados'] += 1
+                if _ya_enviado(correo):
+                    _cerrar(correo, testigo, estado='DUPLICADO')
+                    resumen['duplicados'] += 1
+                    continue
+                try:
+                    if not abierta:
+                        conexion.open()
+                        abierta = True
+                    _mensaje(correo, conexion).send(fail_silently=False)
+                except Exception as e:
+                    print(f"Correo #{correo.pk}: intento {correo.intentos + 1} fallido: {e}")
+                    if _registrar_fallo(correo, testigo, e) == 'ERROR':
+                        resumen['errores'] += 1
+                    else:
+                        resumen['reintentos'] += 1
+                    # La conexión pudo quedar inservible: el siguiente correo abre una nueva
+                    try:
+                        conexion.close()
+                    except Exception:
+                        pass
+                    abierta = False
+                else:
+                    _cerrar(correo, testigo, estado='ENVIADO', ultimo_error=None, fecha_envio=timezone.now())
+                    resumen['enviados'] += 1
+        finally:
+            if abierta:
+                conexion.close()
+
+    if resumen['procesados']:
+        print(f"Correos salientes: {resumen}")
+    return resumen
+
+
+def limpiar_correo_saliente(dias=CORREO_DIAS_RETENCION):
+    """Borra los correos enviados/duplicados más antiguos que `dias` y sus adjuntos."""
+    viejos = CorreoSaliente.objects.filter(
+        estado__in=['ENVIADO', 'DUPLICADO'],
+        fecha_creacion__lt=timezone.now() - timedelta(days=dias),
+    )
+    for adjunto in AdjuntoCorreoSaliente.objects.filter(correo__in=viejos).iterator():
+        adjunto.archivo.delete(save=False)
+    total = viejos.count()
+    viejos.delete()
+    return total
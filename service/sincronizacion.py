@@ -0,0 +1,181 @@
+"""
+Sincronización asíncrona de clientes con ICG (bandeja de salida).
+
+La API guarda el RegistroCliente y llama a encolar_sincronizacion_icg(); el worker de Celery
+ejecuta drenar_sincronizacion_icg(), que reclama lotes de la cola (SKIP LOCKED, varios workers
+pueden drenar a la vez), reutiliza una sola conexión ICG por lote y reintenta con espera
+exponencial. La idempotencia es por número de documento: antes de crear se consulta ICG y, si
+el cliente ya existe (p. ej. un intento anterior alcanzó a insertarlo), solo se actualiza.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from appMercaSur.conect import conectar_sql_server
+from clientes.models import RegistroCliente, SincronizacionClienteICG
+from service.clientICG import actualizarClienteICG, crearClienteICG, getClienteICG
+
+SINCRONIZACION_TAMANO_LOTE = 50
+SINCRONIZACION_MAX_LOTES = 20
+SINCRONIZACION_MAX_INTENTOS = 6
+SINCRONIZACION_ESPERA_BASE = 30        # segundos; se duplica en cada intento
+SINCRONIZACION_ESPERA_MAXIMA = 60 * 60
+# Un trabajo en PROCESANDO más de este tiempo se considera abandonado (worker caído)
+SINCRONIZACION_TIMEOUT_PROCESANDO = timedelta(minutes=15)
+
+
+class ErrorSincronizacionICG(Exception):
+    pass
+
+
+def encolar_sincronizacion_icg(cliente, operacion='CREAR'):
+    """
+    Registra (o reactiva) la sincronización del cliente y dispara el drenado al confirmar la transacción.
+    Un CREAR que aún no se completó no se degrada a ACTUALIZAR: al crearse se envían los datos más recientes.
+    """
+    with transaction.atomic():
+        sync, creado = SincronizacionClienteICG.objects.select_for_update().get_or_create(
+            numero_documento=cliente.numero_documento,
+            defaults={'cliente': cliente, 'operacion': operacion},
+        )
+        if not creado:
+            if sync.operacion != 'CREAR' or sync.estado == 'COMPLETADO':
+                sync.operacion = operacion
+            sync.cliente = cliente
+            sync.estado = 'PENDIENTE'
+            sync.intentos = 0
+            sync.proximo_intento = timezone.now()
+            sync.ultimo_error = None
+            sync.save()
+
+    transaction.on_commit(disparar_drenado_icg)
+    return sync
+
+
+def disparar_drenado_icg():
+    """Encola el drenado en Celery; si el broker no responde, el trabajo espera al drenado periódico."""
+    from clientes.tasks import drenar_sincronizacion_icg_task
+
+    try:
+        drenar_sincronizacion_icg_task.delay()
+    except Exception as e:
+        # El cliente ya quedó en la cola: el drenado periódico de Celery Beat lo recoge
+        print(f"No se pudo disparar el drenado de sincronización ICG: {e}")
+
+
+def estado_sincronizacion_icg(sync):
+    """Representación para la API de consulta de estado."""
+    return {
+        'numero_documento': sync.numero_documento,
+        'operacion': sync.operacion,
+        'estado': sync.estado,
+        'intentos': sync.intentos,
+        'proximo_intento': sync.proximo_intento if sync.estado == 'PENDIENTE' else None,
+        'resultado': sync.resultado,
+        'error': sync.ultimo_error,
+        'fecha_sincronizacion': sync.fecha_sincronizacion,
+    }
+
+
+def _reclamar_lote(tamano):
+    """Marca como PROCESANDO un lote vencido; la marca de tiempo sirve de testigo al cerrar cada trabajo."""
+    ahora = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            SincronizacionClienteICG.objects.select_for_update(skip_locked=True)
+            .filter(
+                Q(estado='PENDIENTE', proximo_intento__lte=ahora)
+                | Q(estado='PROCESANDO', fecha_actualizacion__lt=ahora - SINCRONIZACION_TIMEOUT_PROCESANDO)
+            )
+            .order_by('proximo_intento')
+            .values_list('pk', flat=True)[:tamano]
+        )
+        if not ids:
+            return ahora, []
+        SincronizacionClienteICG.objects.filter(pk__in=ids).update(estado='PROCESANDO', fecha_actualizacion=ahora)
+    return ahora, list(SincronizacionClienteICG.objects.filter(pk__in=ids))
+
+
+def _sincronizar_cliente(sync, conexion):
+    cliente = RegistroCliente.objects.get(pk=sync.cliente_id)
+
+    if sync.operacion == 'CREAR' or not cliente.codcliente:
+        existente = getClienteICG(cliente.numero_documento, conexion)
+        if existente is None or isinstance(existente, str):
+            raise ErrorSincronizacionICG("No se pudo consultar el cliente en ICG.")
+        if not existente:
+            resultado = crearClienteICG(cliente, conexion)
+            if resultado != 'ok':
+                raise ErrorSincronizacionICG(resultado)
+            return 'Cliente registrado en ICG'
+
+        # Ya está en ICG: se enlaza el código y se actualiza en lugar de duplicarlo
+        cliente.codcliente = existente[0][0]
+        cliente.creadoICG = True
+        cliente.save(update_fields=['codcliente', 'creadoICG'])
+
+    resultado = actualizarClienteICG(cliente, conexion)
+    if resultado == 'error':
+        raise ErrorSincronizacionICG("Error al actualizar el cliente en ICG.")
+    return resultado
+
+
+def _cerrar(sync, testigo, **campos):
+    # Si el cliente se volvió a encolar mientras se procesaba, la fila ya no está en PROCESANDO
+    # con este testigo y no se toca: el drenado siguiente la vuelve a enviar
+    campos['fecha_actualizacion'] = timezone.now()
+    return SincronizacionClienteICG.objects.filter(
+        pk=sync.pk, estado='PROCESANDO', fecha_actualizacion=testigo
+    ).update(**campos)
+
+
+def _registrar_fallo(sync, testigo, error):
+    intentos = sync.intentos + 1
+    if intentos >= SINCRONIZACION_MAX_INTENTOS:
+        _cerrar(sync, testigo, estado='ERROR', intentos=intentos, ultimo_error=str(error))
+        return 'ERROR'
+    espera = min(SINCRONIZACION_ESPERA_BASE * 2 ** (intentos - 1), SINCRONIZACION_ESPERA_MAXIMA)
+    _cerrar(sync, testigo, estado='PENDIENTE', intentos=intentos, ultimo_error=str(error),
+            proximo_intento=timezone.now() + timedelta(seconds=espera))
+    return 'PENDIENTE'
+
+
+def drenar_sincronizacion_icg(tamano_lote=SINCRONIZACION_TAMANO_LOTE, max_lotes=SINCRONIZACION_MAX_LOTES):
+    """
+    Procesa la cola de sincronización por lotes con una conexión ICG por lote.
+    :return: dict con procesados, completados, reintentos y errores
+    """
+    resumen = {'procesados': 0, 'completados': 0, 'reintentos': 0, 'errores': 0}
+
+    for _ in range(max_lotes):
+        testigo, lote = _reclamar_lote(tamano_lote)
+        if not lote:
+            break
+
+        conexion = conectar_sql_server()
+        try:
+            for sync in lote:
+                resumen['procesados'] += 1
+                try:
+                    if conexion is None:
+                        raise ErrorSincronizacionICG("Sin conexión a ICG.")
+                    resultado = _sincronizar_cliente(sync, conexion)
+                except Exception as e:
+                    print(f"Sincronización ICG {sync.numero_documento}: intento {sync.intentos + 1} fallido: {e}")
+                    if _registrar_fallo(sync, testigo, e) == 'ERROR':
+                        resumen['errores'] += 1
+                    else:
+                        resumen['reintentos'] += 1
+                else:
+                    _cerrar(sync, testigo, estado='COMPLETADO', resultado=resultado[:255], ultimo_error=None,
+                            fecha_sincronizacion=timezone.now())
+                    resumen['completados'] += 1
+        finally:
+            if conexion is not None:
+                conexion.close()
+
+    if resumen['procesados']:
+        print(f"Sincronización ICG: {resumen}")
+    return resumen
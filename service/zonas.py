@@ -0,0 +1,187 @@
+"""
+Resolución de zona (sucursal) a partir de coordenadas.
+
+Las zonas activas se guardan en memoria del proceso junto con una versión compartida en la
+caché de Django; las señales de ZonaPermitida suben esa versión y cada proceso (web o Celery)
+recarga sus zonas en la siguiente llamada. Para cada punto se descartan primero las zonas cuyo
+recuadro no lo contiene, luego se filtra con haversine (vectorizado con NumPy) y solo a los
+candidatos que quedan cerca del borde se les calcula la distancia geodésica exacta.
+"""
+import logging
+import threading
+
+import numpy as np
+from django.core.cache import cache
+from django.db import transaction
+from geopy.distance import geodesic
+
+from clientes.models import ZonaPermitida
+
+logger = logging.getLogger(__name__)
+
+ZONA_POR_DEFECTO = 'CALDAS'
+
+RADIO_TIERRA_M = 6371008.8
+METROS_POR_GRADO = 111320.0
+# Haversine (esfera) y geodésica (elipsoide) difieren hasta ~0.5 %: por encima de este margen
+# el punto está fuera con seguridad y por debajo dentro; solo la franja intermedia va a geodesic
+MARGEN_HAVERSINE = 0.006
+
+CLAVE_VERSION_ZONAS = 'clientes:zonas:version'
+
+_zonas = None
+_lock = threading.Lock()
+
+
+class _ZonasActivas:
+    """Zonas activas en arreglos paralelos, en el mismo orden que la consulta original (por nombre)."""
+
+    def __init__(self, version, filas):
+        self.version = version
+        self.nombres = [f[0] for f in filas]
+        self.lat = np.array([f[1] for f in filas], dtype=float)
+        self.lon = np.array([f[2] for f in filas], dtype=float)
+        self.radio = np.array([f[3] for f in filas], dtype=float)
+        # Recuadro (grados) que contiene cada círculo, con el margen del haversine incluido
+        radio_grados = self.radio * (1 + MARGEN_HAVERSINE) / METROS_POR_GRADO
+        cos_lat = np.maximum(np.cos(np.radians(self.lat)), 1e-6)
+        self.lat_min = self.lat - radio_grados
+        self.lat_max = self.lat + radio_grados
+        self.lon_min = self.lon - radio_grados / cos_lat
+        self.lon_max = self.lon + radio_grados / cos_lat
+
+
+def _subir_version_zonas():
+    global _zonas
+    try:
+        cache.incr(CLAVE_VERSION_ZONAS)
+    except ValueError:
+        # La clave no existe (caché vacía o expirada)
+        cache.set(CLAVE_VERSION_ZONAS, 1, None)
+    _zonas = None
+
+
+def invalidar_zonas():
+    """
+    Sube la versión compartida: todos los procesos recargan las zonas en su próxima consulta.
+    Dentro de una transacción espera al commit para que nadie recargue datos sin confirmar.
+    """
+    transaction.on_commit(_subir_version_zonas)
+
+
+def obtener_zonas_activas():
+    """Zonas activas del proceso; solo consulta la BD si cambió la versión compartida."""
+    global _zonas
+    version = cache.get(CLAVE_VERSION_ZONAS, 0)
+    zonas = _zonas
+    if zonas is not None and zonas.version == version:
+        return zonas
+
+    with _lock:
+        if _zonas is not None and _zonas.version == version:
+            return _zonas
+        filas = [
+            f for f in ZonaPermitida.objects.filter(activa=True)
+            .values_list('nombre', 'latitude', 'longitude', 'max_distance')
+            if None not in f
+        ]
+        _zonas = _ZonasActivas(version, filas)
+        logger.debug("Zonas activas cargadas en memoria: %s (versión %s)", len(filas), version)
+        return _zonas
+
+
+def _coordenada_valida(latitud, longitud):
+    """(lat, lon) como float, o None si faltan, no son números o están fuera de rango."""
+    if latitud is None or longitud is None:
+        return None
+    try:
+        lat, lon = float(latitud), float(longitud)
+    except (ValueError, TypeError):
+        return None
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def _haversine_m(lat, lon, zonas):
+    """Distancia haversine en metros de un punto a cada zona."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(zonas.lat), np.radians(zonas.lon)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def _resolver_punto(lat, lon, zonas):
+    """Primera zona (en orden) que contiene el punto, o la zona por defecto."""
+    en_recuadro = np.flatnonzero(
+        (zonas.lat_min <= lat) & (lat <= zonas.lat_max) & (zonas.lon_min <= lon) & (lon <= zonas.lon_max)
+    )
+    if not len(en_recuadro):
+        return ZONA_POR_DEFECTO
+
+    distancias = _haversine_m(lat, lon, zonas)
+    for i in en_recuadro:
+        radio = zonas.radio[i]
+        if distancias[i] > radio * (1 + MARGEN_HAVERSINE):
+            continue
+        if distancias[i] < radio * (1 - MARGEN_HAVERSINE) \
+                or geodesic((lat, lon), (zonas.lat[i], zonas.lon[i])).meters <= radio:
+            return zonas.nombres[i]
+    return ZONA_POR_DEFECTO
+
+
+def determinar_zona(latitud, longitud):
+    """
+    Nombre de la zona activa que contiene la coordenada, o 'CALDAS' si no hay ninguna
+    (o la coordenada es nula o inválida).
+    """
+    punto = _coordenada_valida(latitud, longitud)
+    if punto is None:
+        return ZONA_POR_DEFECTO
+    zonas = obtener_zonas_activas()
+    if not zonas.nombres:
+        return ZONA_POR_DEFECTO
+    return _resolver_punto(punto[0], punto[1], zonas)
+
+
+def determinar_zonas(coordenadas):
+    """
+    Versión por lote de determinar_zona para backfills: una sola carga de zonas y el recuadro
+    evaluado para todos los puntos a la vez.
+    :param coordenadas: iterable de (latitud, longitud)
+    :return: lista de nombres de zona en el mismo orden
+    """
+    coordenadas = list(coordenadas)
+    resultado = [ZONA_POR_DEFECTO] * len(coordenadas)
+    zonas = obtener_zonas_activas()
+    if not zonas.nombres:
+        return resultado
+
+    indices, puntos = [], []
+    for i, (latitud, longitud) in enumerate(coordenadas):
+        punto = _coordenada_valida(latitud, longitud)
+        if punto is not None:
+            indices.append(i)
+            puntos.append(punto)
+    if not puntos:
+        return resultado
+
+    puntos = np.array(puntos)
+    lat, lon = puntos[:, :1], puntos[:, 1:]
+    # Matriz puntos × zonas: solo se resuelven los puntos que caen en algún recuadro
+    en_algun_recuadro = (
+        (zonas.lat_min <= lat) & (lat <= zonas.lat_max) & (zonas.lon_min <= lon) & (lon <= zonas.lon_max)
+    ).any(axis=1)
+    for fila in np.flatnonzero(en_algun_recuadro):
+        resultado[indices[fila]] = _resolver_punto(puntos[fila, 0], puntos[fila, 1], zonas)
+    return resultado
+
+
+def determinar_zonas_clientes(clientes):
+    """
+    Zona de cada RegistroCliente del queryset en una sola consulta.
+    :return: dict {pk: nombre de zona}
+    """
+    filas = list(clientes.values_list('pk', 'latitud', 'longitud'))
+    zonas = determinar_zonas((lat, lon) for _, lat, lon in filas)
+    return {pk: zona for (pk, _, _), zona in zip(filas, zonas)}